@@ -0,0 +1,385 @@
+from nmigen import *
+from nmigen.lib.coding import PriorityEncoder
+from nmigen.lib.fifo import SyncFIFOBuffered
+from nmigen.utils import bits_for
+
+# Track bright spots: a single pass, streaming connected component labeler
+# for a binary image, one pixel per clock, which finds the area, centroid
+# and bounding box of each 8-connected blob of pixels with i_p set.
+#
+# Each foreground pixel gets the label of its neighbours to the left and
+# above, or a new label, and when it joins two blobs, one label is merged
+# into the other. The labels of the line above are kept in a line buffer,
+# and the union-find table of labels is kept flat, so the root of any label
+# is one lookup away. There are only labels labels, in registers, so that
+# all of this is done in a cycle.
+#
+# At the end of each line, the labels are swept, and blobs that did not get
+# any pixels in that line are complete. Those with at least min_area pixels
+# are passed to a divider for their centroids, and their labels are freed.
+# The sweep takes labels + 1 cycles, and must finish before the end of the
+# next line. Pixels that need a new label when none are free are dropped.
+#
+# The blobs of a frame are double-buffered: at the end of the frame, o_done
+# is pulsed and o_blobs has the number of blobs found, up to max_blobs. The
+# blobs are read by setting blob_addr, and are in the blob_ outputs on the
+# next cycle. Positions come from the first and last flags, and the frame
+# ends with the last pixel of line h - 1.
+#
+# Completed blobs wait for the divider in a fifo with room for a line's
+# worth and the end of frame marker. Those that find it full, when lines
+# are too short for the divider to keep up, are dropped and counted in
+# o_dropped, which wraps around.
+class BlobTracker(Elaboratable):
+    def __init__(self, w=320, h=480, labels=16, max_blobs=16):
+        # Parameters
+        self.w          = w
+        self.h          = h
+        self.labels     = labels
+        self.max_blobs  = max_blobs
+        self.aw         = bits_for(w * h)
+
+        # Inputs
+        self.i_valid    = Signal()
+        self.i_first    = Signal()
+        self.i_last     = Signal()
+        self.i_p        = Signal()
+        self.min_area   = Signal(self.aw, reset=4)
+        self.blob_addr  = Signal(range(max_blobs))
+
+        # Outputs
+        self.o_done     = Signal()
+        self.o_blobs    = Signal(range(max_blobs + 1))
+        self.blob_x     = Signal(10)
+        self.blob_y     = Signal(10)
+        self.blob_area  = Signal(self.aw)
+        self.blob_min_x = Signal(10)
+        self.blob_max_x = Signal(10)
+        self.blob_min_y = Signal(10)
+        self.blob_max_y = Signal(10)
+        self.o_dropped  = Signal(16)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        n = self.labels
+        lw = bits_for(n - 1)
+        sw = self.aw + 10
+
+        # Position of the input pixel
+        x  = Signal(10)
+        y  = Signal(10)
+        cx = Signal(10)
+        cy = Signal(10)
+        nx = Signal(10)
+        fs = self.i_first
+
+        m.d.comb += [
+            cx.eq(Mux(fs, 0, x)),
+            cy.eq(Mux(fs, 0, y)),
+            nx.eq(Mux(self.i_last, 0, cx + 1))
+        ]
+
+        with m.If(self.i_valid):
+            m.d.sync += [
+                x.eq(nx),
+                y.eq(Mux(self.i_last, cy + 1, cy))
+            ]
+
+        # Label table: parent (always a root), active, and the blob data,
+        # which is only kept up to date for roots
+        parent = Array([Signal(lw, name="parent_%d" % i, reset=i) for i in range(n)])
+        area   = Array([Signal(self.aw, name="area_%d" % i) for i in range(n)])
+        sum_x  = Array([Signal(sw, name="sum_x_%d" % i) for i in range(n)])
+        sum_y  = Array([Signal(sw, name="sum_y_%d" % i) for i in range(n)])
+        min_x  = Array([Signal(10, name="min_x_%d" % i) for i in range(n)])
+        max_x  = Array([Signal(10, name="max_x_%d" % i) for i in range(n)])
+        min_y  = Array([Signal(10, name="min_y_%d" % i) for i in range(n)])
+        max_y  = Array([Signal(10, name="max_y_%d" % i) for i in range(n)])
+        active = Signal(n)
+
+        # Labels touched by each of the last two lines, by line parity
+        touch = Array([Signal(n, name="touch_%d" % i) for i in range(2)])
+
+        # Line buffer of labels, with a foreground bit. It is read at the
+        # position after the next pixel, wrapping round to 0 at the end of the
+        # line, where the first label of the line is needed next.
+        lines = Memory(width=lw + 1, depth=self.w)
+        m.submodules.lr = lr = lines.read_port(transparent=False)
+        m.submodules.lw = lwp = lines.write_port()
+
+        pos = Signal(10)
+        m.d.comb += [
+            pos.eq(Mux(self.i_valid, nx, cx)),
+            lr.addr.eq(Mux(pos == self.w - 1, 0, pos + 1))
+        ]
+
+        # Neighbours: a above left, b above, c above right and d left
+        a = Signal(lw + 1)
+        b = Signal(lw + 1)
+        d = Signal(lw + 1)
+        c = lr.data
+
+        x_first = Signal()
+        x_last  = Signal()
+        y_first = Signal()
+        a_fg    = Signal()
+        b_fg    = Signal()
+        c_fg    = Signal()
+        d_fg    = Signal()
+
+        m.d.comb += [
+            x_first.eq(cx == 0),
+            x_last.eq(cx == self.w - 1),
+            y_first.eq(cy == 0),
+            a_fg.eq(a[lw] & ~x_first & ~y_first),
+            b_fg.eq(b[lw] & ~y_first),
+            c_fg.eq(c[lw] & ~x_last & ~y_first),
+            d_fg.eq(d[lw] & ~x_first)
+        ]
+
+        ra = Signal(lw)
+        rb = Signal(lw)
+        rc = Signal(lw)
+        rd = Signal(lw)
+
+        m.d.comb += [
+            ra.eq(parent[a[:lw]]),
+            rb.eq(parent[b[:lw]]),
+            rc.eq(parent[c[:lw]]),
+            rd.eq(parent[d[:lw]])
+        ]
+
+        # The label for the pixel. When b is set, it joins a, c and d already,
+        # so the only merge is of c into d or a.
+        m.submodules.free = free = PriorityEncoder(n)
+        m.d.comb += free.i.eq(~active)
+
+        fg      = Signal()
+        left_fg = Signal()
+        left    = Signal(lw)
+        merge   = Signal()
+        alloc   = Signal()
+        label   = Signal(lw)
+        ok      = Signal()
+
+        m.d.comb += [
+            fg.eq(self.i_valid & self.i_p),
+            left_fg.eq(d_fg | a_fg),
+            left.eq(Mux(d_fg, rd, ra)),
+            merge.eq(fg & ~b_fg & left_fg & c_fg & (left != rc)),
+            alloc.eq(fg & ~b_fg & ~left_fg & ~c_fg),
+            label.eq(Mux(b_fg, rb, Mux(left_fg, left, Mux(c_fg, rc, free.o)))),
+            ok.eq(fg & ~(alloc & free.n))
+        ]
+
+        # New data for the label, from its own, or both when merging, and
+        # the pixel
+        def update(v, merged, start):
+            return Mux(alloc, start, v[label] + Mux(merge, merged, 0))
+
+        def lower(v, p):
+            o = Mux(alloc, p, v[label])
+            o = Mux(merge & (v[rc] < o), v[rc], o)
+            return Mux(p < o, p, o)
+
+        def higher(v, p):
+            o = Mux(alloc, p, v[label])
+            o = Mux(merge & (v[rc] > o), v[rc], o)
+            return Mux(p > o, p, o)
+
+        u_area  = Signal(self.aw)
+        u_sum_x = Signal(sw)
+        u_sum_y = Signal(sw)
+        u_min_x = Signal(10)
+        u_max_x = Signal(10)
+        u_min_y = Signal(10)
+        u_max_y = Signal(10)
+
+        m.d.comb += [
+            u_area.eq(update(area, area[rc], 0) + 1),
+            u_sum_x.eq(update(sum_x, sum_x[rc], 0) + cx),
+            u_sum_y.eq(update(sum_y, sum_y[rc], 0) + cy),
+            u_min_x.eq(lower(min_x, cx)),
+            u_max_x.eq(higher(max_x, cx)),
+            u_min_y.eq(lower(min_y, cy)),
+            u_max_y.eq(higher(max_y, cy))
+        ]
+
+        with m.If(self.i_valid):
+            m.d.sync += [
+                a.eq(b),
+                b.eq(c),
+                d.eq(Cat(label, ok)),
+                lwp.en.eq(1)
+            ]
+        with m.Else():
+            m.d.sync += lwp.en.eq(0)
+
+        m.d.sync += [
+            lwp.addr.eq(cx),
+            lwp.data.eq(Cat(label, ok))
+        ]
+
+        for i in range(n):
+            with m.If(merge & (parent[i] == rc)):
+                m.d.sync += parent[i].eq(left)
+            with m.If(ok & alloc & (free.o == i)):
+                m.d.sync += parent[i].eq(i)
+            with m.If(ok & (label == i)):
+                m.d.sync += [
+                    area[i].eq(u_area),
+                    sum_x[i].eq(u_sum_x),
+                    sum_y[i].eq(u_sum_y),
+                    min_x[i].eq(u_min_x),
+                    max_x[i].eq(u_max_x),
+                    min_y[i].eq(u_min_y),
+                    max_y[i].eq(u_max_y)
+                ]
+
+        # End of line and frame, seen on the next cycle
+        eol    = Signal()
+        eof    = Signal()
+        eol_q  = Signal()
+
+        m.d.sync += [
+            eol.eq(self.i_valid & self.i_last),
+            eof.eq(self.i_valid & self.i_last & (cy == self.h - 1)),
+            eol_q.eq(cy[0])
+        ]
+
+        # Sweep of the labels after each line
+        sweeping = Signal()
+        s        = Signal(range(n + 1))
+        s_q      = Signal()
+        s_eof    = Signal()
+        touched  = Signal()
+        complete = Signal()
+        free_s   = Signal(n)
+
+        m.d.comb += [
+            touched.eq(Cat(*[(parent[i] == s) & (touch[~s_q][i] | (touch[s_q][i] & ~s_eof))
+                             for i in range(n)]).any()),
+            complete.eq(sweeping & (s < n) & active.bit_select(s, 1) &
+                        (parent[s[:lw]] == s) & ~touched),
+            free_s.eq(Cat(*[complete & (parent[i] == s) for i in range(n)]))
+        ]
+
+        with m.If(eol):
+            m.d.sync += [
+                sweeping.eq(1),
+                s.eq(0),
+                s_q.eq(eol_q),
+                s_eof.eq(eof)
+            ]
+        with m.Elif(sweeping):
+            m.d.sync += s.eq(s + 1)
+            with m.If(s == n):
+                m.d.sync += sweeping.eq(0)
+
+        # The next line's touches are cleared at the end of each line
+        for q, t in enumerate(touch):
+            with m.If(eol & (eol_q != q)):
+                m.d.sync += t.eq(0)
+            with m.If(ok & (cy[0] == q)):
+                m.d.sync += t.bit_select(label, 1).eq(1)
+
+        m.d.sync += active.eq((active & ~free_s) | Mux(ok & alloc, Const(1, n) << free.o, 0))
+
+        # Completed blobs, and markers for the ends of frames, go through a
+        # fifo to the divider
+        fields = [("marker", 1), ("area", self.aw), ("sum_x", sw), ("sum_y", sw),
+                  ("min_x", 10), ("max_x", 10), ("min_y", 10), ("max_y", 10)]
+        entry = Record(fields)
+        m.submodules.fifo = fifo = SyncFIFOBuffered(width=len(entry), depth=n + 1)
+        push = Signal()
+
+        sl = s[:lw]
+        m.d.comb += [
+            entry.marker.eq(sweeping & (s == n) & s_eof),
+            entry.area.eq(area[sl]),
+            entry.sum_x.eq(sum_x[sl]),
+            entry.sum_y.eq(sum_y[sl]),
+            entry.min_x.eq(min_x[sl]),
+            entry.max_x.eq(max_x[sl]),
+            entry.min_y.eq(min_y[sl]),
+            entry.max_y.eq(max_y[sl]),
+            fifo.w_data.eq(entry),
+            push.eq(entry.marker | (complete & (area[sl] >= self.min_area))),
+            fifo.w_en.eq(push & fifo.w_rdy)
+        ]
+
+        with m.If(push & ~fifo.w_rdy):
+            m.d.sync += self.o_dropped.eq(self.o_dropped + 1)
+
+        # Divider for the centroids, a bit per cycle, and the results
+        blob = Record(fields)
+        m.d.comb += blob.eq(fifo.r_data)
+
+        results = Memory(width=20 + self.aw + 40, depth=2 * self.max_blobs)
+        m.submodules.rr = rr = results.read_port(transparent=False)
+        m.submodules.rw = rw = results.write_port()
+
+        bank  = Signal()
+        count = Signal(range(self.max_blobs + 1))
+        step  = Signal(range(11))
+        rem_x = Signal(sw)
+        rem_y = Signal(sw)
+        q_x   = Signal(10)
+        q_y   = Signal(10)
+        div   = Signal(sw)
+        res   = Record(fields)
+
+        m.d.comb += [
+            div.eq(res.area << (step - 1)),
+            fifo.r_en.eq((step == 0) & ~rw.en),
+            rw.addr.eq(Cat(count[:len(self.blob_addr)], bank)),
+            rw.data.eq(Cat(q_x, q_y, res.area, res.min_x, res.max_x, res.min_y, res.max_y)),
+            rr.addr.eq(Cat(self.blob_addr, ~bank)),
+            Cat(self.blob_x, self.blob_y, self.blob_area, self.blob_min_x, self.blob_max_x,
+                self.blob_min_y, self.blob_max_y).eq(rr.data)
+        ]
+
+        m.d.sync += [
+            self.o_done.eq(0),
+            rw.en.eq(0)
+        ]
+
+        with m.If(step == 0):
+            with m.If(fifo.r_rdy & ~rw.en):
+                with m.If(blob.marker):
+                    m.d.sync += [
+                        self.o_done.eq(1),
+                        self.o_blobs.eq(count),
+                        count.eq(0),
+                        bank.eq(~bank)
+                    ]
+                with m.Else():
+                    m.d.sync += [
+                        res.eq(blob),
+                        rem_x.eq(blob.sum_x),
+                        rem_y.eq(blob.sum_y),
+                        q_x.eq(0),
+                        q_y.eq(0),
+                        step.eq(10)
+                    ]
+        with m.Else():
+            with m.If(rem_x >= div):
+                m.d.sync += [
+                    rem_x.eq(rem_x - div),
+                    q_x.bit_select(step - 1, 1).eq(1)
+                ]
+            with m.If(rem_y >= div):
+                m.d.sync += [
+                    rem_y.eq(rem_y - div),
+                    q_y.bit_select(step - 1, 1).eq(1)
+                ]
+            m.d.sync += step.eq(step - 1)
+            with m.If((step == 1) & (count != self.max_blobs)):
+                m.d.sync += rw.en.eq(1)
+
+        # The write of the result is on the cycle after the last step
+        with m.If(rw.en):
+            m.d.sync += count.eq(count + 1)
+
+        return m
@@ -1,10 +1,18 @@
 from nmigen import *
 
+from stream import Stream
+
+# Read RGB565 pixels from the OV7670, in the pclock domain. As well as
+# pixel_valid and pixel_data, the pixels come out of the source stream,
+# with first set on the first pixel of a frame and last on the last pixel
+# of a line. The camera cannot be paused, so source.ready only detects
+# pixels that are not taken, which pulse overrun.
 class CamRead(Elaboratable):
     WAIT_FRAME_START = 0
     ROW_CAPTURE      = 1
 
-    def __init__(self):
+    def __init__(self, res_x=640):
+        self.res_x       = res_x
         self.p_clock     = Signal()
         self.vsync       = Signal()
         self.href        = Signal()
@@ -14,6 +22,8 @@ class CamRead(Elaboratable):
         self.frame_done  = Signal()
         self.row         = Signal(10)
         self.col         = Signal(9)
+        self.source      = Stream(16)
+        self.overrun     = Signal()
 
     def elaborate(self, platform):
         m = Module()
@@ -37,6 +47,16 @@ class CamRead(Elaboratable):
             self.col.eq(col_count)
         ]
 
+        # Here row_count counts the pixels in a line, and has already been
+        # incremented for a valid pixel
+        m.d.comb += [
+            self.source.valid.eq(self.pixel_valid),
+            self.source.data.eq(self.pixel_data),
+            self.source.first.eq((col_count == 0) & (row_count == 1)),
+            self.source.last.eq(row_count == self.res_x),
+            self.overrun.eq(self.source.valid & ~self.source.ready)
+        ]
+
         with m.Switch(fsm_state):
            with m.Case(self.WAIT_FRAME_START):
                m.d.pclock += [
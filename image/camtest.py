@@ -4,9 +4,15 @@ from nmigen import *
 from nmigen.build import *
 from nmigen_boards.ulx3s import *
 
+from nmigen_stdio.serial import *
+
 from camread import *
 from camconfig import *
 from image_stream import *
+from tone_lut import LUTLoader
+from pixel_fifo import PixelFIFO
+from crop_scale import CropScale
+from blobs import BlobTracker
 from debouncer import *
 
 from vga2dvid import VGA2DVID
@@ -59,7 +65,8 @@ class CamTest(Elaboratable):
                  timing: VGATiming, # VGATiming class
                  xadjustf=0, # adjust -3..3 if no picture
                  yadjustf=0, # or to fine-tune f
-                 ddr=True): # False: SDR, True: DDR
+                 ddr=True, # False: SDR, True: DDR
+                 baud=1000000): # uart baud rate, for gamma tables
         self.o_gpdi_dp = Signal(4)
         # Configuration
         self.timing = timing
@@ -69,6 +76,7 @@ class CamTest(Elaboratable):
         self.xadjustf = xadjustf
         self.yadjustf = yadjustf
         self.ddr = ddr
+        self.baud = baud
 
     def elaborate(self, platform):
         # Constants
@@ -111,13 +119,15 @@ class CamTest(Elaboratable):
         sw2 = platform.request("switch",2)
         sw3 = platform.request("switch",3)
         sw8 = platform.request("sw8")
+        uart = platform.request("uart")
+        divisor = int(platform.default_clk_frequency // self.baud)
 
         # Add CamRead submodule
         camread = CamRead()
         m.submodules.camread = camread
 
         # Camera config
-        camconfig = CamConfig()
+        camconfig = CamConfig(sccb_freq=400000)
         m.submodules.camconfig = camconfig
 
         # Configure and read the camera
@@ -175,13 +185,40 @@ class CamTest(Elaboratable):
         ims = ImageStream()
         m.submodules.image_stream = ims
 
+        # The gamma tables can be replaced by ones sent over the uart by
+        # tone.py
+        m.submodules.serial = serial = AsyncSerial(divisor=divisor, pins=uart)
+        m.submodules.loader = loader = LUTLoader(timeout=int(platform.default_clk_frequency // 100))
+
         m.d.comb += [
-            ims.valid.eq(camread.pixel_valid),
-            ims.i_x.eq(camread.row[1:]),
-            ims.i_y.eq(camread.col),
-            ims.i_r.eq(camread.pixel_data[11:]),
-            ims.i_g.eq(camread.pixel_data[5:11]),
-            ims.i_b.eq(camread.pixel_data[0:5]),
+            serial.rx.ack.eq(1),
+            loader.rx_data.eq(serial.rx.data),
+            loader.rx_rdy.eq(serial.rx.rdy),
+            ims.lut.w_addr.eq(loader.w_addr),
+            ims.lut.w_data.eq(loader.w_data),
+            ims.lut.w_en.eq(loader.w_en),
+            ims.lut.swap.eq(loader.swap)
+        ]
+
+        # Pixels cross from the camera's pclock domain
+        m.submodules.fifo = fifo = PixelFIFO(depth=64)
+
+        # The 640 pixel camera lines are halved to fit the 320x480 frame buffer,
+        # averaging each pair of pixels
+        m.submodules.crop = crop = CropScale()
+
+        m.d.comb += [
+            camread.source.connect_to(fifo.sink),
+            fifo.source.ready.eq(crop.sink.ready),
+            crop.sink.valid.eq(fifo.source.valid),
+            crop.sink.first.eq(fifo.source.first),
+            crop.sink.last.eq(fifo.source.last),
+            crop.sink.r.eq(fifo.source.data[11:]),
+            crop.sink.g.eq(fifo.source.data[5:11]),
+            crop.sink.b.eq(fifo.source.data[0:5]),
+            crop.h_div.eq(32),
+            crop.v_div.eq(16),
+            crop.source.connect_to(ims.sink),
             ims.edge.eq(sw8.sw1),
             ims.red.eq(sw8.sw2),
             ims.green.eq(sw8.sw3),
@@ -197,12 +234,12 @@ class CamTest(Elaboratable):
             ims.val.eq(val)
         ]
 
-        with m.If(ims.i_r > max_r):
-            m.d.sync += max_r.eq(ims.i_r) 
-        with m.If(ims.i_g > max_g):
-            m.d.sync += max_g.eq(ims.i_g) 
-        with m.If(ims.i_b > max_b):
-            m.d.sync += max_b.eq(ims.i_b) 
+        with m.If(ims.sink.r > max_r):
+            m.d.sync += max_r.eq(ims.sink.r) 
+        with m.If(ims.sink.g > max_g):
+            m.d.sync += max_g.eq(ims.sink.g) 
+        with m.If(ims.sink.b > max_b):
+            m.d.sync += max_b.eq(ims.sink.b) 
 
         with m.If(camread.frame_done):
             m.d.sync += [
@@ -214,6 +251,40 @@ class CamTest(Elaboratable):
         # Show value on leds
         m.d.comb += leds.eq(ims.p_x)
 
+        # Track the bright spots, as the laser pointer does, and read the
+        # first four of each frame, flipped as the image is
+        m.submodules.blobs = blobs = BlobTracker()
+
+        m.d.comb += [
+            blobs.i_valid.eq(ims.sink.accepted()),
+            blobs.i_first.eq(ims.sink.first),
+            blobs.i_last.eq(ims.sink.last),
+            blobs.i_p.eq(ims.sink.r > val)
+        ]
+
+        blob_x = Array([Signal(9, name="blob_x_%d" % i) for i in range(4)])
+        blob_y = Array([Signal(9, name="blob_y_%d" % i) for i in range(4)])
+        blob_n = Signal(3)
+        blob_i = Signal(3, reset=4)
+        blob_r = Signal(3, reset=4)
+
+        m.d.comb += blobs.blob_addr.eq(blob_i)
+        m.d.sync += blob_r.eq(blob_i)
+
+        with m.If(blobs.o_done):
+            m.d.sync += [
+                blob_i.eq(0),
+                blob_n.eq(Mux(blobs.o_blobs > 4, 4, blobs.o_blobs))
+            ]
+        with m.Elif(blob_i != 4):
+            m.d.sync += blob_i.eq(blob_i + 1)
+
+        with m.If(blob_r != 4):
+            m.d.sync += [
+                blob_x[blob_r].eq(Mux(sw2, 319 - blobs.blob_x, blobs.blob_x)),
+                blob_y[blob_r].eq(Mux(sw3, 479 - blobs.blob_y, blobs.blob_y))
+            ]
+
         # VGA signal generator.
         vga_r = Signal(8)
         vga_g = Signal(8)
@@ -238,21 +309,37 @@ class CamTest(Elaboratable):
            bits_y            = 16  # a smaller/larger value will make it pass timing.
         )
 
-        # Connect frame buffer
+        # Connect frame buffer, which can take a pixel every cycle
         m.d.comb += [
-            w.en.eq(ims.ready),
-            w.addr.eq(ims.o_y * 320 + ims.o_x),
-            w.data.eq(Cat(ims.o_b, ims.o_g, ims.o_r)),
+            ims.source.ready.eq(1),
+            w.en.eq(ims.source.valid),
+            w.addr.eq(ims.source.y * 320 + ims.source.x),
+            w.data.eq(Cat(ims.source.b, ims.source.g, ims.source.r)),
             r.addr.eq(vga.o_beam_y * 320 + vga.o_beam_x[1:])
         ]
 
+        # Crosses on the tracked spots, in the filter view, registered to
+        # line up with the frame buffer data
+        cross = Signal()
+        on_blob = []
+        for i in range(4):
+            dx = Signal(signed(11), name="dx_%d" % i)
+            dy = Signal(signed(11), name="dy_%d" % i)
+            m.d.comb += [
+                dx.eq(vga.o_beam_x[1:] - blob_x[i]),
+                dy.eq(vga.o_beam_y - blob_y[i])
+            ]
+            on_blob.append((i < blob_n) & (((dx == 0) & (dy > -8) & (dy < 8)) |
+                                           ((dy == 0) & (dx > -8) & (dx < 8))))
+        m.d.sync += cross.eq(sw8.sw8 & Cat(*on_blob).any())
+
         # Generate VGA signals
         m.d.comb += [
             vga.i_clk_en.eq(1),
             vga.i_test_picture.eq(0),
-            vga.i_r.eq(Cat(Const(0, unsigned(3)), r.data[11:16])), 
-            vga.i_g.eq(Cat(Const(0, unsigned(2)), r.data[5:11])), 
-            vga.i_b.eq(Cat(Const(0, unsigned(3)), r.data[0:5])), 
+            vga.i_r.eq(Mux(cross, 0, Cat(Const(0, unsigned(3)), r.data[11:16]))),
+            vga.i_g.eq(Mux(cross, 0xff, Cat(Const(0, unsigned(2)), r.data[5:11]))),
+            vga.i_b.eq(Mux(cross, 0, Cat(Const(0, unsigned(3)), r.data[0:5]))),
             vga_r.eq(vga.o_vga_r),
             vga_g.eq(vga.o_vga_g),
             vga_b.eq(vga.o_vga_b),
@@ -326,12 +413,13 @@ if __name__ == "__main__":
     # Figure out which FPGA variant we want to target...
     parser = argparse.ArgumentParser()
     parser.add_argument('variant', choices=variants.keys())
+    parser.add_argument('--baud', type=int, default=1000000, help='uart baud rate')
     args = parser.parse_args()
 
     platform = variants[args.variant]()
 
     m = Module()
-    m.submodules.top = top = CamTest(timing=vga_timings['640x480@60Hz'])
+    m.submodules.top = top = CamTest(timing=vga_timings['640x480@60Hz'], baud=args.baud)
 
     platform.add_resources(ov7670_pmod)
     platform.add_resources(switch_pmod)
@@ -0,0 +1,279 @@
+from nmigen import *
+
+from stream import Stream, SkidBuffer
+
+# Crop and decimate a stream of RGB565 pixels, before it goes to the frame
+# buffer or the image processing, so that they can work on a smaller image.
+#
+# The input pixels are counted from the first and last flags of the stream,
+# and only those inside the crop window (crop_x, crop_y, crop_w, crop_h) are
+# kept. These are then decimated by h_div horizontally and v_div vertically,
+# which are the number of input pixels for each output pixel, with 4
+# fractional bits, so 16 keeps every pixel, 32 halves the size, 64 quarters
+# it and 24 gives 2/3 of it. They must be from 16 to 255.
+#
+# Each output pixel is the average (a box filter) of the input pixels that
+# start inside it, so the number of pixels averaged varies by one for
+# fractional factors. The last pixels of a row or column of the crop window
+# are averaged on their own if there are not enough to fill an output pixel.
+# The horizontal averages are accumulated in a line buffer for the vertical
+# averages. Output pixels carry their co-ordinates.
+class CropScale(Elaboratable):
+    # Fractional bits of h_div and v_div
+    FRAC = 4
+
+    # Most pixels averaged in each direction, and the precision of the
+    # reciprocals used to divide by the number of pixels
+    MAX_N = 16
+    RECIP_BITS = 12
+
+    def __init__(self, max_w=640):
+        # Parameters
+        self.max_w     = max_w
+
+        # Inputs
+        self.sink      = Stream([("r", 5), ("g", 6), ("b", 5)])
+        self.crop_x    = Signal(10)
+        self.crop_y    = Signal(10)
+        self.crop_w    = Signal(11, reset=640)
+        self.crop_h    = Signal(11, reset=480)
+        self.h_div     = Signal(8, reset=16)
+        self.v_div     = Signal(8, reset=16)
+
+        # Outputs
+        self.source    = Stream([("x", 10), ("y", 10), ("r", 5), ("g", 6), ("b", 5)])
+
+    # Reciprocal of n, rounded, used to divide by n
+    @classmethod
+    def recip(cls, n):
+        return ((1 << (cls.RECIP_BITS + 1)) // n + 1) >> 1
+
+    # Average of the sum of n values, with rounding, as done by the hardware
+    @classmethod
+    def average(cls, s, n):
+        return (s * cls.recip(n) + (1 << (cls.RECIP_BITS - 1))) >> cls.RECIP_BITS
+
+    def elaborate(self, platform):
+        m = Module()
+
+        one = 1 << self.FRAC
+        chans = [("r", 5), ("g", 6), ("b", 5)]
+        sw = (self.MAX_N - 1).bit_length() + 1
+
+        recip = Array([Const(0 if n == 0 else self.recip(n), self.RECIP_BITS + 1)
+                       for n in range(self.MAX_N + 1)])
+
+        def average(s, n):
+            return (s * recip[n] + (1 << (self.RECIP_BITS - 1))) >> self.RECIP_BITS
+
+        # Output skid buffer, which stops everything when it is not ready
+        m.submodules.skid = skid = SkidBuffer(self.source.payload_layout)
+        m.d.comb += skid.source.connect_to(self.source)
+
+        out = skid.sink
+        advance = Signal()
+        accept = Signal()
+        m.d.comb += [
+            advance.eq(out.ready),
+            self.sink.ready.eq(advance),
+            accept.eq(self.sink.accepted())
+        ]
+
+        with m.If(out.ready):
+            m.d.sync += out.valid.eq(0)
+
+        # Position of the input pixel, from the first and last flags
+        x  = Signal(10)
+        y  = Signal(10)
+        cx = Signal(10)
+        cy = Signal(10)
+        fs = self.sink.first
+
+        m.d.comb += [
+            cx.eq(Mux(fs, 0, x)),
+            cy.eq(Mux(fs, 0, y))
+        ]
+
+        with m.If(accept):
+            m.d.sync += [
+                x.eq(Mux(self.sink.last, 0, cx + 1)),
+                y.eq(Mux(self.sink.last, cy + 1, cy))
+            ]
+
+        # Crop window
+        x_last = Signal(11)
+        y_last = Signal(11)
+        in_win = Signal()
+        end_x  = Signal()
+        end_y  = Signal()
+
+        m.d.comb += [
+            x_last.eq(self.crop_x + self.crop_w - 1),
+            y_last.eq(self.crop_y + self.crop_h - 1),
+            in_win.eq((cx >= self.crop_x) & (cx <= x_last) & (cy >= self.crop_y) & (cy <= y_last)),
+            end_x.eq(cx == x_last),
+            end_y.eq(cy == y_last)
+        ]
+
+        # Decimation state, which is reset at the start of a frame
+        h_phase = Signal(8)
+        h_n     = Signal(sw)
+        v_phase = Signal(8)
+        v_n     = Signal(sw)
+        v_first = Signal(reset=1)
+        ox      = Signal(10)
+        oy      = Signal(10)
+
+        e_h_phase = Signal(8)
+        e_h_n     = Signal(sw)
+        e_v_phase = Signal(8)
+        e_v_n     = Signal(sw)
+        e_v_first = Signal()
+        e_ox      = Signal(10)
+        e_oy      = Signal(10)
+
+        m.d.comb += [
+            e_h_phase.eq(Mux(fs, 0, h_phase)),
+            e_h_n.eq(Mux(fs, 0, h_n)),
+            e_v_phase.eq(Mux(fs, 0, v_phase)),
+            e_v_n.eq(Mux(fs, 0, v_n)),
+            e_v_first.eq(fs | v_first),
+            e_ox.eq(Mux(fs, 0, ox)),
+            e_oy.eq(Mux(fs, 0, oy))
+        ]
+
+        # Horizontal sums, and the values for a pixel that ends an output pixel
+        h_ph1  = Signal(9)
+        h_emit = Signal()
+        v_ph1  = Signal(9)
+        v_end  = Signal()
+
+        m.d.comb += [
+            h_ph1.eq(e_h_phase + one),
+            h_emit.eq((h_ph1 >= self.h_div) | end_x),
+            v_ph1.eq(e_v_phase + one),
+            v_end.eq((v_ph1 >= self.v_div) | end_y)
+        ]
+
+        # Horizontal average stage
+        h_valid = Signal()
+        h_cnt   = Signal(sw)
+        h_ox    = Signal(10)
+        h_oy    = Signal(10)
+        h_first = Signal()
+        h_vlast = Signal()
+        h_vn    = Signal(sw)
+        h_xlast = Signal()
+
+        with m.If(advance):
+            m.d.sync += h_valid.eq(0)
+
+        h_acc = {}
+        h_tot = {}
+        h_sum = {}
+        for c, dw in chans:
+            h_acc[c] = Signal(dw + sw, name="h_acc_" + c)
+            h_tot[c] = Signal(dw + sw, name="h_tot_" + c)
+            h_sum[c] = Signal(dw + sw, name="h_sum_" + c)
+            m.d.comb += h_tot[c].eq(Mux(e_h_n == 0, 0, h_acc[c]) + self.sink[c])
+
+        with m.If(accept & in_win):
+            with m.If(h_emit):
+                m.d.sync += [
+                    h_valid.eq(1),
+                    h_cnt.eq(e_h_n + 1),
+                    h_ox.eq(e_ox),
+                    h_oy.eq(e_oy),
+                    h_first.eq(e_v_first),
+                    h_vlast.eq(v_end),
+                    h_vn.eq(e_v_n + 1),
+                    h_xlast.eq(end_x),
+                    [h_sum[c].eq(h_tot[c]) for c, _ in chans],
+                    h_n.eq(0),
+                    h_phase.eq(Mux(end_x, 0, h_ph1 - self.h_div)),
+                    ox.eq(Mux(end_x, 0, e_ox + 1))
+                ]
+            with m.Else():
+                m.d.sync += [
+                    [h_acc[c].eq(h_tot[c]) for c, _ in chans],
+                    h_n.eq(e_h_n + 1),
+                    h_phase.eq(h_ph1),
+                    ox.eq(e_ox)
+                ]
+
+            # Vertical state moves on at the end of each line of the window
+            with m.If(end_x):
+                with m.If(v_end):
+                    m.d.sync += [
+                        v_phase.eq(Mux(end_y, 0, v_ph1 - self.v_div)),
+                        v_n.eq(0),
+                        v_first.eq(1),
+                        oy.eq(Mux(end_y, 0, e_oy + 1))
+                    ]
+                with m.Else():
+                    m.d.sync += [
+                        v_phase.eq(v_ph1),
+                        v_n.eq(e_v_n + 1),
+                        v_first.eq(0),
+                        oy.eq(e_oy)
+                    ]
+            with m.Else():
+                m.d.sync += [
+                    v_phase.eq(e_v_phase),
+                    v_n.eq(e_v_n),
+                    v_first.eq(e_v_first),
+                    oy.eq(e_oy)
+                ]
+        with m.Elif(accept & fs):
+            # Start of a frame outside the window
+            m.d.sync += [
+                h_phase.eq(0),
+                h_n.eq(0),
+                v_phase.eq(0),
+                v_n.eq(0),
+                v_first.eq(1),
+                ox.eq(0),
+                oy.eq(0)
+            ]
+
+        # Line buffer of vertical sums, one entry per output column. It is read
+        # at the column being accumulated, or at the one waiting for the
+        # vertical stage while stopped, so the data is there for that stage.
+        lines = Memory(width=sum(dw + sw for _, dw in chans), depth=self.max_w)
+        m.submodules.lr = lr = lines.read_port()
+        m.submodules.lw = lw = lines.write_port()
+
+        m.d.comb += [
+            lr.addr.eq(Mux(advance, e_ox, h_ox)),
+            lw.addr.eq(h_ox),
+            lw.en.eq(advance & h_valid & ~h_vlast)
+        ]
+
+        # Vertical average stage
+        v_sums = []
+        pos = 0
+        for c, dw in chans:
+            h_avg = Signal(dw, name="h_avg_" + c)
+            v_sum = Signal(dw + sw, name="v_sum_" + c)
+            m.d.comb += [
+                h_avg.eq(average(h_sum[c], h_cnt)),
+                v_sum.eq(Mux(h_first, 0, lr.data[pos:pos + dw + sw]) + h_avg)
+            ]
+            pos += dw + sw
+            v_sums.append(v_sum)
+
+            with m.If(advance & h_valid & h_vlast):
+                m.d.sync += out[c].eq(average(v_sum, h_vn))
+
+        m.d.comb += lw.data.eq(Cat(*v_sums))
+
+        with m.If(advance & h_valid & h_vlast):
+            m.d.sync += [
+                out.valid.eq(1),
+                out.x.eq(h_ox),
+                out.y.eq(h_oy),
+                out.first.eq((h_ox == 0) & (h_oy == 0)),
+                out.last.eq(h_xlast)
+            ]
+
+        return m
@@ -1,22 +1,26 @@
 from nmigen import *
 from nmigen.build import Platform
 
+from stream import Stream, SkidBuffer
+from tone_lut import ToneLUT
+
+gamma32 = [0, 0, 0, 0, 1, 1, 1, 2, 2, 3, 3, 4, 5, 5, 6, 7,
+           8, 9, 10, 12, 13, 14, 16, 17, 19, 20, 22, 24, 25, 27, 29, 31]
+
+gamma64 = [0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 2, 2, 2, 3, 3, 4,
+           4, 5, 5, 6, 6, 7, 8, 8, 9, 10, 11, 12, 12, 13, 14, 15,
+           16, 17, 18, 19, 21, 22, 23, 24, 25, 27, 28, 29, 31, 32, 34, 35,
+           37, 38, 40, 41, 43, 45, 46, 48, 50, 52, 53, 55, 57, 59, 61, 63]
+
+# Process a stream of pixels with their co-ordinates. The processed pixels
+# come out of the source stream, through a skid buffer, so that nothing is
+# lost if the stage after it is not ready.
 class ImageStream(Elaboratable):
     def __init__(self, res_x = 320, res_y = 480):
         self.res_x       = res_x
         self.res_y       = res_y
-        self.valid       = Signal()
-        self.i_x         = Signal(10)
-        self.i_y         = Signal(10)
-        self.i_r         = Signal(5)
-        self.i_g         = Signal(6)
-        self.i_b         = Signal(5)
-        self.ready       = Signal(16)
-        self.o_x         = Signal(10)
-        self.o_y         = Signal(9)
-        self.o_r         = Signal(5)
-        self.o_g         = Signal(6)
-        self.o_b         = Signal(5)
+        self.sink        = Stream([("x", 10), ("y", 10), ("r", 5), ("g", 6), ("b", 5)])
+        self.source      = Stream([("x", 10), ("y", 9), ("r", 5), ("g", 6), ("b", 5)])
         self.val         = Signal(signed(7))
         self.edge        = Signal()
         self.x_flip      = Signal()
@@ -33,34 +37,38 @@ class ImageStream(Elaboratable):
         self.border      = Signal()
         self.p_x         = Signal(10)
         self.p_y         = Signal(10)
+        self.lut         = ToneLUT(init_r=gamma32, init_g=gamma64, init_b=gamma32)
 
     def elaborate(self, platform):
         m = Module()
 
-        gamma32 = [0, 0, 0, 0, 1, 1, 1, 2, 2, 3, 3, 4, 5, 5, 6, 7,
-                   8, 9, 10, 12, 13, 14, 16, 17, 19, 20, 22, 24, 25, 27, 29, 31]
-
-        gamma64 = [0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 2, 2, 2, 3, 3, 4,
-                   4, 5, 5, 6, 6, 7, 8, 8, 9, 10, 11, 12, 12, 13, 14, 15,
-                   16, 17, 18, 19, 21, 22, 23, 24, 25, 27, 28, 29, 31, 32, 34, 35,
-                   37, 38, 40, 41, 43, 45, 46, 48, 50, 52, 53, 55, 57, 59, 61, 63]
+        # Output skid buffer, and the pixel being processed
+        m.submodules.skid = skid = SkidBuffer(self.source.payload_layout)
+        m.d.comb += skid.source.connect_to(self.source)
 
-        gr_tab = Memory(width=5, depth=32,init=gamma32)
-        m.submodules.gr = gr = gr_tab.read_port()
+        out = skid.sink
+        valid = Signal()
+        m.d.comb += [
+            self.sink.ready.eq(out.ready),
+            valid.eq(self.sink.accepted())
+        ]
 
-        gg_tab = Memory(width=6, depth=64,init=gamma64)
-        m.submodules.gg = gg = gg_tab.read_port()
+        i_x = self.sink.x
+        i_y = self.sink.y
+        i_r = self.sink.r
+        i_g = self.sink.g
+        i_b = self.sink.b
 
-        gb_tab = Memory(width=5, depth=32,init=gamma32)
-        m.submodules.gb = gb = gb_tab.read_port()
+        # Gamma tables, which can be replaced through the write port of lut
+        m.submodules.lut = lut = self.lut
 
         # Apply x_flip and yflip
         c_x = Signal(10)
         c_y = Signal(10)
 
         m.d.comb += [
-            c_x.eq(Mux(self.x_flip, self.res_x - 1 - self.i_x, self.i_x)),
-            c_y.eq(Mux(self.y_flip, self.res_y - 1 - self.i_y, self.i_y))
+            c_x.eq(Mux(self.x_flip, self.res_x - 1 - i_x, i_x)),
+            c_y.eq(Mux(self.y_flip, self.res_y - 1 - i_y, i_y))
         ]
 
         # Line buffer
@@ -84,17 +92,18 @@ class ImageStream(Elaboratable):
         p_s = Signal(7)
 
         m.d.comb += [
-            s.eq(self.i_r + self.i_g + self.i_b)
+            s.eq(i_r + i_g + i_b)
         ]
 
-        m.d.sync += [
-            # Default ready to false
-            self.ready.eq(0),
-            p_s.eq(s)
-        ]
+        # Default valid to false, once the last pixel has been taken
+        with m.If(out.ready):
+            m.d.sync += out.valid.eq(0)
+
+        with m.If(valid):
+            m.d.sync += p_s.eq(s)
 
         # When at end of line, update line pointers
-        with m.If((c_x == self.res_x - 1) & (self.valid)):
+        with m.If((c_x == self.res_x - 1) & (valid)):
             m.d.sync += [
                 ppl.eq(pl),
                 pl.eq(cl),
@@ -113,7 +122,7 @@ class ImageStream(Elaboratable):
                 c_b.eq(Mux(self.invert, 0x1f - s[2:], s[2:]))
             ]
         with m.Elif(self.filter):
-            with m.If((self.i_r > self.val)):
+            with m.If((i_r > self.val)):
                 m.d.comb += [
                     c_r.eq(0x1f),
                     c_g.eq(0),
@@ -127,9 +136,9 @@ class ImageStream(Elaboratable):
                 ]
         with m.Else():
             m.d.comb += [
-                c_r.eq(self.i_r),
-                c_g.eq(self.i_g),
-                c_b.eq(self.i_b)
+                c_r.eq(i_r),
+                c_g.eq(i_g),
+                c_b.eq(i_b)
             ]
 
         # Calculate laser mouse pointer
@@ -138,7 +147,7 @@ class ImageStream(Elaboratable):
         min_y = Signal(10)
         max_y = Signal(10)
 
-        with m.If((self.i_x == 0) & (self.i_y == 0)):
+        with m.If(valid & (i_x == 0) & (i_y == 0)):
             m.d.sync += [
                 min_x.eq(0),
                 min_y.eq(0),
@@ -146,7 +155,7 @@ class ImageStream(Elaboratable):
                 max_y.eq(0)
             ]
 
-        with m.If(self.i_r > self.val):
+        with m.If(valid & (i_r > self.val)):
             with m.If ((min_x == 0) | (c_x < min_x)):
                 m.d.sync += min_x.eq(c_x)
             with m.If((max_x == 0) | (c_x > max_x)):
@@ -167,16 +176,17 @@ class ImageStream(Elaboratable):
         g_b = Signal(5)
 
         m.d.comb += [
-            gr.addr.eq(c_r),
-            gg.addr.eq(c_g),
-            gb.addr.eq(c_b),
+            lut.i_r.eq(c_r),
+            lut.i_g.eq(c_g),
+            lut.i_b.eq(c_b),
+            lut.i_start.eq(valid & self.sink.first)
         ]
 
         with m.If(self.gamma):
             m.d.comb += [
-                g_r.eq(gr.data),
-                g_g.eq(gg.data),
-                g_b.eq(gb.data)
+                g_r.eq(lut.o_r),
+                g_g.eq(lut.o_g),
+                g_b.eq(lut.o_b)
             ]
         with m.Else():
             m.d.comb += [
@@ -196,20 +206,22 @@ class ImageStream(Elaboratable):
             n_b.eq(g_b + self.val)
         ]
 
-        # Process pixel when valid set, and set ready
-        with m.If(self.valid):
+        # Process pixel when accepted, and set valid
+        with m.If(valid):
             m.d.sync += [
-                self.ready.eq(1),
+                out.valid.eq(1),
+                out.first.eq(self.sink.first),
+                out.last.eq(self.sink.last),
                 # Set output x and y with horizontal and vertical flip
-                self.o_x.eq(c_x),
-                self.o_y.eq(c_y),
+                out.x.eq(c_x),
+                out.y.eq(c_y),
                 # Copy input pixel by default
-                self.o_r.eq(g_r),
-                self.o_g.eq(g_g),
-                self.o_b.eq(g_b),
+                out.r.eq(g_r),
+                out.g.eq(g_g),
+                out.b.eq(g_b),
                 # Write pixel to current line
                 w.addr.eq(cl * self.res_x + c_x),
-                w.data.eq(Cat(self.i_b, self.i_g, self.i_r)),
+                w.data.eq(Cat(i_b, i_g, i_r)),
                 # Get the pixel above the current one
                 r.addr.eq(pl * self.res_x + c_x),
                 above.eq(r.data)
@@ -219,37 +231,37 @@ class ImageStream(Elaboratable):
             with m.If(self.edge):
                 with m.If(((p_s > s) & ((p_s - s) > self.val)) | ((p_s < s) & ((s - p_s) > self.val))):
                     m.d.sync += [
-                        self.o_r.eq(0x1f),
-                        self.o_g.eq(0),
-                        self.o_b.eq(0)
+                        out.r.eq(0x1f),
+                        out.g.eq(0),
+                        out.b.eq(0)
                     ]
                 with m.Else():
                     m.d.sync += [
-                        self.o_r.eq(0),
-                        self.o_g.eq(0),
-                        self.o_b.eq(0)
+                        out.r.eq(0),
+                        out.g.eq(0),
+                        out.b.eq(0)
                     ]
             with m.Else():
             # Increase colors or total brightness
                 with m.If(self.red | self.bright):
                     m.d.sync += [
-                        self.o_r.eq(Mux(n_r > 0x1f, 0x1f, Mux(n_r < 0, 0, n_r)))
+                        out.r.eq(Mux(n_r > 0x1f, 0x1f, Mux(n_r < 0, 0, n_r)))
                     ]
                 with m.If(self.green | self.bright):
                     m.d.sync += [
-                        self.o_g.eq(Mux(n_g > 0x3f, 0x3f, Mux(n_g < 0, 0, n_g)))
+                        out.g.eq(Mux(n_g > 0x3f, 0x3f, Mux(n_g < 0, 0, n_g)))
                     ]
                 with m.If(self.blue | self.bright):
                     m.d.sync += [
-                        self.o_b.eq(Mux(n_b > 0x1f, 0x1f, Mux(n_b < 0, 0, n_b)))
+                        out.b.eq(Mux(n_b > 0x1f, 0x1f, Mux(n_b < 0, 0, n_b)))
                     ]
 
             # Draw a border
             with m.If(self.border & ((c_x == 0) | (c_x == self.res_x - 1) | (c_y == 0) | (c_y == self.res_y - 1))):
                 m.d.sync += [
-                    self.o_r.eq(0),
-                    self.o_g.eq(0),
-                    self.o_b.eq(0x1f)
+                    out.r.eq(0),
+                    out.g.eq(0),
+                    out.b.eq(0x1f)
                 ]
 
         return m
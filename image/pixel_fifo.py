@@ -0,0 +1,75 @@
+from nmigen import *
+from nmigen.lib.fifo import AsyncFIFOBuffered
+from nmigen.lib.cdc import FFSynchronizer
+from nmigen.lib.coding import GrayDecoder
+
+from stream import Stream
+
+# Clock domain crossing for a stream of pixels, from the camera's pclock
+# domain (w_domain) into the system clock domain (r_domain), through an
+# asynchronous fifo with gray-coded pointers.
+#
+# The camera cannot be stopped, so pixels that arrive when the fifo is
+# full are dropped and counted in o_overflow. o_underflow counts the
+# cycles where the reader was ready, in the middle of a line, but the
+# fifo was empty. Both counters are in the read domain, and wrap around.
+class PixelFIFO(Elaboratable):
+    def __init__(self, payload=16, depth=1024, r_domain="sync", w_domain="pclock", cw=16):
+        # Parameters
+        self.depth       = depth
+        self.r_domain    = r_domain
+        self.w_domain    = w_domain
+        self.cw          = cw
+
+        # Inputs, in w_domain
+        self.sink        = Stream(payload)
+
+        # Outputs, in r_domain
+        self.source      = Stream(payload)
+        self.o_overflow  = Signal(cw)
+        self.o_underflow = Signal(cw)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        w_fields = self.sink.payload_fields()
+        r_fields = self.source.payload_fields()
+
+        m.submodules.fifo = fifo = AsyncFIFOBuffered(width=len(Cat(*w_fields)), depth=self.depth,
+                                                     r_domain=self.r_domain, w_domain=self.w_domain)
+
+        m.d.comb += [
+            fifo.w_en.eq(self.sink.valid),
+            fifo.w_data.eq(Cat(*w_fields)),
+            self.sink.ready.eq(fifo.w_rdy),
+            self.source.valid.eq(fifo.r_rdy),
+            Cat(*r_fields).eq(fifo.r_data),
+            fifo.r_en.eq(self.source.ready)
+        ]
+
+        # Overflow count in the write domain, passed to the read domain in gray
+        # code, so that only one bit changes at a time
+        overflow      = Signal(self.cw)
+        overflow_gray = Signal(self.cw)
+        overflow_sync = Signal(self.cw)
+
+        with m.If(self.sink.valid & ~fifo.w_rdy):
+            m.d[self.w_domain] += overflow.eq(overflow + 1)
+        m.d[self.w_domain] += overflow_gray.eq(overflow ^ (overflow >> 1))
+
+        m.submodules.overflow_sync = FFSynchronizer(overflow_gray, overflow_sync, o_domain=self.r_domain)
+        m.submodules.overflow_dec = dec = GrayDecoder(self.cw)
+        m.d.comb += [
+            dec.i.eq(overflow_sync),
+            self.o_overflow.eq(dec.o)
+        ]
+
+        # Underflow count, while inside a line
+        in_line = Signal()
+
+        with m.If(self.source.accepted()):
+            m.d[self.r_domain] += in_line.eq(~self.source.last)
+        with m.Elif(self.source.ready & in_line):
+            m.d[self.r_domain] += self.o_underflow.eq(self.o_underflow + 1)
+
+        return m
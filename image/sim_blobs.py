@@ -0,0 +1,142 @@
+import argparse
+
+import numpy as np
+
+from nmigen import *
+from nmigen.sim import *
+
+from blobs import BlobTracker
+
+# Check BlobTracker against a flood fill, on frames of random spots,
+# rings, diagonal lines and U shapes, which need merging, with random gaps
+# in the input. The blobs read back after each frame must be the blobs of
+# the frame, in any order.
+
+def reference(img, min_area):
+    h, w = img.shape
+    seen = np.zeros_like(img, dtype=bool)
+    blobs = []
+    for y0 in range(h):
+        for x0 in range(w):
+            if img[y0, x0] and not seen[y0, x0]:
+                seen[y0, x0] = True
+                stack = [(y0, x0)]
+                pixels = []
+                while stack:
+                    y, x = stack.pop()
+                    pixels.append((y, x))
+                    for dy in (-1, 0, 1):
+                        for dx in (-1, 0, 1):
+                            yy, xx = y + dy, x + dx
+                            if 0 <= yy < h and 0 <= xx < w and img[yy, xx] and not seen[yy, xx]:
+                                seen[yy, xx] = True
+                                stack.append((yy, xx))
+                ys = [p[0] for p in pixels]
+                xs = [p[1] for p in pixels]
+                if len(pixels) >= min_area:
+                    blobs.append((sum(xs) // len(xs), sum(ys) // len(ys), len(pixels),
+                                  min(xs), max(xs), min(ys), max(ys)))
+    return sorted(blobs)
+
+def make_frame(w, h, n, rng):
+    img = np.zeros((h, w), dtype=int)
+    yy, xx = np.mgrid[0:h, 0:w]
+    for i in range(n):
+        kind = rng.integers(0, 4)
+        cx, cy = rng.integers(0, w), rng.integers(0, h)
+        r = rng.integers(1, 6)
+        if kind == 0:
+            # Spot
+            img |= (xx - cx) ** 2 + (yy - cy) ** 2 <= r * r
+        elif kind == 1:
+            # Ring
+            d = (xx - cx) ** 2 + (yy - cy) ** 2
+            img |= (d <= (r + 2) ** 2) & (d >= r * r)
+        elif kind == 2:
+            # Diagonal line, going down to the left
+            for t in range(3 * r):
+                if 0 <= cy + t < h and 0 <= cx - t < w:
+                    img[cy + t, cx - t] = 1
+        else:
+            # U shape, whose arms meet at the bottom
+            img[cy:cy + 2 * r, cx:cx + 1] = 1
+            img[cy:cy + 2 * r, cx + 2 * r:cx + 2 * r + 1] = 1
+            img[cy + 2 * r:cy + 2 * r + 1, cx:cx + 2 * r + 1] = 1
+    # Some single pixels, below the minimum area
+    for i in range(n):
+        img[rng.integers(0, h), rng.integers(0, w)] = 1
+    return img
+
+def run(frames, labels, max_blobs, min_area, gap, seed):
+    h, w = frames[0].shape
+    dut = BlobTracker(w=w, h=h, labels=labels, max_blobs=max_blobs)
+    rng = np.random.default_rng(seed)
+
+    results = []
+    dropped = []
+
+    def process():
+        yield dut.min_area.eq(min_area)
+        for f in frames:
+            for i, p in enumerate(f.ravel()):
+                while rng.random() < gap:
+                    yield dut.i_valid.eq(0)
+                    yield
+                yield dut.i_p.eq(int(p))
+                yield dut.i_first.eq(i == 0)
+                yield dut.i_last.eq(i % w == w - 1)
+                yield dut.i_valid.eq(1)
+                yield
+            yield dut.i_valid.eq(0)
+            while not (yield dut.o_done):
+                yield
+            yield
+            blobs = []
+            for b in range((yield dut.o_blobs)):
+                yield dut.blob_addr.eq(b)
+                yield
+                yield
+                blobs.append(((yield dut.blob_x), (yield dut.blob_y), (yield dut.blob_area),
+                              (yield dut.blob_min_x), (yield dut.blob_max_x),
+                              (yield dut.blob_min_y), (yield dut.blob_max_y)))
+            results.append(sorted(blobs))
+        dropped.append((yield dut.o_dropped))
+
+    sim = Simulator(dut)
+    sim.add_clock(1e-6)
+    sim.add_sync_process(process)
+    sim.run()
+
+    errors = 0
+    for n, (f, hw) in enumerate(zip(frames, results)):
+        ref = reference(f, min_area)
+        if hw != ref:
+            print("    frame", n)
+            print("      hardware", hw)
+            print("      expected", ref)
+            errors += 1
+        print("frame {} {:2} blobs {:>2} errors".format(n, len(ref), int(hw != ref)))
+    if dropped[0]:
+        print("{} blobs dropped".format(dropped[0]))
+        errors += 1
+    return errors
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=48)
+    parser.add_argument("--height", type=int, default=32)
+    parser.add_argument("--frames", type=int, default=6)
+    parser.add_argument("--spots", type=int, default=5)
+    parser.add_argument("--gap", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    frames = [make_frame(args.width, args.height, args.spots, rng) for i in range(args.frames)]
+
+    errors = 0
+    for gap in [0.0, args.gap]:
+        print("gap", gap)
+        errors += run(frames, 16, 16, 4, gap, args.seed)
+
+    print("{} errors".format(errors))
@@ -0,0 +1,171 @@
+import argparse
+
+import numpy as np
+
+from nmigen import *
+from nmigen.sim import *
+
+from camconfig import CamConfig
+from camread import CamRead
+from pixel_fifo import PixelFIFO
+from crop_scale import CropScale
+from image_stream import ImageStream
+from ov7670_model import OV7670Model
+from readhex import readhex
+
+# End-to-end simulation of the camera path of camtest.py, without a camera:
+# OV7670Model is configured over the SCCB by CamConfig, and its frames go
+# through CamRead, PixelFIFO, CropScale and ImageStream into the frame
+# buffer, as in camtest.py, but for a smaller image. Every complete frame
+# written to the frame buffer once the camera is configured must be the
+# next frame of the video, with each pair of pixels averaged, and no pixels
+# may be dropped by the fifo. The register writes must be those of
+# config.mem. The configuration time, the frame rate and the latency are
+# reported.
+
+class Top(Elaboratable):
+    def __init__(self, w, h, clk_freq):
+        self.w = w
+        self.h = h
+        self.camconfig = CamConfig(clk_freq=clk_freq)
+        self.camread = CamRead(res_x=w)
+        self.fifo = PixelFIFO(depth=64)
+        self.crop = CropScale(max_w=w)
+        self.ims = ImageStream(res_x=w // 2, res_y=h)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        m.submodules.camconfig = camconfig = self.camconfig
+        m.submodules.camread = camread = self.camread
+        m.submodules.fifo = fifo = self.fifo
+        m.submodules.crop = crop = self.crop
+        m.submodules.ims = ims = self.ims
+
+        m.d.comb += [
+            camread.source.connect_to(fifo.sink),
+            fifo.source.ready.eq(crop.sink.ready),
+            crop.sink.valid.eq(fifo.source.valid),
+            crop.sink.first.eq(fifo.source.first),
+            crop.sink.last.eq(fifo.source.last),
+            crop.sink.r.eq(fifo.source.data[11:]),
+            crop.sink.g.eq(fifo.source.data[5:11]),
+            crop.sink.b.eq(fifo.source.data[0:5]),
+            crop.crop_w.eq(self.w),
+            crop.crop_h.eq(self.h),
+            crop.h_div.eq(32),
+            crop.v_div.eq(16),
+            crop.source.connect_to(ims.sink),
+            ims.source.ready.eq(1)
+        ]
+
+        return m
+
+# The frame buffer contents for a frame of the video: CropScale averages
+# each pair of pixels, rounding up
+def expected(img):
+    img = np.asarray(img, dtype=np.int64)
+    out = 0
+    for shift, mask in [(11, 0x1f), (5, 0x3f), (0, 0x1f)]:
+        c = (img >> shift) & mask
+        out |= ((c[:, 0::2] + c[:, 1::2] + 1) >> 1) << shift
+    return out
+
+def run(frames, n_frames, clk_freq, pclk_ratio):
+    h, w = frames[0].shape
+    dut = Top(w, h, clk_freq)
+    camera = OV7670Model(frames, pclk_period=pclk_ratio / clk_freq)
+
+    captured = []
+    config_cycles = [0]
+    overflow = [0]
+
+    def process():
+        fb = np.zeros((h, w // 2), dtype=int)
+        written = np.zeros((h, w // 2), dtype=bool)
+        cycles = 0
+
+        # Configure the camera
+        yield dut.camconfig.start.eq(1)
+        yield
+        yield dut.camconfig.start.eq(0)
+        while not (yield dut.camconfig.done):
+            cycles += 1
+            yield
+        config_cycles[0] = cycles
+
+        # Collect the frames written to the frame buffer
+        while len(captured) < n_frames:
+            if (yield dut.ims.source.valid):
+                x, y = (yield dut.ims.source.x), (yield dut.ims.source.y)
+                fb[y, x] = ((yield dut.ims.source.r) << 11) | ((yield dut.ims.source.g) << 5) | (yield dut.ims.source.b)
+                written[y, x] = True
+                if x == w // 2 - 1 and y == h - 1:
+                    if written.all():
+                        captured.append((camera.cycles, fb.copy()))
+                    written[:] = False
+            yield
+        overflow[0] = yield dut.fifo.o_overflow
+
+    sim = Simulator(dut)
+    sim.add_clock(1 / clk_freq)
+    sim.add_sync_process(process)
+    sim.add_sync_process(camera.sccb.process(dut.camconfig.sioc, dut.camconfig.siod))
+    sim.add_process(camera.process(dut.camread.p_clock, dut.camread.vsync, dut.camread.href, dut.camread.p_data))
+    sim.run()
+
+    errors = 0
+
+    # The register writes
+    writes = [(d >> 8, d & 0xff) for d in readhex("config.mem") if d not in (0xffff, 0xfff0)]
+    if camera.sccb.writes != writes:
+        print("    {} register writes, expected {}".format(len(camera.sccb.writes), len(writes)))
+        errors += 1
+    if camera.format() != "rgb565":
+        print("    camera format", camera.format(), "expected rgb565")
+        errors += 1
+    if overflow[0]:
+        print("    {} pixels dropped by the fifo".format(overflow[0]))
+        errors += 1
+
+    # The frames must follow the video in order, starting from any frame.
+    # The latency is from the end of the frame's last line at the camera to
+    # its last pixel in the frame buffer, in pclk cycles
+    refs = [expected(f) for f in frames]
+    line_cycles = 2 * w + camera.h_blank
+    n = None
+    latency = 0
+    for i, (pclks, fb) in enumerate(captured):
+        matches = [k for k, ref in enumerate(refs) if (fb == ref).all()]
+        if n is None and matches:
+            n = matches[0]
+        if n is None or n % len(frames) not in matches:
+            print("    frame {} does not match frame {} of the video".format(i, n))
+            errors += 1
+            n = None
+        else:
+            ends = [c + (camera.vsync + camera.v_back + h) * line_cycles - camera.h_blank
+                    for c, k, f in camera.sent if k == n % len(frames)]
+            latency = max(latency, pclks - max(e for e in ends if e <= pclks))
+            n += 1
+
+    period = (captured[-1][0] - captured[0][0]) / max(len(captured) - 1, 1)
+    print("{}x{}: configured in {:.1f} ms, {} frames, one every {:.0f} pclk cycles, latency {} pclk cycles {:>2} errors".format(
+        w, h, config_cycles[0] / clk_freq * 1e3, len(captured), period, latency, errors))
+    return errors
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=32)
+    parser.add_argument("--height", type=int, default=16)
+    parser.add_argument("--frames", type=int, default=3)
+    parser.add_argument("--pclk", type=float, default=0.6, help="pclk period, relative to the system clock")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    video = [rng.integers(0, 1 << 16, (args.height, args.width)) for i in range(3)]
+
+    errors = run(video, args.frames, 400000, args.pclk)
+
+    print("{} errors".format(errors))
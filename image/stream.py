@@ -0,0 +1,80 @@
+from nmigen import *
+from nmigen.hdl.rec import Layout
+
+# A stream of pixels (or any other data) with ready/valid handshaking.
+# An item is transferred on a cycle where both valid and ready are set,
+# and the source must hold valid and the payload until then. Along with
+# the payload, first marks the first item of a frame (start of frame) and
+# last marks the last item of a line (end of line).
+#
+# The payload is either a width, giving a single data field, or a layout.
+class Stream(Record):
+    def __init__(self, payload, name=None, src_loc_at=0):
+        if isinstance(payload, int):
+            payload = [("data", payload)]
+        self.payload_layout = Layout.cast(payload)
+
+        super().__init__([
+            ("valid", 1),
+            ("ready", 1),
+            ("first", 1),
+            ("last",  1)
+        ] + [(f, shape) for f, shape, _ in self.payload_layout],
+            name=name, src_loc_at=1 + src_loc_at)
+
+    # All the fields that travel with valid, including first and last
+    def payload_fields(self):
+        return [self.first, self.last] + [self[f] for f, _, _ in self.payload_layout]
+
+    # True on a cycle where an item is transferred
+    def accepted(self):
+        return self.valid & self.ready
+
+    # Statements connecting this stream as the source for sink. Payload fields
+    # are connected by name, and those that sink does not have are left out.
+    def connect_to(self, sink):
+        return [
+            sink.valid.eq(self.valid),
+            sink.first.eq(self.first),
+            sink.last.eq(self.last),
+            [sink[f].eq(self[f]) for f, _, _ in self.payload_layout if f in sink.fields],
+            self.ready.eq(sink.ready)
+        ]
+
+# A skid buffer: a registered stage between two streams, which also
+# registers ready, so that the ready path between stages is broken.
+# When the output is stalled, an item accepted on the same cycle is kept
+# in the skid register, so none are lost.
+class SkidBuffer(Elaboratable):
+    def __init__(self, payload):
+        # Inputs
+        self.sink      = Stream(payload)
+
+        # Outputs
+        self.source    = Stream(payload)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        skid = Stream(self.sink.payload_layout)
+
+        # Ready as long as the skid register is empty
+        m.d.comb += self.sink.ready.eq(~skid.valid)
+
+        with m.If(self.source.ready | ~self.source.valid):
+            # Output register is free, so take from the skid register if it is
+            # full, or else from the input
+            m.d.sync += [
+                self.source.valid.eq(skid.valid | self.sink.valid),
+                [o.eq(Mux(skid.valid, s, i)) for o, s, i in zip(
+                    self.source.payload_fields(), skid.payload_fields(), self.sink.payload_fields())],
+                skid.valid.eq(0)
+            ]
+        with m.Elif(self.sink.accepted()):
+            # Output stalled, so keep the new item in the skid register
+            m.d.sync += [
+                skid.valid.eq(1),
+                [s.eq(i) for s, i in zip(skid.payload_fields(), self.sink.payload_fields())]
+            ]
+
+        return m
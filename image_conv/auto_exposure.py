@@ -0,0 +1,220 @@
+from enum import IntEnum
+
+from nmigen import *
+
+class AutoExposureState(IntEnum):
+    IDLE     = 0
+    CALC     = 1
+    SEND     = 2
+    WAIT     = 3
+    READ     = 4
+
+# Closed-loop auto exposure and white balance for the OV7670.
+# At the end of each frame, when i_stats is pulsed, the channel means from
+# FrameStats are used to adjust the exposure, gain and red and blue balance,
+# and any registers that have changed are written over the SCCB.
+#
+# The luma is taken as (r + g + b) / 2 (the same as ImageConv's mono green),
+# and the exposure is scaled by about (1 + error / 32) each frame, so that it
+# converges in a few frames. It is at most halved, as the error is limited
+# when the image is saturated. The gain is only raised when the exposure is at
+# its maximum. White balance uses the gray world assumption: the red and
+# blue gains are scaled in the same way, to make their means equal to green.
+#
+# The low 2 bits of the exposure are in COM1, with other settings, so COM1
+# is read over the SCCB before it is first written after being enabled, and
+# only its exposure bits are changed.
+class AutoExposure(Elaboratable):
+    # OV7670 registers
+    GAIN  = 0x00
+    BLUE  = 0x01
+    RED   = 0x02
+    COM1  = 0x04
+    AECHH = 0x07
+    AECH  = 0x10
+    COM8  = 0x13
+
+    # COM8 with fast AEC, unlimited step and the banding filter, but AGC,
+    # AWB and AEC off
+    COM8_MANUAL = 0xe0
+
+    def __init__(self, target=32, deadband=1, max_exposure=0x1ff):
+        # Parameters
+        self.target       = target
+        self.deadband     = deadband
+        self.max_exposure = max_exposure
+
+        # Inputs
+        self.enable       = Signal()
+        self.i_stats      = Signal()
+        self.i_mean_r     = Signal(5)
+        self.i_mean_g     = Signal(6)
+        self.i_mean_b     = Signal(5)
+        self.sccb_ready   = Signal()
+        self.sccb_rd_data = Signal(8)
+        self.sccb_rd_valid = Signal()
+
+        # Outputs
+        self.sccb_start   = Signal()
+        self.sccb_addr    = Signal(8)
+        self.sccb_data    = Signal(8)
+        self.sccb_read    = Signal()
+        self.o_exposure   = Signal(16, reset=0x100)
+        self.o_gain       = Signal(8)
+        self.o_red        = Signal(8, reset=0x80)
+        self.o_blue       = Signal(8, reset=0x80)
+        self.o_converged  = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+
+        fsm_state = Signal(3, reset=AutoExposureState.IDLE)
+        timer     = Signal(2)
+
+        # COM1 as read from the camera, and whether it has been read
+        com1      = Signal(8)
+        com1_read = Signal()
+
+        # Registers to write: COM8, exposure, gain, red and blue
+        regs = [
+            (self.COM8,  Const(self.COM8_MANUAL, 8)),
+            (self.AECHH, self.o_exposure[10:16]),
+            (self.AECH,  self.o_exposure[2:10]),
+            (self.COM1,  Cat(self.o_exposure[0:2], com1[2:])),
+            (self.GAIN,  self.o_gain),
+            (self.RED,   self.o_red),
+            (self.BLUE,  self.o_blue)
+        ]
+        dirty = Signal(len(regs), reset=(1 << len(regs)) - 1)
+        index = Signal(range(len(regs)))
+
+        # Luma and errors, in 6-bit units, signed so the errors can be negative
+        y      = Signal(signed(8))
+        r      = Signal(signed(8))
+        g      = Signal(signed(8))
+        b      = Signal(signed(8))
+        err    = Signal(signed(8))
+        err_r  = Signal(signed(8))
+        err_b  = Signal(signed(8))
+
+        m.d.comb += [
+            r.eq(self.i_mean_r << 1),
+            g.eq(self.i_mean_g),
+            b.eq(self.i_mean_b << 1),
+            y.eq((self.i_mean_r + self.i_mean_g + self.i_mean_b) >> 1),
+            err.eq(self.target - y),
+            err_r.eq(g - r),
+            err_b.eq(g - b)
+        ]
+
+        # New values, before clamping
+        n_exp  = Signal(signed(24))
+        n_gain = Signal(signed(10))
+        n_red  = Signal(signed(18))
+        n_blue = Signal(signed(18))
+        step   = Signal(signed(24))
+
+        m.d.comb += [
+            step.eq((self.o_exposure * Mux(err < -16, -16, err)) >> 5),
+            n_exp.eq(self.o_exposure + Mux(step == 0, Mux(err < 0, -1, 1), step)),
+            n_gain.eq(self.o_gain + (err >> 1)),
+            n_red.eq(self.o_red + ((self.o_red * err_r) >> 5)),
+            n_blue.eq(self.o_blue + ((self.o_blue * err_b) >> 5))
+        ]
+
+        def clamp(v, lo, hi):
+            return Mux(v < lo, lo, Mux(v > hi, hi, v))
+
+        def outside(e, d):
+            return (e > d) | (e < -d)
+
+        with m.Switch(fsm_state):
+            with m.Case(AutoExposureState.IDLE):
+                with m.If(self.i_stats & self.enable):
+                    m.d.sync += fsm_state.eq(AutoExposureState.CALC)
+            with m.Case(AutoExposureState.CALC):
+                m.d.sync += [
+                    fsm_state.eq(AutoExposureState.SEND),
+                    index.eq(0),
+                    self.o_converged.eq(~outside(err, self.deadband))
+                ]
+                # Exposure, using gain when exposure is at its limit
+                with m.If(outside(err, self.deadband)):
+                    with m.If(((err > 0) & (self.o_exposure == self.max_exposure)) |
+                              ((err < 0) & (self.o_gain != 0))):
+                        m.d.sync += [
+                            self.o_gain.eq(clamp(n_gain, 0, 0xff)),
+                            dirty[4].eq(1)
+                        ]
+                    with m.Else():
+                        m.d.sync += [
+                            self.o_exposure.eq(clamp(n_exp, 1, self.max_exposure)),
+                            dirty[1:4].eq(0b111)
+                        ]
+                # White balance
+                with m.If(outside(err_r, self.deadband)):
+                    m.d.sync += [
+                        self.o_red.eq(clamp(n_red, 0, 0xff)),
+                        dirty[5].eq(1)
+                    ]
+                with m.If(outside(err_b, self.deadband)):
+                    m.d.sync += [
+                        self.o_blue.eq(clamp(n_blue, 0, 0xff)),
+                        dirty[6].eq(1)
+                    ]
+            with m.Case(AutoExposureState.SEND):
+                with m.If(~dirty.bit_select(index, 1)):
+                    with m.If(index == len(regs) - 1):
+                        m.d.sync += fsm_state.eq(AutoExposureState.IDLE)
+                    with m.Else():
+                        m.d.sync += index.eq(index + 1)
+                with m.Elif(self.sccb_ready & (index == 3) & ~com1_read):
+                    # Read COM1, to keep its other bits
+                    m.d.sync += [
+                        self.sccb_start.eq(1),
+                        self.sccb_read.eq(1),
+                        self.sccb_addr.eq(self.COM1),
+                        fsm_state.eq(AutoExposureState.READ)
+                    ]
+                with m.Elif(self.sccb_ready):
+                    m.d.sync += [
+                        self.sccb_start.eq(1),
+                        self.sccb_read.eq(0),
+                        dirty.bit_select(index, 1).eq(0),
+                        timer.eq(3),
+                        fsm_state.eq(AutoExposureState.WAIT)
+                    ]
+                    with m.Switch(index):
+                        for i, (addr, data) in enumerate(regs):
+                            with m.Case(i):
+                                m.d.sync += [
+                                    self.sccb_addr.eq(addr),
+                                    self.sccb_data.eq(data)
+                                ]
+            with m.Case(AutoExposureState.WAIT):
+                # Give the SCCB time to drop ready
+                m.d.sync += [
+                    self.sccb_start.eq(0),
+                    timer.eq(timer - 1)
+                ]
+                with m.If(timer == 0):
+                    m.d.sync += fsm_state.eq(AutoExposureState.SEND)
+            with m.Case(AutoExposureState.READ):
+                m.d.sync += self.sccb_start.eq(0)
+                with m.If(self.sccb_rd_valid):
+                    m.d.sync += [
+                        com1.eq(self.sccb_rd_data),
+                        com1_read.eq(1),
+                        fsm_state.eq(AutoExposureState.SEND)
+                    ]
+
+        # Rewrite everything when re-enabled, as the camera may have been reconfigured
+        with m.If(~self.enable):
+            m.d.sync += [
+                dirty.eq(dirty.reset),
+                com1_read.eq(0),
+                self.sccb_start.eq(0),
+                fsm_state.eq(AutoExposureState.IDLE)
+            ]
+
+        return m
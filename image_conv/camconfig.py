@@ -4,39 +4,95 @@ from ov7670_config import *
 from sccb import *
 from readhex import *
 
+# Configures the camera from config.mem, or from a dict of register
+# settings given as config, when start is set. Once done, other register
+# writes can be made with sccb_start, sccb_addr and sccb_data, when
+# sccb_ready is set, or reads with sccb_read set too, whose value is in
+# sccb_rd_data when sccb_rd_valid is set. With yuv set, the camera is configured for YUV422 in
+# place of RGB565. The OV7670 takes SCCB clocks of up to 400kHz.
+#
+# With verify set, the registers are read back once they are written, and
+# errors counts those that differ. SIOD must then be an open drain pin,
+# driven low only when siod_en is set and siod is low, with siod_i its
+# level.
 class CamConfig(Elaboratable):
-    def __init__(self):
+    def __init__(self, clk_freq=None, yuv=False, config=None, sccb_freq=100000, verify=False):
+        self.clk_freq = clk_freq
+        self.yuv = yuv
+        self.config = config
+        self.sccb_freq = sccb_freq
+        self.verify = verify
+
         self.start = Signal()
+        self.siod_i = Signal(reset=1)
         self.sioc = Signal()
         self.siod = Signal()
+        self.siod_en = Signal()
         self.done = Signal()
         self.rom_addr = Signal(8)
+        self.errors = Signal(8)
+        self.bad_reg = Signal(8)
+        self.sccb_start = Signal()
+        self.sccb_addr = Signal(8)
+        self.sccb_data = Signal(8)
+        self.sccb_read = Signal()
+        self.sccb_ready = Signal()
+        self.sccb_rd_data = Signal(8)
+        self.sccb_rd_valid = Signal()
 
     def elaborate(self, platform):
         m = Module()
 
-        config_data = readhex("config.mem")
-        config_rom = Memory(width=16, depth=len(config_data), init=config_data)
+        if self.config is None:
+            config_data = readhex("config.mem")
+        else:
+            config_data = OV7670Config.compile(self.config)
+        if self.yuv:
+            config_data = OV7670Config.yuv_config(config_data)
+        config_rom = Memory(width=17, depth=len(config_data), init=OV7670Config.rom(config_data))
         m.submodules.r = r = config_rom.read_port()
 
-        ov7670_config = OV7670Config()
+        ov7670_config = OV7670Config(clk_freq=self.clk_freq, verify=self.verify)
         m.submodules.ov7670_config = ov7670_config
 
-        sccb = SCCB()
+        sccb = SCCB(sccb_freq=self.sccb_freq, clk_freq=self.clk_freq)
         m.submodules.sccb = sccb
 
         m.d.comb += [
             self.sioc.eq(~sccb.sioc_oe),
             self.siod.eq(~sccb.siod_oe),
+            self.siod_en.eq(~sccb.siod_rd),
+            sccb.siod_i.eq(self.siod_i),
             self.done.eq(ov7670_config.done),
             r.addr.eq(ov7670_config.rom_addr),
             ov7670_config.sccb_ready.eq(sccb.ready),
+            ov7670_config.sccb_busy.eq(sccb.busy),
+            ov7670_config.sccb_rd_data.eq(sccb.rd_data),
+            ov7670_config.sccb_rd_valid.eq(sccb.rd_valid),
             ov7670_config.start.eq(self.start),
             ov7670_config.rom_data.eq(r.data),
-            sccb.address.eq(ov7670_config.sccb_addr),
-            sccb.data.eq(ov7670_config.sccb_data),
-            sccb.start.eq(ov7670_config.sccb_start),
-            self.rom_addr.eq(ov7670_config.rom_addr)
+            self.rom_addr.eq(ov7670_config.rom_addr),
+            self.errors.eq(ov7670_config.errors),
+            self.bad_reg.eq(ov7670_config.bad_reg),
+            self.sccb_ready.eq(sccb.ready & ov7670_config.done),
+            self.sccb_rd_data.eq(sccb.rd_data),
+            self.sccb_rd_valid.eq(sccb.rd_valid & ov7670_config.done)
         ]
 
+        # The SCCB is used by the configuration until it is done
+        with m.If(ov7670_config.done):
+            m.d.comb += [
+                sccb.address.eq(self.sccb_addr),
+                sccb.data.eq(self.sccb_data),
+                sccb.read.eq(self.sccb_read),
+                sccb.start.eq(self.sccb_start)
+            ]
+        with m.Else():
+            m.d.comb += [
+                sccb.address.eq(ov7670_config.sccb_addr),
+                sccb.data.eq(ov7670_config.sccb_data),
+                sccb.read.eq(ov7670_config.sccb_read),
+                sccb.start.eq(ov7670_config.sccb_start)
+            ]
+
         return m
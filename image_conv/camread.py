@@ -1,10 +1,26 @@
 from nmigen import *
 
+from stream import Stream
+
+# Read RGB565 pixels from the OV7670, in the pclock domain. As well as
+# pixel_valid and pixel_data, the pixels come out of the source stream,
+# with first set on the first pixel of a frame and last on the last pixel
+# of a line. The camera cannot be paused, so source.ready only detects
+# pixels that are not taken, which pulse overrun.
+#
+# With yuv set, the camera is expected to send YUV422 (Y U Y V ...), and
+# pixel_data has Y in the top byte and U or V, alternately, in the bottom
+# byte. The source stream then has y, u and v for every pixel, with the
+# chroma of each pair of pixels shared by both. Each pixel comes out one
+# pixel later than in RGB mode, as it needs the V of its pair, and the
+# last pixel of a line comes out just after href goes low.
 class CamRead(Elaboratable):
     WAIT_FRAME_START = 0
     ROW_CAPTURE      = 1
 
-    def __init__(self):
+    def __init__(self, res_x=640, yuv=False):
+        self.res_x       = res_x
+        self.yuv         = yuv
         self.p_clock     = Signal()
         self.vsync       = Signal()
         self.href        = Signal()
@@ -14,6 +30,8 @@ class CamRead(Elaboratable):
         self.frame_done  = Signal()
         self.row         = Signal(10)
         self.col         = Signal(10)
+        self.source      = Stream([("y", 8), ("u", 8), ("v", 8)] if yuv else 16)
+        self.overrun     = Signal()
 
     def elaborate(self, platform):
         m = Module()
@@ -37,6 +55,69 @@ class CamRead(Elaboratable):
             self.col.eq(col_count)
         ]
 
+        m.d.comb += self.overrun.eq(self.source.valid & ~self.source.ready)
+
+        if self.yuv:
+            # Pair up the words, which have the U of a pair of pixels with the
+            # first and the V with the second. The column count has already
+            # been incremented, so it is even for the second word of a pair.
+            p_y      = Signal(8)
+            p_c      = Signal(8)
+            pair_u   = Signal(8)
+            pair_v   = Signal(8)
+            line_end = Signal()
+
+            m.d.pclock += [
+                self.source.valid.eq(0),
+                line_end.eq(~self.href & (col_count != 0) & (fsm_state == self.ROW_CAPTURE))
+            ]
+
+            with m.If(self.pixel_valid):
+                m.d.pclock += [
+                    p_y.eq(self.pixel_data[8:]),
+                    p_c.eq(self.pixel_data[0:8])
+                ]
+                with m.If(~col_count[0]):
+                    # First pixel of the pair, now that its V is here
+                    m.d.pclock += [
+                        pair_u.eq(p_c),
+                        pair_v.eq(self.pixel_data[0:8]),
+                        self.source.valid.eq(1),
+                        self.source.y.eq(p_y),
+                        self.source.u.eq(p_c),
+                        self.source.v.eq(self.pixel_data[0:8]),
+                        self.source.first.eq((row_count == 0) & (col_count == 2)),
+                        self.source.last.eq(0)
+                    ]
+                with m.Elif(col_count != 1):
+                    # Second pixel of the previous pair
+                    m.d.pclock += [
+                        self.source.valid.eq(1),
+                        self.source.y.eq(p_y),
+                        self.source.u.eq(pair_u),
+                        self.source.v.eq(pair_v),
+                        self.source.first.eq(0),
+                        self.source.last.eq(0)
+                    ]
+            with m.Elif(line_end):
+                # Second pixel of the last pair in the line
+                m.d.pclock += [
+                    self.source.valid.eq(1),
+                    self.source.y.eq(p_y),
+                    self.source.u.eq(pair_u),
+                    self.source.v.eq(pair_v),
+                    self.source.first.eq(0),
+                    self.source.last.eq(1)
+                ]
+        else:
+            # The column count has already been incremented for a valid pixel
+            m.d.comb += [
+                self.source.valid.eq(self.pixel_valid),
+                self.source.data.eq(self.pixel_data),
+                self.source.first.eq((row_count == 0) & (col_count == 1)),
+                self.source.last.eq(col_count == self.res_x)
+            ]
+
         with m.Switch(fsm_state):
            with m.Case(self.WAIT_FRAME_START):
                m.d.pclock += [
@@ -4,12 +4,19 @@ from nmigen import *
 from nmigen.build import *
 from nmigen_boards.ulx3s import *
 
-from nmigen.lib.fifo import SyncFIFOBuffered
 from nmigen_stdio.serial import *
 
 from camread import *
 from camconfig import *
+from pixel_fifo import PixelFIFO
+from yuv2rgb import YUV2RGB
+from motion import MotionDetect, MotionReport
+from snapshot import Snapshot
+from tone_lut import ToneLUT, LUTLoader, LUTFill
+from crop_scale import CropScale
 from image_conv import ImageConv
+from frame_stats import FrameStats
+from auto_exposure import AutoExposure
 from debouncer import *
 
 from vga2dvid import VGA2DVID
@@ -37,7 +44,7 @@ gpdi_resource = [
 ov7670_pmod = [
     Resource("ov7670", 0,
              Subsignal("cam_data", Pins("10+ 10- 9+ 9- 8+ 8- 7+ 7-", dir="i", conn=("gpio", 0)), Attrs(IO_TYPE="LVCMOS33")),
-             Subsignal("cam_SIOD", Pins("0+", dir="o", conn=("gpio", 0)), Attrs(IO_TYPE="LVCMOS33")),
+             Subsignal("cam_SIOD", Pins("0+", dir="io", conn=("gpio", 0)), Attrs(IO_TYPE="LVCMOS33", PULLMODE="UP")),
              Subsignal("cam_SIOC", Pins("0-", dir="o", conn=("gpio", 0)), Attrs(IO_TYPE="LVCMOS33")),
              Subsignal("cam_HREF", Pins("1+", dir="i", conn=("gpio", 0)), Attrs(IO_TYPE="LVCMOS33")),
              Subsignal("cam_VSYNC", Pins("1-", dir="i", conn=("gpio", 0)), Attrs(IO_TYPE="LVCMOS33")),
@@ -67,7 +74,9 @@ class Camera(Elaboratable):
                  timing: VGATiming, # VGATiming class
                  xadjustf=0, # adjust -3..3 if no picture
                  yadjustf=0, # or to fine-tune f
-                 ddr=True): # False: SDR, True: DDR
+                 ddr=True, # False: SDR, True: DDR
+                 yuv=False, # True: read the camera in YUV422
+                 baud=1000000): # uart baud rate, for snapshots
         self.o_gpdi_dp = Signal(4)
         # Configuration
         self.timing = timing
@@ -77,6 +86,8 @@ class Camera(Elaboratable):
         self.xadjustf = xadjustf
         self.yadjustf = yadjustf
         self.ddr = ddr
+        self.yuv = yuv
+        self.baud = baud
 
     def elaborate(self, platform):
         # Constants
@@ -107,7 +118,7 @@ class Camera(Elaboratable):
         right   = platform.request("button_right", 0)
         sw      =  Cat([platform.request("switch",i) for i in range(4)])
         uart    = platform.request("uart")
-        divisor = int(platform.default_clk_frequency // 115200)
+        divisor = int(platform.default_clk_frequency // self.baud)
 
         m = Module()
         
@@ -123,11 +134,13 @@ class Camera(Elaboratable):
         pll.create_clkout(cd_shift, pixel_f * 5.0 * (1.0 if self.ddr else 2.0))
 
         # Add CamRead submodule
-        camread = CamRead()
+        camread = CamRead(yuv=self.yuv)
         m.submodules.camread = camread
 
-        # Camera config
-        camconfig = CamConfig()
+        # Camera config, at 400kHz, with the registers read back to check
+        # them. The number of registers that differ and the last of them
+        # are shown on the Pmod leds.
+        camconfig = CamConfig(yuv=self.yuv, sccb_freq=400000, verify=True)
         m.submodules.camconfig = camconfig
 
         # Configure and read the camera
@@ -136,7 +149,9 @@ class Camera(Elaboratable):
             ov7670.cam_PWON.eq(0),
             ov7670.cam_XCLK.eq(clk25.i),
             ov7670.cam_SIOC.eq(camconfig.sioc),
-            ov7670.cam_SIOD.eq(camconfig.siod),
+            ov7670.cam_SIOD.o.eq(camconfig.siod),
+            ov7670.cam_SIOD.oe.eq(camconfig.siod_en),
+            camconfig.siod_i.eq(ov7670.cam_SIOD.i),
             camconfig.start.eq(btn1),
             camread.p_data.eq(Cat([ov7670.cam_data[i] for i in range(8)])),
             camread.href.eq(ov7670.cam_HREF),
@@ -147,8 +162,8 @@ class Camera(Elaboratable):
         # Create the uart
         m.submodules.serial = serial = AsyncSerial(divisor=divisor, pins=uart)
 
-        # Input fifo
-        m.submodules.fifo = fifo = SyncFIFOBuffered(width=16,depth=1024)
+        # Input fifo, from the camera's pclock domain
+        m.submodules.fifo = fifo = PixelFIFO(payload=camread.source.payload_layout, depth=1024)
 
         # Frame buffer
         buffer = Memory(width=16, depth=320 * 480)
@@ -194,8 +209,6 @@ class Camera(Elaboratable):
         frozen  = Signal()
         writing = Signal()
         written = Signal()
-        w_addr  = Signal(18)
-        byte    = Signal()
 
         with m.If(debosd.btn_down):
             m.d.sync += osd_on.eq(~osd_on)
@@ -263,53 +276,153 @@ class Camera(Elaboratable):
                     with m.Case(11): # filter
                         m.d.sync += []
 
-        # Image global stats
-        max_r = Signal(5)
-        max_g = Signal(6)
-        max_b = Signal(5)
+        # Image convolution
+        m.submodules.ims = ims = ImageConv()
 
-        avg_r = Signal(21)
-        avg_g = Signal(22)
-        avg_b = Signal(21)
+        # Image global stats, for each frame going into the image convolution
+        m.submodules.stats = stats = FrameStats()
 
-        a_r   = Signal(5)
-        a_g   = Signal(6)
-        a_b   = Signal(5)
+        m.d.comb += [
+            stats.i_valid.eq(ims.sink.accepted()),
+            stats.i_r.eq(ims.sink.r),
+            stats.i_g.eq(ims.sink.g),
+            stats.i_b.eq(ims.sink.b),
+            stats.i_frame_done.eq(ims.frame_done)
+        ]
 
-        frames = Signal(6)
+        # Motion detection, on the frames going into the image convolution,
+        # enabled by switch 1. A line is sent over the uart for each frame
+        # with motion, unless a snapshot is being sent.
+        m.submodules.motion = motion = MotionDetect()
+        m.submodules.report = report = MotionReport(cw=motion.cw, n_tiles=motion.n_tiles)
 
-        # Image convolution
-        m.submodules.ims = ims = ImageConv()
+        m.d.comb += [
+            motion.i_valid.eq(ims.sink.accepted()),
+            motion.i_first.eq(ims.sink.first),
+            motion.i_last.eq(ims.sink.last),
+            motion.i_r.eq(ims.sink.r),
+            motion.i_g.eq(ims.sink.g),
+            motion.i_b.eq(ims.sink.b),
+            report.i_start.eq(sw[1] & motion.o_done & motion.o_motion & ~writing),
+            report.i_count.eq(motion.o_count),
+            report.i_min_x.eq(motion.o_min_x),
+            report.i_max_x.eq(motion.o_max_x),
+            report.i_min_y.eq(motion.o_min_y),
+            report.i_max_y.eq(motion.o_max_y),
+            report.i_tiles.eq(motion.o_tiles)
+        ]
 
-        p_r = Signal(9)
-        p_g = Signal(10)
-        p_b = Signal(9)
-        
-        # Sync the fifo with the camera
+        # Auto exposure and white balance, enabled by switch 0 once the camera is configured
+        m.submodules.ae = ae = AutoExposure()
+
+        m.d.comb += [
+            ae.enable.eq(sw[0] & camconfig.done),
+            ae.i_stats.eq(stats.o_done),
+            ae.i_mean_r.eq(stats.o_mean_r),
+            ae.i_mean_g.eq(stats.o_mean_g),
+            ae.i_mean_b.eq(stats.o_mean_b),
+            ae.sccb_ready.eq(camconfig.sccb_ready),
+            ae.sccb_rd_data.eq(camconfig.sccb_rd_data),
+            ae.sccb_rd_valid.eq(camconfig.sccb_rd_valid),
+            camconfig.sccb_start.eq(ae.sccb_start),
+            camconfig.sccb_addr.eq(ae.sccb_addr),
+            camconfig.sccb_data.eq(ae.sccb_data),
+            camconfig.sccb_read.eq(ae.sccb_read)
+        ]
+
+        # Tone curves, applied to the pixels from crop. By default they are
+        # the colour gains, plus the brightness, set by the buttons, but
+        # tables sent over the uart by tone.py replace them until a gain is
+        # changed again
+        m.submodules.tone = tone = ToneLUT()
+        m.submodules.loader = loader = LUTLoader(timeout=int(platform.default_clk_frequency // 100))
+        m.submodules.fill = fill = LUTFill()
+
+        gain_r = Signal(signed(9))
+        gain_g = Signal(signed(9))
+        gain_b = Signal(signed(9))
+
+        m.d.comb += [
+            serial.rx.ack.eq(1),
+            loader.rx_data.eq(serial.rx.data),
+            loader.rx_rdy.eq(serial.rx.rdy),
+            gain_r.eq(redness + brightness),
+            gain_g.eq(greenness + brightness),
+            gain_b.eq(blueness + brightness),
+            fill.gain_r.eq(Mux(gain_r < 0, 0, gain_r)),
+            fill.gain_g.eq(Mux(gain_g < 0, 0, gain_g)),
+            fill.gain_b.eq(Mux(gain_b < 0, 0, gain_b)),
+            fill.hold.eq(loader.busy),
+            tone.w_addr.eq(Mux(loader.busy, loader.w_addr, fill.w_addr)),
+            tone.w_data.eq(Mux(loader.busy, loader.w_data, fill.w_data)),
+            tone.w_en.eq(loader.w_en | fill.w_en),
+            tone.swap.eq(loader.swap | fill.swap)
+        ]
+
+        # Sync the fifo with the camera, from the first pixel of a frame, as
+        # the line buffers of ImageConv count the pixels from reset
         sync_fifo = Signal(reset=0)
-        with m.If((camread.col == 639) & (camread.row == 0)):
-            m.d.sync += sync_fifo.eq(1)
+        with m.If(camread.source.valid & camread.source.first):
+            m.d.pclock += sync_fifo.eq(1)
+
+        # Halve the 640 pixel camera lines to fit the 320x480 frame buffer,
+        # averaging each pair of pixels
+        m.submodules.crop = crop = CropScale()
 
-        # Connect fifo and ims
         m.d.comb += [
-            fifo.w_en.eq(camread.pixel_valid & camread.col[0] & sync_fifo), # Only write every other pixel
-            fifo.w_data.eq(camread.pixel_data), 
-            fifo.r_en.eq(fifo.r_rdy & ~ims.o_stall),
-            ims.i_valid.eq(fifo.r_rdy),
-            p_r.eq(fifo.r_data[11:] * (redness + brightness)),
-            ims.i_r.eq(p_r[4:]),
-            p_g.eq(fifo.r_data[5:11] * (greenness + brightness)),
-            ims.i_g.eq(p_g[4:]),
-            p_b.eq(fifo.r_data[0:5] * (blueness + brightness)),
-            ims.i_b.eq(p_b[4:]),
+            crop.h_div.eq(32),
+            crop.v_div.eq(16)
+        ]
+
+        # Connect camread, fifo and crop, converting YUV to RGB after the fifo,
+        # where mono comes straight from Y
+        m.d.comb += [
+            fifo.sink.valid.eq(camread.source.valid & (sync_fifo | camread.source.first)),
+            fifo.sink.first.eq(camread.source.first),
+            fifo.sink.last.eq(camread.source.last),
+            [fifo.sink[f].eq(camread.source[f]) for f, _, _ in camread.source.payload_layout],
+            camread.source.ready.eq(fifo.sink.ready | ~(sync_fifo | camread.source.first))
+        ]
+
+        if self.yuv:
+            m.submodules.yuv2rgb = yuv2rgb = YUV2RGB()
+            m.d.comb += [
+                fifo.source.connect_to(yuv2rgb.sink),
+                yuv2rgb.mono.eq(mono),
+                yuv2rgb.source.connect_to(crop.sink)
+            ]
+        else:
+            m.d.comb += [
+                fifo.source.ready.eq(crop.sink.ready),
+                crop.sink.valid.eq(fifo.source.valid),
+                crop.sink.first.eq(fifo.source.first),
+                crop.sink.last.eq(fifo.source.last),
+                crop.sink.r.eq(fifo.source.data[11:]),
+                crop.sink.g.eq(fifo.source.data[5:11]),
+                crop.sink.b.eq(fifo.source.data[0:5])
+            ]
+
+        # Connect crop and ims
+        m.d.comb += [
+            crop.source.ready.eq(ims.sink.ready),
+            ims.sink.valid.eq(crop.source.valid),
+            ims.sink.first.eq(crop.source.first),
+            ims.sink.last.eq(crop.source.last),
+            tone.i_r.eq(crop.source.r),
+            tone.i_g.eq(crop.source.g),
+            tone.i_b.eq(crop.source.b),
+            tone.i_start.eq(crop.source.accepted() & crop.source.first),
+            ims.sink.r.eq(tone.o_r),
+            ims.sink.g.eq(tone.o_g),
+            ims.sink.b.eq(tone.o_b),
             ims.sel.eq(sharpness),
             ims.x_flip.eq(x_flip),
             ims.y_flip.eq(y_flip),
             ims.mono.eq(mono),
             ims.invert.eq(invert),
-            ims.avg_r.eq(a_r),
-            ims.avg_g.eq(a_g),
-            ims.avg_b.eq(a_b)
+            ims.avg_r.eq(stats.o_mean_r),
+            ims.avg_g.eq(stats.o_mean_g),
+            ims.avg_b.eq(stats.o_mean_b)
         ]
 
         # Take a snapshot
@@ -317,67 +430,33 @@ class Camera(Elaboratable):
             m.d.sync += [
                 snap.eq(~snap),
                 frozen.eq(0),
-                w_addr.eq(0),
-                written.eq(0),
-                byte.eq(0)
+                written.eq(0)
             ]
 
         with m.If(ims.frame_done & snap):
             m.d.sync += frozen.eq(1)
-            with m.If(~written):
-                m.d.sync += writing.eq(1)
+
+        # Send the frozen frame, compressed unless switch 2 is on. Decode it
+        # with snap_decode.py
+        m.submodules.snapshot = snapshot = Snapshot(w=320, h=480)
 
         m.d.comb += [
-            serial.tx.data.eq(Mux(byte, r.data[8:], r.data[:8])),
-            serial.tx.ack.eq(writing)
+            snapshot.start.eq(frozen & ~written & ~report.busy),
+            snapshot.compress.eq(~sw[2]),
+            snapshot.rd_data.eq(r.data),
+            snapshot.tx_rdy.eq(serial.tx.rdy),
+            writing.eq(snapshot.busy),
+            serial.tx.data.eq(Mux(writing, snapshot.tx_data, report.tx_data)),
+            serial.tx.ack.eq(snapshot.tx_ack | report.tx_ack),
+            report.tx_rdy.eq(serial.tx.rdy & ~writing)
         ]
 
-        with m.If(writing):
-            with m.If(w_addr == 320 * 480):
-                m.d.sync += [
-                    writing.eq(0),
-                    written.eq(1)
-                ]
-            with m.Elif(serial.tx.ack & serial.tx.rdy):
-                m.d.sync += byte.eq(~byte)
-                with m.If(byte):
-                    m.d.sync += w_addr.eq(w_addr+1)
-
-        # Calculate maximum for each color, each frame
-        with m.If(ims.i_r > max_r):
-            m.d.sync += max_r.eq(ims.i_r) 
-        with m.If(ims.i_g > max_g):
-            m.d.sync += max_g.eq(ims.i_g) 
-        with m.If(ims.i_b > max_b):
-            m.d.sync += max_b.eq(ims.i_b) 
-
-        # Calculate average looking at middle 256 x 256 pixels
-        with m.If(camread.col[0] & camread.pixel_valid):
-            with m.If((camread.col[1:] >= 32) & (camread.col[1:] < 288) & 
-                      (camread.row >= 112) & (camread.row < 368)):
-                m.d.sync += [
-                    avg_r.eq(avg_r + ims.i_r),
-                    avg_g.eq(avg_g + ims.i_g),
-                    avg_b.eq(avg_b + ims.i_b)
-                ]
-
-        with m.If(camread.frame_done):
-            m.d.sync += [
-                frames.eq(frames+1),
-                max_r.eq(0),
-                max_g.eq(0),
-                max_b.eq(0),
-                avg_r.eq(0),
-                avg_g.eq(0),
-                avg_b.eq(0),
-                a_r.eq(avg_r[16:]),
-                a_g.eq(avg_g[16:]),
-                a_b.eq(avg_b[16:]),
-            ]
-            #with m.If(frames == 0):
-                #m.d.sync += leds16.eq(Cat([avg_b[16:],avg_g[16:],avg_r[16:]]))
+        with m.If(snapshot.start):
+            m.d.sync += written.eq(1)
 
-        m.d.comb += leds16.eq(w_addr)
+        # Show the snapshot progress, or else the pixels lost by the input fifo
+        m.d.comb += leds16.eq(Mux(writing, snapshot.line,
+                                  Mux(camconfig.errors != 0, Cat(camconfig.bad_reg, camconfig.errors), fifo.o_overflow)))
 
         # Show value on leds
         m.d.comb += leds.eq(osd_val)
@@ -404,12 +483,13 @@ class Camera(Elaboratable):
            bits_y            = 16  # a smaller/larger value will make it pass timing.
         )
 
-        # Connect frame buffer
+        # Connect frame buffer, which can take a pixel every cycle
         m.d.comb += [
-            w.en.eq(ims.o_valid & ~frozen),
-            w.addr.eq(ims.o_y * 320 + ims.o_x),
-            w.data.eq(Cat(ims.o_b, ims.o_g, ims.o_r)),
-            r.addr.eq(Mux(writing, w_addr, vga.o_beam_y * 320 + vga.o_beam_x[1:]))
+            ims.source.ready.eq(1),
+            w.en.eq(ims.source.valid & ~frozen),
+            w.addr.eq(ims.source.y * 320 + ims.source.x),
+            w.data.eq(Cat(ims.source.b, ims.source.g, ims.source.r)),
+            r.addr.eq(Mux(writing, snapshot.rd_addr, vga.o_beam_y * 320 + vga.o_beam_x[1:]))
         ]
 
         # OSD
@@ -428,6 +508,24 @@ class Camera(Elaboratable):
             osd.border.eq(border)
         ]
 
+        # Motion box, in screen co-ordinates, flipped as the image is
+        box_x0 = Signal(9)
+        box_x1 = Signal(9)
+        box_y0 = Signal(9)
+        box_y1 = Signal(9)
+
+        m.d.comb += [
+            box_x0.eq(Mux(x_flip, 319 - motion.o_max_x, motion.o_min_x)),
+            box_x1.eq(Mux(x_flip, 319 - motion.o_min_x, motion.o_max_x)),
+            box_y0.eq(Mux(y_flip, 479 - motion.o_max_y, motion.o_min_y)),
+            box_y1.eq(Mux(y_flip, 479 - motion.o_min_y, motion.o_max_y)),
+            osd.box_on.eq(sw[1] & (motion.o_min_x <= motion.o_max_x)),
+            osd.box_x0.eq(Cat(C(0, 1), box_x0)),
+            osd.box_x1.eq(Cat(C(1, 1), box_x1)),
+            osd.box_y0.eq(box_y0),
+            osd.box_y1.eq(box_y1)
+        ]
+
         # Generate VGA signals
         m.d.comb += [
             vga.i_clk_en.eq(1),
@@ -509,6 +607,8 @@ if __name__ == "__main__":
     # Figure out which FPGA variant we want to target...
     parser = argparse.ArgumentParser()
     parser.add_argument('variant', choices=variants.keys())
+    parser.add_argument('--yuv', action='store_true', help='read the camera in YUV422')
+    parser.add_argument('--baud', type=int, default=1000000, help='uart baud rate')
     args = parser.parse_args()
 
     platform = variants[args.variant]()
@@ -516,7 +616,7 @@ if __name__ == "__main__":
     m = Module()
 
     # Add the top module
-    m.submodules.top = top = Camera(timing=vga_timings['640x480@60Hz'])
+    m.submodules.top = top = Camera(timing=vga_timings['640x480@60Hz'], yuv=args.yuv, baud=args.baud)
 
     # Add OV7670 and LED Pmod resurces
     platform.add_resources(ov7670_pmod)
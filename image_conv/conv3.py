@@ -2,24 +2,29 @@ from nmigen import *
 
 from nmigen.utils import bits_for
 
-# Apply a convolution kernel to a stream of monochrome pixels or an RGB channel
-class Conv3(Elaboratable):
-    def __init__(self, k, sh=0, w=320, h=240, dw=8, same=0):
+from stream import Stream, SkidBuffer
+
+# Extract a 3x3 window from a stream of monochrome pixels or an RGB channel,
+# extending the edges with the closest pixel. The window taps in o_w are
+# valid when o_en is set, and the result of processing them should be
+# registered, so that it is in step with o_x and o_y.
+# The window only moves when i_ready is set, so that the stages after it
+# can hold their results while the stream is stalled.
+class Window3(Elaboratable):
+    def __init__(self, w=320, h=240, dw=8):
         # Parameters
         self.w         = w
         self.h         = h
-        self.k         = k
-        self.sh        = sh
         self.dw        = dw
-        self.same      = same
 
         # Inputs
         self.i_p       = Signal(dw)
         self.i_valid   = Signal()
+        self.i_ready   = Signal(reset=1)
 
         # Outputs
-        self.o_p       = Signal(dw)
-        self.o_valid   = Signal()
+        self.o_w       = [Signal(dw, name="w%d%d" % (i // 3, i % 3)) for i in range(9)]
+        self.o_en      = Signal()
         self.o_stall   = Signal()
         self.o_x       = Signal(bits_for(w), reset=self.w - 1)
         self.o_y       = Signal(bits_for(h), reset=self.h - 1)
@@ -32,9 +37,18 @@ class Conv3(Elaboratable):
         x = Signal(bits_for(self.w), reset=0)
         y = Signal(bits_for(self.h + 3), reset=0)
 
-        # x2 is two columns ahead of x with wraparound
-        x2 = Signal(bits_for(self.h))
-        m.d.comb += x2.eq(Mux(x >= self.w - 2, x + 2 - self.w, x + 2))
+        # Window moves this cycle
+        step = Signal()
+        m.d.comb += step.eq((self.i_valid | self.o_stall) & self.i_ready)
+
+        # The line buffers are read one column ahead of the next x, with
+        # wraparound, so x2 is two columns ahead of x when the window moves,
+        # and one column ahead when it does not
+        x2 = Signal(bits_for(self.w))
+        with m.If(step):
+            m.d.comb += x2.eq(Mux(x >= self.w - 2, x + 2 - self.w, x + 2))
+        with m.Else():
+            m.d.comb += x2.eq(Mux(x == self.w - 1, 0, x + 1))
 
         # Indicates if pixel generation has started
         started = Signal(reset=0)
@@ -74,37 +88,27 @@ class Conv3(Elaboratable):
         # Connect line buffers
         m.d.comb += [
             w0.addr.eq(x),
-            w0.en.eq(self.i_valid & (y != 1) & (y != self.h)),
+            w0.en.eq(self.i_valid & self.i_ready & (y != 1) & (y != self.h)),
             w0.data.eq(Mux(y >= 2, pd1, self.i_p)),
             w1.addr.eq(x),
-            w1.en.eq(self.i_valid & (y != self.h)),
+            w1.en.eq(self.i_valid & self.i_ready & (y != self.h)),
             w1.data.eq(self.i_p),
             r0.addr.eq(x2),
             r1.addr.eq(x2)
         ]
 
-        # Pixel not valid by default
-        m.d.sync += [
-            self.o_valid.eq(0),
-            self.frame_done.eq(0)
-        ]
+        # Window outputs
+        m.d.comb += [o.eq(p) for o, p in zip(self.o_w, [p00, p01, p02, p10, p11, p12, p20, p21, p22])]
 
-        # New pixel value
-        n_p = Signal(self.dw + self.sh + 1)
-        m.d.comb += [
-            n_p.eq(p00 * self.k[0] +
-                   p01 * self.k[1] +
-                   p02 * self.k[2] +
-                   p10 * self.k[3] +
-                   p11 * self.k[4] +
-                   p12 * self.k[5] +
-                   p20 * self.k[6] +
-                   p21 * self.k[7] +
-                   p22 * self.k[8])
-        ]
+        # Frame done is held until the next cycle the window can move, so
+        # that it is seen by the stages after it
+        done = Signal()
+        m.d.comb += self.frame_done.eq(done & self.i_ready)
+        with m.If(self.i_ready):
+            m.d.sync += done.eq(0)
 
         # Process pixel
-        with m.If(self.i_valid | self.o_stall):
+        with m.If(step):
             # Save last values read for wraparound
             m.d.sync += [
                 pd0.eq(r0.data),
@@ -128,7 +132,7 @@ class Conv3(Elaboratable):
                     started.eq(0),
                     self.o_x.eq(self.w - 1),
                     self.o_y.eq(self.h - 1),
-                    self.frame_done.eq(1)
+                    done.eq(1)
                 ]
 
             # Pixel generation starts on row 1, column 1
@@ -174,10 +178,9 @@ class Conv3(Elaboratable):
                     p20.eq(Mux(y == self.h, Mux(x == 0, pd1, p11), Mux(x == 0, self.i_p, p21))),
                     p21.eq(Mux(y == self.h, Mux(x == 0, pd1, p12), self.i_p)),
                     # Generate the pixel
-                    self.o_valid.eq(1),
-                    self.o_x.eq(self.o_x+1),
-                    self.o_p.eq((Mux(self.same & n_p[-1], (p11 << self.sh) , n_p) >> self.sh))
+                    self.o_x.eq(self.o_x+1)
                 ]
+                m.d.comb += self.o_en.eq(1)
                 with m.If(self.o_x == self.w - 1):
                     m.d.sync += [
                         self.o_y.eq(self.o_y + 1),
@@ -187,4 +190,88 @@ class Conv3(Elaboratable):
                         m.d.sync += self.o_y.eq(0)
 
         return m
- 
+
+# Apply a convolution kernel to the window taps from a Window3
+class Kernel3(Elaboratable):
+    def __init__(self, k, sh=0, dw=8, same=0):
+        # Parameters
+        self.k         = k
+        self.sh        = sh
+        self.dw        = dw
+        self.same      = same
+
+        # Inputs
+        self.i_w       = [Signal(dw) for i in range(9)]
+        self.i_en      = Signal()
+        self.i_ready   = Signal(reset=1)
+
+        # Outputs
+        self.o_p       = Signal(dw)
+        self.o_valid   = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+
+        # New pixel value
+        n_p = Signal(self.dw + self.sh + 1)
+        m.d.comb += n_p.eq(sum(self.i_w[i] * self.k[i] for i in range(9)))
+
+        # Pixel not valid by default, once the last one has been taken
+        with m.If(self.i_ready):
+            m.d.sync += self.o_valid.eq(0)
+
+        # Generate the pixel, using the original value on overflow if same is set
+        with m.If(self.i_en):
+            m.d.sync += [
+                self.o_valid.eq(1),
+                self.o_p.eq((Mux(self.same & n_p[-1], (self.i_w[4] << self.sh) , n_p) >> self.sh))
+            ]
+
+        return m
+
+# Apply a convolution kernel to a stream of monochrome pixels or an RGB channel.
+# The output stream carries the co-ordinates of each pixel, and a skid
+# buffer holds the result when the output is stalled.
+class Conv3(Elaboratable):
+    def __init__(self, k, sh=0, w=320, h=240, dw=8, same=0):
+        # Parameters
+        self.w         = w
+        self.h         = h
+        self.k         = k
+        self.sh        = sh
+        self.dw        = dw
+        self.same      = same
+
+        # Inputs
+        self.sink      = Stream(dw)
+
+        # Outputs
+        self.source    = Stream([("data", dw), ("x", bits_for(w)), ("y", bits_for(h))])
+        self.frame_done = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+
+        m.submodules.window = window = Window3(w=self.w, h=self.h, dw=self.dw)
+        m.submodules.kernel = kernel = Kernel3(self.k, sh=self.sh, dw=self.dw, same=self.same)
+        m.submodules.skid = skid = SkidBuffer(self.source.payload_layout)
+
+        m.d.comb += [
+            window.i_p.eq(self.sink.data),
+            window.i_valid.eq(self.sink.valid),
+            window.i_ready.eq(skid.sink.ready),
+            self.sink.ready.eq(skid.sink.ready & ~window.o_stall),
+            [i.eq(o) for i, o in zip(kernel.i_w, window.o_w)],
+            kernel.i_en.eq(window.o_en),
+            kernel.i_ready.eq(skid.sink.ready),
+            skid.sink.valid.eq(kernel.o_valid),
+            skid.sink.first.eq((window.o_x == 0) & (window.o_y == 0)),
+            skid.sink.last.eq(window.o_x == self.w - 1),
+            skid.sink.data.eq(kernel.o_p),
+            skid.sink.x.eq(window.o_x),
+            skid.sink.y.eq(window.o_y),
+            skid.source.connect_to(self.source),
+            self.frame_done.eq(window.frame_done)
+        ]
+
+        return m
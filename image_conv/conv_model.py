@@ -0,0 +1,115 @@
+import numpy as np
+
+# Bit-exact software models of the image processing blocks, used by the
+# simulation harnesses to check the hardware pixel by pixel.
+
+# Return the 9 3x3 window taps of an image as a (9, h, w) array, in the
+# same p00..p22 order as Conv3, with edges extended with the closest pixel
+def window3(img):
+    h, w = img.shape
+    p = np.pad(img.astype(np.int64), 1, mode="edge")
+    return np.stack([p[dy:dy + h, dx:dx + w] for dy in range(3) for dx in range(3)])
+
+# Model of Conv3: sum of products, optionally falling back to the centre
+# pixel when the (dw + sh + 1)-bit sum has its top bit set (same=1),
+# then shifted right by sh and truncated to dw bits
+def conv3(img, k, sh=0, dw=8, same=0):
+    win = window3(img)
+    s = np.tensordot(np.array(list(k), dtype=np.int64), win, axes=1)
+    if same:
+        n = s & ((1 << (dw + sh + 1)) - 1)
+        s = np.where(n >> (dw + sh), win[4] << sh, n)
+    return (s >> sh) & ((1 << dw) - 1)
+
+# Model of Sobel3, returning the saturated magnitude and the direction
+def sobel(img, sh=2, dw=8, l2=False):
+    p00, p01, p02, p10, p11, p12, p20, p21, p22 = window3(img)
+    gx = (p02 + 2 * p12 + p22) - (p00 + 2 * p10 + p20)
+    gy = (p20 + 2 * p21 + p22) - (p00 + 2 * p01 + p02)
+    ax, ay = np.abs(gx), np.abs(gy)
+    if l2:
+        mx, mn = np.maximum(ax, ay), np.minimum(ax, ay)
+        mag = mx + (mn >> 2) + (mn >> 3)
+    else:
+        mag = ax + ay
+    mag = np.minimum(mag >> sh, (1 << dw) - 1)
+    dir = np.where(ay * 5 <= ax * 2, 0,
+          np.where(ay * 2 > ax * 5, 2,
+          np.where((gx < 0) == (gy < 0), 1, 3)))
+    return mag, dir
+
+# Model of Median3
+def median3(img):
+    return np.median(window3(img), axis=0).astype(np.int64)
+
+# Model of the ImageConv mono/invert output stage for one set of channels
+def mono(r, g, b, invert=0):
+    s = r.astype(np.int64) + g + b
+    o_r, o_g, o_b = s >> 2, s >> 1, s >> 2
+    if invert:
+        o_r, o_g, o_b = ~o_r, ~o_g, ~o_b
+    return o_r & 0x1f, o_g & 0x3f, o_b & 0x1f
+
+# Groups of input pixels averaged for each output pixel by CropScale, for
+# n pixels decimated by div (with 4 fractional bits)
+def scale_groups(n, div):
+    groups = []
+    start = phase = 0
+    for i in range(n):
+        phase += 16
+        if phase >= div or i == n - 1:
+            groups.append((start, i + 1))
+            start = i + 1
+            phase = 0 if i == n - 1 else phase - div
+    return groups
+
+# Model of CropScale for one channel, with the averages rounded the same way
+def crop_scale(img, crop, h_div, v_div, recip_bits=12):
+    x, y, w, h = crop
+    img = img[y:y + h, x:x + w].astype(np.int64)
+
+    def average(s, n):
+        recip = ((1 << (recip_bits + 1)) // n + 1) >> 1
+        return (s * recip + (1 << (recip_bits - 1))) >> recip_bits
+
+    cols = np.stack([average(img[:, a:b].sum(axis=1), b - a) for a, b in scale_groups(img.shape[1], h_div)], axis=1)
+    return np.stack([average(cols[a:b].sum(axis=0), b - a) for a, b in scale_groups(img.shape[0], v_div)])
+
+# Model of YUV2RGB, for full range YUV, returning 5, 6 and 5 bit channels
+def yuv2rgb(y, u, v, mono=0):
+    y = np.asarray(y, dtype=np.int64)
+    d = np.asarray(u, dtype=np.int64) - 128
+    e = np.asarray(v, dtype=np.int64) - 128
+    if mono:
+        return y >> 3, y >> 2, y >> 3
+    r = np.clip(((y << 8) + 359 * e + 128) >> 8, 0, 255)
+    g = np.clip(((y << 8) - 88 * d - 183 * e + 128) >> 8, 0, 255)
+    b = np.clip(((y << 8) + 454 * d + 128) >> 8, 0, 255)
+    return r >> 3, g >> 2, b >> 3
+
+# Model of MotionDetect for one frame of RGB565, against the previous one
+# (or None for the first frame). Returns the count, the box as (min x,
+# max x, min y, max y), or None if nothing moved, and the tile counts.
+def motion(prev, cur, threshold, step=4, tiles_x=8, tiles_y=8):
+    def luma(img):
+        r, g, b = rgb565_split(img)
+        return ((r + g + b) >> 1)[::step, ::step]
+
+    h, w = cur.shape
+    moved = np.zeros((h, w), dtype=bool)
+    if prev is not None:
+        moved[::step, ::step] = np.abs(luma(cur) - luma(prev)) > threshold
+    tiles = moved.reshape(tiles_y, h // tiles_y, tiles_x, w // tiles_x).sum(axis=(1, 3))
+    ys, xs = np.nonzero(moved)
+    box = (xs.min(), xs.max(), ys.min(), ys.max()) if len(xs) else None
+    return int(moved.sum()), box, tiles
+
+# Split a 16-bit RGB565 image into 5, 6 and 5 bit channels
+def rgb565_split(img):
+    img = img.astype(np.int64)
+    return img >> 11, (img >> 5) & 0x3f, img & 0x1f
+
+# Load a raw little-endian RGB565 dump, as produced by the camtest snapshot
+def load_rgb565(filename, w=320, h=480):
+    data = np.fromfile(filename, dtype="<u2", count=w * h)
+    return data.reshape(h, w)
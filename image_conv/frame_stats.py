@@ -0,0 +1,205 @@
+from nmigen import *
+from nmigen.utils import bits_for, log2_int
+
+# Per-frame statistics of an RGB565 pixel stream: a histogram for each
+# channel, kept in block RAM, and the minimum, maximum and mean of each
+# channel. The statistics are double-buffered: while one frame is being
+# accumulated, those of the previous frame can be read. They are swapped
+# on i_frame_done, and o_done is pulsed when the new results are available.
+# A pixel valid with i_frame_done is the last of the frame it ends.
+#
+# The histogram is read by setting hist_chan (0 = red, 1 = green, 2 = blue)
+# and hist_bin, and the count is in hist_count on the next cycle.
+class FrameStats(Elaboratable):
+    def __init__(self, bins=32, max_pixels=320 * 480):
+        # Parameters
+        self.bins        = bins
+        self.cw          = bits_for(max_pixels)
+
+        # Inputs
+        self.i_valid     = Signal()
+        self.i_r         = Signal(5)
+        self.i_g         = Signal(6)
+        self.i_b         = Signal(5)
+        self.i_frame_done = Signal()
+        self.hist_chan   = Signal(2)
+        self.hist_bin    = Signal(log2_int(bins))
+
+        # Outputs
+        self.o_done      = Signal()
+        self.o_count     = Signal(self.cw)
+        self.o_min_r     = Signal(5)
+        self.o_min_g     = Signal(6)
+        self.o_min_b     = Signal(5)
+        self.o_max_r     = Signal(5)
+        self.o_max_g     = Signal(6)
+        self.o_max_b     = Signal(5)
+        self.o_mean_r    = Signal(5)
+        self.o_mean_g    = Signal(6)
+        self.o_mean_b    = Signal(5)
+        self.hist_count  = Signal(self.cw)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        bb = log2_int(self.bins)
+
+        # Bank of the histograms being accumulated, the other holding those
+        # of the last frame
+        frame = Signal()
+
+        with m.If(self.i_frame_done):
+            m.d.sync += frame.eq(~frame)
+
+        # Pixel count for the frame, including the pixel this cycle
+        count     = Signal(self.cw)
+        cur_count = Signal(self.cw)
+        m.d.comb += cur_count.eq(count + self.i_valid)
+        with m.If(self.i_frame_done):
+            m.d.sync += count.eq(0)
+        with m.Else():
+            m.d.sync += count.eq(cur_count)
+
+        # Histogram read data for the selected channel, and whether the bin
+        # was hit in the last frame
+        hist_data  = Array([Signal(self.cw, name="hist_data_%d" % i) for i in range(3)])
+        hist_valid = Array([Signal(name="hist_valid_%d" % i) for i in range(3)])
+        hist_chan = Signal(2)
+        m.d.sync += hist_chan.eq(self.hist_chan)
+        m.d.comb += self.hist_count.eq(Mux(hist_valid[hist_chan], hist_data[hist_chan], 0))
+
+        # Dividers for the means, started at the end of the frame
+        div_count = Signal(self.cw)
+        div_step  = Signal(range(7))
+        m.d.sync += self.o_done.eq(0)
+
+        with m.If(div_step != 0):
+            m.d.sync += div_step.eq(div_step - 1)
+            with m.If(div_step == 1):
+                m.d.sync += self.o_done.eq(1)
+
+        for n, (i_p, o_min, o_max, o_mean) in enumerate([
+                (self.i_r, self.o_min_r, self.o_max_r, self.o_mean_r),
+                (self.i_g, self.o_min_g, self.o_max_g, self.o_mean_g),
+                (self.i_b, self.o_min_b, self.o_max_b, self.o_mean_b)]):
+            dw = len(i_p)
+
+            # Bin for the pixel value
+            if dw >= bb:
+                p_bin = i_p[dw - bb:]
+            else:
+                p_bin = Cat(Const(0, bb - dw), i_p)
+
+            # Histogram memory, with a bank per frame, and a bit for each bin
+            # of each bank set when it is written. The bits of the bank to be
+            # accumulated are cleared at the end of each frame, so bins not
+            # hit in a frame read as zero, and the memory never needs clearing
+            hist = Memory(width=self.cw, depth=2 * self.bins)
+            valid = Signal(2 * self.bins, name="valid_%d" % n)
+            m.submodules["hist_r%d" % n] = hr = hist.read_port(transparent=False)
+            m.submodules["hist_w%d" % n] = hw = hist.write_port()
+            m.submodules["hist_o%d" % n] = ho = hist.read_port(transparent=False)
+
+            m.d.comb += [
+                ho.addr.eq(Cat(self.hist_bin, ~frame)),
+                hist_data[n].eq(ho.data)
+            ]
+            m.d.sync += hist_valid[n].eq(valid.bit_select(Cat(self.hist_bin, ~frame), 1))
+
+            # Read, increment and write back the bin, forwarding the last
+            # value written, as it is not yet visible to the read
+            inc_valid = Signal(name="inc_valid_%d" % n)
+            inc_bin   = Signal(bb, name="inc_bin_%d" % n)
+            inc_frame = Signal(name="inc_frame_%d" % n)
+            last_bin  = Signal(bb, name="last_bin_%d" % n)
+            last_fr   = Signal(name="last_fr_%d" % n)
+            last_val  = Signal(self.cw, name="last_val_%d" % n)
+            last_wr   = Signal(name="last_wr_%d" % n)
+            old       = Signal(self.cw, name="old_%d" % n)
+            new       = Signal(self.cw, name="new_%d" % n)
+
+            m.d.comb += [
+                hr.addr.eq(Cat(p_bin, frame)),
+                old.eq(Mux(last_wr & (last_bin == inc_bin) & (last_fr == inc_frame), last_val,
+                           Mux(valid.bit_select(hw.addr, 1), hr.data, 0))),
+                new.eq(old + 1),
+                hw.addr.eq(Cat(inc_bin, inc_frame)),
+                hw.data.eq(new),
+                hw.en.eq(inc_valid)
+            ]
+
+            # The bank cleared is never the one written: the last pixel of a
+            # frame is written in the old bank the cycle after
+            with m.If(self.i_frame_done):
+                m.d.sync += valid.word_select(~frame, self.bins).eq(0)
+            with m.If(inc_valid):
+                m.d.sync += valid.bit_select(hw.addr, 1).eq(1)
+
+            m.d.sync += [
+                inc_valid.eq(self.i_valid),
+                inc_bin.eq(p_bin),
+                inc_frame.eq(frame),
+                last_wr.eq(inc_valid),
+                last_bin.eq(inc_bin),
+                last_fr.eq(inc_frame),
+                last_val.eq(new)
+            ]
+
+            # Minimum, maximum and sum, and those including the pixel this
+            # cycle
+            p_min = Signal(dw, reset=(1 << dw) - 1, name="min_%d" % n)
+            p_max = Signal(dw, name="max_%d" % n)
+            p_sum = Signal(self.cw + dw, name="sum_%d" % n)
+            cur_min = Signal(dw, name="cur_min_%d" % n)
+            cur_max = Signal(dw, name="cur_max_%d" % n)
+            cur_sum = Signal(self.cw + dw, name="cur_sum_%d" % n)
+
+            m.d.comb += [
+                cur_min.eq(Mux(self.i_valid & (i_p < p_min), i_p, p_min)),
+                cur_max.eq(Mux(self.i_valid & (i_p > p_max), i_p, p_max)),
+                cur_sum.eq(p_sum + Mux(self.i_valid, i_p, 0))
+            ]
+
+            with m.If(self.i_frame_done):
+                m.d.sync += [
+                    p_min.eq(p_min.reset),
+                    p_max.eq(0),
+                    p_sum.eq(0),
+                    o_min.eq(cur_min),
+                    o_max.eq(cur_max)
+                ]
+            with m.Else():
+                m.d.sync += [
+                    p_min.eq(cur_min),
+                    p_max.eq(cur_max),
+                    p_sum.eq(cur_sum)
+                ]
+
+            # Restoring division of the sum by the count, a bit per cycle
+            rem  = Signal(self.cw + dw, name="rem_%d" % n)
+            mean = Signal(dw, name="mean_%d" % n)
+            sub  = Signal(self.cw + dw, name="sub_%d" % n)
+            m.d.comb += sub.eq(div_count << (div_step - 1))
+
+            with m.If(self.i_frame_done):
+                m.d.sync += [
+                    rem.eq(cur_sum),
+                    mean.eq(0)
+                ]
+            with m.Elif(div_step != 0):
+                with m.If((div_count != 0) & (rem >= sub)):
+                    m.d.sync += [
+                        rem.eq(rem - sub),
+                        mean.bit_select(div_step - 1, 1).eq(1)
+                    ]
+                with m.If(div_step == 1):
+                    m.d.sync += o_mean.eq(mean | ((div_count != 0) & (rem >= sub)))
+
+        with m.If(self.i_frame_done):
+            m.d.sync += [
+                div_count.eq(cur_count),
+                div_step.eq(6),
+                self.o_count.eq(cur_count)
+            ]
+
+        return m
@@ -1,19 +1,63 @@
 from nmigen import *
 from nmigen.build import Platform
 
-from conv3 import Conv3
-
+from conv3 import Window3, Kernel3
+from sobel import Sobel3
+from median3 import Median3
+from stream import Stream, SkidBuffer
+
+# Image processing on a stream of RGB565 pixels. The input is the sink
+# stream, and the processed pixels, with their co-ordinates, come out of
+# the source stream in the same order. When the source is stalled, the
+# whole pipeline stops, and a skid buffer keeps the pixels that are
+# already on their way out.
 class ImageConv(Elaboratable):
-    def __init__(self, res_x = 320, res_y = 480):
+    # Kernels selectable with sel: name, kernel, shift and whether to keep
+    # the original pixel if the result overflows
+    KERNELS = {
+        # Identity
+        0: ("ident",  [ 0, 0, 0,
+                        0, 1, 0,
+                        0, 0, 0], 0, 1),
+        # Guassian blur
+        1: ("blur",   [ 1, 2, 1,
+                        2, 4, 2,
+                        1, 2, 1], 4, 0),
+        # Sharpen
+        2: ("sharp",  [ 0,-1, 0,
+                       -1, 5,-1,
+                        0,-1, 0], 0, 1),
+        # Emboss
+        3: ("emboss", [-2,-1, 0,
+                       -1, 1, 1,
+                        0, 1, 2], 0, 1),
+        # Edge detection
+        4: ("edge",   [-1,-1,-1,
+                       -1, 8,-1,
+                       -1,-1,-1], 0, 0),
+        # Box blur
+        5: ("box",    [ 1, 1, 1,
+                        1, 1, 1,
+                        1, 1, 1], 3, 1)
+    }
+
+    # Selects the avg_r, avg_g and avg_b inputs
+    AVG = 6
+
+    # Selects the Sobel gradient magnitude
+    SOBEL = 7
+
+    # Selects the median filter
+    MEDIAN = 8
+
+    def __init__(self, res_x = 320, res_y = 480, sobel_l2 = False):
         # Parameters
         self.res_x       = res_x
         self.res_y       = res_y
+        self.sobel_l2    = sobel_l2
         
         # Inputs
-        self.i_valid     = Signal()
-        self.i_r         = Signal(5)
-        self.i_g         = Signal(6)
-        self.i_b         = Signal(5)
+        self.sink        = Stream([("r", 5), ("g", 6), ("b", 5)])
         self.sel         = Signal(4)
         self.x_flip      = Signal()
         self.y_flip      = Signal()
@@ -24,156 +68,147 @@ class ImageConv(Elaboratable):
         self.avg_b       = Signal(5)
 
         # Outputs
-        self.o_stall     = Signal()
-        self.o_valid     = Signal()
-        self.o_x         = Signal(10)
-        self.o_y         = Signal(9)
-        self.o_r         = Signal(5)
-        self.o_g         = Signal(6)
-        self.o_b         = Signal(5)
+        self.source      = Stream([
+            ("x",   10),
+            ("y",   9),
+            ("r",   5),
+            ("g",   6),
+            ("b",   5),
+            ("dir", 2)  # Sobel direction, except when median selected
+        ])
         self.frame_done  = Signal()
 
     def elaborate(self, platform):
         m = Module()
 
+        # Output skid buffer, which stops the pipeline when it is not ready
+        m.submodules.skid = skid = SkidBuffer(self.source.payload_layout)
+        ready = skid.sink.ready
+
+        m.d.comb += skid.source.connect_to(self.source)
+
         p_s = Signal(7)
-        def connect(c, ch):
-            m.d.comb += [
-                c.i_p.eq(ch),
-                c.i_valid.eq(self.i_valid)
-            ]
 
         def select(c_r, c_g, c_b):
             with m.If(self.mono):
                 m.d.comb += [
                     p_s.eq(c_r + c_g + c_b),
-                    self.o_r.eq(Mux(self.invert, ~p_s[2:], p_s[2:])),
-                    self.o_g.eq(Mux(self.invert, ~p_s[1:], p_s[1:])),
-                    self.o_b.eq(Mux(self.invert, ~p_s[2:], p_s[2:]))
+                    skid.sink.r.eq(Mux(self.invert, ~p_s[2:], p_s[2:])),
+                    skid.sink.g.eq(Mux(self.invert, ~p_s[1:], p_s[1:])),
+                    skid.sink.b.eq(Mux(self.invert, ~p_s[2:], p_s[2:]))
                 ]
             with m.Else():
                 m.d.comb += [
-                    self.o_r.eq(c_r),
-                    self.o_g.eq(c_g),
-                    self.o_b.eq(c_b)
+                    skid.sink.r.eq(c_r),
+                    skid.sink.g.eq(c_g),
+                    skid.sink.b.eq(c_b)
                 ]
 
-        # Identity
-        k_ident = Array([0,0,0,
-                         0,1,0,
-                         0,0,0])
-        sh_ident = 0
-        
-        # Edge detection
-        k_edge = Array([-1,-1,-1,
-                        -1, 8,-1,
-                        -1,-1,-1])
-        sh_edge = 0
-        
-        # Sharpen
-        k_sharp = Array([ 0,-1, 0,
-                          -1, 5,-1,
-                          0,-1, 0])
-        sh_sharp=0
-        
-        # Guassian blur
-        k_blur = Array([1, 2 , 1,
-                        2, 4,  2,
-                        1, 2,  1])
-        sh_blur = 4
+        # Create the shared windows, one for each channel
+        m.submodules.win_r = win_r = Window3(w=self.res_x, h=self.res_y, dw=5)
+        m.submodules.win_g = win_g = Window3(w=self.res_x, h=self.res_y, dw=6)
+        m.submodules.win_b = win_b = Window3(w=self.res_x, h=self.res_y, dw=5)
 
-        # Box blur
-        k_box = Array([1, 1, 1,
-                       1, 1, 1,
-                       1, 1, 1])
-        sh_box = 3
+        for win, ch in [(win_r, self.sink.r), (win_g, self.sink.g), (win_b, self.sink.b)]:
+            m.d.comb += [
+                win.i_p.eq(ch),
+                win.i_valid.eq(self.sink.valid),
+                win.i_ready.eq(ready)
+            ]
 
-        # Emboss
-        k_emboss = Array([-2, -1,  0,
-                          -1,  1,  1,
-                           0 , 1,  2])
-        sh_emboss = 0
-
-        # Adjust color balance (not used)
-        k_bal = Array([0,0,0,
-                       0,3,0,
-                       0,0,0])
-        sh_bal = 2
-                   
-        # Create the convolution modules
-        m.submodules.blur_r = blur_r = Conv3(k_blur, w=self.res_x, h=self.res_y, dw=5,sh=sh_blur)
-        m.submodules.blur_g = blur_g = Conv3(k_blur, w=self.res_x, h=self.res_y, dw=6,sh=sh_blur)
-        m.submodules.blur_b = blur_b = Conv3(k_blur, w=self.res_x, h=self.res_y, dw=5,sh=sh_blur)
-
-        connect(blur_r, self.i_r)
-        connect(blur_g, self.i_g)
-        connect(blur_b, self.i_b)
-
-        m.submodules.box_r = box_r = Conv3(k_box, w=self.res_x, h=self.res_y, dw=5,sh=sh_box,same=1)
-        m.submodules.box_g = box_g = Conv3(k_box, w=self.res_x, h=self.res_y, dw=6,sh=sh_box,same=1)
-        m.submodules.box_b = box_b = Conv3(k_box, w=self.res_x, h=self.res_y, dw=5,sh=sh_box,same=1)
-
-        connect(box_r, self.i_r)
-        connect(box_g, self.i_g)
-        connect(box_b, self.i_b)
-
-        m.submodules.edge_r = edge_r = Conv3(k_edge, w=self.res_x, h=self.res_y, dw=5,sh=sh_edge)
-        m.submodules.edge_g = edge_g = Conv3(k_edge, w=self.res_x, h=self.res_y, dw=6,sh=sh_edge)
-        m.submodules.edge_b = edge_b = Conv3(k_edge, w=self.res_x, h=self.res_y, dw=5,sh=sh_edge)
-
-        connect(edge_r, self.i_r)
-        connect(edge_g, self.i_g)
-        connect(edge_b, self.i_b)
-
-        m.submodules.sharp_r = sharp_r = Conv3(k_sharp, w=self.res_x, h=self.res_y, dw=5,sh=sh_sharp,same=1)
-        m.submodules.sharp_g = sharp_g = Conv3(k_sharp, w=self.res_x, h=self.res_y, dw=6,sh=sh_sharp,same=1)
-        m.submodules.sharp_b = sharp_b = Conv3(k_sharp, w=self.res_x, h=self.res_y, dw=5,sh=sh_sharp,same=1)
-
-        connect(sharp_r, self.i_r)
-        connect(sharp_g, self.i_g)
-        connect(sharp_b, self.i_b)
-
-        m.submodules.emboss_r = emboss_r = Conv3(k_emboss, w=self.res_x, h=self.res_y, dw=5,sh=sh_emboss,same=1)
-        m.submodules.emboss_g = emboss_g = Conv3(k_emboss, w=self.res_x, h=self.res_y, dw=6,sh=sh_emboss,same=1)
-        m.submodules.emboss_b = emboss_b = Conv3(k_emboss, w=self.res_x, h=self.res_y, dw=5,sh=sh_emboss,same=1)
-
-        connect(emboss_r, self.i_r)
-        connect(emboss_g, self.i_g)
-        connect(emboss_b, self.i_b)
-
-        m.submodules.ident_r = ident_r = Conv3(k_ident, w=self.res_x, h=self.res_y, dw=5,sh=sh_ident,same=1)
-        m.submodules.ident_g = ident_g = Conv3(k_ident, w=self.res_x, h=self.res_y, dw=6,sh=sh_ident,same=1)
-        m.submodules.ident_b = ident_b = Conv3(k_ident, w=self.res_x, h=self.res_y, dw=5,sh=sh_ident,same=1)
-
-        connect(ident_r, self.i_r)
-        connect(ident_g, self.i_g)
-        connect(ident_b, self.i_b)
+        m.d.comb += self.sink.ready.eq(ready & ~win_r.o_stall)
+
+        def connect(c, win):
+            m.d.comb += [
+                [i.eq(o) for i, o in zip(c.i_w, win.o_w)],
+                c.i_en.eq(win.o_en),
+                c.i_ready.eq(ready)
+            ]
+
+        # Create the convolution kernels, three per kernel, one for each channel
+        convs = {}
+        for sel, (name, k, sh, same) in self.KERNELS.items():
+            c_r = Kernel3(k, dw=5, sh=sh, same=same)
+            c_g = Kernel3(k, dw=6, sh=sh, same=same)
+            c_b = Kernel3(k, dw=5, sh=sh, same=same)
+
+            m.submodules[name + "_r"] = c_r
+            m.submodules[name + "_g"] = c_g
+            m.submodules[name + "_b"] = c_b
+
+            connect(c_r, win_r)
+            connect(c_g, win_g)
+            connect(c_b, win_b)
+
+            convs[sel] = (c_r, c_g, c_b)
+
+        # Sobel edge detection
+        m.submodules.sobel_r = sobel_r = Sobel3(dw=5, l2=self.sobel_l2)
+        m.submodules.sobel_g = sobel_g = Sobel3(dw=6, l2=self.sobel_l2)
+        m.submodules.sobel_b = sobel_b = Sobel3(dw=5, l2=self.sobel_l2)
+
+        connect(sobel_r, win_r)
+        connect(sobel_g, win_g)
+        connect(sobel_b, win_b)
+
+        convs[self.SOBEL] = (sobel_r, sobel_g, sobel_b)
+
+        # Median filter, which is pipelined, so carries the position with it
+        m.submodules.median_r = median_r = Median3(dw=5, xw=len(win_r.o_x), yw=len(win_r.o_y))
+        m.submodules.median_g = median_g = Median3(dw=6, xw=len(win_g.o_x), yw=len(win_g.o_y))
+        m.submodules.median_b = median_b = Median3(dw=5, xw=len(win_b.o_x), yw=len(win_b.o_y))
+
+        for median, win in [(median_r, win_r), (median_g, win_g), (median_b, win_b)]:
+            connect(median, win)
+            m.d.comb += [
+                median.i_x.eq(win.o_x),
+                median.i_y.eq(win.o_y),
+                median.i_frame_done.eq(win.frame_done)
+            ]
+
+        convs[self.MEDIAN] = (median_r, median_g, median_b)
 
         # Any channel can be used for these outputs
+        valid = Signal()
+        x = Signal(10)
+        y = Signal(9)
+        frame_done = Signal()
+
+        with m.If(self.sel == self.MEDIAN):
+            m.d.comb += [
+                valid.eq(median_r.o_valid),
+                x.eq(median_r.o_x),
+                y.eq(median_r.o_y),
+                frame_done.eq(median_r.o_frame_done)
+            ]
+        with m.Else():
+            m.d.comb += [
+                valid.eq(convs[0][0].o_valid),
+                x.eq(win_r.o_x),
+                y.eq(win_r.o_y),
+                frame_done.eq(win_r.frame_done)
+            ]
+
         m.d.comb += [
-            self.o_stall.eq(ident_r.o_stall),
-            self.o_valid.eq(ident_r.i_valid),
-            self.o_x.eq(Mux(self.x_flip, self.res_x - 1 - ident_r.o_x, ident_r.o_x)),
-            self.o_y.eq(Mux(self.y_flip, self.res_y - 1 - ident_r.o_y, ident_r.o_y)),
-            self.frame_done.eq(ident_r.frame_done)
+            skid.sink.valid.eq(valid),
+            skid.sink.first.eq((x == 0) & (y == 0)),
+            skid.sink.last.eq(x == self.res_x - 1),
+            skid.sink.x.eq(Mux(self.x_flip, self.res_x - 1 - x, x)),
+            skid.sink.y.eq(Mux(self.y_flip, self.res_y - 1 - y, y)),
+            skid.sink.dir.eq(sobel_g.o_dir),
+            self.frame_done.eq(frame_done)
         ]
 
         # Select the required convolution
         with m.Switch(self.sel):
-            with m.Case(1):
-                select(blur_r.o_p, blur_g.o_p, blur_b.o_p)
-            with m.Case(2):
-                select(sharp_r.o_p, sharp_g.o_p, sharp_b.o_p)
-            with m.Case(3):
-                select(emboss_r.o_p, emboss_g.o_p, emboss_b.o_p)
-            with m.Case(4):
-                select(edge_r.o_p, edge_g.o_p, edge_b.o_p)
-            with m.Case(5):
-                select(box_r.o_p, box_g.o_p, box_b.o_p)
-            with m.Case(6):
+            for sel, (c_r, c_g, c_b) in convs.items():
+                if sel != 0:
+                    with m.Case(sel):
+                        select(c_r.o_p, c_g.o_p, c_b.o_p)
+            with m.Case(self.AVG):
                 select(self.avg_r, self.avg_g, self.avg_b)
             with m.Default():
-                select(ident_r.o_p, ident_g.o_p, ident_b.o_p)
+                select(*[c.o_p for c in convs[0]])
 
         return m
 
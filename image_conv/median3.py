@@ -0,0 +1,97 @@
+from nmigen import *
+
+# 3x3 median filter working on the window taps from a Window3.
+# The median is found with a pipelined compare-exchange network (the 19
+# comparator median network), with a register after each layer, so a new
+# window can be accepted every clock. The coordinates and frame_done of
+# the pixel, in step with the registered window, are delayed with it.
+# The pipeline only moves when i_ready is set.
+class Median3(Elaboratable):
+    # Layers of compare-exchange operations, each puts the minimum of the
+    # two taps in the first and the maximum in the second
+    NETWORK = [
+        [(1, 2), (4, 5), (7, 8)],
+        [(0, 1), (3, 4), (6, 7)],
+        [(1, 2), (4, 5), (7, 8)],
+        [(0, 3), (5, 8), (4, 7)],
+        [(3, 6), (1, 4), (2, 5)],
+        [(4, 7)],
+        [(4, 2)],
+        [(6, 4)],
+        [(4, 2)]
+    ]
+
+    # Cycles from i_en to o_valid
+    LATENCY = len(NETWORK) + 1
+
+    def __init__(self, dw=8, xw=10, yw=10):
+        # Parameters
+        self.dw        = dw
+
+        # Inputs
+        self.i_w       = [Signal(dw) for i in range(9)]
+        self.i_en      = Signal()
+        self.i_ready   = Signal(reset=1)
+        self.i_x       = Signal(xw)
+        self.i_y       = Signal(yw)
+        self.i_frame_done = Signal()
+
+        # Outputs
+        self.o_p       = Signal(dw)
+        self.o_valid   = Signal()
+        self.o_x       = Signal(xw)
+        self.o_y       = Signal(yw)
+        self.o_frame_done = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+
+        # Register the window
+        p = [Signal(self.dw, name="p0_%d" % i) for i in range(9)]
+        valid = Signal()
+        with m.If(self.i_ready):
+            m.d.sync += [
+                [r.eq(w) for r, w in zip(p, self.i_w)],
+                valid.eq(self.i_en)
+            ]
+
+        # Position is in step with the registered window
+        x = self.i_x
+        y = self.i_y
+        frame_done = self.i_frame_done
+
+        for n, layer in enumerate(self.NETWORK):
+            # Compare and exchange
+            c = list(p)
+            for a, b in layer:
+                swap = p[a] > p[b]
+                c[a] = Mux(swap, p[b], p[a])
+                c[b] = Mux(swap, p[a], p[b])
+
+            # Pipeline register
+            s = [Signal(self.dw, name="p%d_%d" % (n + 1, i)) for i in range(9)]
+            s_valid = Signal(name="valid%d" % (n + 1))
+            s_x = Signal.like(self.i_x, name="x%d" % (n + 1))
+            s_y = Signal.like(self.i_y, name="y%d" % (n + 1))
+            s_frame_done = Signal(name="frame_done%d" % (n + 1))
+            with m.If(self.i_ready):
+                m.d.sync += [
+                    [r.eq(v) for r, v in zip(s, c)],
+                    s_valid.eq(valid),
+                    s_x.eq(x),
+                    s_y.eq(y),
+                    s_frame_done.eq(frame_done)
+                ]
+
+            p, valid, x, y, frame_done = s, s_valid, s_x, s_y, s_frame_done
+
+        m.d.comb += [
+            self.o_p.eq(p[4]),
+            self.o_valid.eq(valid),
+            self.o_x.eq(x),
+            self.o_y.eq(y),
+            # Only once, as the pipeline may be held with it set
+            self.o_frame_done.eq(frame_done & self.i_ready)
+        ]
+
+        return m
@@ -0,0 +1,331 @@
+from nmigen import *
+from nmigen.utils import bits_for, log2_int
+
+# Motion detection by frame differencing, on an RGB565 pixel stream.
+#
+# The luma of each pixel, (r + g + b) / 2 as 6 bits, is compared with the
+# same pixel of the previous frame, kept in block RAM, and the pixel has
+# moved if they differ by more than threshold. Only one pixel in step x step
+# is compared, to keep the reference frame small.
+#
+# For each frame, the pixels that moved are counted, both in total and in
+# each of tiles_x x tiles_y tiles, and their bounding box is found. At the
+# end of the frame, these are latched in the outputs and o_done is pulsed.
+# o_motion is set if the total is at least min_count, and o_tiles has a bit
+# for each tile, in raster order, set if its count is at least
+# tile_threshold. The box is empty (min > max) if nothing moved.
+#
+# The tile counts are double-buffered: those of the previous frame are
+# read by setting tile_addr, and are in tile_count on the next cycle.
+#
+# Positions come from the first and last flags, and the frame ends with
+# the last pixel of line h - 1. Nothing moves in the first frame.
+class MotionDetect(Elaboratable):
+    def __init__(self, w=320, h=480, step=4, tiles_x=8, tiles_y=8):
+        # Parameters
+        assert w % step == 0 and h % step == 0
+        assert w % tiles_x == 0 and h % tiles_y == 0
+        self.w              = w
+        self.h              = h
+        self.step           = step
+        self.tiles_x        = tiles_x
+        self.tiles_y        = tiles_y
+        self.n_tiles        = tiles_x * tiles_y
+        self.cw             = bits_for((w // step) * (h // step))
+
+        # Inputs
+        self.i_valid        = Signal()
+        self.i_first        = Signal()
+        self.i_last         = Signal()
+        self.i_r            = Signal(5)
+        self.i_g            = Signal(6)
+        self.i_b            = Signal(5)
+        self.threshold      = Signal(6, reset=6)
+        self.min_count      = Signal(self.cw, reset=16)
+        self.tile_threshold = Signal(self.cw, reset=4)
+        self.tile_addr      = Signal(range(self.n_tiles))
+
+        # Outputs
+        self.o_done         = Signal()
+        self.o_motion       = Signal()
+        self.o_count        = Signal(self.cw)
+        self.o_min_x        = Signal(10)
+        self.o_max_x        = Signal(10)
+        self.o_min_y        = Signal(10)
+        self.o_max_y        = Signal(10)
+        self.o_tiles        = Signal(self.n_tiles)
+        self.tile_count     = Signal(self.cw)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        sb = log2_int(self.step)
+        tile_w = self.w // self.tiles_x
+        tile_h = self.h // self.tiles_y
+
+        # Position of the input pixel, and its tile
+        x  = Signal(10)
+        y  = Signal(10)
+        xt = Signal(range(tile_w))
+        yt = Signal(range(tile_h))
+        tx = Signal(range(self.tiles_x))
+        ty = Signal(range(self.tiles_y))
+
+        cx  = Signal(10)
+        cy  = Signal(10)
+        cxt = Signal(range(tile_w))
+        cyt = Signal(range(tile_h))
+        ctx = Signal(range(self.tiles_x))
+        cty = Signal(range(self.tiles_y))
+        fs  = self.i_first
+
+        m.d.comb += [
+            cx.eq(Mux(fs, 0, x)),
+            cy.eq(Mux(fs, 0, y)),
+            cxt.eq(Mux(fs, 0, xt)),
+            cyt.eq(Mux(fs, 0, yt)),
+            ctx.eq(Mux(fs, 0, tx)),
+            cty.eq(Mux(fs, 0, ty))
+        ]
+
+        with m.If(self.i_valid):
+            with m.If(self.i_last):
+                m.d.sync += [
+                    x.eq(0),
+                    xt.eq(0),
+                    tx.eq(0),
+                    y.eq(cy + 1),
+                    yt.eq(Mux(cyt == tile_h - 1, 0, cyt + 1)),
+                    ty.eq(Mux(cyt == tile_h - 1, cty + 1, cty))
+                ]
+            with m.Else():
+                m.d.sync += [
+                    x.eq(cx + 1),
+                    xt.eq(Mux(cxt == tile_w - 1, 0, cxt + 1)),
+                    tx.eq(Mux(cxt == tile_w - 1, ctx + 1, ctx)),
+                    y.eq(cy),
+                    yt.eq(cyt),
+                    ty.eq(cty)
+                ]
+
+        # Reference frame of sampled luma, read for each pixel and written
+        # back with the new value on the next cycle
+        ref = Memory(width=6, depth=(self.w >> sb) * (self.h >> sb))
+        m.submodules.ref_r = ref_r = ref.read_port(transparent=False)
+        m.submodules.ref_w = ref_w = ref.write_port()
+
+        luma    = Signal(7)
+        sampled = Signal()
+        addr    = Signal(range(ref.depth))
+
+        m.d.comb += [
+            luma.eq(self.i_r + self.i_g + self.i_b),
+            sampled.eq((cx[:sb] == 0) & (cy[:sb] == 0) if sb else 1),
+            addr.eq((cy >> sb) * (self.w >> sb) + (cx >> sb)),
+            ref_r.addr.eq(addr)
+        ]
+
+        # Stage 1: compare with the reference
+        s1_valid     = Signal()
+        s1_sampled   = Signal()
+        s1_l         = Signal(6)
+        s1_addr      = Signal(range(ref.depth))
+        s1_x         = Signal(10)
+        s1_y         = Signal(10)
+        s1_tx        = Signal(range(self.tiles_x))
+        s1_ty        = Signal(range(self.tiles_y))
+        s1_tile_end  = Signal()
+        s1_frame_end = Signal()
+
+        m.d.sync += [
+            s1_valid.eq(self.i_valid),
+            s1_sampled.eq(sampled),
+            s1_l.eq(luma[1:]),
+            s1_addr.eq(addr),
+            s1_x.eq(cx),
+            s1_y.eq(cy),
+            s1_tx.eq(ctx),
+            s1_ty.eq(cty),
+            s1_tile_end.eq((cxt == tile_w - 1) & (cyt == tile_h - 1)),
+            s1_frame_end.eq(self.i_last & (cy == self.h - 1))
+        ]
+
+        m.d.comb += [
+            ref_w.addr.eq(s1_addr),
+            ref_w.data.eq(s1_l),
+            ref_w.en.eq(s1_valid & s1_sampled)
+        ]
+
+        have_ref = Signal()
+        diff     = Signal(signed(7))
+        motion   = Signal()
+
+        m.d.comb += [
+            diff.eq(s1_l - ref_r.data),
+            motion.eq(have_ref & s1_valid & s1_sampled &
+                      (Mux(diff < 0, -diff, diff) > self.threshold))
+        ]
+
+        # Stage 2: accumulate the counts and the box for the frame. The tiles
+        # of a row of tiles are counted in registers, one per column, and
+        # written to the tile memory as each tile is finished.
+        count = Signal(self.cw)
+        min_x = Signal(10, reset=(1 << 10) - 1)
+        max_x = Signal(10)
+        min_y = Signal(10, reset=(1 << 10) - 1)
+        max_y = Signal(10)
+        tiles = Signal(self.n_tiles)
+
+        cols = Array([Signal(self.cw, name="col_%d" % i) for i in range(self.tiles_x)])
+        tile = Signal(range(self.n_tiles))
+        cnt  = Signal(self.cw)
+
+        m.d.comb += [
+            tile.eq(s1_ty * self.tiles_x + s1_tx),
+            cnt.eq(cols[s1_tx] + motion)
+        ]
+
+        n_count = Signal(self.cw)
+        n_min_x = Signal(10)
+        n_max_x = Signal(10)
+        n_min_y = Signal(10)
+        n_max_y = Signal(10)
+        n_tiles = Signal(self.n_tiles)
+
+        m.d.comb += [
+            n_count.eq(count + motion),
+            n_min_x.eq(Mux(motion & (s1_x < min_x), s1_x, min_x)),
+            n_max_x.eq(Mux(motion & (s1_x > max_x), s1_x, max_x)),
+            n_min_y.eq(Mux(motion & (s1_y < min_y), s1_y, min_y)),
+            n_max_y.eq(Mux(motion & (s1_y > max_y), s1_y, max_y)),
+            n_tiles.eq(tiles | Mux(s1_tile_end & (cnt >= self.tile_threshold), Const(1, self.n_tiles) << tile, 0))
+        ]
+
+        # Tile counts, with a bank per frame
+        bank = Signal()
+        tm = Memory(width=self.cw, depth=2 * self.n_tiles)
+        m.submodules.tile_r = tr = tm.read_port(transparent=False)
+        m.submodules.tile_w = tw = tm.write_port()
+
+        m.d.comb += [
+            tr.addr.eq(Cat(self.tile_addr, ~bank)),
+            self.tile_count.eq(tr.data),
+            tw.addr.eq(Cat(tile, bank)),
+            tw.data.eq(cnt),
+            tw.en.eq(s1_valid & s1_tile_end)
+        ]
+
+        for i, col in enumerate(cols):
+            with m.If(s1_valid & (s1_tx == i)):
+                m.d.sync += col.eq(Mux(s1_tile_end, 0, cnt))
+
+        m.d.sync += self.o_done.eq(0)
+
+        with m.If(s1_valid & s1_frame_end):
+            m.d.sync += [
+                self.o_done.eq(1),
+                self.o_motion.eq(n_count >= self.min_count),
+                self.o_count.eq(n_count),
+                self.o_min_x.eq(n_min_x),
+                self.o_max_x.eq(n_max_x),
+                self.o_min_y.eq(n_min_y),
+                self.o_max_y.eq(n_max_y),
+                self.o_tiles.eq(n_tiles),
+                count.eq(0),
+                min_x.eq(min_x.reset),
+                max_x.eq(0),
+                min_y.eq(min_y.reset),
+                max_y.eq(0),
+                tiles.eq(0),
+                bank.eq(~bank),
+                have_ref.eq(1)
+            ]
+        with m.Elif(s1_valid):
+            m.d.sync += [
+                count.eq(n_count),
+                min_x.eq(n_min_x),
+                max_x.eq(n_max_x),
+                min_y.eq(n_min_y),
+                max_y.eq(n_max_y),
+                tiles.eq(n_tiles)
+            ]
+
+        return m
+
+# Send the results of MotionDetect as a line of text, over a uart transmit
+# port with data, ack and rdy, such as that of AsyncSerial:
+#
+#   M ccccc xxx xxx yyy yyy tttttttttttttttt
+#
+# in hex: the count, the box (min x, max x, min y, max y) and the tiles,
+# with the last tile in the first digit. The results are latched on
+# i_start, which is ignored while a line is being sent.
+class MotionReport(Elaboratable):
+    def __init__(self, cw=14, n_tiles=64):
+        # Parameters
+        self.cw        = cw
+        self.n_tiles   = n_tiles
+
+        # Inputs
+        self.i_start   = Signal()
+        self.i_count   = Signal(cw)
+        self.i_min_x   = Signal(10)
+        self.i_max_x   = Signal(10)
+        self.i_min_y   = Signal(10)
+        self.i_max_y   = Signal(10)
+        self.i_tiles   = Signal(n_tiles)
+        self.tx_rdy    = Signal()
+
+        # Outputs
+        self.busy      = Signal()
+        self.tx_data   = Signal(8)
+        self.tx_ack    = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+
+        count = Signal(self.cw)
+        min_x = Signal(10)
+        max_x = Signal(10)
+        min_y = Signal(10)
+        max_y = Signal(10)
+        tiles = Signal(self.n_tiles)
+
+        def hex_digit(n):
+            return Mux(n < 10, n + ord("0"), n + ord("A") - 10)
+
+        def hex_field(s, digits):
+            return [hex_digit(s[4 * i:4 * i + 4]) for i in reversed(range(digits))]
+
+        chars = [ord("M"), ord(" ")] + hex_field(count, (self.cw + 3) // 4)
+        for s in [min_x, max_x, min_y, max_y]:
+            chars += [ord(" ")] + hex_field(s, 3)
+        chars += [ord(" ")] + hex_field(tiles, (self.n_tiles + 3) // 4)
+        chars += [ord("\r"), ord("\n")]
+
+        chars = Array([Const(c, 8) if isinstance(c, int) else c for c in chars])
+        char = Signal(range(len(chars)))
+
+        m.d.comb += [
+            self.tx_data.eq(chars[char]),
+            self.tx_ack.eq(self.busy)
+        ]
+
+        with m.If(self.busy):
+            with m.If(self.tx_rdy):
+                m.d.sync += char.eq(char + 1)
+                with m.If(char == len(chars) - 1):
+                    m.d.sync += self.busy.eq(0)
+        with m.Elif(self.i_start):
+            m.d.sync += [
+                self.busy.eq(1),
+                char.eq(0),
+                count.eq(self.i_count),
+                min_x.eq(self.i_min_x),
+                max_x.eq(self.i_max_x),
+                min_y.eq(self.i_min_y),
+                max_y.eq(self.i_max_y),
+                tiles.eq(self.i_tiles)
+            ]
+
+        return m
@@ -19,6 +19,11 @@ class OSD(Elaboratable):
         self.sel     = Signal()
         self.grid    = Signal()
         self.border  = Signal()
+        self.box_on  = Signal()
+        self.box_x0  = Signal(10)
+        self.box_x1  = Signal(10)
+        self.box_y0  = Signal(10)
+        self.box_y1  = Signal(10)
 
         # outputs
         self.o_r     = Signal(8)
@@ -36,6 +41,18 @@ class OSD(Elaboratable):
                                             (self.y < 2) | (self.y >= 478)), 0xff, self.i_b))
         ]
 
+        # Outline of a box, such as the motion detected, in red
+        with m.If(self.box_on &
+                  (((self.x >= self.box_x0) & (self.x <= self.box_x1) &
+                    ((self.y == self.box_y0) | (self.y == self.box_y1))) |
+                   ((self.y >= self.box_y0) & (self.y <= self.box_y1) &
+                    ((self.x == self.box_x0) | (self.x == self.box_x1))))):
+            m.d.sync += [
+                self.o_r.eq(0xFF),
+                self.o_g.eq(0),
+                self.o_b.eq(0)
+            ]
+
         y_offset = Signal(10)
         xb = Signal(4)
         yb = Signal(4)
@@ -0,0 +1,152 @@
+import argparse
+
+import numpy as np
+
+from nmigen import *
+from nmigen.sim import *
+
+from camconfig import CamConfig
+from frame_stats import FrameStats
+from auto_exposure import AutoExposure
+from sccb_model import SCCBModel
+
+# Closed-loop simulation of AutoExposure. The camera is configured from
+# config.mem, and a synthetic camera model then produces frames whose
+# brightness and color depend on the exposure, gain and balance registers
+# written over the SCCB. FrameStats measures the frames and AutoExposure
+# adjusts the registers. The light level changes part way through. COM1
+# is given other bits than the exposure's, which must be kept.
+
+class Top(Elaboratable):
+    def __init__(self, w, h, clk_freq):
+        self.camconfig = CamConfig(clk_freq=clk_freq)
+        self.stats     = FrameStats(max_pixels=w * h)
+        self.ae        = AutoExposure()
+
+    def elaborate(self, platform):
+        m = Module()
+
+        m.submodules.camconfig = camconfig = self.camconfig
+        m.submodules.stats = stats = self.stats
+        m.submodules.ae = ae = self.ae
+
+        m.d.comb += [
+            ae.enable.eq(camconfig.done),
+            ae.i_stats.eq(stats.o_done),
+            ae.i_mean_r.eq(stats.o_mean_r),
+            ae.i_mean_g.eq(stats.o_mean_g),
+            ae.i_mean_b.eq(stats.o_mean_b),
+            ae.sccb_ready.eq(camconfig.sccb_ready),
+            ae.sccb_rd_data.eq(camconfig.sccb_rd_data),
+            ae.sccb_rd_valid.eq(camconfig.sccb_rd_valid),
+            camconfig.sccb_start.eq(ae.sccb_start),
+            camconfig.sccb_addr.eq(ae.sccb_addr),
+            camconfig.sccb_data.eq(ae.sccb_data),
+            camconfig.sccb_read.eq(ae.sccb_read)
+        ]
+
+        return m
+
+# Synthetic camera: the level of each channel is proportional to the scene
+# color, the light, the exposure and gain, and the red and blue balance
+class CameraModel:
+    def __init__(self, sccb, scene, w, h, seed=1):
+        self.sccb    = sccb
+        self.scene   = np.array(scene)
+        self.texture = np.random.default_rng(seed).uniform(0.8, 1.2, (h, w))
+
+    def exposure(self):
+        r = self.sccb.reg
+        return ((r(0x07) & 0x3f) << 10) | (r(0x10, 0x40) << 2) | (r(0x04) & 3)
+
+    def gain(self):
+        g = self.sccb.reg(0x00)
+        return np.prod([1 + ((g >> i) & 1) for i in range(4, 8)]) * (1 + (g & 15) / 16)
+
+    def frame(self, light):
+        wb = np.array([self.sccb.reg(0x02, 0x80), 0x80, self.sccb.reg(0x01, 0x80)]) / 0x80
+        level = self.scene * wb * light * self.exposure() / 256 * self.gain()
+        r, g, b = [np.clip(l * self.texture, 0, 1) for l in level]
+        r = np.round(r * 31).astype(int)
+        g = np.round(g * 63).astype(int)
+        b = np.round(b * 31).astype(int)
+        return (r << 11) | (g << 5) | b
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=24)
+    parser.add_argument("--vcd", action="store_true")
+    args = parser.parse_args()
+
+    w, h = 8, 8
+    clk_freq = 400000 # Just fast enough for 100kHz SCCB, to keep the simulation short
+    dut = Top(w, h, clk_freq)
+    sccb = SCCBModel()
+    camera = CameraModel(sccb, scene=[0.5, 0.35, 0.25], w=w, h=h)
+
+    # Light level for each frame
+    lights = [0.3] * (args.frames // 2) + [2.0] * (args.frames - args.frames // 2)
+    results = []
+
+    def process():
+        # Configure the camera
+        yield dut.camconfig.start.eq(1)
+        yield
+        yield dut.camconfig.start.eq(0)
+        while not (yield dut.camconfig.done):
+            yield
+        print("configured with {} writes".format(len(sccb.writes)))
+        n_config = len(sccb.writes)
+
+        # CCIR656 and HREF skip set in COM1, as a configuration might
+        sccb.regs[0x04] = 0x4c
+
+        for f, light in enumerate(lights):
+            exposure, gain = camera.exposure(), sccb.reg(0x00)
+            frame = camera.frame(light)
+            for p in frame.ravel():
+                yield dut.stats.i_r.eq(int(p) >> 11)
+                yield dut.stats.i_g.eq((int(p) >> 5) & 0x3f)
+                yield dut.stats.i_b.eq(int(p) & 0x1f)
+                yield dut.stats.i_valid.eq(1)
+                yield
+            yield dut.stats.i_valid.eq(0)
+            yield dut.stats.i_frame_done.eq(1)
+            yield
+            yield dut.stats.i_frame_done.eq(0)
+
+            # Vertical blanking, long enough for the register writes
+            for i in range(4000):
+                yield
+
+            means = [(yield dut.stats.o_mean_r), (yield dut.stats.o_mean_g), (yield dut.stats.o_mean_b)]
+            results.append((f, light, exposure, gain, means))
+            print("frame {:2} light {:.1f} exposure {:4} gain {:3} red {:3} blue {:3} means r {:2} g {:2} b {:2} luma {:2}".format(
+                  f, light, exposure, gain, sccb.reg(0x02, 0x80), sccb.reg(0x01, 0x80),
+                  *means, sum(means) >> 1))
+
+        print("{} register writes while running".format(len(sccb.writes) - n_config))
+
+    sim = Simulator(dut)
+    sim.add_clock(1 / clk_freq)
+    sim.add_sync_process(process)
+    sim.add_sync_process(sccb.process(dut.camconfig.sioc, dut.camconfig.siod, dut.camconfig.siod_i))
+    if args.vcd:
+        with sim.write_vcd("test.vcd", "test.gtkw"):
+            sim.run()
+    else:
+        sim.run()
+
+    # Check that each half has converged within a few frames
+    errors = 0
+    for start in [0, len(lights) // 2]:
+        for f, light, exposure, gain, (r, g, b) in results[start + 6:start + len(lights) // 2]:
+            if abs((r + g + b) // 2 - dut.ae.target) > 2 or abs(2 * r - g) > 3 or abs(2 * b - g) > 3:
+                print("frame", f, "not converged")
+                errors += 1
+
+    if sccb.reg(0x04) & 0xfc != 0x4c:
+        print("COM1 0x{:02x}, its other bits not kept".format(sccb.reg(0x04)))
+        errors += 1
+
+    print("{} errors".format(errors))
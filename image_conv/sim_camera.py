@@ -0,0 +1,210 @@
+import argparse
+
+import numpy as np
+
+from nmigen import *
+from nmigen.sim import *
+
+from camconfig import CamConfig
+from camread import CamRead
+from pixel_fifo import PixelFIFO
+from yuv2rgb import YUV2RGB
+from crop_scale import CropScale
+from image_conv import ImageConv
+from ov7670_model import OV7670Model
+from ov7670_config import OV7670Config
+from readhex import readhex
+import conv_model
+
+# End-to-end simulation of the camera path of camtest.py, without a camera:
+# OV7670Model is configured over the SCCB by CamConfig, and its frames go
+# through CamRead, PixelFIFO, YUV2RGB in YUV mode, CropScale and ImageConv
+# into the frame buffer, as in camtest.py, but for a smaller image. Every
+# complete frame written to the frame buffer once the camera is configured
+# must be the next frame of the video, as given by the numpy models, and
+# no pixels may be dropped by the fifo. The register writes must be those
+# of config.mem. The configuration time and the frame rate are reported.
+
+class Top(Elaboratable):
+    def __init__(self, w, h, clk_freq, yuv):
+        self.w = w
+        self.h = h
+        self.yuv = yuv
+        self.camconfig = CamConfig(clk_freq=clk_freq, yuv=yuv)
+        self.camread = CamRead(res_x=w, yuv=yuv)
+        self.fifo = PixelFIFO(payload=self.camread.source.payload_layout, depth=64)
+        self.crop = CropScale(max_w=w)
+        self.ims = ImageConv(res_x=w // 2, res_y=h)
+        self.buffer = Memory(width=16, depth=w // 2 * h)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        m.submodules.camconfig = camconfig = self.camconfig
+        m.submodules.camread = camread = self.camread
+        m.submodules.fifo = fifo = self.fifo
+        m.submodules.crop = crop = self.crop
+        m.submodules.ims = ims = self.ims
+        m.submodules.w = w = self.buffer.write_port()
+
+        # Sync the fifo with the camera, from the first pixel of a frame, as
+        # the line buffers of ImageConv count the pixels from reset
+        sync_fifo = Signal(reset=0)
+        with m.If(camread.source.valid & camread.source.first):
+            m.d.pclock += sync_fifo.eq(1)
+
+        m.d.comb += [
+            crop.crop_w.eq(self.w),
+            crop.crop_h.eq(self.h),
+            crop.h_div.eq(32),
+            crop.v_div.eq(16),
+            fifo.sink.valid.eq(camread.source.valid & (sync_fifo | camread.source.first)),
+            fifo.sink.first.eq(camread.source.first),
+            fifo.sink.last.eq(camread.source.last),
+            [fifo.sink[f].eq(camread.source[f]) for f, _, _ in camread.source.payload_layout],
+            camread.source.ready.eq(fifo.sink.ready | ~(sync_fifo | camread.source.first))
+        ]
+
+        if self.yuv:
+            m.submodules.yuv2rgb = yuv2rgb = YUV2RGB()
+            m.d.comb += [
+                fifo.source.connect_to(yuv2rgb.sink),
+                yuv2rgb.source.connect_to(crop.sink)
+            ]
+        else:
+            m.d.comb += [
+                fifo.source.ready.eq(crop.sink.ready),
+                crop.sink.valid.eq(fifo.source.valid),
+                crop.sink.first.eq(fifo.source.first),
+                crop.sink.last.eq(fifo.source.last),
+                crop.sink.r.eq(fifo.source.data[11:]),
+                crop.sink.g.eq(fifo.source.data[5:11]),
+                crop.sink.b.eq(fifo.source.data[0:5])
+            ]
+
+        m.d.comb += [
+            crop.source.connect_to(ims.sink),
+            ims.source.ready.eq(1),
+            w.en.eq(ims.source.valid),
+            w.addr.eq(ims.source.y * (self.w // 2) + ims.source.x),
+            w.data.eq(Cat(ims.source.b, ims.source.g, ims.source.r))
+        ]
+
+        return m
+
+# The frame buffer contents for a frame of the video, in the given format
+def expected(img, fmt):
+    h, w = img.shape
+    if fmt == "yuv422":
+        ys, us, vs = OV7670Model.rgb2yuv(img)
+        r, g, b = conv_model.yuv2rgb(ys, np.repeat(us, 2, axis=1), np.repeat(vs, 2, axis=1))
+    else:
+        r, g, b = conv_model.rgb565_split(img)
+    r, g, b = [conv_model.crop_scale(c, (0, 0, w, h), 32, 16) for c in (r, g, b)]
+    return (r << 11) | (g << 5) | b
+
+def run(frames, yuv, n_frames, clk_freq, pclk_ratio):
+    h, w = frames[0].shape
+    dut = Top(w, h, clk_freq, yuv)
+    camera = OV7670Model(frames, pclk_period=pclk_ratio / clk_freq)
+
+    captured = []
+    config_cycles = [0]
+    overflow = [0]
+
+    def process():
+        fb = np.zeros((h, w // 2), dtype=int)
+        written = np.zeros((h, w // 2), dtype=bool)
+        cycles = 0
+
+        # Configure the camera
+        yield dut.camconfig.start.eq(1)
+        yield
+        yield dut.camconfig.start.eq(0)
+        while not (yield dut.camconfig.done):
+            cycles += 1
+            yield
+        config_cycles[0] = cycles
+
+        # Collect the frames written to the frame buffer
+        while len(captured) < n_frames:
+            if (yield dut.ims.source.valid):
+                x, y = (yield dut.ims.source.x), (yield dut.ims.source.y)
+                fb[y, x] = ((yield dut.ims.source.r) << 11) | ((yield dut.ims.source.g) << 5) | (yield dut.ims.source.b)
+                written[y, x] = True
+                if x == w // 2 - 1 and y == h - 1:
+                    if written.all():
+                        captured.append((camera.cycles, fb.copy()))
+                    written[:] = False
+            cycles += 1
+            yield
+        overflow[0] = yield dut.fifo.o_overflow
+
+    sim = Simulator(dut)
+    sim.add_clock(1 / clk_freq)
+    sim.add_sync_process(process)
+    sim.add_sync_process(camera.sccb.process(dut.camconfig.sioc, dut.camconfig.siod))
+    sim.add_process(camera.process(dut.camread.p_clock, dut.camread.vsync, dut.camread.href, dut.camread.p_data))
+    sim.run()
+
+    errors = 0
+
+    # The register writes
+    config = readhex("config.mem")
+    if yuv:
+        config = OV7670Config.yuv_config(config)
+    writes = [(d >> 8, d & 0xff) for d in config if d not in (0xffff, 0xfff0)]
+    if camera.sccb.writes != writes:
+        print("    {} register writes, expected {}".format(len(camera.sccb.writes), len(writes)))
+        errors += 1
+    fmt = "yuv422" if yuv else "rgb565"
+    if camera.format() != fmt:
+        print("    camera format", camera.format(), "expected", fmt)
+        errors += 1
+    if overflow[0]:
+        print("    {} pixels dropped by the fifo".format(overflow[0]))
+        errors += 1
+
+    # The frames must follow the video in order, starting from any frame.
+    # The latency is from the end of the frame's last line at the camera to
+    # its last pixel in the frame buffer, in pclk cycles
+    refs = [expected(f, fmt) for f in frames]
+    line_cycles = 2 * w + camera.h_blank
+    n = None
+    latency = 0
+    for i, (pclks, fb) in enumerate(captured):
+        matches = [k for k, ref in enumerate(refs) if (fb == ref).all()]
+        if n is None and matches:
+            n = matches[0]
+        if n is None or n % len(frames) not in matches:
+            print("    frame {} does not match frame {} of the video".format(i, n))
+            errors += 1
+            n = None
+        else:
+            ends = [c + (camera.vsync + camera.v_back + h) * line_cycles - camera.h_blank
+                    for c, k, f in camera.sent if k == n % len(frames)]
+            latency = max(latency, pclks - max(e for e in ends if e <= pclks))
+            n += 1
+
+    period = (captured[-1][0] - captured[0][0]) / max(len(captured) - 1, 1)
+    print("{} {}x{}: configured in {:.1f} ms, {} frames, one every {:.0f} pclk cycles, latency {} pclk cycles {:>2} errors".format(
+        fmt, w, h, config_cycles[0] / clk_freq * 1e3, len(captured), period, latency, errors))
+    return errors
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=32)
+    parser.add_argument("--height", type=int, default=16)
+    parser.add_argument("--frames", type=int, default=3)
+    parser.add_argument("--pclk", type=float, default=0.6, help="pclk period, relative to the system clock")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    video = [rng.integers(0, 1 << 16, (args.height, args.width)) for i in range(3)]
+
+    errors = 0
+    for yuv in [False, True]:
+        errors += run(video, yuv, args.frames, 400000, args.pclk)
+
+    print("{} errors".format(errors))
@@ -0,0 +1,113 @@
+import argparse
+
+import numpy as np
+
+from nmigen import *
+from nmigen.sim import *
+
+from crop_scale import CropScale
+import conv_model
+
+# Check CropScale against the numpy model, for a range of crop windows and
+# decimation factors, with random gaps in the input and stalls on the output.
+
+def test_crop_scale(frames, crop, h_div, v_div, stall, seed):
+    h, w = frames[0].shape
+    dut = CropScale(max_w=w)
+    rng = np.random.default_rng(seed)
+
+    refs = []
+    for f in frames:
+        chans = [conv_model.crop_scale(c, crop, h_div, v_div) for c in conv_model.rgb565_split(f)]
+        refs.append((chans[0] << 11) | (chans[1] << 5) | chans[2])
+    oh, ow = refs[0].shape
+
+    out = [np.full((oh, ow), -1, dtype=np.int64) for f in frames]
+    n_out = 0
+    errors = 0
+
+    def process():
+        nonlocal n_out, errors
+        yield dut.crop_x.eq(crop[0])
+        yield dut.crop_y.eq(crop[1])
+        yield dut.crop_w.eq(crop[2])
+        yield dut.crop_h.eq(crop[3])
+        yield dut.h_div.eq(h_div)
+        yield dut.v_div.eq(v_div)
+
+        pixels = [(int(p), i == 0, i % w == w - 1) for f in frames for i, p in enumerate(f.ravel())]
+        n_in = 0
+        while n_out < len(frames) * oh * ow:
+            if n_in < len(pixels) and rng.random() >= stall:
+                p, first, last = pixels[n_in]
+                r, g, b = p >> 11, (p >> 5) & 0x3f, p & 0x1f
+                yield dut.sink.r.eq(int(r))
+                yield dut.sink.g.eq(int(g))
+                yield dut.sink.b.eq(int(b))
+                yield dut.sink.first.eq(first)
+                yield dut.sink.last.eq(last)
+                yield dut.sink.valid.eq(1)
+            else:
+                yield dut.sink.valid.eq(0)
+            yield dut.source.ready.eq(int(rng.random() >= stall))
+            yield Settle()
+            if (yield dut.sink.valid) and (yield dut.sink.ready):
+                n_in += 1
+            if (yield dut.source.valid) and (yield dut.source.ready):
+                i = n_out % (oh * ow)
+                x = yield dut.source.x
+                y = yield dut.source.y
+                if (x, y) != (i % ow, i // ow):
+                    print("    pixel", i, "at", (x, y))
+                    errors += 1
+                if ((yield dut.source.first) != (i == 0) or
+                    (yield dut.source.last) != (i % ow == ow - 1)):
+                    errors += 1
+                r = yield dut.source.r
+                g = yield dut.source.g
+                b = yield dut.source.b
+                out[n_out // (oh * ow)][i // ow, i % ow] = (r << 11) | (g << 5) | b
+                n_out += 1
+            yield
+
+    sim = Simulator(dut)
+    sim.add_clock(1e-6)
+    sim.add_sync_process(process)
+    sim.run()
+
+    hw = np.stack(out)
+    ref = np.stack(refs)
+    bad = np.argwhere(hw != ref)
+    for i in bad[:4]:
+        print("    at", tuple(i), "hardware", hex(hw[tuple(i)]), "model", hex(ref[tuple(i)]))
+    return errors + len(bad), (oh, ow)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=40)
+    parser.add_argument("--height", type=int, default=30)
+    parser.add_argument("--frames", type=int, default=2)
+    parser.add_argument("--stall", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    w, h = args.width, args.height
+    rng = np.random.default_rng(args.seed)
+    frames = [rng.integers(0, 1 << 16, (h, w)) for i in range(args.frames)]
+
+    errors = 0
+    for crop, h_div, v_div in [
+            ((0, 0, w, h), 16, 16),
+            ((0, 0, w, h), 32, 16),
+            ((0, 0, w, h), 32, 32),
+            ((0, 0, w, h), 64, 64),
+            ((5, 3, 27, 19), 24, 40),
+            ((1, 2, w - 3, h - 2), 37, 255),
+            ((w - 8, h - 6, 8, 6), 16, 16)]:
+        for stall in [0.0, args.stall]:
+            e, size = test_crop_scale(frames, crop, h_div, v_div, stall, args.seed)
+            print("crop {:<18} h_div {:3} v_div {:3} stall {:.1f} -> {:>9} {:>5} errors".format(
+                  str(crop), h_div, v_div, stall, "{}x{}".format(size[1], size[0]), e))
+            errors += e
+
+    print("{} errors".format(errors))
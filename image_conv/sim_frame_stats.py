@@ -0,0 +1,119 @@
+import argparse
+
+import numpy as np
+
+from nmigen import *
+from nmigen.sim import *
+
+from frame_stats import FrameStats
+import conv_model
+
+# Check FrameStats against numpy. Each frame is streamed with random gaps
+# between pixels, and the histogram of the previous frame is read back
+# while the next one is being accumulated. In odd frames the last pixel
+# comes with i_frame_done.
+
+# Model of the FrameStats results for a frame
+def frame_stats(frame, bins):
+    res = {}
+    bb = int(np.log2(bins))
+    for name, c, dw in zip("rgb", conv_model.rgb565_split(frame), [5, 6, 5]):
+        b = c >> (dw - bb) if dw >= bb else c << (bb - dw)
+        res["hist_" + name] = np.bincount(b.ravel(), minlength=bins)
+        res["min_" + name] = c.min()
+        res["max_" + name] = c.max()
+        res["mean_" + name] = c.sum() // c.size
+    res["count"] = frame.size
+    return res
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=40)
+    parser.add_argument("--height", type=int, default=30)
+    parser.add_argument("--frames", type=int, default=4)
+    parser.add_argument("--bins", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    w, h = args.width, args.height
+
+    # Random frames, with runs of the same value to exercise the
+    # read-modify-write forwarding, and dark frames after them, with most
+    # bins empty, which must not see the counts of earlier frames in the
+    # same bank
+    frames = []
+    for i in range(args.frames):
+        f = rng.integers(0, 1 << 16, (h, w))
+        f[::2] = f[::2, :1]
+        frames.append(f)
+    for i in range(4):
+        frames.append(rng.integers(0, 0x0841, (h, w)))
+
+    dut = FrameStats(bins=args.bins, max_pixels=w * h)
+    errors = 0
+
+    def read_stats():
+        res = {}
+        for name in "rgb":
+            for s in ["min", "max", "mean"]:
+                res[s + "_" + name] = yield getattr(dut, "o_" + s + "_" + name)
+        res["count"] = yield dut.o_count
+        for n, name in enumerate("rgb"):
+            hist = []
+            for i in range(args.bins):
+                yield dut.hist_chan.eq(n)
+                yield dut.hist_bin.eq(i)
+                yield
+                yield Settle()
+                hist.append((yield dut.hist_count))
+            res["hist_" + name] = np.array(hist)
+        return res
+
+    def check(f, res):
+        global errors
+        ref = frame_stats(frames[f], args.bins)
+        for k in ref:
+            if not np.array_equal(ref[k], res[k]):
+                print("frame", f, k, "hardware", res[k], "model", ref[k])
+                errors += 1
+
+    def process():
+        for f, frame in enumerate(frames):
+            done = False
+            pixels = frame.ravel()
+            for i, p in enumerate(pixels):
+                r, g, b = conv_model.rgb565_split(p)
+                yield dut.i_r.eq(int(r))
+                yield dut.i_g.eq(int(g))
+                yield dut.i_b.eq(int(b))
+                yield dut.i_valid.eq(1)
+                if f % 2 and i == len(pixels) - 1:
+                    break
+                yield
+                yield dut.i_valid.eq(0)
+                for i in range(rng.integers(0, 3)):
+                    yield
+                # Read the previous frame while accumulating this one
+                if f > 0 and not done:
+                    yield dut.i_valid.eq(0)
+                    check(f - 1, (yield from read_stats()))
+                    done = True
+            yield dut.i_frame_done.eq(1)
+            yield
+            yield dut.i_valid.eq(0)
+            yield dut.i_frame_done.eq(0)
+            for i in range(10):
+                yield
+                if (yield dut.o_done):
+                    break
+            else:
+                print("frame", f, "o_done not set")
+        check(len(frames) - 1, (yield from read_stats()))
+
+    sim = Simulator(dut)
+    sim.add_clock(1e-6)
+    sim.add_sync_process(process)
+    sim.run()
+
+    print("{} frames, {} errors".format(len(frames), errors))
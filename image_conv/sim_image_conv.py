@@ -0,0 +1,180 @@
+import argparse
+import time
+
+import numpy as np
+
+from nmigen import *
+from nmigen.sim import *
+
+from conv3 import Conv3
+from image_conv import ImageConv
+import conv_model
+
+# Randomized regression harness for Conv3 and ImageConv.
+# Streams random and real images through the hardware in simulation and
+# compares every output pixel with the numpy models in conv_model.py.
+# Everything is run twice, the second time with random stalls on the input
+# and output streams, which must not lose or repeat any pixels.
+
+# Feed frames of pixels into a module's sink stream, and collect the output
+# pixels from its source stream. set_in sets the payload for a pixel, and
+# get_out returns the output pixel. With stall set, the input has random
+# gaps and the output is randomly not ready, with that probability.
+# Returns the frames produced, the cycle count and the number of errors
+# in the first and last flags.
+def stream(dut, frames, set_in, get_out, stall=0.0, seed=1):
+    h, w = frames[0].shape[:2]
+    out = [np.zeros(f.shape, dtype=np.int64) for f in frames]
+    rng = np.random.default_rng(seed)
+    n_in = n_out = 0
+    cycles = [0]
+    flag_errors = [0]
+
+    def process():
+        nonlocal n_in, n_out
+        pixels = [p for f in frames for p in f.reshape(h * w, -1)]
+        while n_out < len(pixels):
+            if (n_in < len(pixels)) and rng.random() >= stall:
+                yield from set_in(pixels[n_in])
+                yield dut.sink.valid.eq(1)
+            else:
+                yield dut.sink.valid.eq(0)
+            yield dut.source.ready.eq(int(rng.random() >= stall))
+            yield Settle()
+            if (yield dut.sink.valid) and (yield dut.sink.ready):
+                n_in += 1
+            if (yield dut.source.valid) and (yield dut.source.ready):
+                x = yield dut.source.x
+                y = yield dut.source.y
+                i = n_out % (w * h)
+                if ((yield dut.source.first) != (i == 0) or
+                    (yield dut.source.last) != (i % w == w - 1)):
+                    flag_errors[0] += 1
+                out[n_out // (w * h)][y, x] = yield from get_out()
+                n_out += 1
+            yield
+            cycles[0] += 1
+
+    sim = Simulator(dut)
+    sim.add_clock(1e-6)
+    sim.add_sync_process(process)
+    sim.run()
+
+    return out, cycles[0], flag_errors[0]
+
+def report(name, hw, ref, cycles, flag_errors):
+    bad = np.argwhere(hw != ref)
+    print("{:<30} {:>6} mismatches {:>4} flag errors {:>8} cycles {:6.3f} pixels/clock".format(
+          name, len(bad), flag_errors, cycles, hw.size / cycles))
+    for i in bad[:4]:
+        print("    at", tuple(i), "hardware", hw[tuple(i)], "model", ref[tuple(i)])
+    return len(bad) + flag_errors
+
+def test_conv3(frames, k, sh, dw, same, stall=0.0):
+    dut = Conv3(Array(k), w=frames[0].shape[1], h=frames[0].shape[0], dw=dw, sh=sh, same=same)
+
+    def set_in(p):
+        yield dut.sink.data.eq(int(p[0]))
+
+    def get_out():
+        return (yield dut.source.data)
+
+    out, cycles, flag_errors = stream(dut, frames, set_in, get_out, stall)
+    hw = np.stack(out)
+    ref = np.stack([conv_model.conv3(f, k, sh, dw, same) for f in frames])
+    return hw, ref, cycles, flag_errors
+
+def test_image_conv(frames, sel, mono=0, invert=0, avg=(0, 0, 0), sobel_l2=False, stall=0.0):
+    dut = ImageConv(res_x=frames[0].shape[1], res_y=frames[0].shape[0], sobel_l2=sobel_l2)
+
+    def set_in(p):
+        r, g, b = conv_model.rgb565_split(p[0])
+        yield dut.sink.r.eq(int(r))
+        yield dut.sink.g.eq(int(g))
+        yield dut.sink.b.eq(int(b))
+        yield dut.sel.eq(sel)
+        yield dut.mono.eq(mono)
+        yield dut.invert.eq(invert)
+        yield dut.avg_r.eq(avg[0])
+        yield dut.avg_g.eq(avg[1])
+        yield dut.avg_b.eq(avg[2])
+
+    def get_out():
+        r = yield dut.source.r
+        g = yield dut.source.g
+        b = yield dut.source.b
+        # The direction is not delayed through the median pipeline
+        dir = 0 if sel == ImageConv.MEDIAN else (yield dut.source.dir)
+        return (dir << 16) | (r << 11) | (g << 5) | b
+
+    out, cycles, flag_errors = stream(dut, frames, set_in, get_out, stall)
+    hw = np.stack(out)
+
+    refs = []
+    for f in frames:
+        i_r, i_g, i_b = conv_model.rgb565_split(f)
+        k, sh, same = ImageConv.KERNELS[sel if sel in ImageConv.KERNELS else 0][1:]
+        r = conv_model.conv3(i_r, k, sh, 5, same)
+        g = conv_model.conv3(i_g, k, sh, 6, same)
+        b = conv_model.conv3(i_b, k, sh, 5, same)
+        if sel == ImageConv.AVG:
+            r, g, b = [np.full(f.shape, a, dtype=np.int64) for a in avg]
+        if sel == ImageConv.SOBEL:
+            r = conv_model.sobel(i_r, dw=5, l2=sobel_l2)[0]
+            g = conv_model.sobel(i_g, dw=6, l2=sobel_l2)[0]
+            b = conv_model.sobel(i_b, dw=5, l2=sobel_l2)[0]
+        if sel == ImageConv.MEDIAN:
+            r, g, b = [conv_model.median3(c) for c in (i_r, i_g, i_b)]
+        if mono:
+            r, g, b = conv_model.mono(r, g, b, invert)
+        dir = 0 if sel == ImageConv.MEDIAN else conv_model.sobel(i_g, dw=6, l2=sobel_l2)[1]
+        refs.append((dir << 16) | (r << 11) | (g << 5) | b)
+    return hw, np.stack(refs), cycles, flag_errors
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=16)
+    parser.add_argument("--height", type=int, default=12)
+    parser.add_argument("--frames", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--stall", type=float, default=0.3,
+                        help="probability of a gap in the input or a stall of the output")
+    parser.add_argument("--image", help="raw RGB565 snapshot (320x480) to use as an extra test image")
+    args = parser.parse_args()
+
+    w, h = args.width, args.height
+    rng = np.random.default_rng(args.seed)
+
+    # Random frames, plus a frame with saturated values to exercise overflow
+    frames = [rng.integers(0, 1 << 16, (h, w)) for i in range(args.frames)]
+    frames.append(rng.choice([0x0000, 0xffff], (h, w)))
+    if args.image:
+        frames.append(conv_model.load_rgb565(args.image)[:h, :w])
+
+    errors = 0
+    start = time.time()
+
+    for stall in [0.0, args.stall]:
+        suffix = " stall" if stall else ""
+
+        for sel, (name, k, sh, same) in ImageConv.KERNELS.items():
+            for dw in [5, 6]:
+                chans = [f & ((1 << dw) - 1) for f in frames]
+                res = test_conv3(chans, k, sh, dw, same, stall=stall)
+                errors += report("Conv3 {} dw={}{}".format(name, dw, suffix), *res)
+
+        for sel, (name, k, sh, same) in ImageConv.KERNELS.items():
+            res = test_image_conv(frames, sel, stall=stall)
+            errors += report("ImageConv {}{}".format(name, suffix), *res)
+
+        for name, kwargs in [
+                ("avg",           dict(sel=ImageConv.AVG, avg=(17, 42, 9))),
+                ("edge mono inv", dict(sel=4, mono=1, invert=1)),
+                ("sobel",         dict(sel=ImageConv.SOBEL)),
+                ("sobel l2",      dict(sel=ImageConv.SOBEL, sobel_l2=True)),
+                ("median",        dict(sel=ImageConv.MEDIAN)),
+                ("median mono",   dict(sel=ImageConv.MEDIAN, mono=1))]:
+            res = test_image_conv(frames, stall=stall, **kwargs)
+            errors += report("ImageConv {}{}".format(name, suffix), *res)
+
+    print("{} mismatches, {:.1f}s".format(errors, time.time() - start))
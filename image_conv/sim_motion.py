@@ -0,0 +1,160 @@
+import argparse
+
+import numpy as np
+
+from nmigen import *
+from nmigen.sim import *
+
+from motion import MotionDetect, MotionReport
+import conv_model
+
+# Check MotionDetect against the numpy model, on a sequence of frames with
+# moving blocks, noise below the threshold and a still frame, with random
+# gaps in the input. The tile counts are read back between frames, and the
+# lines sent by MotionReport, through a uart that is randomly not ready,
+# must match the results.
+
+class Top(Elaboratable):
+    def __init__(self, w, h, step, tiles_x, tiles_y):
+        self.motion = MotionDetect(w=w, h=h, step=step, tiles_x=tiles_x, tiles_y=tiles_y)
+        self.report = MotionReport(cw=self.motion.cw, n_tiles=self.motion.n_tiles)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        m.submodules.motion = motion = self.motion
+        m.submodules.report = report = self.report
+
+        m.d.comb += [
+            report.i_start.eq(motion.o_done & motion.o_motion),
+            report.i_count.eq(motion.o_count),
+            report.i_min_x.eq(motion.o_min_x),
+            report.i_max_x.eq(motion.o_max_x),
+            report.i_min_y.eq(motion.o_min_y),
+            report.i_max_y.eq(motion.o_max_y),
+            report.i_tiles.eq(motion.o_tiles)
+        ]
+
+        return m
+
+def make_frames(w, h, n, rng):
+    frames = []
+    f = rng.integers(0, 1 << 16, (h, w))
+    for i in range(n):
+        f = f.copy()
+        if i % 3 == 1:
+            # Move a block
+            bw, bh = rng.integers(4, w // 2), rng.integers(4, h // 2)
+            x, y = rng.integers(0, w - bw), rng.integers(0, h - bh)
+            f[y:y + bh, x:x + bw] = rng.integers(0, 1 << 16, (bh, bw))
+        elif i % 3 == 2:
+            # Small noise in the low bits of green
+            f = f ^ (rng.integers(0, 2, (h, w)) << 5)
+        frames.append(f)
+    return frames
+
+def run(w, h, step, tiles_x, tiles_y, frames, threshold, gap, seed):
+    dut = Top(w, h, step, tiles_x, tiles_y)
+    md = dut.motion
+    rng = np.random.default_rng(seed)
+
+    results = []
+    uart = []
+    done = [False]
+
+    def process():
+        yield md.threshold.eq(threshold)
+        yield md.min_count.eq(1)
+        yield md.tile_threshold.eq(2)
+        for f in frames:
+            for i, p in enumerate(f.ravel()):
+                while rng.random() < gap:
+                    yield md.i_valid.eq(0)
+                    yield
+                p = int(p)
+                yield md.i_r.eq(p >> 11)
+                yield md.i_g.eq((p >> 5) & 0x3f)
+                yield md.i_b.eq(p & 0x1f)
+                yield md.i_first.eq(i == 0)
+                yield md.i_last.eq(i % w == w - 1)
+                yield md.i_valid.eq(1)
+                yield
+            yield md.i_valid.eq(0)
+            while not (yield md.o_done):
+                yield
+            r = {}
+            for k in ["motion", "count", "min_x", "max_x", "min_y", "max_y", "tiles"]:
+                r[k] = yield getattr(md, "o_" + k)
+            counts = []
+            for t in range(md.n_tiles):
+                yield md.tile_addr.eq(t)
+                yield
+                yield
+                counts.append((yield md.tile_count))
+            r["tile_counts"] = np.array(counts).reshape(tiles_y, tiles_x)
+            results.append(r)
+        for i in range(2000):
+            yield
+        done[0] = True
+
+    # Uart transmitter, randomly not ready
+    def tx():
+        while not done[0]:
+            rdy = rng.random() < 0.2
+            yield dut.report.tx_rdy.eq(int(rdy))
+            yield Settle()
+            if rdy and (yield dut.report.tx_ack):
+                uart.append((yield dut.report.tx_data))
+            yield
+
+    sim = Simulator(dut)
+    sim.add_clock(1e-6)
+    sim.add_sync_process(process)
+    sim.add_sync_process(tx)
+    sim.run()
+
+    errors = 0
+    lines = []
+    prev = None
+    for n, (f, r) in enumerate(zip(frames, results)):
+        count, box, tiles = conv_model.motion(prev, f, threshold, step, tiles_x, tiles_y)
+        box = box and tuple(int(i) for i in box)
+        prev = f
+        bits = sum(1 << i for i, c in enumerate(tiles.ravel()) if c >= 2)
+        hw_box = (r["min_x"], r["max_x"], r["min_y"], r["max_y"])
+        ok = (r["count"] == count and r["motion"] == (count >= 1) and
+              (hw_box == box if box else r["min_x"] > r["max_x"]) and
+              r["tiles"] == bits and (r["tile_counts"] == tiles).all())
+        if not ok:
+            print("    frame", n, "hardware", r["count"], hw_box, hex(r["tiles"]),
+                  "model", count, box, hex(bits))
+            errors += 1
+        if r["motion"]:
+            lines.append("M {:0{}X} {:03X} {:03X} {:03X} {:03X} {:0{}X}\r\n".format(
+                r["count"], (md.cw + 3) // 4, *hw_box, r["tiles"], (md.n_tiles + 3) // 4))
+        print("frame {} count {:5} box {:<18} tiles {}".format(n, count, str(box), format(bits, "0{}b".format(md.n_tiles))))
+
+    if bytes(uart).decode() != "".join(lines):
+        print("    uart sent", bytes(uart), "expected", "".join(lines).encode())
+        errors += 1
+    return errors
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=64)
+    parser.add_argument("--height", type=int, default=48)
+    parser.add_argument("--frames", type=int, default=7)
+    parser.add_argument("--threshold", type=int, default=6)
+    parser.add_argument("--gap", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    frames = make_frames(args.width, args.height, args.frames, rng)
+
+    errors = 0
+    for step in [2, 4]:
+        print("step", step)
+        errors += run(args.width, args.height, step, 4, 4, frames, args.threshold, args.gap, args.seed)
+
+    print("{} errors".format(errors))
@@ -0,0 +1,135 @@
+import argparse
+import math
+
+import numpy as np
+
+from nmigen import *
+from nmigen.sim import *
+
+from pixel_fifo import PixelFIFO
+
+# Multi-clock simulation of PixelFIFO. Lines of pixels are written in the
+# pclock domain, whose period drifts either side of the sync clock period,
+# and read in the sync domain with a randomly stalling reader. The pixels
+# read must be the ones the fifo accepted, in order, and the overflow and
+# underflow counters must match the pixels dropped and the cycles starved.
+
+class Top(Elaboratable):
+    def __init__(self, depth):
+        self.fifo   = PixelFIFO(depth=depth)
+        self.pclock = ClockDomain("pclock")
+
+    def elaborate(self, platform):
+        m = Module()
+
+        m.domains.pclock = self.pclock
+        m.submodules.fifo = self.fifo
+
+        return m
+
+def run(name, depth, lines, w, ready_prob, period, drift, seed):
+    dut = Top(depth)
+    fifo = dut.fifo
+    rng = np.random.default_rng(seed)
+
+    accepted = []
+    received = []
+    dropped = [0]
+    underflow = [0]
+    counters = {}
+    done = [False]
+
+    # Pixel clock, with the period drifting sinusoidally
+    def pclock():
+        n = 0
+        while not done[0]:
+            p = period * (1 + drift * math.sin(2 * math.pi * n / 400))
+            yield dut.pclock.clk.eq(1)
+            yield Delay(p / 2)
+            yield dut.pclock.clk.eq(0)
+            yield Delay(p / 2)
+            n += 1
+
+    # Camera: lines of pixels with blanking between them, which cannot wait
+    def writer():
+        for y in range(lines):
+            for x in range(w):
+                p = int(rng.integers(0, 1 << 16))
+                yield fifo.sink.data.eq(p)
+                yield fifo.sink.first.eq((x == 0) & (y == 0))
+                yield fifo.sink.last.eq(x == w - 1)
+                yield fifo.sink.valid.eq(1)
+                yield Settle()
+                if (yield fifo.sink.ready):
+                    accepted.append((p, x == 0 and y == 0, x == w - 1))
+                else:
+                    dropped[0] += 1
+                yield
+            yield fifo.sink.valid.eq(0)
+            for i in range(int(rng.integers(4, 20))):
+                yield
+
+    # Reader in the sync domain, randomly not ready
+    def reader():
+        in_line = False
+        idle = 0
+        while idle < 200:
+            ready = rng.random() < ready_prob
+            yield fifo.source.ready.eq(int(ready))
+            yield Settle()
+            if (yield fifo.source.valid):
+                if ready:
+                    last = yield fifo.source.last
+                    received.append(((yield fifo.source.data), bool((yield fifo.source.first)), bool(last)))
+                    in_line = not last
+                idle = 0
+            else:
+                if ready and in_line:
+                    underflow[0] += 1
+                idle += 1
+            yield
+        # The counters have settled by now
+        counters["overflow"] = yield fifo.o_overflow
+        counters["underflow"] = yield fifo.o_underflow
+        done[0] = True
+
+    sim = Simulator(dut)
+    sim.add_clock(1e-6, domain="sync")
+    sim.add_process(pclock)
+    sim.add_sync_process(writer, domain="pclock")
+    sim.add_sync_process(reader, domain="sync")
+    sim.run()
+
+    errors = 0
+    if received != accepted:
+        print("    pixels read do not match the pixels written")
+        errors += 1
+    if counters["overflow"] != dropped[0]:
+        print("    overflow {} expected {}".format(counters["overflow"], dropped[0]))
+        errors += 1
+    if counters["underflow"] != underflow[0]:
+        print("    underflow {} expected {}".format(counters["underflow"], underflow[0]))
+        errors += 1
+
+    print("{:<24} {:>6} pixels {:>6} dropped {:>6} starved cycles {:>2} errors".format(
+          name, len(received), dropped[0], underflow[0], errors))
+    return errors
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=64)
+    parser.add_argument("--lines", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    errors = 0
+    w, lines = args.width, args.lines
+
+    # Camera slower than the system clock, as on the board
+    errors += run("slow pclock", 64, lines, w, 0.9, 2.1e-6, 0.5, args.seed)
+    # Camera clock drifting either side of the system clock
+    errors += run("drifting pclock", 64, lines, w, 0.9, 1.05e-6, 0.6, args.seed)
+    # Reader too slow, so the fifo overflows
+    errors += run("overflow", 16, lines, w, 0.3, 0.9e-6, 0.3, args.seed)
+
+    print("{} errors".format(errors))
@@ -0,0 +1,140 @@
+import argparse
+
+import numpy as np
+
+from nmigen import *
+from nmigen.sim import *
+
+from snapshot import Snapshot
+import snap_decode
+
+# Send frames from a frame buffer through Snapshot, with a uart that is
+# randomly not ready, and check that the bytes sent are those of the model
+# in snap_decode.py, and that they decode to the frame. Lines of random
+# pixels, flat areas longer than a run, repeated lines and areas that
+# repeat the line above with a shift are used, compressed and not. The
+# compression ratio and the time the upload would take are reported.
+
+class Top(Elaboratable):
+    def __init__(self, img):
+        h, w = img.shape
+        self.buffer = Memory(width=16, depth=w * h, init=[int(p) for p in img.ravel()])
+        self.snapshot = Snapshot(w=w, h=h)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        m.submodules.snapshot = snapshot = self.snapshot
+        m.submodules.r = r = self.buffer.read_port()
+
+        m.d.comb += [
+            r.addr.eq(snapshot.rd_addr),
+            snapshot.rd_data.eq(r.data)
+        ]
+
+        return m
+
+def make_frame(w, h, kind, rng):
+    if kind == "random":
+        return rng.integers(0, 1 << 16, (h, w))
+    if kind == "flat":
+        # Blocks of a few colours, with runs longer than 64
+        img = np.zeros((h, w), dtype=int)
+        for i in range(6):
+            x, y = rng.integers(0, w), rng.integers(0, h)
+            img[y:y + rng.integers(1, h), x:x + rng.integers(1, w)] = rng.integers(0, 4)
+        return img
+    if kind == "lines":
+        # Each line is either new, the line above, or partly the line above
+        img = rng.integers(0, 4, (h, w))
+        for y in range(1, h):
+            c = rng.integers(0, 3)
+            if c == 1:
+                img[y] = img[y - 1]
+            elif c == 2:
+                x0, x1 = sorted(rng.integers(0, w, 2))
+                img[y, x0:x1] = img[y - 1, x0:x1]
+        return img
+    # A gradient, with noise, like a camera image
+    yy, xx = np.mgrid[0:h, 0:w]
+    g = (xx * 64 // w + rng.integers(0, 2, (h, w))) & 0x3f
+    return (yy * 32 // h) << 11 | g << 5 | (rng.integers(0, 3, (h, w)) == 0)
+
+def run(img, compress, rdy, seed):
+    dut = Top(img)
+    sn = dut.snapshot
+    rng = np.random.default_rng(seed)
+
+    uart = []
+    cycles = [0]
+    done = [False]
+
+    def process():
+        yield sn.compress.eq(compress)
+        yield sn.start.eq(1)
+        yield
+        yield sn.start.eq(0)
+        yield
+        while (yield sn.busy):
+            cycles[0] += 1
+            yield
+        done[0] = True
+
+    # Uart transmitter, randomly not ready
+    def tx():
+        while not done[0]:
+            r = rng.random() < rdy
+            yield sn.tx_rdy.eq(int(r))
+            yield Settle()
+            if r and (yield sn.tx_ack):
+                uart.append((yield sn.tx_data))
+            yield
+
+    sim = Simulator(dut)
+    sim.add_clock(1e-6)
+    sim.add_sync_process(process)
+    sim.add_sync_process(tx)
+    sim.run()
+
+    errors = 0
+    sent = bytes(uart)
+    expected = snap_decode.encode(img, compress)
+    if sent != expected:
+        n = next((i for i, (a, b) in enumerate(zip(sent, expected)) if a != b), min(len(sent), len(expected)))
+        print("    byte", n, "sent", sent[n:n + 8].hex(), "expected", expected[n:n + 8].hex(),
+              "lengths", len(sent), len(expected))
+        errors += 1
+    try:
+        out, flags, size = snap_decode.decode_bytes(sent)
+        if size != len(sent) or flags != compress or not (out == img).all():
+            print("    decoded frame differs")
+            errors += 1
+    except (ValueError, IndexError) as e:
+        print("    decode failed:", e)
+        errors += 1
+    return errors, len(sent), cycles[0]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=160)
+    parser.add_argument("--height", type=int, default=12)
+    parser.add_argument("--rdy", type=float, default=0.3)
+    parser.add_argument("--baud", type=int, default=1000000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    errors = 0
+    for kind in ["random", "flat", "lines", "gradient"]:
+        img = make_frame(args.width, args.height, kind, rng)
+        for compress in [0, 1]:
+            e, size, cycles = run(img, compress, args.rdy, args.seed)
+            errors += e
+            ratio = 2 * img.size / size
+            # Scaled up to a 320x480 frame, 10 bits a byte
+            scale = 320 * 480 / img.size
+            print("{:8} compress {} {:6} bytes ratio {:5.2f} {:6} cycles, 320x480 {:5.2f} s at {} baud, {:5.2f} s raw at 115200 {:>2} errors".format(
+                kind, compress, size, ratio, cycles, size * scale * 10 / args.baud, args.baud,
+                2 * 320 * 480 * 10 / 115200, e))
+
+    print("{} errors".format(errors))
@@ -0,0 +1,186 @@
+import argparse
+
+import numpy as np
+
+from nmigen import *
+from nmigen.sim import *
+
+from tone_lut import ToneLUT, LUTLoader, LUTFill
+import tone
+
+# ToneLUT, LUTLoader and LUTFill connected as in camtest.py, with frames of
+# random pixels going through the tables, and uart bytes given straight to
+# the loader. The tables are first the identity, then those LUTFill makes
+# for the gains at reset, then those loaded by tone.py's message, sent
+# slowly enough to span several frames, and then those for new gains, and
+# for gains that change during a load. Each frame must be looked up in one
+# set of tables from its first pixel to its last, and the sets must come
+# in that order. A load that stops half way must time out and change
+# nothing.
+
+class Top(Elaboratable):
+    def __init__(self, timeout):
+        self.tone   = ToneLUT()
+        self.loader = LUTLoader(timeout=timeout)
+        self.fill   = LUTFill()
+
+    def elaborate(self, platform):
+        m = Module()
+
+        m.submodules.tone = tone = self.tone
+        m.submodules.loader = loader = self.loader
+        m.submodules.fill = fill = self.fill
+
+        m.d.comb += [
+            fill.hold.eq(loader.busy),
+            tone.w_addr.eq(Mux(loader.busy, loader.w_addr, fill.w_addr)),
+            tone.w_data.eq(Mux(loader.busy, loader.w_data, fill.w_data)),
+            tone.w_en.eq(loader.w_en | fill.w_en),
+            tone.swap.eq(loader.swap | fill.swap)
+        ]
+
+        return m
+
+def run(n_pixels, byte_gap, seed):
+    dut = Top(timeout=20 * byte_gap)
+    lut = dut.tone
+    rng = np.random.default_rng(seed)
+
+    gains0 = (18, 12, 16)
+    gains1 = (24, 8, 40)
+    gains2 = (16, 20, 10)
+    loaded = tone.tables(gamma=0.6, contrast=1.2, brightness=-0.05, gains=(1.0, 0.9, 1.1))
+    loaded2 = tone.tables(gamma=2.0)
+    sets = [(list(range(32)), list(range(64)), list(range(32))),
+            tone.fill_tables(*gains0),
+            loaded,
+            tone.fill_tables(*gains1),
+            loaded2,
+            tone.fill_tables(*gains2)]
+
+    # The pixels and outputs of each frame
+    frames = []
+    marks = {}
+    stuck = [False]
+
+    def pixels():
+        yield Passive()
+        while True:
+            frame = []
+            frames.append(frame)
+            for i in range(n_pixels):
+                r, g, b = int(rng.integers(0, 32)), int(rng.integers(0, 64)), int(rng.integers(0, 32))
+                yield lut.i_r.eq(r)
+                yield lut.i_g.eq(g)
+                yield lut.i_b.eq(b)
+                yield lut.i_start.eq(i == 0)
+                yield Settle()
+                frame.append(((r, g, b), ((yield lut.o_r), (yield lut.o_g), (yield lut.o_b))))
+                yield
+                yield lut.i_start.eq(0)
+                for j in range(rng.integers(0, 2)):
+                    yield
+
+    def send(data):
+        for d in data:
+            yield dut.loader.rx_data.eq(d)
+            yield dut.loader.rx_rdy.eq(1)
+            yield
+            yield dut.loader.rx_rdy.eq(0)
+            for i in range(byte_gap):
+                yield
+
+    # Wait for the tables being written to be swapped in, and for the
+    # frame after that to be complete
+    def settle():
+        for i in range(4):
+            yield
+        while (yield dut.fill.busy) | (yield dut.loader.busy) | (yield lut.pending):
+            yield
+        f = len(frames)
+        while len(frames) < f + 2:
+            yield
+
+    def process():
+        yield dut.fill.gain_r.eq(gains0[0])
+        yield dut.fill.gain_g.eq(gains0[1])
+        yield dut.fill.gain_b.eq(gains0[2])
+        yield from settle()
+        marks["fill"] = len(frames)
+
+        # A load that stops, and must be abandoned
+        yield from send(tone.message(*loaded)[:50])
+        for i in range(30 * byte_gap):
+            yield
+        stuck[0] = (yield dut.loader.busy)
+        yield from settle()
+        marks["partial"] = len(frames)
+
+        yield from send(b"xy" + tone.message(*loaded))
+        yield from settle()
+        marks["loaded"] = len(frames)
+
+        yield dut.fill.gain_r.eq(gains1[0])
+        yield dut.fill.gain_g.eq(gains1[1])
+        yield dut.fill.gain_b.eq(gains1[2])
+        yield from settle()
+        marks["gains"] = len(frames)
+
+        # Gains that change during a load replace the loaded tables
+        msg = tone.message(*loaded2)
+        yield from send(msg[:64])
+        yield dut.fill.gain_r.eq(gains2[0])
+        yield dut.fill.gain_g.eq(gains2[1])
+        yield dut.fill.gain_b.eq(gains2[2])
+        yield from send(msg[64:])
+        yield from settle()
+        marks["both"] = len(frames)
+
+    sim = Simulator(dut)
+    sim.add_clock(1e-6)
+    sim.add_sync_process(process)
+    sim.add_sync_process(pixels)
+    sim.run()
+
+    errors = 0
+
+    if stuck[0]:
+        print("    truncated load not abandoned")
+        errors += 1
+
+    # The set of tables each complete frame was looked up in
+    used = []
+    for f, frame in enumerate(frames[:-1]):
+        k = [s for s, t in enumerate(sets)
+             if all(o == (t[0][i[0]], t[1][i[1]], t[2][i[2]]) for i, o in frame)]
+        if not k:
+            print("    frame {} uses no one set of tables".format(f))
+            errors += 1
+        used.append(k[0] if k else None)
+
+    # The order of the sets, and the set in use after each step
+    seen = [s for s in used if s is not None]
+    if seen != sorted(seen):
+        print("    sets of tables out of order:", used)
+        errors += 1
+    for name, s in [("fill", 1), ("partial", 1), ("loaded", 2), ("gains", 3), ("both", 5)]:
+        if used[marks[name] - 2] != s:
+            print("    after {}, frame uses set {}, expected {}".format(name, used[marks[name] - 2], s))
+            errors += 1
+    if 2 not in seen:
+        print("    loaded tables never used")
+        errors += 1
+
+    print("{} frames of {} pixels, sets of tables {} {:>2} errors".format(len(used), n_pixels, used, errors))
+    return errors
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pixels", type=int, default=48)
+    parser.add_argument("--gap", type=int, default=10, help="cycles between uart bytes")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    errors = run(args.pixels, args.gap, args.seed)
+
+    print("{} errors".format(errors))
@@ -0,0 +1,154 @@
+import argparse
+
+import numpy as np
+
+from nmigen import *
+from nmigen.sim import *
+
+from camread import CamRead
+from yuv2rgb import YUV2RGB
+import conv_model
+
+# Check the YUV422 path: CamRead in YUV mode, fed with the bytes of random
+# YUV frames, must give every pixel with the chroma of its pair, and the
+# right first and last flags. YUV2RGB is then checked against the numpy
+# model, in colour and mono, with random gaps in the input and stalls on
+# the output.
+
+def test_camread(frames, blank):
+    dut = CamRead(res_x=frames[0][0].shape[1], yuv=True)
+    h, w = frames[0][0].shape
+
+    expected = []
+    for ys, us, vs in frames:
+        for r in range(h):
+            for c in range(w):
+                expected.append((int(ys[r, c]), int(us[r, c // 2]), int(vs[r, c // 2]),
+                                 r == 0 and c == 0, c == w - 1))
+    received = []
+
+    # Camera, which also drives the pixel clock
+    def process():
+        def clock(vsync, href, data):
+            yield dut.vsync.eq(vsync)
+            yield dut.href.eq(href)
+            yield dut.p_data.eq(data)
+            yield Delay(0.5e-6)
+            yield dut.p_clock.eq(1)
+            yield Delay(0.5e-6)
+            if (yield dut.source.valid):
+                received.append(((yield dut.source.y), (yield dut.source.u), (yield dut.source.v),
+                                 bool((yield dut.source.first)), bool((yield dut.source.last))))
+            yield dut.p_clock.eq(0)
+
+        for ys, us, vs in frames:
+            for i in range(4):
+                yield from clock(1, 0, 0)
+            for i in range(blank):
+                yield from clock(0, 0, 0)
+            for r in range(h):
+                for c in range(w):
+                    yield from clock(0, 1, int(ys[r, c]))
+                    yield from clock(0, 1, int(us[r, c // 2] if c % 2 == 0 else vs[r, c // 2]))
+                for i in range(blank):
+                    yield from clock(0, 0, 0)
+        for i in range(4):
+            yield from clock(1, 0, 0)
+
+    sim = Simulator(dut)
+    sim.add_process(process)
+    sim.run()
+
+    errors = 0
+    if len(received) != len(expected):
+        print("    {} pixels, expected {}".format(len(received), len(expected)))
+        errors += 1
+    for i, (hw, ref) in enumerate(zip(received, expected)):
+        if hw != ref:
+            if errors < 4:
+                print("    pixel", i, "hardware", hw, "expected", ref)
+            errors += 1
+    return errors, len(received)
+
+def test_yuv2rgb(ys, us, vs, mono, stall, seed):
+    dut = YUV2RGB()
+    rng = np.random.default_rng(seed)
+    n = len(ys)
+    w = 16
+
+    ref = conv_model.yuv2rgb(ys, us, vs, mono)
+    out = []
+    errors = 0
+    cycles = 0
+
+    def process():
+        nonlocal errors, cycles
+        yield dut.mono.eq(mono)
+        n_in = 0
+        while len(out) < n:
+            if n_in < n and rng.random() >= stall:
+                yield dut.sink.y.eq(int(ys[n_in]))
+                yield dut.sink.u.eq(int(us[n_in]))
+                yield dut.sink.v.eq(int(vs[n_in]))
+                yield dut.sink.first.eq(n_in == 0)
+                yield dut.sink.last.eq(n_in % w == w - 1)
+                yield dut.sink.valid.eq(1)
+            else:
+                yield dut.sink.valid.eq(0)
+            yield dut.source.ready.eq(int(rng.random() >= stall))
+            yield Settle()
+            if (yield dut.sink.valid) and (yield dut.sink.ready):
+                n_in += 1
+            if (yield dut.source.valid) and (yield dut.source.ready):
+                i = len(out)
+                if ((yield dut.source.first) != (i == 0) or
+                    (yield dut.source.last) != (i % w == w - 1) or
+                    (yield dut.source.y) != ys[i]):
+                    errors += 1
+                out.append(((yield dut.source.r), (yield dut.source.g), (yield dut.source.b)))
+            cycles += 1
+            yield
+
+    sim = Simulator(dut)
+    sim.add_clock(1e-6)
+    sim.add_sync_process(process)
+    sim.run()
+
+    for i, (hw, r, g, b) in enumerate(zip(out, *ref)):
+        if hw != (r, g, b):
+            if errors < 4:
+                print("    pixel", i, "yuv", (ys[i], us[i], vs[i]), "hardware", hw, "model", (r, g, b))
+            errors += 1
+    return errors, n / cycles
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=16)
+    parser.add_argument("--height", type=int, default=6)
+    parser.add_argument("--frames", type=int, default=2)
+    parser.add_argument("--pixels", type=int, default=4000)
+    parser.add_argument("--stall", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    errors = 0
+
+    w, h = args.width, args.height
+    frames = [(rng.integers(0, 256, (h, w)), rng.integers(0, 256, (h, w // 2)), rng.integers(0, 256, (h, w // 2)))
+              for i in range(args.frames)]
+    for blank in [2, 8]:
+        e, n = test_camread(frames, blank)
+        print("camread yuv  blank {:2}           -> {:>5} pixels {:>5} errors".format(blank, n, e))
+        errors += e
+
+    ys, us, vs = [rng.integers(0, 256, args.pixels) for i in range(3)]
+    # Include the extremes, which need clamping
+    ys[:4], us[:4], vs[:4] = [0, 255, 0, 255], [0, 255, 255, 0], [0, 255, 0, 255]
+    for mono in [0, 1]:
+        for stall in [0.0, args.stall]:
+            e, rate = test_yuv2rgb(ys, us, vs, mono, stall, args.seed)
+            print("yuv2rgb mono {} stall {:.1f}     -> {:.3f} pixels/clock {:>5} errors".format(mono, stall, rate, e))
+            errors += e
+
+    print("{} errors".format(errors))
@@ -0,0 +1,167 @@
+import argparse
+import struct
+import sys
+import time
+import zlib
+
+import numpy as np
+
+# Receive a snapshot sent by Snapshot (snapshot.py), from a serial port or
+# a file of the bytes captured from it, decode it and write it as a PNG,
+# and optionally as a raw RGB565 dump, as read by conv_model.load_rgb565
+# and bmp.py. encode() gives the bytes the hardware sends for an image.
+
+HEADER = b"SNAP"
+MAX_LIT = 128
+MAX_RUN = 64
+
+LIT   = 0
+REP   = 1
+ABOVE = 2
+
+def encode(img, compress=True):
+    h, w = img.shape
+    out = bytearray(HEADER + struct.pack("<HHB", w, h, int(compress)))
+
+    def literals(lits):
+        if lits:
+            out.append(len(lits) - 1)
+            for p in lits:
+                out.extend(struct.pack("<H", p))
+
+    for y in range(h):
+        lits = []
+        mode, rr, ra, run, prev = LIT, 0, 0, 0, 0
+        for x in range(w):
+            p = int(img[y, x])
+            eq_last = compress and x != 0 and p == prev
+            eq_above = compress and y != 0 and p == int(img[y - 1, x])
+            n_rr = min(rr + 1, 2) if eq_last else 0
+            n_ra = min(ra + 1, 2) if eq_above else 0
+            if mode == LIT:
+                lits.append(p)
+                if n_ra == 2 or n_rr == 2:
+                    # The last two literals start a run
+                    literals(lits[:-2])
+                    lits = []
+                    mode = ABOVE if n_ra == 2 else REP
+                    run = 2
+                elif len(lits) == MAX_LIT:
+                    literals(lits)
+                    lits = []
+                    rr, ra = 0, 0
+                else:
+                    rr, ra = n_rr, n_ra
+            elif (eq_last if mode == REP else eq_above) and run != MAX_RUN:
+                run += 1
+            else:
+                out.append(0x80 | (mode == ABOVE) << 6 | (run - 1))
+                lits = [p]
+                mode, rr, ra = LIT, int(eq_last), int(eq_above)
+            prev = p
+        if mode == LIT:
+            literals(lits)
+        else:
+            out.append(0x80 | (mode == ABOVE) << 6 | (run - 1))
+    return bytes(out)
+
+def decode(read):
+    # read(n) returns the next n bytes. Anything before the header, such as
+    # motion reports, is skipped
+    window = b""
+    while window != HEADER:
+        window = (window + read(1))[-4:]
+    w, h, flags = struct.unpack("<HHB", read(5))
+    img = np.zeros((h, w), dtype=np.uint16)
+    for y in range(h):
+        x = 0
+        while x < w:
+            c = read(1)[0]
+            if c < 0x80:
+                n = c + 1
+                img[y, x:x + n] = np.frombuffer(read(2 * n), dtype="<u2")
+            elif c < 0xc0:
+                n = (c & 0x3f) + 1
+                img[y, x:x + n] = img[y, x - 1]
+            else:
+                n = (c & 0x3f) + 1
+                img[y, x:x + n] = img[y - 1, x:x + n]
+            x += n
+            if x > w:
+                raise ValueError("line {} overflows".format(y))
+    return img, flags
+
+def decode_bytes(data):
+    pos = [0]
+
+    def read(n):
+        b = data[pos[0]:pos[0] + n]
+        if len(b) != n:
+            raise ValueError("snapshot is truncated")
+        pos[0] += n
+        return b
+
+    img, flags = decode(read)
+    return img, flags, pos[0]
+
+def rgb888(img, double=False):
+    r = (img >> 11) & 0x1f
+    g = (img >> 5) & 0x3f
+    b = img & 0x1f
+    rgb = np.stack([(r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)], axis=-1).astype(np.uint8)
+    # The frame buffer pixels are shown twice as wide
+    return np.repeat(rgb, 2, axis=1) if double else rgb
+
+def write_png(filename, rgb):
+    h, w, _ = rgb.shape
+
+    def chunk(kind, data):
+        return (struct.pack(">I", len(data)) + kind + data +
+                struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff))
+
+    raw = b"".join(b"\x00" + rgb[y].tobytes() for y in range(h))
+    with open(filename, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 2, 0, 0, 0)))
+        f.write(chunk(b"IDAT", zlib.compress(raw, 9)))
+        f.write(chunk(b"IEND", b""))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", help="serial port, or file of captured bytes with --file")
+    parser.add_argument("png")
+    parser.add_argument("--file", action="store_true", help="read the bytes from a file")
+    parser.add_argument("--baud", type=int, default=1000000)
+    parser.add_argument("--raw", help="also write the RGB565 pixels to this file")
+    parser.add_argument("--double", action="store_true", help="double the width, as on the display")
+    args = parser.parse_args()
+
+    if args.file:
+        src = open(args.input, "rb")
+    else:
+        import serial
+        src = serial.Serial(args.input, args.baud, timeout=None)
+        print("Take a snapshot with the left button")
+
+    count = [0]
+    start = [None]
+
+    def read(n):
+        b = src.read(n)
+        if len(b) != n:
+            sys.exit("snapshot is truncated")
+        if start[0] is None:
+            start[0] = time.time()
+        count[0] += n
+        return b
+
+    img, flags = decode(read)
+    elapsed = time.time() - start[0]
+    src.close()
+
+    h, w = img.shape
+    write_png(args.png, rgb888(img, args.double))
+    if args.raw:
+        img.astype("<u2").tofile(args.raw)
+    print("{}x{}, {} bytes, {}compressed, ratio {:.2f}, {:.2f} s".format(
+        w, h, count[0], "" if flags & 1 else "un", 2 * w * h / count[0], elapsed))
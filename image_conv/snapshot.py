@@ -0,0 +1,265 @@
+from enum import IntEnum
+
+from nmigen import *
+
+class SnapshotState(IntEnum):
+    IDLE      = 0
+    HEADER    = 1
+    READ_P    = 2
+    READ_A    = 3
+    PROC      = 4
+    NEXT      = 5
+    LINE_END  = 6
+    FLUSH     = 7
+    FLUSH_RD  = 8
+    FLUSH_LO  = 9
+    FLUSH_HI  = 10
+    SEND      = 11
+
+# Send a frozen frame of RGB565 pixels from the frame buffer over a uart
+# transmit port (data, ack and rdy, as AsyncSerial), compressed line by
+# line. The frame is sent as:
+#
+#   "SNAP", width and height (16 bits, little-endian), flags (bit 0 set if
+#   compressed), and then each line as a sequence of packets:
+#
+#   0nnnnnnn  n + 1 literal pixels follow, each little-endian
+#   10nnnnnn  repeat the last pixel n + 1 times
+#   11nnnnnn  copy n + 1 pixels from the line above
+#
+# The encoder reads the frame buffer through rd_addr and rd_data, with the
+# data a cycle after the address, two reads per pixel. The literals are
+# kept in a buffer until a run of two or more pixels is found, and runs are
+# extended as far as they go, up to 64 pixels. Without compress, only
+# literals are sent. snap_decode.py decodes it on the host.
+class Snapshot(Elaboratable):
+    MAX_LIT = 128
+    MAX_RUN = 64
+
+    def __init__(self, w=320, h=480):
+        # Parameters
+        self.w        = w
+        self.h        = h
+
+        # Inputs
+        self.start    = Signal()
+        self.compress = Signal(reset=1)
+        self.rd_data  = Signal(16)
+        self.tx_rdy   = Signal()
+
+        # Outputs
+        self.busy     = Signal()
+        self.rd_addr  = Signal(range(w * h))
+        self.tx_data  = Signal(8)
+        self.tx_ack   = Signal()
+        self.line     = Signal(range(h))
+
+    def elaborate(self, platform):
+        m = Module()
+
+        fsm_state        = Signal(4, reset=SnapshotState.IDLE)
+        fsm_return_state = Signal(4)
+        flush_state      = Signal(4)
+
+        # Header
+        header = Array([Const(c, 8) for c in b"SNAP" + bytes([
+            self.w & 0xff, self.w >> 8, self.h & 0xff, self.h >> 8])] + [Cat(self.compress, Const(0, 7))])
+        hi = Signal(range(len(header)))
+
+        # Position, and the pixel and the one above it
+        x    = Signal(range(self.w))
+        y    = Signal(range(self.h))
+        p    = Signal(16)
+        a    = Signal(16)
+        prev = Signal(16)
+
+        # Literal buffer
+        lit = Memory(width=16, depth=self.MAX_LIT)
+        m.submodules.lit_r = lit_r = lit.read_port()
+        m.submodules.lit_w = lit_w = lit.write_port()
+
+        nl   = Signal(range(self.MAX_LIT + 1))
+        nf   = Signal(range(self.MAX_LIT + 1))
+        fi   = Signal(range(self.MAX_LIT + 1))
+
+        # Runs: the number of pixels equal to the one before and to the one
+        # above, ending at the current pixel, up to 2, and the current run
+        LIT   = 0
+        REP   = 1
+        ABOVE = 2
+        mode  = Signal(2)
+        rr    = Signal(2)
+        ra    = Signal(2)
+        run   = Signal(range(self.MAX_RUN + 1))
+
+        eq_last  = Signal()
+        eq_above = Signal()
+        n_rr     = Signal(2)
+        n_ra     = Signal(2)
+
+        m.d.comb += [
+            eq_last.eq(self.compress & (x != 0) & (p == prev)),
+            eq_above.eq(self.compress & (y != 0) & (p == a)),
+            n_rr.eq(Mux(eq_last, Mux(rr == 2, 2, rr + 1), 0)),
+            n_ra.eq(Mux(eq_above, Mux(ra == 2, 2, ra + 1), 0)),
+            self.busy.eq(fsm_state != SnapshotState.IDLE),
+            self.line.eq(y),
+            self.tx_ack.eq(fsm_state == SnapshotState.SEND),
+            lit_w.addr.eq(nl),
+            lit_w.data.eq(p),
+            lit_r.addr.eq(fi)
+        ]
+
+        def send(byte, state):
+            return [
+                self.tx_data.eq(byte),
+                fsm_return_state.eq(state),
+                fsm_state.eq(SnapshotState.SEND)
+            ]
+
+        def flush(n, state):
+            return [
+                nf.eq(n),
+                flush_state.eq(state),
+                fsm_state.eq(SnapshotState.FLUSH)
+            ]
+
+        with m.Switch(fsm_state):
+            with m.Case(SnapshotState.IDLE):
+                with m.If(self.start):
+                    m.d.sync += [
+                        hi.eq(0),
+                        x.eq(0),
+                        y.eq(0),
+                        fsm_state.eq(SnapshotState.HEADER)
+                    ]
+            with m.Case(SnapshotState.HEADER):
+                with m.If(hi == len(header) - 1):
+                    m.d.sync += send(header[hi], SnapshotState.READ_P)
+                with m.Else():
+                    m.d.sync += [
+                        hi.eq(hi + 1),
+                        send(header[hi], SnapshotState.HEADER)
+                    ]
+            with m.Case(SnapshotState.READ_P):
+                m.d.comb += self.rd_addr.eq(y * self.w + x)
+                m.d.sync += fsm_state.eq(SnapshotState.READ_A)
+                with m.If(x == 0):
+                    m.d.sync += [
+                        nl.eq(0),
+                        mode.eq(LIT),
+                        rr.eq(0),
+                        ra.eq(0)
+                    ]
+            with m.Case(SnapshotState.READ_A):
+                m.d.comb += self.rd_addr.eq((y - 1) * self.w + x)
+                m.d.sync += [
+                    p.eq(self.rd_data),
+                    fsm_state.eq(SnapshotState.PROC)
+                ]
+            with m.Case(SnapshotState.PROC):
+                m.d.sync += [
+                    a.eq(self.rd_data),
+                    fsm_state.eq(SnapshotState.NEXT)
+                ]
+            with m.Case(SnapshotState.NEXT):
+                # Add the pixel to the literals or the run
+                m.d.sync += prev.eq(p)
+                with m.Switch(mode):
+                    with m.Case(LIT):
+                        m.d.comb += lit_w.en.eq(1)
+                        with m.If(n_ra == 2):
+                            # The last two literals start a run from above
+                            m.d.sync += [
+                                nl.eq(0),
+                                mode.eq(ABOVE),
+                                run.eq(2),
+                                flush(nl - 1, SnapshotState.LINE_END)
+                            ]
+                        with m.Elif(n_rr == 2):
+                            # The last two literals start a repeat
+                            m.d.sync += [
+                                nl.eq(0),
+                                mode.eq(REP),
+                                run.eq(2),
+                                flush(nl - 1, SnapshotState.LINE_END)
+                            ]
+                        with m.Elif(nl == self.MAX_LIT - 1):
+                            m.d.sync += [
+                                nl.eq(0),
+                                rr.eq(0),
+                                ra.eq(0),
+                                flush(self.MAX_LIT, SnapshotState.LINE_END)
+                            ]
+                        with m.Else():
+                            m.d.sync += [
+                                nl.eq(nl + 1),
+                                rr.eq(n_rr),
+                                ra.eq(n_ra),
+                                fsm_state.eq(SnapshotState.LINE_END)
+                            ]
+                    with m.Default():
+                        # Extend the run, or else send it and start the literals
+                        with m.If(Mux(mode == REP, eq_last, eq_above) & (run != self.MAX_RUN)):
+                            m.d.sync += [
+                                run.eq(run + 1),
+                                fsm_state.eq(SnapshotState.LINE_END)
+                            ]
+                        with m.Else():
+                            m.d.comb += lit_w.en.eq(1)
+                            m.d.sync += [
+                                nl.eq(1),
+                                mode.eq(LIT),
+                                rr.eq(eq_last),
+                                ra.eq(eq_above),
+                                send(Cat((run - 1)[:6], mode == ABOVE, Const(1, 1)), SnapshotState.LINE_END)
+                            ]
+            with m.Case(SnapshotState.LINE_END):
+                # Move on to the next pixel, sending what is left at the end of
+                # the line
+                with m.If(x == self.w - 1):
+                    with m.If((mode == LIT) & (nl != 0)):
+                        m.d.sync += [
+                            nl.eq(0),
+                            flush(nl, SnapshotState.LINE_END)
+                        ]
+                    with m.Elif(mode != LIT):
+                        m.d.sync += [
+                            mode.eq(LIT),
+                            send(Cat((run - 1)[:6], mode == ABOVE, Const(1, 1)), SnapshotState.LINE_END)
+                        ]
+                    with m.Else():
+                        m.d.sync += [
+                            x.eq(0),
+                            y.eq(y + 1),
+                            fsm_state.eq(Mux(y == self.h - 1, SnapshotState.IDLE, SnapshotState.READ_P))
+                        ]
+                with m.Else():
+                    m.d.sync += [
+                        x.eq(x + 1),
+                        fsm_state.eq(SnapshotState.READ_P)
+                    ]
+            with m.Case(SnapshotState.FLUSH):
+                # Send the first nf literals
+                m.d.sync += fi.eq(0)
+                with m.If(nf == 0):
+                    m.d.sync += fsm_state.eq(flush_state)
+                with m.Else():
+                    m.d.sync += send(nf - 1, SnapshotState.FLUSH_RD)
+            with m.Case(SnapshotState.FLUSH_RD):
+                with m.If(fi == nf):
+                    m.d.sync += fsm_state.eq(flush_state)
+                with m.Else():
+                    m.d.sync += fsm_state.eq(SnapshotState.FLUSH_LO)
+            with m.Case(SnapshotState.FLUSH_LO):
+                m.d.sync += send(lit_r.data[:8], SnapshotState.FLUSH_HI)
+            with m.Case(SnapshotState.FLUSH_HI):
+                m.d.sync += [
+                    fi.eq(fi + 1),
+                    send(lit_r.data[8:], SnapshotState.FLUSH_RD)
+                ]
+            with m.Case(SnapshotState.SEND):
+                with m.If(self.tx_rdy):
+                    m.d.sync += fsm_state.eq(fsm_return_state)
+
+        return m
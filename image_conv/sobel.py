@@ -0,0 +1,89 @@
+from nmigen import *
+
+# Sobel edge detector working on the window taps from a Window3.
+# Computes Gx and Gy in one pass, and outputs the gradient magnitude,
+# shifted right by sh and saturated to dw bits, together with the
+# direction of the gradient, quantized to 0, 45, 90 or 135 degrees.
+# The magnitude is |Gx| + |Gy| or, if l2 is set, the approximation
+# max + 3/8 min of sqrt(Gx^2 + Gy^2).
+class Sobel3(Elaboratable):
+    # Gradient directions, with y increasing down the image
+    DIR_0   = 0
+    DIR_45  = 1
+    DIR_90  = 2
+    DIR_135 = 3
+
+    def __init__(self, sh=2, dw=8, l2=False):
+        # Parameters
+        self.sh        = sh
+        self.dw        = dw
+        self.l2        = l2
+
+        # Inputs
+        self.i_w       = [Signal(dw) for i in range(9)]
+        self.i_en      = Signal()
+        self.i_ready   = Signal(reset=1)
+
+        # Outputs
+        self.o_p       = Signal(dw)
+        self.o_dir     = Signal(2)
+        self.o_valid   = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+
+        p00, p01, p02, p10, p11, p12, p20, p21, p22 = self.i_w
+
+        # Gradients and their absolute values
+        gx = Signal(signed(self.dw + 3))
+        gy = Signal(signed(self.dw + 3))
+        ax = Signal(self.dw + 2)
+        ay = Signal(self.dw + 2)
+
+        m.d.comb += [
+            gx.eq((p02 + (p12 << 1) + p22) - (p00 + (p10 << 1) + p20)),
+            gy.eq((p20 + (p21 << 1) + p22) - (p00 + (p01 << 1) + p02)),
+            ax.eq(Mux(gx < 0, -gx, gx)),
+            ay.eq(Mux(gy < 0, -gy, gy))
+        ]
+
+        # Magnitude
+        mag = Signal(self.dw + 3)
+        if self.l2:
+            mx = Signal(self.dw + 2)
+            mn = Signal(self.dw + 2)
+            m.d.comb += [
+                mx.eq(Mux(ax > ay, ax, ay)),
+                mn.eq(Mux(ax > ay, ay, ax)),
+                mag.eq(mx + (mn >> 2) + (mn >> 3))
+            ]
+        else:
+            m.d.comb += mag.eq(ax + ay)
+
+        max_p = (1 << self.dw) - 1
+        mag_sh = Signal(self.dw + 3)
+        m.d.comb += mag_sh.eq(mag >> self.sh)
+
+        # Direction, using tan(22.5) ~ 2/5 and tan(67.5) ~ 5/2
+        dir = Signal(2)
+        with m.If(ay * 5 <= ax * 2):
+            m.d.comb += dir.eq(self.DIR_0)
+        with m.Elif(ay * 2 > ax * 5):
+            m.d.comb += dir.eq(self.DIR_90)
+        with m.Elif((gx < 0) == (gy < 0)):
+            m.d.comb += dir.eq(self.DIR_45)
+        with m.Else():
+            m.d.comb += dir.eq(self.DIR_135)
+
+        # Pixel not valid by default, once the last one has been taken
+        with m.If(self.i_ready):
+            m.d.sync += self.o_valid.eq(0)
+
+        with m.If(self.i_en):
+            m.d.sync += [
+                self.o_valid.eq(1),
+                self.o_p.eq(Mux(mag_sh > max_p, max_p, mag_sh)),
+                self.o_dir.eq(dir)
+            ]
+
+        return m
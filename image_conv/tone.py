@@ -0,0 +1,56 @@
+import argparse
+
+import numpy as np
+
+# Build tone curves for ToneLUT (tone_lut.py) and send them to the board
+# over the uart, where LUTLoader loads them and they are used from the
+# next frame. Each curve is
+#
+#   y = (clip(x * gain, 0, 1) ** gamma - 0.5) * contrast + 0.5 + brightness
+#
+# for x and y from 0 to 1, clipped, and scaled to the 32 entries of red
+# and blue and the 64 of green. fill_tables() gives the tables LUTFill
+# makes for the colour gains.
+
+MAGIC = b"T"
+
+def curve(n, gamma=1.0, contrast=1.0, brightness=0.0, gain=1.0):
+    x = np.arange(n) / (n - 1)
+    y = np.clip(x * gain, 0, 1) ** gamma
+    y = (y - 0.5) * contrast + 0.5 + brightness
+    return [int(v) for v in np.rint(np.clip(y, 0, 1) * (n - 1))]
+
+def tables(gamma=1.0, contrast=1.0, brightness=0.0, gains=(1.0, 1.0, 1.0)):
+    return tuple(curve(n, gamma, contrast, brightness, gain)
+                 for n, gain in zip((32, 64, 32), gains))
+
+# The tables of LUTFill, for gains with 4 fractional bits
+def fill_tables(gain_r, gain_g, gain_b):
+    return tuple([min((x * gain) >> 4, n - 1) for x in range(n)]
+                 for n, gain in zip((32, 64, 32), (gain_r, gain_g, gain_b)))
+
+# The bytes that load the tables: red at 0-31, green at 32-95 and blue at
+# 96-127
+def message(r, g, b):
+    return MAGIC + bytes(r + g + b)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", help="serial port, or print the tables if not given")
+    parser.add_argument("--baud", type=int, default=1000000)
+    parser.add_argument("--gamma", type=float, default=1.0, help="above 1 darkens the mid tones, 2 gives the tables of image_stream.py")
+    parser.add_argument("--contrast", type=float, default=1.0)
+    parser.add_argument("--brightness", type=float, default=0.0, help="-1 to 1")
+    parser.add_argument("--gains", type=float, nargs=3, default=[1.0, 1.0, 1.0], metavar=("R", "G", "B"))
+    args = parser.parse_args()
+
+    r, g, b = tables(args.gamma, args.contrast, args.brightness, args.gains)
+
+    if args.port:
+        import serial
+        with serial.Serial(args.port, args.baud) as port:
+            port.write(message(r, g, b))
+        print("Sent {} bytes".format(len(message(r, g, b))))
+    else:
+        for name, t in [("r", r), ("g", g), ("b", b)]:
+            print(name, " ".join(str(v) for v in t))
@@ -0,0 +1,210 @@
+from nmigen import *
+
+# Per-channel tone curves for RGB565 pixels: a 32 entry table for red and
+# blue and a 64 entry table for green, looked up combinatorially.
+#
+# The tables are double-buffered. Writes go to the back bank, through
+# w_addr and w_data, with red at 0-31, green at 32-95 and blue at 96-127,
+# and swap then makes the back bank the front bank at the start of the
+# next frame, from the pixel where i_start is set. A write before then
+# cancels the swap, so the front bank is never written. All 128 entries
+# should be written before each swap, as the back bank holds the tables
+# from before the last swap.
+class ToneLUT(Elaboratable):
+    def __init__(self, init_r=None, init_g=None, init_b=None):
+        # Parameters, the initial tables of both banks, identity by default
+        self.init_r  = init_r or list(range(32))
+        self.init_g  = init_g or list(range(64))
+        self.init_b  = init_b or list(range(32))
+
+        # Inputs
+        self.i_r     = Signal(5)
+        self.i_g     = Signal(6)
+        self.i_b     = Signal(5)
+        self.i_start = Signal()
+        self.w_addr  = Signal(7)
+        self.w_data  = Signal(8)
+        self.w_en    = Signal()
+        self.swap    = Signal()
+
+        # Outputs
+        self.o_r     = Signal(5)
+        self.o_g     = Signal(6)
+        self.o_b     = Signal(5)
+        self.pending = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+
+        # Bank being read, which changes on the first pixel after a swap
+        bank = Signal()
+        cur  = Signal()
+
+        m.d.comb += cur.eq(bank ^ (self.pending & self.i_start & ~self.w_en))
+        m.d.sync += bank.eq(cur)
+
+        with m.If(self.swap):
+            m.d.sync += self.pending.eq(1)
+        with m.Elif(self.i_start | self.w_en):
+            m.d.sync += self.pending.eq(0)
+
+        for name, i, o, init, base in [("r", self.i_r, self.o_r, self.init_r, 0),
+                                       ("g", self.i_g, self.o_g, self.init_g, 32),
+                                       ("b", self.i_b, self.o_b, self.init_b, 96)]:
+            n = len(init)
+            lut = Memory(width=len(o), depth=2 * n, init=init + init)
+            m.submodules["lut_" + name + "_r"] = r = lut.read_port(domain="comb")
+            m.submodules["lut_" + name + "_w"] = w = lut.write_port()
+
+            m.d.comb += [
+                r.addr.eq(Cat(i, cur)),
+                o.eq(r.data),
+                w.addr.eq(Cat((self.w_addr - base)[:len(i)], ~cur)),
+                w.data.eq(self.w_data),
+                w.en.eq(self.w_en & (self.w_addr >= base) & (self.w_addr < base + n))
+            ]
+
+        return m
+
+# Load the tables of a ToneLUT from bytes received by a uart: the byte "T"
+# followed by the 128 entries, after which the tables are swapped. A load
+# that stops for more than timeout cycles is abandoned.
+class LUTLoader(Elaboratable):
+    MAGIC = ord("T")
+
+    def __init__(self, timeout=250000):
+        # Parameters
+        self.timeout = timeout
+
+        # Inputs
+        self.rx_data = Signal(8)
+        self.rx_rdy  = Signal()
+
+        # Outputs
+        self.w_addr  = Signal(7)
+        self.w_data  = Signal(8)
+        self.w_en    = Signal()
+        self.swap    = Signal()
+        self.busy    = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+
+        timer = Signal(range(self.timeout + 1))
+
+        m.d.sync += [
+            self.w_en.eq(0),
+            self.swap.eq(0)
+        ]
+
+        # w_addr is the address of the last write
+        with m.If(~self.busy):
+            with m.If(self.rx_rdy & (self.rx_data == self.MAGIC)):
+                m.d.sync += [
+                    self.busy.eq(1),
+                    self.w_addr.eq(127),
+                    timer.eq(self.timeout)
+                ]
+        with m.Elif(self.rx_rdy):
+            m.d.sync += [
+                self.w_addr.eq(self.w_addr + 1),
+                self.w_data.eq(self.rx_data),
+                self.w_en.eq(1),
+                timer.eq(self.timeout)
+            ]
+            with m.If(self.w_addr == 126):
+                m.d.sync += [
+                    self.busy.eq(0),
+                    self.swap.eq(1)
+                ]
+        with m.Elif(timer == 0):
+            m.d.sync += self.busy.eq(0)
+        with m.Else():
+            m.d.sync += timer.eq(timer - 1)
+
+        return m
+
+# Fill the tables of a ToneLUT with the curves for channel gains, with 4
+# fractional bits, each entry being its index times the gain, clipped to
+# the largest value, and swap them. This is done at reset and whenever a
+# gain changes. While hold is set, it waits, and then starts again.
+class LUTFill(Elaboratable):
+    def __init__(self):
+        # Inputs
+        self.gain_r = Signal(8)
+        self.gain_g = Signal(8)
+        self.gain_b = Signal(8)
+        self.hold   = Signal()
+
+        # Outputs
+        self.w_addr = Signal(7)
+        self.w_data = Signal(8)
+        self.w_en   = Signal()
+        self.swap   = Signal()
+        self.busy   = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+
+        gains = Cat(self.gain_r, self.gain_g, self.gain_b)
+        last  = Signal(len(gains))
+        dirty = Signal(reset=1)
+        addr  = Signal(8)
+
+        # The entry of the current address
+        x    = Signal(6)
+        gain = Signal(8)
+        top  = Signal(6)
+        prod = Signal(14)
+
+        with m.If(addr < 32):
+            m.d.comb += [
+                x.eq(addr),
+                gain.eq(self.gain_r),
+                top.eq(31)
+            ]
+        with m.Elif(addr < 96):
+            m.d.comb += [
+                x.eq(addr - 32),
+                gain.eq(self.gain_g),
+                top.eq(63)
+            ]
+        with m.Else():
+            m.d.comb += [
+                x.eq(addr - 96),
+                gain.eq(self.gain_b),
+                top.eq(31)
+            ]
+
+        m.d.comb += [
+            prod.eq((x * gain) >> 4),
+            self.w_addr.eq(addr),
+            self.w_data.eq(Mux(prod > top, top, prod)),
+            self.w_en.eq(self.busy & ~self.hold)
+        ]
+
+        m.d.sync += self.swap.eq(0)
+
+        # A change of gain, or hold, starts the tables again
+        with m.If(self.hold | (gains != last)):
+            m.d.sync += [
+                last.eq(gains),
+                dirty.eq(dirty | self.busy | (gains != last)),
+                addr.eq(0),
+                self.busy.eq(0)
+            ]
+        with m.Elif(self.busy):
+            m.d.sync += addr.eq(addr + 1)
+            with m.If(addr == 127):
+                m.d.sync += [
+                    addr.eq(0),
+                    self.busy.eq(0),
+                    self.swap.eq(1)
+                ]
+        with m.Elif(dirty):
+            m.d.sync += [
+                dirty.eq(0),
+                self.busy.eq(1)
+            ]
+
+        return m
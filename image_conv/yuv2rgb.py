@@ -0,0 +1,112 @@
+from nmigen import *
+
+from stream import Stream, SkidBuffer
+
+# Convert a stream of YUV pixels, as read from the camera in YUV422 mode,
+# to RGB565, one pixel per clock.
+#
+# The camera gives full range (JPEG) YCbCr, so with d = u - 128 and
+# e = v - 128:
+#
+#   r = y + 1.402 e
+#   g = y - 0.344 d - 0.714 e
+#   b = y + 1.772 d
+#
+# in fixed point with 8 fractional bits, rounded and clamped to 0..255
+# before being truncated to 5, 6 and 5 bits. It is pipelined in three
+# stages: the offset chroma, the sums of products, and the clamp.
+#
+# Y also goes through unchanged, and when mono is set the output is the
+# grey level from Y, so monochrome needs no r+g+b sum and keeps the full
+# resolution of the camera's luma.
+class YUV2RGB(Elaboratable):
+    # Fractional bits of the coefficients
+    FRAC = 8
+
+    # Coefficients: r from e, g from d, g from e, b from d
+    K_RV = 359
+    K_GU = 88
+    K_GV = 183
+    K_BU = 454
+
+    def __init__(self):
+        # Inputs
+        self.sink      = Stream([("y", 8), ("u", 8), ("v", 8)])
+        self.mono      = Signal()
+
+        # Outputs
+        self.source    = Stream([("r", 5), ("g", 6), ("b", 5), ("y", 8)])
+
+    def elaborate(self, platform):
+        m = Module()
+
+        # Output skid buffer, which stops the pipeline when it is not ready
+        m.submodules.skid = skid = SkidBuffer(self.source.payload_layout)
+        m.d.comb += skid.source.connect_to(self.source)
+
+        out = skid.sink
+        advance = out.ready
+        m.d.comb += self.sink.ready.eq(advance)
+
+        # Stage 1: offset chroma
+        s1_valid = Signal()
+        s1_first = Signal()
+        s1_last  = Signal()
+        s1_y     = Signal(8)
+        s1_d     = Signal(signed(9))
+        s1_e     = Signal(signed(9))
+
+        # Stage 2: sums of products, with the rounding constant
+        s2_valid = Signal()
+        s2_first = Signal()
+        s2_last  = Signal()
+        s2_y     = Signal(8)
+        s2_r     = Signal(signed(self.FRAC + 10))
+        s2_g     = Signal(signed(self.FRAC + 10))
+        s2_b     = Signal(signed(self.FRAC + 10))
+
+        half = 1 << (self.FRAC - 1)
+        y_fix = Signal(signed(self.FRAC + 10))
+        m.d.comb += y_fix.eq((s1_y << self.FRAC) + half)
+
+        def clamp(s):
+            c = s >> self.FRAC
+            return Mux(c < 0, 0, Mux(c > 255, 255, c[0:8]))
+
+        r8 = Signal(8)
+        g8 = Signal(8)
+        b8 = Signal(8)
+        m.d.comb += [
+            r8.eq(clamp(s2_r)),
+            g8.eq(clamp(s2_g)),
+            b8.eq(clamp(s2_b))
+        ]
+
+        with m.If(advance):
+            m.d.sync += [
+                s1_valid.eq(self.sink.valid),
+                s1_first.eq(self.sink.first),
+                s1_last.eq(self.sink.last),
+                s1_y.eq(self.sink.y),
+                s1_d.eq(self.sink.u - 128),
+                s1_e.eq(self.sink.v - 128),
+
+                s2_valid.eq(s1_valid),
+                s2_first.eq(s1_first),
+                s2_last.eq(s1_last),
+                s2_y.eq(s1_y),
+                s2_r.eq(y_fix + self.K_RV * s1_e),
+                s2_g.eq(y_fix - self.K_GU * s1_d - self.K_GV * s1_e),
+                s2_b.eq(y_fix + self.K_BU * s1_d),
+
+                # Stage 3: clamp and truncate, into the skid buffer
+                out.valid.eq(s2_valid),
+                out.first.eq(s2_first),
+                out.last.eq(s2_last),
+                out.y.eq(s2_y),
+                out.r.eq(Mux(self.mono, s2_y[3:], r8[3:])),
+                out.g.eq(Mux(self.mono, s2_y[2:], g8[2:])),
+                out.b.eq(Mux(self.mono, s2_y[3:], b8[3:]))
+            ]
+
+        return m
@@ -1,75 +1,162 @@
+import argparse
 import shlex
 import sys
 
-labels = {}
-globals = {}
-next_global = 0
-fixups = []
-code = []
-memory_ops = {'add': 0, 'sub': 0x100, 'st': 0x300, 'and': 0x600}
-
-lexer = shlex.shlex(sys.stdin)
-lexer.commenters = '#'
-lexer.wordchars += '_:-'
-
-while True:
-    token = lexer.get_token()
-    if token == '':
-        break
-
-    if token[-1] == ':':
-        # define label
-        token = token[:-1]
-        if token in labels:
-            raise Exception(str(lexer.lineno) + ': redefined label ' + token)
-        else:
-            labels[token] = len(code)
-    elif token == 'res':
-        # reserve data
-        globals[lexer.get_token()] = next_global
-        lookahead = lexer.get_token()
-        if lookahead == ',':
-            next_global += int(lexer.get_token())
+# Assembler for MiteCPU, as a library and a command.
+#
+# Assembler.assemble takes the source text and assembles it a line at a
+# time, with each line split into tokens by shlex as before. A bl to a
+# label not yet defined is fixed up when the whole source has been read,
+# and every error is collected, with its line number, rather than stopping
+# at the first. Operands are checked to fit in their 8 bits, and the code
+# and the data reserved with res to fit in their 256 words.
+#
+# code is then the program, as the init of MiteCPU's code Memory, so
+# MiteCPU(assemble(text)) builds a CPU running it, and listing has the
+# address and the instruction assembled for each line.
+#
+# python3 assemble.py < prog.asm > progmem.hex assembles a program as
+# before, writing the hex, one instruction a line, to stdout; a source file
+# can be given instead, and --lst writes the listing to a file.
+
+MEMORY_OPS = {"add": 0x000, "sub": 0x100, "st": 0x300, "index": 0x500, "and": 0x600}
+
+class Assembler:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.code      = []
+        self.labels    = {}
+        self.globals   = {}   # Data addresses reserved with res
+        self.errors    = []
+        self.listing   = []
+        self.fixups    = []   # (address, label, line number) of each forward bl
+        self.next_data = 0
+
+    # Assemble source text, returning True if there were no errors
+    def assemble(self, source):
+        self.reset()
+        lines = source.splitlines() if isinstance(source, str) else [l.rstrip("\n") for l in source]
+        for lineno, text in enumerate(lines, 1):
+            address = len(self.code)
+            self._line(text, lineno)
+            self.listing.append("%02x  %-3s  %s" % (address, " ".join("%03x" % w for w in self.code[address:]), text))
+        for address, label, lineno in self.fixups:
+            if label in self.labels:
+                self.code[address] |= self.labels[label]
+            else:
+                self._error(lineno, "undefined label " + label)
+        if len(self.code) > 256:
+            self._error(len(lines), "%d instructions, more than 256" % len(self.code))
+        if self.next_data > 256:
+            self._error(len(lines), "%d data words reserved, more than 256" % self.next_data)
+        return not self.errors
+
+    def _error(self, lineno, message):
+        self.errors.append("%d: %s" % (lineno, message))
+
+    def _line(self, text, lineno):
+        lexer = shlex.shlex(text)
+        lexer.commenters = '#'
+        lexer.wordchars += '_:-'
+        tokens = list(lexer)
+        while tokens:
+            token = tokens.pop(0)
+            if token[-1] == ':':
+                # define label
+                self._define(self.labels, token[:-1], len(self.code), lineno)
+            elif token == 'res':
+                # reserve data, one word or the count after a comma
+                count = 1
+                name = tokens.pop(0) if tokens else ''
+                if tokens[:1] == [',']:
+                    count = self._number(tokens[1] if len(tokens) > 1 else '', 1, 256, lineno)
+                    del tokens[:2]
+                self._define(self.globals, name, self.next_data, lineno)
+                self.next_data += count
+            elif token == 'ldi':
+                # load immediate, a number or the address of the data
+                operand = tokens.pop(0) if tokens else ''
+                self.code.append(0x200 | self._operand(operand, -128, 255, lineno) & 0xff)
+            elif token == 'bl':
+                # branch if the accumulator is negative
+                target = tokens.pop(0) if tokens else ''
+                if target in self.labels:
+                    self.code.append(0x400 | self.labels[target])
+                else:
+                    self.fixups.append((len(self.code), target, lineno))
+                    self.code.append(0x400)
+            elif token in MEMORY_OPS:
+                operand = tokens.pop(0) if tokens else ''
+                self.code.append(MEMORY_OPS[token] | self._operand(operand, 0, 255, lineno))
+            else:
+                self._error(lineno, "bad instruction " + token)
+                return
+
+    def _define(self, symbols, name, value, lineno):
+        if not name.isidentifier():
+            self._error(lineno, "bad name " + repr(name))
+        elif name in self.labels or name in self.globals:
+            self._error(lineno, "redefined " + name)
         else:
-            lexer.push_token(lookahead)
-            next_global += 1
-    elif token == 'ldi':
-        # Load immediate
-        operand = lexer.get_token()
-        if operand.isdigit() or operand[0] == '-':
+            symbols[name] = value
+
+    # A number, in range, or the address of data reserved with res
+    def _operand(self, operand, low, high, lineno):
+        if operand in self.globals:
+            return self.globals[operand]
+        elif operand.lstrip('-').isdigit():
+            return self._number(operand, low, high, lineno)
+        self._error(lineno, "undefined data " + repr(operand))
+        return 0
+
+    def _number(self, operand, low, high, lineno):
+        try:
             value = int(operand)
-            if value > 127 or value < -128:
-                raise Exception(str(lexer.lineno) + ': value out of range')
-            elif value < 0:
-                value = (0xff ^ (-value)) + 1  # Convert to twos complement
-        else:
-            # Assume this is loading a data pointer
-            value = globals[operand]
-
-        code += [0x200 | (value & 0xff)]
-    elif token == 'bl':
-        # Branch if accumulator less than zero
-        target = lexer.get_token()
-        if target in labels:
-            code += [0x400 | labels[target]]
-        else:
-            fixups = [(len(code), target)]
-            code += [0x400]
-    elif token in memory_ops:
-        operand = lexer.get_token()
-        if operand.isdigit():
-            opval = int(operand)
-        else:
-            opval = globals[operand]
+        except ValueError:
+            self._error(lineno, "bad number " + repr(operand))
+            return 0
+        if not low <= value <= high:
+            self._error(lineno, "value %d out of range %d to %d" % (value, low, high))
+            return 0
+        return value
 
-        code += [memory_ops[token] | opval]
-    elif token == 'index':
-        code += [0x500 | globals[lexer.get_token()]]
-    else:
-        raise Exception(str(lexer.lineno) + ': bad instruction' + token)
+    def symbols(self):
+        return "\n".join(["%-16s code %02x" % l for l in sorted(self.labels.items())] +
+                         ["%-16s data %02x" % g for g in sorted(self.globals.items())])
 
-for addr, label in fixups:
-    code[addr] = (code[addr] & 0x700) | (labels[label] & 0xff)
+    # The code as hex, one instruction a line, as readhex() reads
+    def hex(self):
+        return "".join("%03x\n" % w for w in self.code)
+
+# Assemble source text, returning the code, or raising ValueError with the
+# errors
+def assemble(source):
+    asm = Assembler()
+    if not asm.assemble(source):
+        raise ValueError("\n".join(asm.errors))
+    return asm.code
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("source", nargs="?", help="assembler source, default stdin")
+    parser.add_argument("--lst", help="file to write the listing and symbols to")
+    args = parser.parse_args()
+
+    if args.source:
+        with open(args.source) as f:
+            source = f.read()
+    else:
+        source = sys.stdin.read()
 
-for x in code:
-    print('%03x' % x)
+    asm = Assembler()
+    ok = asm.assemble(source)
+    if args.lst:
+        with open(args.lst, "w") as f:
+            f.write("\n".join(asm.listing) + "\n\n" + asm.symbols() + "\n")
+    for e in asm.errors:
+        print(e, file=sys.stderr)
+    if ok:
+        sys.stdout.write(asm.hex())
+    sys.exit(not ok)
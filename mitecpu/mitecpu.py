@@ -1,93 +1,138 @@
 import argparse
 
 from nmigen import *
-from nmigen_boards.ulx3s import *
-
-def readhex():
-    f = open("progmem.hex","r")
-    l = []
-    while True:
-        s = f.readline()
-        if s:
-            l.append(int(s,16))
-        else:
-            break
-    f.close()
-    return l
+
+# MiteCPU, pipelined, on the rising edge only.
+#
+# An instruction is fetched from code, has its data address worked out and
+# read from data, and then executes, a stage a cycle, with the next one
+# behind it in each. The data address uses the index forwarded from an
+# index instruction executing; a branch is decided on the acc after the
+# instruction executing, and fetches its target at once; and a store is
+# forwarded to the read behind it, if it is of the same address. So
+# nothing stalls and an instruction completes each cycle.
+#
+# The pipeline steps once in each 1 << delay_bits cycles, so with the
+# default of 22 the leds can be seen to change at 25MHz, and with 0 it
+# runs at the full clock. retire is set in the cycles an instruction
+# completes, with its address in ip_e, for simulation.
+#
+# prog is the code Memory's init, from assemble.py, such as
+# assemble(open("test1.asm").read()).
 
 class MiteCPU(Elaboratable):
+    def __init__(self, prog, delay_bits=22):
+        self.prog       = prog
+        self.delay_bits = delay_bits
+
+        self.leds       = Signal(8)
+        self.retire     = Signal()
+        self.ip_e       = Signal(8)
+        self.acc        = Signal(8)
+        self.st         = Signal()   # Set with retire for a store, of acc to st_addr
+        self.st_addr    = Signal(8)
+
     def elaborate(self, platform):
-        led   = [platform.request("led", i) for i in range(8)]
-        clk25 = platform.request("clk25")
-        prog = readhex()
-        print(" ".join(hex(n) for n in prog))
-        code = Memory(width=11, depth=256, init=prog)
+        m = Module()
+
+        if platform:
+            led   = [platform.request("led", i) for i in range(8)]
+            clk25 = platform.request("clk25")
+
+            # Create sync domain
+            m.domains.sync = ClockDomain()
+            m.d.comb += ClockSignal().eq(clk25.i)
+
+            m.d.comb += Cat(led[i].o for i in range(8)).eq(self.leds)
+
+        code = Memory(width=11, depth=256, init=self.prog)
         data = Memory(width=8, depth=256)
-        ip = Signal(8, reset=0xff)
-        ip_nxt = Signal(8)
-        instr = Signal(11, reset=0)
-        acc = Signal(8, reset=0)
-        index = Signal(8, reset=0)
-        op = Signal(8, reset=0)
-        addr = Signal(8)
-        leds = Cat(led[i].o for i in range(8))
-        delay = Signal(22)
+        m.submodules.code_rd = code_rd = code.read_port(transparent=False)
+        m.submodules.data_rd = data_rd = data.read_port(transparent=False)
+        m.submodules.data_wr = data_wr = data.write_port()
 
-        m = Module()
+        step    = Signal()            # The pipeline moves on this cycle
+        ip      = Signal(8, reset=0xff) # Address of the instruction in the address stage
+        ip_nxt  = Signal(8)
+        valid_a = Signal()
+        valid_e = Signal()
+        instr_a = Signal(11)
+        instr_e = Signal(11)
+        addr_a  = Signal(8)
+        addr_e  = Signal(8)
+        op      = Signal(8)           # data[addr_e], read in the address stage
+        fwd     = Signal()            # The store before was to addr_e
+        fwd_val = Signal(8)
+        acc_nxt = Signal(8)
+        index   = Signal(8)
+
+        if self.delay_bits:
+            delay = Signal(self.delay_bits)
+            m.d.sync += delay.eq(delay + 1)
+            m.d.comb += step.eq(delay == 0)
+        else:
+            m.d.comb += step.eq(1)
+
+        m.d.comb += [
+            instr_a.eq(code_rd.data),
+            op.eq(Mux(fwd, fwd_val, data_rd.data)),
+            # The execute stage
+            index.eq(Mux(valid_e & (instr_e[8:] == 5), op, 0))
+        ]
+
+        with m.Switch(Mux(valid_e, instr_e[8:], 7)):
+            with m.Case("000"):
+                m.d.comb += acc_nxt.eq(self.acc + op)
+            with m.Case("001"):
+                m.d.comb += acc_nxt.eq(self.acc - op)
+            with m.Case("110"):
+                m.d.comb += acc_nxt.eq(self.acc & op)
+            with m.Case("010"):
+                m.d.comb += acc_nxt.eq(instr_e[0:8])
+            with m.Default():
+                m.d.comb += acc_nxt.eq(self.acc)
+
+        m.d.comb += [
+            self.retire.eq(step & valid_e),
+            self.st.eq(self.retire & (instr_e[8:] == 3)),
+            self.st_addr.eq(addr_e),
+            data_wr.addr.eq(addr_e),
+            data_wr.data.eq(self.acc),
+            data_wr.en.eq(self.st),
+            # The address stage
+            addr_a.eq(instr_a[0:8] + index),
+            data_rd.addr.eq(addr_a),
+            data_rd.en.eq(step),
+            # Branch on the acc after the instruction executing
+            ip_nxt.eq(Mux(valid_a & (instr_a[8:] == 4) & acc_nxt[7], instr_a[0:8], ip + 1)),
+            code_rd.addr.eq(ip_nxt),
+            code_rd.en.eq(step)
+        ]
+
+        with m.If(step):
+            m.d.sync += [
+                ip.eq(ip_nxt),
+                valid_a.eq(1),
+                valid_e.eq(valid_a),
+                instr_e.eq(instr_a),
+                addr_e.eq(addr_a),
+                self.ip_e.eq(ip),
+                self.acc.eq(acc_nxt),
+                fwd.eq(self.st & (addr_e == addr_a)),
+                fwd_val.eq(self.acc)
+            ]
+            # data[0] is leds
+            with m.If(self.st & (instr_e[0:8] == 0)):
+                m.d.sync += self.leds.eq(self.acc)
 
-        # Create sync domain
-        m.domains.sync = ClockDomain()
-        m.d.comb += ClockSignal().eq(clk25.i)
-
-        # Create negedge domain
-        neg = ClockDomain("neg", clk_edge="neg")
-        m.domains += neg
-        m.d.comb += neg.clk.eq(clk25.i)
-       
-        # Set address 
-        m.d.comb += addr.eq(instr[0:8] + index)
-
-        # Set ip_nxt
-        with m.If((instr[8:] == 4) & acc[7]):
-            m.d.comb += ip_nxt.eq(instr[0:8])
-        with m.Else():
-            m.d.comb += ip_nxt.eq(ip + 1)
-
-        # Delay counter
-        m.d.sync += delay.eq(delay + 1)
-
-        with m.If(delay == 0):
-            # Advance instruction pointer
-            m.d.sync += ip.eq(ip_nxt)
-            
-            # Fetch next instruction
-            m.d.sync += instr.eq(code[ip_nxt])
-
-            # Decode and execute current instruction
-            m.d.sync += index.eq(0) # index defaults to zero
-            with m.Switch(instr[8:]):
-                with m.Case("000"):
-                    m.d.sync += acc.eq(acc + op)
-                with m.Case("001"):
-                    m.d.sync += acc.eq(acc - op)
-                with m.Case("110"):
-                    m.d.sync += acc.eq(acc & op)
-                with m.Case("010"):
-                    m.d.sync += acc.eq(instr[0:8])
-                with m.Case("101"):
-                    m.d.sync += index.eq(op)
-                with m.Case("011"):
-                    m.d.sync += data[addr].eq(acc)
-                    # data[0] is leds
-                    with m.If(instr[0:8] == 0):
-                        m.d.sync += leds.eq(acc)
-           
-            # Fetch the op on the negative edge of clock
-            m.d.neg += op.eq(data[addr])
- 
         return m
 
 if __name__ == "__main__":
+    from nmigen_boards.ulx3s import *
+
+    from assemble import assemble
+    from miteemu import readhex
+
     variants = {
         '12F': ULX3S_12F_Platform,
         '25F': ULX3S_25F_Platform,
@@ -98,7 +143,12 @@ if __name__ == "__main__":
     # Figure out which FPGA variant we want to target...
     parser = argparse.ArgumentParser()
     parser.add_argument('variant', choices=variants.keys())
+    parser.add_argument('program', nargs='?', default='progmem.hex', help="assembler source, or hex from assemble.py")
+    parser.add_argument('--delay-bits', type=int, default=22, help="cycles for each instruction, as a power of 2, 0 for the full clock")
     args = parser.parse_args()
 
+    with open(args.program) as f:
+        prog = assemble(f.read()) if args.program.endswith(".asm") else readhex(f)
+
     platform = variants[args.variant]()
-    platform.build(MiteCPU(), do_program=True)
+    platform.build(MiteCPU(prog, delay_bits=args.delay_bits), do_program=True)
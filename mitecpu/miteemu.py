@@ -0,0 +1,103 @@
+import argparse
+import sys
+
+# Instruction set simulator for MiteCPU.
+#
+# Instructions are 11 bits, a 3-bit opcode and an 8-bit operand, n. The
+# memory operand is data[n + index], where index is the value loaded by an
+# index instruction just before, and zero after any other:
+#
+#   000 add    acc += data[n + index]
+#   001 sub    acc -= data[n + index]
+#   010 ldi    acc = n
+#   011 st     data[n + index] = acc, and the leds too if n is 0
+#   100 bl     branch to n if acc is negative
+#   101 index  index = data[n + index], for the next instruction
+#   110 and    acc &= data[n + index]
+#   111        no operation
+#
+# The code and data memories are 256 words, the code starts at 0 and the
+# data is all zero. Cycles are counted as on the pipelined MiteCPU: the
+# first instruction completes at the end of cycle 2 << delay_bits, and each
+# one after 1 << delay_bits cycles later.
+
+OPS = ["add", "sub", "ldi", "st", "bl", "index", "and", "nop"]
+
+class MiteEmu:
+    def __init__(self, code, delay_bits=0):
+        self.code   = (list(code) + [0] * 256)[:256]
+        self.data   = [0] * 256
+        self.ip     = 0
+        self.acc    = 0
+        self.index  = 0
+        self.leds   = 0
+        self.steps  = 0
+        self.period = 1 << delay_bits
+        self.cycles = self.period  # Filling the pipeline
+        self.store  = None         # (address, value) of the last instruction's store
+
+    # Run one instruction, returning the address it was at
+    def step(self):
+        ip = self.ip
+        w = self.code[ip]
+        op, n = w >> 8, w & 0xff
+        addr = (n + self.index) & 0xff
+        self.index = 0
+        self.ip = (ip + 1) & 0xff
+        self.store = None
+        if op == 0:
+            self.acc = (self.acc + self.data[addr]) & 0xff
+        elif op == 1:
+            self.acc = (self.acc - self.data[addr]) & 0xff
+        elif op == 2:
+            self.acc = n
+        elif op == 3:
+            self.data[addr] = self.acc
+            self.store = (addr, self.acc)
+            if n == 0:
+                self.leds = self.acc
+        elif op == 4:
+            if self.acc & 0x80:
+                self.ip = n
+        elif op == 5:
+            self.index = self.data[addr]
+        elif op == 6:
+            self.acc &= self.data[addr]
+        self.steps += 1
+        self.cycles += self.period
+        return ip
+
+    def run(self, max_steps):
+        for _ in range(max_steps):
+            self.step()
+
+    def disassemble(self, ip):
+        w = self.code[ip]
+        return "%-5s %d" % (OPS[w >> 8], w & 0xff) if w >> 8 != 7 else "nop"
+
+# Reads the hex that assemble.py writes, one instruction a line
+def readhex(f):
+    return [int(s, 16) for s in f.read().split()]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("hexfile", help="output of assemble.py, - for stdin")
+    parser.add_argument("--steps", type=int, default=100, help="instructions to run")
+    parser.add_argument("--delay-bits", type=int, default=0, help="cycles for each instruction, as a power of 2")
+    parser.add_argument("--notrace", action="store_true", help="print only the stores to the leds")
+    args = parser.parse_args()
+
+    if args.hexfile == "-":
+        code = readhex(sys.stdin)
+    else:
+        with open(args.hexfile) as f:
+            code = readhex(f)
+
+    emu = MiteEmu(code, args.delay_bits)
+    for _ in range(args.steps):
+        ip = emu.step()
+        if not args.notrace:
+            print("%8d  %02x : %03x  %-9s : acc %02x" % (emu.cycles, ip, emu.code[ip], emu.disassemble(ip), emu.acc) +
+                  ("  [%02x] = %02x" % emu.store if emu.store else ""))
+        elif emu.store and emu.store[0] == 0:
+            print("%8d  leds %02x" % (emu.cycles, emu.leds))
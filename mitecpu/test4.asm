@@ -0,0 +1,54 @@
+res leds
+res one
+res four
+res mask
+res i
+res sum
+res table, 4
+res tmp
+
+        ldi 1
+        st  one
+        ldi 4
+        st  four
+        ldi 15
+        st  mask
+        ldi 0
+        st  i
+
+fill:   ldi 7
+        index i
+        st  table
+        ldi 1
+        add i
+        st  i
+        sub four
+        bl  fill
+
+        ldi 0
+        st  sum
+        st  i
+total:  ldi 0
+        add sum
+        index i
+        add table
+        st  sum
+        ldi 1
+        add i
+        st  i
+        sub four
+        bl  total
+
+        ldi -1
+        and mask
+        st  leds
+        ldi 2
+        st  tmp
+        index tmp
+        add table
+        add sum
+        st  tmp
+        add tmp
+        st  leds
+end:    ldi -1
+        bl  end
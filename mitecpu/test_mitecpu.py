@@ -0,0 +1,91 @@
+import argparse
+import glob
+import os
+import sys
+
+from nmigen import *
+from nmigen.sim import *
+
+from mitecpu import MiteCPU
+from assemble import assemble
+from miteemu import MiteEmu
+
+# Runs the test programs on MiteCPU in simulation and on MiteEmu, cycle by
+# cycle: each instruction must complete in the cycle the emulator says,
+# at the same address, with the same store, and leave the same acc and
+# leds, at the full clock and with a delay. test_programs runs them all
+# under pytest.
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Run code for cycles on both, returning a list of the differences
+def compare(code, cycles, delay_bits):
+    cpu = MiteCPU(code, delay_bits)
+    emu = MiteEmu(code, delay_bits)
+    diffs = []
+
+    def process():
+        # The process starts after the first edge, in cycle 1
+        for c in range(1, cycles):
+            yield Settle()
+            if (yield cpu.retire):
+                st = None
+                if (yield cpu.st):
+                    st = ((yield cpu.st_addr), (yield cpu.acc))
+                ip = emu.step()
+                if c != emu.cycles:
+                    diffs.append("cycle %d: instruction at 0x%02x done, expected in cycle %d" % (c, ip, emu.cycles))
+                if (yield cpu.ip_e) != ip:
+                    diffs.append("cycle %d: instruction at 0x%02x, expected 0x%02x" % (c, (yield cpu.ip_e), ip))
+                if st != emu.store:
+                    diffs.append("cycle %d: store %s, expected %s" % (c, st, emu.store))
+                yield
+                yield Settle()
+                if (yield cpu.acc) != emu.acc or (yield cpu.leds) != emu.leds:
+                    diffs.append("cycle %d: acc 0x%02x leds 0x%02x, expected 0x%02x and 0x%02x" % (
+                        c, (yield cpu.acc), (yield cpu.leds), emu.acc, emu.leds))
+            else:
+                if c == emu.cycles + emu.period:
+                    diffs.append("cycle %d: no instruction done" % c)
+                yield
+            if diffs:
+                return
+
+    sim = Simulator(cpu)
+    sim.add_clock(1e-6)
+    sim.add_sync_process(process)
+    sim.run()
+
+    return emu.steps, diffs
+
+def test_programs():
+    for src in sorted(glob.glob(os.path.join(HERE, "test*.asm"))):
+        with open(src) as f:
+            code = assemble(f.read())
+        for delay_bits in [0, 1, 3]:
+            steps, diffs = compare(code, 500 << delay_bits, delay_bits)
+            assert not diffs, "{} with delay_bits {}: {}".format(os.path.basename(src), delay_bits, diffs[0])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("programs", nargs="*", help="assembler sources, default test*.asm")
+    parser.add_argument("--cycles", type=int, default=500, help="cycles to run at the full clock")
+    parser.add_argument("--delay-bits", type=int, nargs="*", default=[0, 1, 3], help="delays to run with")
+    args = parser.parse_args()
+
+    programs = args.programs or sorted(glob.glob(os.path.join(HERE, "test*.asm")))
+
+    errors = 0
+    for src in programs:
+        with open(src) as f:
+            code = assemble(f.read())
+        for delay_bits in args.delay_bits:
+            steps, diffs = compare(code, args.cycles << delay_bits, delay_bits)
+            print("{} with delay_bits {}: {} instructions {}".format(
+                os.path.basename(src), delay_bits, steps, "ok" if not diffs else "differ"))
+            for d in diffs:
+                print("    " + d)
+            errors += bool(diffs)
+
+    print("{} errors".format(errors))
+    sys.exit(1 if errors else 0)
@@ -0,0 +1,91 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from opc6asm import Assembler
+
+# Assembler benchmark: a generated source of nested macros, each instance
+# with its own labels, and with EQU constants and expressions in the
+# operands, is assembled in process, and optionally by another assembler
+# run as a command, such as the old opc6asm.py from git, whose hex must be
+# the same.
+
+PROLOGUE = """\
+MACRO   PUSH( _r_ )
+        push    _r_, r14
+ENDMACRO
+
+MACRO   POP( _r_ )
+        pop     _r_, r14
+ENDMACRO
+
+MACRO   ADD32( _a_, _b_ )
+        add     _a_, _b_
+        adc     _a_+1, _b_+1
+ENDMACRO
+
+MACRO   DELAY( _n_ )
+        PUSH    (r1)
+        mov     r1, r0, _n_
+@loop:  dec     r1, 1
+        nz.mov  pc, r0, @loop
+        POP     (r1)
+ENDMACRO
+
+MACRO   BLOCK( _k_ )
+        ADD32   (r2, r4)
+        DELAY   (_k_ * STEP + 1)
+        ld      r5, r0, table + (_k_ % 16)
+        cmp     r5, r0, (BASE >> 2) & 0xff
+        z.jsr   r13, r0, done
+ENDMACRO
+
+        EQU     STEP, 3
+        EQU     BASE, 0x400
+        ORG     0x0000
+        mov     r14, r0, 0xffff
+"""
+
+EPILOGUE = """\
+done:   mov     pc, r13
+table:  WORD    %s
+        halt    r0, r0, 0x999
+""" % ", ".join("0x%04x" % (i * 37) for i in range(16))
+
+def source(blocks):
+    return PROLOGUE + "".join("b%d:    BLOCK   (%d)\n" % (i, i) for i in range(blocks)) + EPILOGUE
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--blocks", type=int, default=2000, help="macro instances in the source")
+    parser.add_argument("--compare", help="another assembler to run, as python3 asm src hex")
+    args = parser.parse_args()
+
+    src = source(args.blocks)
+    lines = src.count("\n")
+
+    asm = Assembler()
+    t = time.perf_counter()
+    asm.assemble(src)
+    t = time.perf_counter() - t
+    errors = len(asm.errors)
+    print("{} lines, {} words, {} lines expanded: {:.3f} s in process, {:.0f} lines/s".format(
+        lines, asm.wcount, len(asm.listing), t, len(asm.listing) / t))
+
+    if args.compare:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            srcfile, hexfile = os.path.join(tmpdir, "bench.s"), os.path.join(tmpdir, "bench.hex")
+            with open(srcfile, "w") as f:
+                f.write(src)
+            t = time.perf_counter()
+            subprocess.run([sys.executable, args.compare, srcfile, hexfile], check=True, stdout=subprocess.DEVNULL)
+            t = time.perf_counter() - t
+            with open(hexfile) as f:
+                same = f.read() == asm.hex()
+            print("{}: {:.3f} s, hex {}".format(args.compare, t, "the same" if same else "differs"))
+            errors += not same
+
+    print("{} errors".format(errors))
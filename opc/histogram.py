@@ -0,0 +1,103 @@
+import argparse
+import gzip
+import re
+import sys
+
+from opc6asm import COMMENT_RE, LINE_RE, OPCODES
+from opc6emu import DECODE, OPS, PRED, PREDS, OPC6Emu
+from readhex import readhex
+
+# Instruction histograms of OPC6 programs: static, of the instructions in
+# an opc6asm.py listing, or dynamic, of those run, from an opc6emu.py trace
+# or by running a hex file on the emulator. Instructions are counted by
+# opcode, with those predicated off and those of two words, and by
+# predicate.
+
+TRACE_RE = re.compile(r"^([0-9a-f]{4}) : ([0-9a-f]{4}) [0-9a-f ]{4} : .*? : [0-9A-F] \d (\d) (\d) (\d) :")
+LIST_RE  = re.compile(r"^([0-9a-f]{4})  ([0-9a-f]{4})")
+
+class Histogram:
+    def __init__(self):
+        self.ops   = [0] * len(OPS)
+        self.off   = [0] * len(OPS)
+        self.two   = [0] * len(OPS)
+        self.preds = [0] * 8
+
+    # Count n of instruction word w, off of them predicated off
+    def add(self, w, n=1, off=0):
+        op = DECODE[w][0]
+        self.ops[op] += n
+        self.off[op] += off
+        self.two[op] += n if w & 0x1000 else 0
+        self.preds[w >> 13] += n
+
+    # Static counts, of the instructions in a listing
+    @classmethod
+    def from_listing(cls, f):
+        h = cls()
+        for line in f:
+            m = LIST_RE.match(line)
+            if m and LINE_RE.match(COMMENT_RE.sub("", line[28:])).group("inst") in OPCODES:
+                h.add(int(m.group(2), 16))
+        return h
+
+    # Dynamic counts, from a trace, in which an instruction is predicated
+    # off if its predicate fails on the flags after the one before
+    @classmethod
+    def from_trace(cls, f):
+        h = cls()
+        flags = 0
+        for line in f:
+            m = TRACE_RE.match(line)
+            if m:
+                w = int(m.group(2), 16)
+                h.add(w, off=0 if PRED[((w >> 13) << 3) | flags] else 1)
+                flags = int(m.group(3)) << 2 | int(m.group(4)) << 1 | int(m.group(5))
+        return h
+
+    # Dynamic counts, from those of an emulator run with stats
+    @classmethod
+    def from_emulator(cls, emu):
+        h = cls()
+        for w, n in enumerate(emu.counts):
+            if n:
+                h.add(w, n, emu.off[w])
+        return h
+
+    def write(self, f, title, width):
+        total = sum(self.ops)
+        scale = width / max(max(self.ops), 1)
+        f.write("{}: {} instructions, {} predicated off, {} of two words\n\n".format(
+            title, total, sum(self.off), sum(self.two)))
+        f.write("{:<8} {:>9} {:>7} {:>9} {:>9}\n".format("op", "count", "%", "off", "2-word"))
+        for i in sorted(range(len(OPS)), key=lambda i: -self.ops[i]):
+            if self.ops[i]:
+                f.write("{:<8} {:>9} {:>6.2f}% {:>9} {:>9}  {}\n".format(
+                    OPS[i], self.ops[i], 100 * self.ops[i] / total, self.off[i], self.two[i],
+                    "#" * round(self.ops[i] * scale)))
+        f.write("\n{:<8} {:>9} {:>7}\n".format("pred", "count", "%"))
+        for p in range(8):
+            if self.preds[p] and p != 1:
+                n = self.preds[p] + (self.preds[1] if p == 0 else 0)
+                f.write("{:<8} {:>9} {:>6.2f}%\n".format(PREDS[p][:-1] or "always", n, 100 * n / total))
+
+def open_text(path):
+    return gzip.open(path, "rt") if path.endswith(".gz") else open(path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("-d", "--dynamic", action="store_true", help="count the instructions run, from a trace or hex file")
+    mode.add_argument("-s", "--static", action="store_true", help="count the instructions in a listing")
+    parser.add_argument("-f", "--file", help="trace (.gz too), hex or listing file, default stdin")
+    parser.add_argument("-w", "--width", type=int, default=32, help="width of the longest bar")
+    args = parser.parse_args()
+
+    if args.dynamic and args.file and args.file.endswith(".hex"):
+        emu = OPC6Emu(readhex(args.file), stats=True)
+        emu.run()
+        h = Histogram.from_emulator(emu)
+    else:
+        with open_text(args.file) if args.file else sys.stdin as f:
+            h = Histogram.from_trace(f) if args.dynamic else Histogram.from_listing(f)
+    h.write(sys.stdout, "Dynamic" if args.dynamic else "Static", args.width)
@@ -4,13 +4,16 @@ HLT=0x10;BSWP=0x11;PPSR=0x12;GPSR=0x13;RTI=0x14;NOT=0x15;OUT=0x16;IN=0x17;PUSH=0
 FET0=0x0;FET1=0x1;EAD=0x2;RDM=0x3;EXEC=0x4;WRM=0x5;INT=0x6
 EI=3;S=2;C=1;Z=0;P0=15;P1=14;P2=13;IRLEN=12;IRLD=16;IRSTO=17;IRNPRED=18;IRWBK=19;INT_VECTOR0=0x0002;INT_VECTOR1=0x0004
 class OPC6(Elaboratable):
-    def __init__(self):
+    def __init__(self, stats=False):
         self.reset_b = Signal(); self.din = Signal(16); self.int_b = Signal(2); self.clken = Signal(); self.vpa = Signal(); self.vda = Signal()
         self.vio = Signal(); self.dout = Signal(16); self.address = Signal(16); self.rnw = Signal(); self.halted = Signal()
+        self.stats = stats # Performance counters: instructions retired, executed by opcode and predicated off, cycles stalled by clken, and cycles in each state
+        self.PC_q = Signal(16, name="PC_q"); self.PSR_q = Signal(8, name="PSR_q"); self.FSM_q = Signal(3, name="FSM_q"); self.RF_q = Memory(width=16, depth=16, name="reg") # Architectural state, for co-simulation
+        if stats: self.retired = Signal(32); self.op_counts = Array(Signal(32, name="op_count%d" % i) for i in range(32)); self.pred_off = Signal(32); self.stalls = Signal(32); self.state_cycles = Array(Signal(32, name="state_cycles%d" % i) for i in range(8))
     def ports(self): return [self.reset_b, self.din, self.int_b, self.clken, self.halted, self.vpa, self.vda, self.vio, self.dout, self.address, self.rnw]
     def elaborate(self, platform):
-        OR_q, PC_q, PCI_q, result, IR_q, FSM_q, swiid, PSRI_q, PSR_q, zero, carry, sign, enable_int, reset_s0_b, reset_s1_b, pred_q, op, op_d,pred_d, pred_din, RF_w_p2, RF_dout, operand, repl1, repl2 = tuple(map(lambda x: Signal(x), [16,16,16,16,20,3,4,4,8,1,1,1,1,1,1,1,5,5,1,1,16,16,16,16,16]))
-        RF_q = Memory(width=16, depth=16, name="reg")       
+        OR_q, PCI_q, result, IR_q, swiid, PSRI_q, zero, carry, sign, enable_int, reset_s0_b, reset_s1_b, pred_q, op, op_d,pred_d, pred_din, RF_w_p2, RF_dout, operand, repl1, repl2, alu_carry = tuple(map(lambda x: Signal(x), [16,16,16,20,4,4,1,1,1,1,1,1,1,5,5,1,1,16,16,16,16,16,1]))
+        PC_q, PSR_q, FSM_q, RF_q = self.PC_q, self.PSR_q, self.FSM_q, self.RF_q
         m = Module()
         m.d.comb += [
             op.eq(Cat([IR_q[8:12],IR_q[IRNPRED]])),
@@ -28,17 +31,17 @@ class OPC6(Elaboratable):
             self.vpa.eq((FSM_q == FET0) | (FSM_q == FET1) | (FSM_q == EXEC)),
             self.vda.eq(((FSM_q == RDM) | (FSM_q == WRM)) & (op != IN) & (op != OUT)),
             self.vio.eq(((FSM_q == RDM) | (FSM_q == WRM)) & ((op == IN) | (op == OUT))),
-            Cat([zero, carry, sign, enable_int, swiid]).eq(Mux((op == PPSR), operand[:8], Mux((IR_q[:4] != 0xf), Cat([(result == 0), carry, result[15], PSR_q[3:8]]), PSR_q)))
+            Cat([zero, carry, sign, enable_int, swiid]).eq(Mux((op == PPSR), operand[:8], Mux((IR_q[:4] != 0xf), Cat([(result == 0), alu_carry, result[15], PSR_q[3:8]]), PSR_q)))
         ]
-        with m.If((op == HLT) & (FSM_q == EXEC)): m.d.sync += self.halted.eq(1)
+        with m.If((op == HLT) & (FSM_q == EXEC) & self.clken): m.d.sync += self.halted.eq(1)
         with m.Switch(op): # ALU
-            with m.Case(AND, OR): m.d.comb += Cat([result,carry]).eq(Mux(Cat([IR_q[8],PSR_q[C]]), (RF_dout & operand), (RF_dout | operand)))
-            with m.Case(ADD, ADC, INC): m.d.comb += Cat([result,carry]).eq(RF_dout + operand + (IR_q[8] & PSR_q[C]))
-            with m.Case(SUB, SBC, CMP, CMPC, DEC): m.d.comb += Cat([result,carry]).eq(RF_dout + (operand ^ 0xffff) + Mux(IR_q[8], PSR_q[C],1))
-            with m.Case(XOR, GPSR): m.d.comb += Cat([result,carry]).eq(Mux(IR_q[IRNPRED], Cat([PSR_q,Const(0,8),PSR_q[C]]), (RF_dout ^ operand)))
-            with m.Case(NOT, BSWP): m.d.comb += Cat([carry,result]).eq(Mux(IR_q[10],Cat([PSR_q[C], ~operand]),Cat([PSR_q[C], operand[8:], operand[:8]])))
-            with m.Case(ROR, ASR, LSR): m.d.comb += Cat([carry,result]).eq(Cat([operand, Mux((IR_q[10] == 0), PSR_q[C], Mux(IR_q[8], operand[15], 0))]))
-            with m.Default(): m.d.comb += Cat([result,carry]).eq(Cat([operand, PSR_q[C]]))
+            with m.Case(AND, OR): m.d.comb += Cat([result,alu_carry]).eq(Cat([Mux(IR_q[8], (RF_dout & operand), (RF_dout | operand)), PSR_q[C]]))
+            with m.Case(ADD, ADC, INC): m.d.comb += Cat([result,alu_carry]).eq(RF_dout + operand + (IR_q[8] & PSR_q[C]))
+            with m.Case(SUB, SBC, CMP, CMPC, DEC): m.d.comb += Cat([result,alu_carry]).eq(RF_dout + (operand ^ 0xffff) + Mux(IR_q[8], PSR_q[C],1))
+            with m.Case(XOR, GPSR): m.d.comb += Cat([result,alu_carry]).eq(Mux(IR_q[IRNPRED], Cat([PSR_q,Const(0,8),PSR_q[C]]), Cat([(RF_dout ^ operand),PSR_q[C]])))
+            with m.Case(NOT, BSWP): m.d.comb += Cat([alu_carry,result]).eq(Mux(IR_q[10],Cat([PSR_q[C], ~operand]),Cat([PSR_q[C], operand[8:], operand[:8]])))
+            with m.Case(ROR, ASR, LSR): m.d.comb += Cat([alu_carry,result]).eq(Cat([operand, Mux((IR_q[10] == 0), PSR_q[C], Mux(IR_q[9], operand[15], 0))]))
+            with m.Default(): m.d.comb += Cat([result,alu_carry]).eq(Cat([operand, PSR_q[C]]))
         with m.If(self.clken):
             m.d.sync += [ reset_s0_b.eq(self.reset_b), reset_s1_b.eq(reset_s0_b), pred_q.eq(Mux(FSM_q == FET0, pred_din, pred_d)) ]
             with m.If(reset_s1_b == 0): m.d.sync += [ PC_q.eq(0), PCI_q.eq(0), PSR_q.eq(0), FSM_q.eq(0) ]
@@ -47,7 +50,7 @@ class OPC6(Elaboratable):
                     with m.Case(FET0): m.d.sync += FSM_q.eq(Mux(self.din[IRLEN], FET1, Mux((pred_din == 0),  FET0, Mux(((self.din[8:12] == LD) | (self.din[8:12] == STO) | (op_d == PUSH) | (op_d == POP)), EAD, EXEC))))
                     with m.Case(FET1): m.d.sync += FSM_q.eq(Mux((pred_q == 0), FET0, Mux(((IR_q[:4] != 0) | IR_q[IRLD] | IR_q[IRSTO]), EAD, EXEC)))
                     with m.Case(EAD): m.d.sync += FSM_q.eq(Mux(IR_q[IRLD], RDM, Mux(IR_q[IRSTO], WRM, EXEC)))
-                    with m.Case(EXEC): m.d.sync += FSM_q.eq(Mux((((self.int_b != 3) & PSR_q[EI]) | ((op == PPSR) & (swiid != 0))), INT, Mux(((IR_q[:4] == 0xf) | (op == JSR)), FET0, Mux(self.din[IRLEN], FET1, Mux(((self.din[8:12] == LD) | (self.din[8:12] == STO) | (op_d == POP) | (op_d == PUSH)), EAD, Mux(pred_d, EXEC, FET0))))))
+                    with m.Case(EXEC): m.d.sync += FSM_q.eq(Mux((((self.int_b != 3) & PSR_q[EI]) | ((op == PPSR) & (swiid != 0))), INT, Mux(((IR_q[:4] == 0xf) | (op == JSR)), FET0, Mux(self.din[IRLEN], FET1, Mux((pred_d == 0), FET0, Mux(((self.din[8:12] == LD) | (self.din[8:12] == STO) | (op_d == POP) | (op_d == PUSH)), EAD, EXEC))))))
                     with m.Case(WRM): m.d.sync += FSM_q.eq(Mux(((self.int_b != 3) & PSR_q[EI]), INT, FET0))
                     with m.Default(): m.d.sync += FSM_q.eq(Mux((FSM_q == RDM), EXEC, FET0))
                 m.d.sync += OR_q.eq(Mux(((FSM_q == FET0) | (FSM_q == EXEC)), Repl((op_d == PUSH), 16) ^ Cat([Mux(((op_d == DEC) | (op_d == INC)), self.din[4:8], Cat([op_d == POP, Const(0,3)])), Const(0,12)]), Mux(FSM_q == EAD, RF_w_p2 + OR_q, self.din)))
@@ -61,4 +64,15 @@ class OPC6(Elaboratable):
                 with m.If(((FSM_q == EXEC) & (op != CMP) & (op != CMPC)) | (((FSM_q == WRM) | (FSM_q == RDM)) & IR_q[IRWBK])): m.d.sync += RF_q[IR_q[:4]].eq(Mux((op == JSR), PC_q, result)) 
                 with m.If((FSM_q == FET0) | (FSM_q == EXEC)): m.d.sync += IR_q.eq(Cat([self.din, ((self.din[8:12] == LD) | (op_d == POP)), ((self.din[8:12] == STO) | (op_d == PUSH)), ((self.din[13:] == 1)), ((op_d == PUSH) | (op_d == POP))])) 
                 with m.Elif(((FSM_q == EAD) & (IR_q[IRLD] | IR_q[IRSTO])) | (FSM_q == RDM)): m.d.sync += IR_q[:8].eq(Cat([IR_q[4:8],IR_q[:4]])) #  Swap source/dest reg in EA for reads and writes for writeback of 'source' in push/pop .. swap back again in RDMEM
+        if self.stats: # An instruction is retired when executed, in EXEC or in WRM for sto and push, or when fetched and predicated off, in FET0, FET1 or in EXEC after the one before
+            executed, skipped = Signal(), Signal()
+            m.d.comb += [
+                executed.eq((FSM_q == EXEC) | (FSM_q == WRM)),
+                skipped.eq(Mux(FSM_q == FET1, pred_q == 0, ~self.din[IRLEN] & Mux(FSM_q == FET0, pred_din == 0, (FSM_q == EXEC) & (pred_d == 0) & (op != HLT) & (IR_q[:4] != 0xf) & (op != JSR) & ~(((self.int_b != 3) & PSR_q[EI]) | ((op == PPSR) & (swiid != 0))))))
+            ]
+            with m.If(reset_s1_b & ~self.halted):
+                with m.If(self.clken):
+                    m.d.sync += [ self.retired.eq(self.retired + executed + skipped), self.pred_off.eq(self.pred_off + skipped), self.state_cycles[FSM_q].eq(self.state_cycles[FSM_q] + 1) ]
+                    with m.If(executed): m.d.sync += self.op_counts[op].eq(self.op_counts[op] + 1)
+                with m.Else(): m.d.sync += self.stalls.eq(self.stalls + 1)
         return m
@@ -0,0 +1,221 @@
+from nmigen import *
+
+# An instruction cache and a data cache for OPC6, in front of a slower
+# memory such as SDRAM.
+#
+# The CPU's address is looked up in both caches each cycle, and a hit
+# is returned on din in the same cycle, as from a Memory read port, so a run
+# of hits takes no more cycles than from BRAM. On a miss clken is held
+# low while the line is filled from the memory, a word at a time, after
+# which the access hits. Stores are written through, to a one word write
+# buffer, so a store stalls only if the buffer is still full with the one
+# before; a store updates the line it hits in either cache but does not
+# fill one it misses. A fill waits for the write buffer to be empty, so it
+# reads what was stored. IO accesses pass straight through, with their
+# read data from io_din.
+#
+# The memory port takes a request, mem_rd or mem_wr with mem_addr and
+# mem_wdata, held until mem_ack is set, with mem_rdata, in the last cycle
+# of the access.
+
+class Cache(Elaboratable):
+    def __init__(self, lines=64, line_words=4, ways=1):
+        assert ways in (1, 2)
+        assert line_words >= 2 and line_words & (line_words - 1) == 0
+        assert lines >= ways and lines & (lines - 1) == 0
+        self.lines      = lines
+        self.line_words = line_words
+        self.ways       = ways
+
+        self.addr       = Signal(16)   # Looked up
+        self.hit        = Signal()
+        self.rdata      = Signal(16)
+        self.wdata      = Signal(16)
+        self.write      = Signal()     # Write wdata to the word at addr, if it hits
+        self.used       = Signal()     # The line at addr was used, for the LRU
+        self.fill       = Signal()     # Write wdata to word fill_word of the victim line for addr
+        self.fill_word  = Signal(range(line_words))
+        self.fill_done  = Signal()     # and make the line valid, with the tag of addr
+
+    def elaborate(self, platform):
+        m = Module()
+
+        sets = self.lines // self.ways
+        ob = (self.line_words - 1).bit_length()
+        ib = (sets - 1).bit_length()
+
+        index  = self.addr[ob:ob + ib]
+        tag    = self.addr[ob + ib:]
+        victim = Signal(range(2))
+        hits   = Signal(self.ways)
+        valids = Signal(self.ways)
+        words  = []
+
+        for w in range(self.ways):
+            tags = Memory(width=len(tag) + 1, depth=sets, name="tags%d" % w) # Valid and tag
+            data = Memory(width=16, depth=sets * self.line_words, name="data%d" % w)
+            m.submodules["tag_rd%d" % w] = tag_rd = tags.read_port(domain="comb")
+            m.submodules["tag_wr%d" % w] = tag_wr = tags.write_port()
+            m.submodules["data_rd%d" % w] = data_rd = data.read_port(domain="comb")
+            m.submodules["data_wr%d" % w] = data_wr = data.write_port()
+
+            m.d.comb += [
+                tag_rd.addr.eq(index),
+                valids[w].eq(tag_rd.data[0]),
+                hits[w].eq(tag_rd.data == Cat([C(1, 1), tag])),
+                data_rd.addr.eq(self.addr[:ob + ib]),
+                tag_wr.addr.eq(index),
+                tag_wr.data.eq(Cat([C(1, 1), tag])),
+                tag_wr.en.eq(self.fill_done & (victim == w)),
+                data_wr.addr.eq(Mux(self.fill, Cat([self.fill_word, index]), self.addr[:ob + ib])),
+                data_wr.data.eq(self.wdata),
+                data_wr.en.eq((self.fill & (victim == w)) | (self.write & hits[w]))
+            ]
+            words.append(data_rd.data)
+
+        m.d.comb += self.hit.eq(hits.any())
+
+        if self.ways == 1:
+            m.d.comb += self.rdata.eq(words[0])
+        else:
+            lru = Array(Signal(name="lru%d" % i) for i in range(sets)) # The way to replace next
+            m.d.comb += [
+                self.rdata.eq(Mux(hits[1], words[1], words[0])),
+                victim.eq(Mux(~valids[0], 0, Mux(~valids[1], 1, lru[index])))
+            ]
+            with m.If(self.used & self.hit):
+                m.d.sync += lru[index].eq(~hits[1])
+
+        return m
+
+class OPC6Cache(Elaboratable):
+    def __init__(self, lines=64, line_words=4, ways=1):
+        self.line_words = line_words
+        self.icache = Cache(lines, line_words, ways)
+        self.dcache = Cache(lines, line_words, ways)
+
+        # CPU port, named as on the CPU
+        self.address   = Signal(16)
+        self.dout      = Signal(16)
+        self.rnw       = Signal()
+        self.vpa       = Signal()
+        self.vda       = Signal()
+        self.vio       = Signal()
+        self.din       = Signal(16)
+        self.clken     = Signal()
+        self.io_din    = Signal(16)
+
+        # Memory port
+        self.mem_addr  = Signal(16)
+        self.mem_rd    = Signal()
+        self.mem_wr    = Signal()
+        self.mem_wdata = Signal(16)
+        self.mem_rdata = Signal(16)
+        self.mem_ack   = Signal()
+
+        self.idle      = Signal() # Nothing left to write to the memory
+
+        # Counters: fetches, data reads and stores completed, fetches and
+        # reads that missed, cycles a store waited for the write buffer,
+        # and cycles with clken low
+        self.fetches      = Signal(32)
+        self.fetch_misses = Signal(32)
+        self.reads        = Signal(32)
+        self.read_misses  = Signal(32)
+        self.writes       = Signal(32)
+        self.write_stalls = Signal(32)
+        self.stalls       = Signal(32)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        m.submodules.icache = icache = self.icache
+        m.submodules.dcache = dcache = self.dcache
+
+        ob = (self.line_words - 1).bit_length()
+
+        fetch    = Signal()
+        read     = Signal()
+        write    = Signal()
+        imiss    = Signal()
+        dmiss    = Signal()
+        full     = Signal()   # The write buffer cannot take a store this cycle
+        filling  = Signal()
+        fill_i   = Signal()   # Filling the instruction cache
+        count    = Signal(range(self.line_words))
+        last     = Signal()
+        wb_valid = Signal()
+        wb_addr  = Signal(16)
+        wb_data  = Signal(16)
+
+        m.d.comb += [
+            fetch.eq(self.vpa),
+            read.eq(self.vda & self.rnw),
+            write.eq(self.vda & ~self.rnw),
+            imiss.eq(fetch & ~icache.hit),
+            dmiss.eq(read & ~dcache.hit),
+            full.eq(wb_valid & ~(self.mem_wr & self.mem_ack)),
+            last.eq(count == self.line_words - 1),
+            self.clken.eq(~filling & ~imiss & ~dmiss & ~(write & full)),
+            self.din.eq(Mux(self.vio, self.io_din, Mux(self.vpa, icache.rdata, dcache.rdata))),
+            self.idle.eq(~wb_valid),
+            self.mem_rd.eq(filling),
+            self.mem_wr.eq(wb_valid & ~filling),
+            self.mem_addr.eq(Mux(filling, Cat([count, self.address[ob:]]), wb_addr)),
+            self.mem_wdata.eq(wb_data)
+        ]
+
+        for cache, fills in ((icache, fill_i), (dcache, ~fill_i)):
+            m.d.comb += [
+                cache.addr.eq(self.address),
+                cache.wdata.eq(Mux(filling, self.mem_rdata, self.dout)),
+                cache.write.eq(write & self.clken),
+                cache.fill.eq(filling & fills & self.mem_ack),
+                cache.fill_word.eq(count),
+                cache.fill_done.eq(filling & fills & self.mem_ack & last)
+            ]
+        m.d.comb += [
+            icache.used.eq(fetch & self.clken),
+            dcache.used.eq(self.vda & self.clken)
+        ]
+
+        # Fill a line, after the write buffer has been written
+        with m.If(filling):
+            with m.If(self.mem_ack):
+                m.d.sync += count.eq(count + 1)
+                with m.If(last):
+                    m.d.sync += filling.eq(0)
+        with m.Elif((imiss | dmiss) & ~wb_valid):
+            m.d.sync += [
+                filling.eq(1),
+                fill_i.eq(imiss),
+                count.eq(0)
+            ]
+            with m.If(imiss):
+                m.d.sync += self.fetch_misses.eq(self.fetch_misses + 1)
+            with m.Else():
+                m.d.sync += self.read_misses.eq(self.read_misses + 1)
+
+        # Write buffer
+        with m.If(write & self.clken):
+            m.d.sync += [
+                wb_valid.eq(1),
+                wb_addr.eq(self.address),
+                wb_data.eq(self.dout)
+            ]
+        with m.Elif(self.mem_wr & self.mem_ack):
+            m.d.sync += wb_valid.eq(0)
+
+        with m.If(self.clken):
+            m.d.sync += [
+                self.fetches.eq(self.fetches + fetch),
+                self.reads.eq(self.reads + read),
+                self.writes.eq(self.writes + write)
+            ]
+        with m.Else():
+            m.d.sync += [
+                self.stalls.eq(self.stalls + 1),
+                self.write_stalls.eq(self.write_stalls + (write & full))
+            ]
+
+        return m
@@ -0,0 +1,227 @@
+import argparse
+import collections
+import glob
+import io
+import os
+import sys
+import time
+from array import array
+
+from nmigen import *
+from nmigen.sim import *
+
+import opc6
+import opc6a
+import opc6p
+from opc6asm import Assembler
+from opc6emu import OPC6Emu
+
+FET0 = opc6.FET0; EXEC = opc6.EXEC
+
+CORES = {"opc6": opc6.OPC6, "opc6a": opc6a.OPC6, "opc6p": opc6p.OPC6}
+
+# Runs programs on an OPC6 core in simulation, with a memory model, and on
+# OPC6Emu in lockstep. Each time the core fetches the instruction that the
+# emulator runs next, all the instructions before it have been run, and
+# the registers, the PSR, the memory and the outs of the two are compared.
+# The pipelined core instead signals each instruction it completes, and
+# they are compared after each.
+# The first difference stops the run, with the last instructions run.
+# Cycles per instruction are reported for each program, counting those
+# predicated off.
+
+class Top(Elaboratable):
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.din = Signal(16)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        m.submodules.cpu = cpu = self.cpu
+
+        m.d.comb += [
+            cpu.int_b.eq(3),
+            cpu.reset_b.eq(1),
+            cpu.clken.eq(1),
+            cpu.din.eq(self.din)
+        ]
+
+        return m
+
+# Assemble a program, returning its memory image, and writing it to
+# hexfile if given
+def assemble(src, hexfile=None):
+    asm = Assembler()
+    with open(src) as f:
+        if not asm.assemble(f.read()):
+            raise ValueError("{}:\n{}".format(src, "\n".join(asm.errors)))
+    if hexfile:
+        with open(hexfile, "w") as f:
+            f.write(asm.hex())
+    return asm.mem
+
+# One clock cycle of the core, with its reads served from mem or iomem and
+# its writes stored there, and the outs added to outputs. Returns the
+# address of the core before the edge.
+def cycle(top, mem, iomem, outputs):
+    cpu = top.cpu
+    yield Settle()
+    address = yield cpu.address
+    if (yield cpu.rnw):
+        yield top.din.eq(iomem[address] if (yield cpu.vio) else mem[address])
+    elif (yield cpu.vio):
+        iomem[address] = yield cpu.dout
+        outputs.append((address, iomem[address]))
+    elif (yield cpu.vda):
+        mem[address] = yield cpu.dout
+    yield
+    yield Settle()
+    return address
+
+# Run code on a core until it halts, returning the cycles, whether it
+# halted, the outs and the memory
+def simulate(core, code, max_cycles):
+    top = Top(CORES[core]())
+    mem = array('H', bytes(0x20000))
+    mem[:len(code)] = array('H', code)
+    iomem = array('H', bytes(0x20000))
+    outputs = []
+    result = [0, False]
+
+    def process():
+        while result[0] < max_cycles:
+            yield from cycle(top, mem, iomem, outputs)
+            result[0] += 1
+            if (yield top.cpu.halted):
+                result[1] = True
+                return
+
+    sim = Simulator(top)
+    sim.add_clock(1e-6)
+    sim.add_sync_process(process)
+    sim.run()
+
+    return result[0], result[1], outputs, mem
+
+# Run code on a core and the emulator, returning the cycles, the
+# instructions and a list of the differences, which is empty if there were
+# none
+def cosim(core, code, max_cycles, window):
+    top = Top(CORES[core]())
+    emu = OPC6Emu(code)
+    mem = array('H', emu.mem)
+    iomem = array('H', bytes(0x20000))
+    outputs = []
+    history = collections.deque(maxlen=window)
+    cycles = [0]
+    diffs = []
+
+    def compare(cpu):
+        for i in range(1, 15):
+            v = yield cpu.RF_q[i]
+            if v != emu.regs[i]:
+                diffs.append("r%d is 0x%04x, expected 0x%04x" % (i, v, emu.regs[i]))
+        v = yield cpu.PSR_q
+        if v != emu.psr:
+            diffs.append("psr is 0x%02x, expected 0x%02x" % (v, emu.psr))
+        if mem != emu.mem:
+            a = next(a for a in range(len(mem)) if mem[a] != emu.mem[a])
+            diffs.append("mem[0x%04x] is 0x%04x, expected 0x%04x" % (a, mem[a], emu.mem[a]))
+        if outputs != emu.outputs:
+            diffs.append("%d outs, expected %d" % (len(outputs), len(emu.outputs)))
+
+    def step():
+        trace = io.StringIO()
+        emu.run(1, trace=trace)
+        history.append("%8d  %s" % (cycles[0], trace.getvalue().rstrip().replace("\n", "\n" + " " * 10)))
+
+    def retired():
+        cpu = top.cpu
+        while cycles[0] < max_cycles:
+            yield from cycle(top, mem, iomem, outputs)
+            cycles[0] += 1
+            if (yield cpu.retire):
+                step()
+                yield from compare(cpu)
+                if diffs or emu.halted:
+                    return
+            if (yield cpu.halted):
+                diffs.append("halted, expected to run on at 0x%04x" % emu.pc)
+                return
+        diffs.append("not halted after %d cycles" % max_cycles)
+
+    def process():
+        cpu = top.cpu
+        if hasattr(cpu, "retire"):
+            yield from retired()
+            return
+        stray = 0
+        # The core fetches from 0 while it is held in reset, and the fetch
+        # that runs is the one after which the PC moves on
+        yield top.din.eq(mem[0])
+        while not (yield cpu.PC_q):
+            yield
+            cycles[0] += 1
+            yield Settle()
+        emu.run(1, trace=io.StringIO())
+        while cycles[0] < max_cycles:
+            fsm = yield cpu.FSM_q
+            address = yield from cycle(top, mem, iomem, outputs)
+            cycles[0] += 1
+            if (yield cpu.halted):
+                yield from compare(cpu)
+                if not emu.halted:
+                    diffs.append("halted at 0x%04x, expected to run on at 0x%04x" % (address, emu.pc))
+                return
+            if fsm in (FET0, EXEC):
+                if address == emu.pc and not emu.halted:
+                    stray = 0
+                    yield from compare(cpu)
+                    if diffs:
+                        return
+                    step()
+                else:
+                    # Only the fetch after a jump or before an interrupt is
+                    # not run
+                    stray += 1
+                    if stray > 1:
+                        diffs.append("fetched from 0x%04x, expected 0x%04x" % (address, emu.pc))
+                        return
+        diffs.append("not halted after %d cycles" % max_cycles)
+
+    sim = Simulator(top)
+    sim.add_clock(1e-6)
+    sim.add_sync_process(process)
+    sim.run()
+
+    if diffs:
+        print("\n".join(history))
+    return cycles[0], emu.steps, diffs
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("programs", nargs="*", help="assembler sources, default all in tests")
+    parser.add_argument("--core", choices=list(CORES) + ["all"], default="all", help="core to run")
+    parser.add_argument("--max-cycles", type=int, default=3000000, help="maximum cycles for each program")
+    parser.add_argument("--window", type=int, default=16, help="instructions shown before a difference")
+    args = parser.parse_args()
+
+    programs = args.programs or sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "tests", "*.s")))
+    cores = list(CORES) if args.core == "all" else [args.core]
+
+    errors = 0
+    for src in programs:
+        code = assemble(src)
+        for core in cores:
+            t = time.perf_counter()
+            cycles, steps, diffs = cosim(core, code, args.max_cycles, args.window)
+            t = time.perf_counter() - t
+            for d in diffs:
+                print("  " + d)
+            errors += 1 if diffs else 0
+            print("{:<16} {:<6} {:>9} instructions {:>9} cycles CPI {:.3f} {:>7.1f} s {}".format(
+                os.path.basename(src), core, steps, cycles, cycles / max(steps, 1), t,
+                "differs" if diffs else "ok"))
+    print("{} errors".format(errors))
+    sys.exit(1 if errors else 0)
@@ -0,0 +1,154 @@
+from nmigen import *
+
+from opc6 import OPC6
+from opc6_cache import OPC6Cache
+from sdram16 import Sdram
+
+# OPC6 running from SDRAM, through OPC6Cache.
+#
+# The SDRAM controller does an access, or a refresh if there is none, in
+# each eight cycles of the 100MHz sdram clock, started by a rising edge on
+# its sync input. SdramPort runs in the sync domain, at ratio times slower,
+# and starts one every 8 // ratio cycles, in a slot: a request made in the
+# first cycle of a slot is done by the last, when it is acknowledged, and
+# one made later waits for the next slot. A slot with no request is a
+# refresh, and one in 64 is kept for a refresh if there has been none,
+# for one each 7.8us. The first slots after power on are left to the
+# controller to initialise the SDRAM.
+#
+# System copies a program into the SDRAM, and then takes the CPU out of
+# reset to run it. The ROM holds the address and the word of each word of
+# the program that is not zero, as the programs are mostly empty memory,
+# and only those are written, or with clear all 64K words, with zeros
+# between them. opc6_sdram_test.py builds it for the ULX3S.
+
+class SdramPort(Elaboratable):
+    def __init__(self, ratio=4):
+        assert ratio in (2, 4)
+        self.slot_cycles = 8 // ratio
+
+        self.ctrl  = Sdram()
+
+        self.addr  = Signal(16)
+        self.rd    = Signal()
+        self.wr    = Signal()
+        self.wdata = Signal(16)
+        self.rdata = Signal(16)
+        self.ack   = Signal()
+        self.up    = Signal() # The SDRAM is initialised
+
+    def elaborate(self, platform):
+        m = Module()
+
+        m.submodules.ctrl = ctrl = self.ctrl
+
+        slot = Signal(range(self.slot_cycles))
+        boot = Signal(range(40)) # Slots since power on
+        busy = Signal()          # An access was started in this slot
+        wait = Signal(6)         # Slots since the last refresh
+        due  = Signal()          # This slot is for a refresh
+
+        m.d.comb += [
+            self.up.eq(boot == 39),
+            due.eq(~self.up | wait.all()),
+            ctrl.init.eq(boot == 0),
+            ctrl.sync.eq(slot == 0),
+            ctrl.addr.eq(self.addr),
+            ctrl.din.eq(self.wdata),
+            ctrl.ds.eq(C(0b11, 2)),
+            ctrl.oe.eq(~due & self.rd),
+            ctrl.we.eq(~due & self.wr),
+            self.rdata.eq(ctrl.dout),
+            self.ack.eq(busy & (slot == self.slot_cycles - 1))
+        ]
+
+        m.d.sync += slot.eq(Mux(slot == self.slot_cycles - 1, 0, slot + 1))
+
+        with m.If(slot == 0):
+            m.d.sync += [
+                busy.eq(~due & (self.rd | self.wr)),
+                wait.eq(Mux(~due & (self.rd | self.wr), wait + 1, 0))
+            ]
+        with m.If((slot == self.slot_cycles - 1) & ~self.up):
+            m.d.sync += boot.eq(boot + 1)
+
+        return m
+
+class System(Elaboratable):
+    def __init__(self, image, ratio=4, lines=64, line_words=4, ways=1, clear=False, cpu=None):
+        self.words  = [(a, w) for a, w in enumerate(image) if w] or [(0, 0)]
+        self.clear  = clear
+        self.cpu    = cpu or OPC6()
+        self.cache  = OPC6Cache(lines, line_words, ways)
+        self.port   = SdramPort(ratio)
+        self.io_din = Signal(16)
+        self.loaded = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+
+        m.submodules.cpu   = cpu   = self.cpu
+        m.submodules.cache = cache = self.cache
+        m.submodules.port  = port  = self.port
+
+        rom = Memory(width=32, depth=len(self.words), init=[a << 16 | w for a, w in self.words])
+        m.submodules.rom_rd = rom_rd = rom.read_port(transparent=False)
+        index     = Signal(range(len(self.words) + 1))
+        load_addr = Signal(16)
+        match     = Signal()   # The ROM has a word for load_addr
+        step      = Signal()   # Go on to the next word in the ROM
+
+        m.d.comb += [
+            cpu.int_b.eq(3),
+            cpu.reset_b.eq(self.loaded),
+            cpu.clken.eq(cache.clken),
+            cpu.din.eq(cache.din),
+            cache.address.eq(cpu.address),
+            cache.dout.eq(cpu.dout),
+            cache.rnw.eq(cpu.rnw),
+            cache.vpa.eq(cpu.vpa),
+            cache.vda.eq(cpu.vda),
+            cache.vio.eq(cpu.vio),
+            cache.io_din.eq(self.io_din),
+            cache.mem_rdata.eq(port.rdata),
+            cache.mem_ack.eq(port.ack & self.loaded),
+            rom_rd.addr.eq(index + step) # Read a cycle ahead, for the next slot
+        ]
+
+        # Copy the program, a word at a time, while the CPU is in reset
+        with m.If(self.loaded):
+            m.d.comb += [
+                port.addr.eq(cache.mem_addr),
+                port.rd.eq(cache.mem_rd),
+                port.wr.eq(cache.mem_wr),
+                port.wdata.eq(cache.mem_wdata)
+            ]
+        with m.Else():
+            if self.clear:
+                m.d.comb += [
+                    match.eq((index < len(self.words)) & (rom_rd.data[16:] == load_addr)),
+                    step.eq(port.ack & match),
+                    port.addr.eq(load_addr),
+                    port.wr.eq(port.up),
+                    port.wdata.eq(Mux(match, rom_rd.data[:16], 0))
+                ]
+                with m.If(port.ack):
+                    m.d.sync += [
+                        load_addr.eq(load_addr + 1),
+                        index.eq(index + match)
+                    ]
+                    with m.If(load_addr == 0xffff):
+                        m.d.sync += self.loaded.eq(1)
+            else:
+                m.d.comb += [
+                    step.eq(port.ack),
+                    port.addr.eq(rom_rd.data[16:]),
+                    port.wr.eq(port.up),
+                    port.wdata.eq(rom_rd.data[:16])
+                ]
+                with m.If(port.ack):
+                    m.d.sync += index.eq(index + 1)
+                    with m.If(index == len(self.words) - 1):
+                        m.d.sync += self.loaded.eq(1)
+
+        return m
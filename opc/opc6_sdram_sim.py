@@ -0,0 +1,131 @@
+import argparse
+import os
+import sys
+from array import array
+
+from nmigen import *
+from nmigen.sim import *
+
+from opc6_cosim import CORES, assemble, simulate
+from opc6_sdram import System
+from opc6emu import OPC6Emu
+from sdram_model import SdramModel
+
+# Runs programs on OPC6 from SDRAM in simulation: System copies each into
+# SdramModel, through SdramPort and the Sdram controller, and runs it
+# through OPC6Cache, with the sync clock divided from the sdram clock as on
+# the board. What the program outs, and the memory when it halts, must be
+# those of OPC6Emu. The cycles it takes are compared with those from a
+# memory that answers in every cycle, as BRAM does, and the cache counters
+# are printed.
+
+class Top(Elaboratable):
+    def __init__(self, system, ratio):
+        self.system = system
+        self.ratio  = ratio
+
+    def elaborate(self, platform):
+        m = Module()
+
+        m.domains.sdram = ClockDomain("sdram")
+        m.domains.sync = ClockDomain("sync")
+
+        m.submodules.system = self.system
+
+        div = Signal(2)
+        m.d.sdram += div.eq(div+1)
+        m.d.comb += ClockSignal().eq(div[self.ratio.bit_length() - 2])
+
+        return m
+
+def run(core, code, args):
+    system = System(code, args.ratio, args.lines, args.line_words, args.ways, cpu=CORES[core]())
+    top = Top(system, args.ratio)
+    model = SdramModel(system.port.ctrl, array('H', bytes(0x20000)))
+    iomem = array('H', bytes(0x20000))
+    outputs = []
+    counts = {}
+
+    def process():
+        cpu, cache = system.cpu, system.cache
+        load = cycles = 0
+        names = ("fetches", "fetch_misses", "reads", "read_misses", "writes", "write_stalls", "stalls")
+        while not (yield system.loaded):
+            load += 1
+            yield
+        for name in names: # The counters run from power on
+            counts[name] = -(yield getattr(cache, name))
+        while cycles < args.max_cycles and not (yield cpu.halted):
+            yield Settle()
+            if (yield cpu.vio) and (yield cpu.clken):
+                address = yield cpu.address
+                if (yield cpu.rnw):
+                    yield system.io_din.eq(iomem[address])
+                else:
+                    iomem[address] = yield cpu.dout
+                    outputs.append((address, iomem[address]))
+            yield
+            cycles += 1
+        while not (yield cache.idle): # Let the last store reach the SDRAM
+            yield
+        yield
+        counts["load"], counts["cycles"] = load, cycles
+        counts["halted"] = yield cpu.halted
+        for name in names:
+            counts[name] += yield getattr(cache, name)
+
+    sim = Simulator(top)
+    sim.add_clock(10e-9, domain="sdram")
+    sim.add_sync_process(process, domain="sync")
+    sim.add_sync_process(model.process, domain="sdram")
+    sim.run()
+
+    return counts, outputs, model
+
+def percent(n, total):
+    return 100 * n / max(total, 1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("programs", nargs="*", help="assembler sources, default the short ones in tests")
+    parser.add_argument("--core", choices=list(CORES), default="opc6", help="core to run")
+    parser.add_argument("--ratio", type=int, choices=[2, 4], default=4, help="sdram clock cycles per cpu cycle")
+    parser.add_argument("--lines", type=int, default=64, help="lines in each cache")
+    parser.add_argument("--line-words", type=int, default=4, help="words in each line")
+    parser.add_argument("--ways", type=int, choices=[1, 2], default=1, help="direct mapped or 2-way set associative")
+    parser.add_argument("--max-cycles", type=int, default=100000, help="maximum cycles for each program")
+    args = parser.parse_args()
+
+    programs = args.programs or [os.path.join(os.path.dirname(os.path.abspath(__file__)), "tests", p + ".s") for p in
+                                 ("hello", "fib", "davefib_int", "pushpop", "string", "testinc", "testpsr", "sqrt")]
+
+    errors = 0
+    for src in programs:
+        code = assemble(src)
+        emu = OPC6Emu(code)
+        emu.run()
+        counts, outputs, model = run(args.core, code, args)
+        bram, _, _, _ = simulate(args.core, code, args.max_cycles)
+
+        print("{}: {} cycles, {:.3f} times the {} from BRAM, after {} loading".format(
+            os.path.basename(src), counts["cycles"], counts["cycles"] / max(bram, 1), bram, counts["load"]))
+        print("    fetches {} missed {:.2f}%  reads {} missed {:.2f}%  writes {} stalled {}  stalls {}".format(
+            counts["fetches"], percent(counts["fetch_misses"], counts["fetches"]),
+            counts["reads"], percent(counts["read_misses"], counts["reads"]),
+            counts["writes"], counts["write_stalls"], counts["stalls"]))
+        print("    sdram reads {} writes {} refreshes {}, at most {} cycles apart".format(
+            model.reads, model.writes, model.refreshes, model.max_gap))
+
+        if not counts["halted"]:
+            print("    did not halt")
+            errors += 1
+        elif outputs != emu.outputs:
+            print("    outs differ")
+            errors += 1
+        elif model.mem != emu.mem:
+            a = next(a for a in range(len(emu.mem)) if model.mem[a] != emu.mem[a])
+            print("    mem[0x%04x] is 0x%04x, expected 0x%04x" % (a, model.mem[a], emu.mem[a]))
+            errors += 1
+
+    print("{} errors".format(errors))
+    sys.exit(1 if errors else 0)
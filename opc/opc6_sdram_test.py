@@ -0,0 +1,104 @@
+import argparse
+
+from nmigen import *
+from nmigen.build import *
+from nmigen_boards.ulx3s import *
+
+from ecp5pll import ECP5PLL
+from opc6_sdram import System
+from readhex import readhex
+
+# Runs a program from SDRAM on the ULX3S, with the last word it outs shown
+# on the leds
+class Top(Elaboratable):
+    def __init__(self, image, ratio):
+        self.image = image
+        self.ratio = ratio
+
+    def elaborate(self, platform):
+        m = Module()
+
+        # Get pins
+        led = [platform.request("led", count) for count in range(8)]
+        leds = Cat([i.o for i in led])
+        clk_in = platform.request(platform.default_clk, dir='-')[0]
+
+        dir_dict = {
+            "a":"-",
+            "ba":"-",
+            "cke":"-",
+            "clk":"-",
+            "clk_en":"-",
+            "dq":"io",
+            "dqm":"-",
+            "cas":"-",
+            "cs":"-",
+            "ras":"-",
+            "we":"-",
+            }
+
+        sdram = platform.request("sdram", dir=dir_dict)
+
+        # Clock generation
+        # PLL - 100MHz for sdram
+        sdram_freq = 100000000
+        m.domains.sdram = cd_sdram = ClockDomain("sdram")
+        m.domains.sdram_clk = cd_sdram_clk = ClockDomain("sdram_clk")
+
+        m.submodules.ecp5pll = pll = ECP5PLL()
+        pll.register_clkin(clk_in,  platform.default_clk_frequency)
+        pll.create_clkout(cd_sdram, sdram_freq)
+        pll.create_clkout(cd_sdram_clk, sdram_freq, phase=180)
+
+        # Divide clock by ratio for the sync domain
+        div = Signal(2)
+        m.d.sdram += div.eq(div+1)
+
+        m.domains.sync = cd_sync = ClockDomain("sync")
+        m.d.comb += ClockSignal().eq(div[self.ratio.bit_length() - 2])
+
+        m.submodules.system = system = System(self.image, self.ratio, clear=True)
+        cpu = system.cpu
+        ctrl = system.port.ctrl
+
+        m.d.comb += [
+            sdram.a.eq(ctrl.sd_addr),
+            sdram.dqm.eq(ctrl.sd_dqm),
+            sdram.ba.eq(ctrl.sd_ba),
+            sdram.cs.eq(ctrl.sd_cs),
+            sdram.we.eq(ctrl.sd_we),
+            sdram.ras.eq(ctrl.sd_ras),
+            sdram.cas.eq(ctrl.sd_cas),
+            sdram.clk_en.eq(1),
+            sdram.clk.eq(ClockSignal("sdram_clk")),
+            sdram.dq.o.eq(ctrl.sd_data_out),
+            sdram.dq.oe.eq(ctrl.sd_data_dir),
+            ctrl.sd_data_in.eq(sdram.dq.i),
+            system.io_din.eq(0)
+        ]
+
+        # Show the last word out on the leds
+        with m.If(cpu.vio & ~cpu.rnw & cpu.clken):
+            m.d.sync += leds.eq(cpu.dout)
+
+        return m
+
+if __name__ == "__main__":
+    variants = {
+        '12F': ULX3S_12F_Platform,
+        '25F': ULX3S_25F_Platform,
+        '45F': ULX3S_45F_Platform,
+        '85F': ULX3S_85F_Platform
+    }
+
+    # Figure out which FPGA variant we want to target...
+    parser = argparse.ArgumentParser()
+    parser.add_argument('variant', choices=variants.keys())
+    parser.add_argument('hexfile', help="program, from opc6asm.py")
+    parser.add_argument('--ratio', type=int, choices=[2, 4], default=4, help="sdram clock cycles per cpu cycle")
+    args = parser.parse_args()
+
+    image = readhex(args.hexfile)
+
+    platform = variants[args.variant]()
+    platform.build(Top(image, args.ratio), do_program=True)
@@ -0,0 +1,126 @@
+import argparse
+import os
+import sys
+from array import array
+
+from nmigen import *
+from nmigen.sim import *
+
+import opc6
+from opc6_cosim import assemble, cycle
+from opc6emu import DECODE, OPS, OPC6Emu
+
+STATES = ["FET0", "FET1", "EAD", "RDM", "EXEC", "WRM", "INT"]
+
+# Runs programs on OPC6 with its performance counters, and with clken held
+# low for one cycle in every stall_every, as a slow memory would, and
+# prints where the cycles went: the cycles in each state, the stalls, and
+# the instructions executed by opcode. The counters are checked against
+# the counts of the emulator: the instructions retired, those predicated
+# off and those executed of each opcode must be the same, the stalls those
+# inserted, and the cycles in the states the rest.
+
+class Top(Elaboratable):
+    def __init__(self):
+        self.cpu   = opc6.OPC6(stats=True)
+        self.din   = Signal(16)
+        self.clken = Signal(reset=1)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        m.submodules.cpu = cpu = self.cpu
+
+        m.d.comb += [
+            cpu.int_b.eq(3),
+            cpu.reset_b.eq(1),
+            cpu.clken.eq(self.clken),
+            cpu.din.eq(self.din)
+        ]
+
+        return m
+
+def run(code, max_cycles, stall_every):
+    top = Top()
+    mem = array('H', bytes(0x20000))
+    mem[:len(code)] = array('H', code)
+    iomem = array('H', bytes(0x20000))
+    outputs = []
+    counts = {}
+
+    def process():
+        cpu = top.cpu
+        cycles = stalls = 0
+        while cycles < max_cycles and not (yield cpu.halted):
+            cycles += 1
+            if stall_every and cycles % stall_every == 0:
+                # The memory is not ready: clken is low and nothing moves
+                stalls += 1
+                yield top.clken.eq(0)
+                yield
+                yield top.clken.eq(1)
+            else:
+                yield from cycle(top, mem, iomem, outputs)
+        counts["cycles"] = cycles
+        counts["inserted"] = stalls
+        for name in ("retired", "pred_off", "stalls"):
+            counts[name] = yield getattr(cpu, name)
+        counts["states"], counts["ops"] = [], []
+        for i in range(len(STATES)):
+            counts["states"].append((yield cpu.state_cycles[i]))
+        for i in range(len(OPS)):
+            counts["ops"].append((yield cpu.op_counts[i]))
+
+    sim = Simulator(top)
+    sim.add_clock(1e-6)
+    sim.add_sync_process(process)
+    sim.run()
+
+    return counts
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("programs", nargs="*", help="assembler sources, default the short ones in tests")
+    parser.add_argument("--max-cycles", type=int, default=100000, help="maximum cycles for each program")
+    parser.add_argument("--stall-every", type=int, default=7, help="cycles between stalls, 0 for none")
+    args = parser.parse_args()
+
+    programs = args.programs or [os.path.join(os.path.dirname(os.path.abspath(__file__)), "tests", p + ".s") for p in
+                                 ("hello", "fib", "davefib_int", "pushpop", "string", "testinc", "testpsr", "sqrt")]
+
+    errors = 0
+    for src in programs:
+        code = assemble(src)
+        emu = OPC6Emu(code, stats=True)
+        emu.run()
+        ops = [0] * len(OPS)
+        for w, n in enumerate(emu.counts):
+            ops[DECODE[w][0]] += n - emu.off[w]
+        counts = run(code, args.max_cycles, args.stall_every)
+
+        print("{}: {} cycles, {} instructions, {} predicated off, CPI {:.3f} without stalls".format(
+            os.path.basename(src), counts["cycles"], counts["retired"], counts["pred_off"],
+            (counts["cycles"] - counts["stalls"]) / max(counts["retired"], 1)))
+        print("    " + "  ".join("{} {}".format(s, n) for s, n in zip(STATES, counts["states"])) +
+              "  stalls {}".format(counts["stalls"]))
+        print("    " + "  ".join("{} {}".format(OPS[i], n) for i, n in sorted(enumerate(counts["ops"]), key=lambda x: -x[1]) if n))
+
+        if counts["retired"] != emu.steps:
+            print("    {} instructions retired, expected {}".format(counts["retired"], emu.steps))
+            errors += 1
+        if counts["pred_off"] != sum(emu.off):
+            print("    {} predicated off, expected {}".format(counts["pred_off"], sum(emu.off)))
+            errors += 1
+        if counts["ops"] != ops:
+            print("    executed by opcode differs: " + ", ".join(
+                "{} {} expected {}".format(OPS[i], a, b) for i, (a, b) in enumerate(zip(counts["ops"], ops)) if a != b))
+            errors += 1
+        # The process starts after the first clock edge, and the counters
+        # after the second, at the end of the reset synchroniser
+        if counts["stalls"] != counts["inserted"] or sum(counts["states"]) + counts["stalls"] != counts["cycles"] - 1:
+            print("    {} stalls and {} cycles in states, expected {} and {}".format(
+                counts["stalls"], sum(counts["states"]), counts["inserted"], counts["cycles"] - 1 - counts["inserted"]))
+            errors += 1
+
+    print("{} errors".format(errors))
+    sys.exit(1 if errors else 0)
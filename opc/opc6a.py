@@ -19,20 +19,26 @@ class OPC6(Elaboratable):
         self.rnw = Signal()
         self.halted = Signal()
 
+        # Architectural state, for co-simulation
+        self.PC_q = Signal(16, name="PC_q")
+        self.FSM_q = Signal(3, name="FSM_q")
+        self.PSR_q = Signal(8, name="PSR_q")
+        self.RF_q = Memory(width=16, depth=16, name="reg")
+
     def ports(self): # For simulation
         return [self.reset_b, self.din, self.int_b, self.clken, self.halted,
                 self.vpa, self.vda, self.vio, self.dout, self.address, self.rnw]
 
     def elaborate(self, platform):
         OR_q       = Signal(16)
-        PC_q       = Signal(16)
+        PC_q       = self.PC_q
         PCI_q      = Signal(16)
         result     = Signal(16)
         IR_q       = Signal(20)
-        FSM_q      = Signal(3)
+        FSM_q      = self.FSM_q
         swiid      = Signal(4)
         PSRI_q     = Signal(4)
-        PSR_q      = Signal(8)
+        PSR_q      = self.PSR_q
         zero       = Signal()
         carry      = Signal()
         sign       = Signal()
@@ -49,8 +55,9 @@ class OPC6(Elaboratable):
         operand    = Signal(16)
         repl1      = Signal(16)
         repl2      = Signal(16)
+        alu_carry  = Signal()
 
-        RF_q = Memory(width=16, depth=16, name="reg")       
+        RF_q = self.RF_q
         m = Module()
 
         m.d.comb += [
@@ -69,27 +76,27 @@ class OPC6(Elaboratable):
             self.vpa.eq((FSM_q == FET0) | (FSM_q == FET1) | (FSM_q == EXEC)),
             self.vda.eq(((FSM_q == RDM) | (FSM_q == WRM)) & (op != IN) & (op != OUT)),
             self.vio.eq(((FSM_q == RDM) | (FSM_q == WRM)) & ((op == IN) | (op == OUT))),
-            Cat([zero, carry, sign, enable_int, swiid]).eq(Mux((op == PPSR), operand[:8], Mux((IR_q[:4] != 0xf), Cat([(result == 0), carry, result[15], PSR_q[3:8]]), PSR_q)))
+            Cat([zero, carry, sign, enable_int, swiid]).eq(Mux((op == PPSR), operand[:8], Mux((IR_q[:4] != 0xf), Cat([(result == 0), alu_carry, result[15], PSR_q[3:8]]), PSR_q)))
         ]
 
-        with m.If((op == HLT) & (FSM_q == EXEC)): # Makes simulator detecting halted easier
+        with m.If((op == HLT) & (FSM_q == EXEC) & self.clken): # Makes simulator detecting halted easier
             m.d.sync += self.halted.eq(1)
 
         with m.Switch(op): # ALU
             with m.Case(AND, OR):
-                m.d.comb += Cat([result,carry]).eq(Mux(Cat([IR_q[8],PSR_q[C]]), (RF_dout & operand), (RF_dout | operand)))
+                m.d.comb += Cat([result,alu_carry]).eq(Cat([Mux(IR_q[8], (RF_dout & operand), (RF_dout | operand)), PSR_q[C]]))
             with m.Case(ADD, ADC, INC):
-                m.d.comb += Cat([result,carry]).eq(RF_dout + operand + (IR_q[8] & PSR_q[C]))
+                m.d.comb += Cat([result,alu_carry]).eq(RF_dout + operand + (IR_q[8] & PSR_q[C]))
             with m.Case(SUB, SBC, CMP, CMPC, DEC):
-                m.d.comb += Cat([result,carry]).eq(RF_dout + (operand ^ 0xffff) + Mux(IR_q[8], PSR_q[C],1))
+                m.d.comb += Cat([result,alu_carry]).eq(RF_dout + (operand ^ 0xffff) + Mux(IR_q[8], PSR_q[C],1))
             with m.Case(XOR, GPSR):
-                m.d.comb += Cat([result,carry]).eq(Mux(IR_q[IRNPRED], Cat([PSR_q,Const(0,8),PSR_q[C]]), (RF_dout ^ operand)))
+                m.d.comb += Cat([result,alu_carry]).eq(Mux(IR_q[IRNPRED], Cat([PSR_q,Const(0,8),PSR_q[C]]), Cat([(RF_dout ^ operand),PSR_q[C]])))
             with m.Case(NOT, BSWP):
-                m.d.comb += Cat([carry,result]).eq(Mux(IR_q[10],Cat([PSR_q[C], ~operand]),Cat([PSR_q[C], operand[8:], operand[:8]])))
+                m.d.comb += Cat([alu_carry,result]).eq(Mux(IR_q[10],Cat([PSR_q[C], ~operand]),Cat([PSR_q[C], operand[8:], operand[:8]])))
             with m.Case(ROR, ASR, LSR):
-                m.d.comb += Cat([carry,result]).eq(Cat([operand, Mux((IR_q[10] == 0), PSR_q[C], Mux(IR_q[8], operand[15], 0))]))
+                m.d.comb += Cat([alu_carry,result]).eq(Cat([operand, Mux((IR_q[10] == 0), PSR_q[C], Mux(IR_q[9], operand[15], 0))]))
             with m.Default():
-                m.d.comb += Cat([result,carry]).eq(Cat([operand, PSR_q[C]]))
+                m.d.comb += Cat([result,alu_carry]).eq(Cat([operand, PSR_q[C]]))
 
         with m.If(self.clken):
             m.d.sync += [
@@ -113,7 +120,7 @@ class OPC6(Elaboratable):
                     with m.Case(EAD):
                         m.d.sync += FSM_q.eq(Mux(IR_q[IRLD], RDM, Mux(IR_q[IRSTO], WRM, EXEC)))
                     with m.Case(EXEC):
-                        m.d.sync += FSM_q.eq(Mux((((self.int_b != 3) & PSR_q[EI]) | ((op == PPSR) & (swiid != 0))), INT, Mux(((IR_q[:4] == 0xf) | (op == JSR)), FET0, Mux(self.din[IRLEN], FET1, Mux(((self.din[8:12] == LD) | (self.din[8:12] == STO) | (op_d == POP) | (op_d == PUSH)), EAD, Mux(pred_d, EXEC, FET0))))))
+                        m.d.sync += FSM_q.eq(Mux((((self.int_b != 3) & PSR_q[EI]) | ((op == PPSR) & (swiid != 0))), INT, Mux(((IR_q[:4] == 0xf) | (op == JSR)), FET0, Mux(self.din[IRLEN], FET1, Mux((pred_d == 0), FET0, Mux(((self.din[8:12] == LD) | (self.din[8:12] == STO) | (op_d == POP) | (op_d == PUSH)), EAD, EXEC))))))
                     with m.Case(WRM):
                         m.d.sync += FSM_q.eq(Mux(((self.int_b != 3) & PSR_q[EI]), INT, FET0))
                     with m.Default():
@@ -139,6 +146,6 @@ class OPC6(Elaboratable):
                     m.d.sync += IR_q.eq(Cat([self.din, ((self.din[8:12] == LD) | (op_d == POP)), ((self.din[8:12] == STO) | (op_d == PUSH)), ((self.din[13:] == 1)), ((op_d == PUSH) | (op_d == POP))])) 
                 with m.Elif(((FSM_q == EAD) & (IR_q[IRLD] | IR_q[IRSTO])) | (FSM_q == RDM)):
                     m.d.sync += IR_q[:8].eq(Cat([IR_q[4:8],IR_q[:4]])) #  Swap source/dest reg in EA for reads and writes for writeback of 'source' in push/pop .. swap back again in RDMEM
-            
+
         return m
 
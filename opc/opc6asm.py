@@ -1,71 +1,275 @@
-import sys, re, codecs
-op = "mov,and,or,xor,add,adc,sto,ld,ror,jsr,sub,sbc,inc,lsr,dec,asr,halt,bswp,putpsr,getpsr,rti,not,out,in,push,pop,cmp,cmpc".split(",")
-symtab = dict( [ ("r%d"%d,d) for d in range(0,16)] + [("pc",15), ("psr",0)])
-pdict = {"1":0x0000,"z":0x4000,"nz":0x6000,"c":0x8000,"nc":0xA000,"mi":0xC000,"pl":0xE000,"":0x0000} ##0x2000 reseved for non-predicated instuctions
-(wordmem,macro,macroname,newtext,wcount,errors,warnings,reg_re,mnum,nextmnum)=([0x0000]*64*1024,dict(),None,[],0,[],[],re.compile("(r\d*|psr|pc)"),0,0)
-def expand_macro(line, macro, mnum):  # recursively expand macros, passing on instances not (yet) defined
-    global nextmnum
-    (text,mobj)=([line],re.match("^(?P<label>\w*\:)?\s*(?P<name>\w+)\s*?\((?P<params>.*?)\)",line))
-    if mobj and mobj.groupdict()["name"] in macro:
-        (label,instname,paramstr)= (mobj.groupdict()["label"],mobj.groupdict()["name"],mobj.groupdict()["params"])
-        (text, instparams,mnum,nextmnum) = (["#%s" % line], [x.strip() for x in paramstr.split(",")],nextmnum,nextmnum+1)
+import argparse
+import ast
+import codecs
+import operator
+import re
+import sys
+
+# Assembler for the OPC6, as a library and a command.
+#
+# Assembler.assemble takes the source text, expands its macros, and splits
+# each line into its label, predicate, instruction and operand expressions
+# once, and the two passes then work from those. Expressions are Python
+# expressions of numbers, symbols and the registers, which are parsed once
+# and evaluated by walking their syntax tree, with int() and ord() the only
+# calls.
+#
+# python3 opc6asm.py prog.s prog.hex > prog.lst assembles a file as before,
+# with the listing and symbol table on stdout, and with --bin and --lst
+# writes the memory image as little endian words and the listing to files.
+
+OPS = "mov,and,or,xor,add,adc,sto,ld,ror,jsr,sub,sbc,inc,lsr,dec,asr,halt,bswp,putpsr,getpsr,rti,not,out,in,push,pop,cmp,cmpc".split(",")
+OPCODES = {op: i for i, op in enumerate(OPS)}
+PREDICATES = {"1": 0x0000, "z": 0x4000, "nz": 0x6000, "c": 0x8000, "nc": 0xA000, "mi": 0xC000, "pl": 0xE000, "": 0x0000} # 0x2000 is for the non-predicated instructions
+REGISTERS = dict([("r%d" % d, d) for d in range(0, 16)] + [("pc", 15), ("psr", 0)])
+STRINGS = ("STRING", "BSTRING", "PBSTRING")
+
+LINE_RE     = re.compile(r'^(?:(?P<label>\w+):)?\s*((?:(?P<pred>((pl)|(mi)|(nc)|(nz)|(c)|(z)|(1)?)?)\.))?(?P<inst>\w+)?\s*(?P<operands>.*)')
+COMMENT_RE  = re.compile(r"#.*")
+MACRO_RE    = re.compile(r"\s*?MACRO\s*(?P<name>\w*)\s*?\((?P<params>.*)\)", re.IGNORECASE)
+ENDMACRO_RE = re.compile(r"\s*?ENDMACRO.*", re.IGNORECASE)
+CALL_RE     = re.compile(r"^(?P<label>\w*\:)?\s*(?P<name>\w+)\s*?\((?P<params>.*?)\)")
+STRING_RE   = re.compile(r'.*STRING\s*\"(.*?)\"(?:\s*?,\s*?\"(.*?)\")?(?:\s*?,\s*?\"(.*?)\")?(?:\s*?,\s*?\"(.*?)\")?.*?')
+REG_RE      = re.compile(r"(r\d*|psr|pc)")
+NOT_SYM_RE  = re.compile(r"r\d|r\d\d|pc|psr")
+
+BINOPS = {
+    ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv, ast.Mod: operator.mod, ast.Pow: operator.pow,
+    ast.LShift: operator.lshift, ast.RShift: operator.rshift,
+    ast.BitAnd: operator.and_, ast.BitOr: operator.or_, ast.BitXor: operator.xor
+}
+UNOPS = {ast.USub: operator.neg, ast.UAdd: operator.pos, ast.Invert: operator.invert}
+CALLS = {"int": int, "ord": ord}
+
+# An operand expression, parsed once. value() raises ValueError if it is
+# not a valid expression, or a symbol in it is not defined.
+class Expression:
+    def __init__(self, text):
+        self.text = text
+        try:
+            self.tree = ast.parse(text.strip(), mode="eval").body
+        except SyntaxError:
+            self.tree = None
+
+    def value(self, symbols):
+        if self.tree is None:
+            raise ValueError("Syntax error in {}".format(self.text))
+        return self._eval(self.tree, symbols)
+
+    def _eval(self, node, symbols):
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float, str)):
+            return node.value
+        elif isinstance(node, ast.Name):
+            if node.id not in symbols:
+                raise ValueError("Undefined symbol {}".format(node.id))
+            return symbols[node.id]
+        elif isinstance(node, ast.BinOp) and type(node.op) in BINOPS:
+            try:
+                return BINOPS[type(node.op)](self._eval(node.left, symbols), self._eval(node.right, symbols))
+            except (TypeError, ZeroDivisionError) as e:
+                raise ValueError(str(e))
+        elif isinstance(node, ast.UnaryOp) and type(node.op) in UNOPS:
+            try:
+                return UNOPS[type(node.op)](self._eval(node.operand, symbols))
+            except TypeError as e:
+                raise ValueError(str(e))
+        elif (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in CALLS
+              and len(node.args) == 1 and not node.keywords):
+            try:
+                return CALLS[node.func.id](self._eval(node.args[0], symbols))
+            except TypeError as e:
+                raise ValueError(str(e))
+        raise ValueError("Illegal expression {}".format(self.text))
+
+# A source line, after macro expansion, split into its fields
+class Line:
+    __slots__ = ("text", "label", "pred", "inst", "operands", "fields", "exprs")
+
+    def __init__(self, text, expression):
+        self.text = text
+        m = LINE_RE.match(COMMENT_RE.sub("", text))
+        self.label, pred, self.inst, self.operands = m.group("label", "pred", "inst", "operands")
+        self.pred = "1" if pred is None else pred
+        self.fields = [x.strip() for x in self.operands.split(",")]
+        self.exprs = [expression(f) for f in self.fields] if self.inst and self.inst not in STRINGS else None
+
+class Assembler:
+    def __init__(self):
+        self._expressions = {}
+        self.reset()
+
+    def reset(self):
+        self.mem      = [0x0000] * 64 * 1024
+        self.symbols  = dict(REGISTERS)
+        self.errors   = []
+        self.warnings = []
+        self.listing  = []
+        self.wcount   = 0
+        self.top      = 0
+
+    def expression(self, text):
+        e = self._expressions.get(text)
+        if e is None:
+            e = self._expressions[text] = Expression(text)
+        return e
+
+    # Expand the macros in the source lines, returning the lines to
+    # assemble, with macro definitions and calls commented out
+    def expand(self, lines):
+        macros = {}
+        name = None
+        self._mnum = 0
+        text = []
+        for line in lines:
+            m = MACRO_RE.match(line)
+            if m:
+                name = m.group("name")
+                macros[name] = ([x.strip() for x in m.group("params").split(",")], [])
+            elif ENDMACRO_RE.match(line):
+                name, line = None, "# " + line
+            elif name:
+                macros[name][1].append(line)
+            text.extend(self._expand(("" if not name else "# ") + line, macros))
+        return text
+
+    # Recursively expand a macro call, passing on instances not (yet)
+    # defined
+    def _expand(self, line, macros):
+        m = CALL_RE.match(line)
+        if not (m and m.group("name") in macros):
+            return [line]
+        label, name, params = m.group("label", "name", "params")
+        text = ["#%s" % line]
+        args = [x.strip() for x in params.split(",")]
+        mnum = self._mnum
+        self._mnum += 1
         if label:
-            text.append("%s%s"% (label, ":" if (label != "" and label != "None" and not (label.endswith(":"))) else ""))
-        for newline in macro[instname][1]:
-            for (s,r) in zip( macro[instname][0], instparams):
-                newline = (newline.replace(s,r) if s else newline).replace('@','%s_%s' % (instname,mnum))
-            text.extend(expand_macro(newline, macro, nextmnum))
-    return(text)
-for line in open(sys.argv[1], "r").readlines():       # Pass 0 - macro expansion
-    mobj =  re.match("\s*?MACRO\s*(?P<name>\w*)\s*?\((?P<params>.*)\)", line, re.IGNORECASE)
-    if mobj:
-        (macroname,macro[macroname])=(mobj.groupdict()["name"],([x.strip() for x in (mobj.groupdict()["params"]).split(",")],[]))
-    elif re.match("\s*?ENDMACRO.*", line, re.IGNORECASE):
-        (macroname, line) = (None, '# ' + line)
-    elif macroname:
-        macro[macroname][1].append(line)
-    newtext.extend(expand_macro(('' if not macroname else '# ') + line, macro, mnum))
-for iteration in range (0,2): # Two pass assembly
-    (wcount,nextmem) = (0,0)
-    for line in newtext:
-        mobj = re.match('^(?:(?P<label>\w+):)?\s*((?:(?P<pred>((pl)|(mi)|(nc)|(nz)|(c)|(z)|(1)?)?)\.))?(?P<inst>\w+)?\s*(?P<operands>.*)',re.sub("#.*","",line))
-        (label, pred, inst,operands) = [ mobj.groupdict()[item] for item in ("label","pred", "inst","operands")]
-        (pred, opfields,words, memptr) = ("1" if pred==None else pred, [ x.strip() for x in operands.split(",")],[], nextmem)
-        if (iteration==0 and (label and label != "None") or (inst=="EQU")):
-            errors = (errors + ["Error: Symbol %16s redefined in ...\n         %s" % (label,line.strip())]) if label in symtab else errors
-            exec ("%s= int(%s)" % ((label,str(nextmem)) if label!= None else (opfields[0], opfields[1])), globals(), symtab )
-        if (inst in("WORD","BYTE") or inst in op) and iteration < 1:
-            nextmem += (len(opfields) if inst=="WORD" else ((len(opfields)+1)//2) if inst=="BYTE" else len(opfields)-1) # If two operands are provide instuction will be one word
-        elif inst in op or inst in ("BYTE","WORD","STRING","BSTRING","PBSTRING"):
-            if  inst in("STRING","BSTRING","PBSTRING"):
-                strings = re.match('.*STRING\s*\"(.*?)\"(?:\s*?,\s*?\"(.*?)\")?(?:\s*?,\s*?\"(.*?)\")?(?:\s*?,\s*?\"(.*?)\")?.*?', line.rstrip())
-                string_data = codecs.decode(''.join([ x for x in strings.groups() if x != None]),  'unicode_escape')
-                string_len = chr(len( string_data ) & 0xFF) if inst=="PBSTRING" else ''    # limit string length to 255 for PBSTRINGS
-                (step, wordstr) =  ( 2 if inst in("BSTRING","PBSTRING") else 1, string_len + string_data + chr(0))                
-                (words) = ([(ord(wordstr[i]) | ((ord(wordstr[i+1])<<8) if inst in ("BSTRING","PBSTRING") else 0)) for  i in range(0,len(wordstr)-1,step) ])
-            else:
-                if ((len(opfields)==2 and not reg_re.match(opfields[1])) and inst not in ("inc","dec","WORD","BYTE")):
-                    warnings.append("Warning: suspected register field missing in ...\n         %s" % (line.strip()))
+            text.append(label)
+        for body in macros[name][1]:
+            for s, r in zip(macros[name][0], args):
+                body = body.replace(s, r) if s else body
+                body = body.replace("@", "%s_%s" % (name, mnum))
+            text.extend(self._expand(body, macros))
+        return text
+
+    # Assemble source text, returning True if there were no errors
+    def assemble(self, source):
+        self.reset()
+        lines = source.splitlines(True) if isinstance(source, str) else list(source)
+        parsed = [Line(text, self.expression) for text in self.expand(lines)]
+        for iteration in range(2):
+            self._pass(parsed, iteration)
+        return not self.errors
+
+    def _error(self, message, line):
+        self.errors.append("Error: %s in ...\n         %s" % (message, line.text.strip()))
+
+    def _pass(self, parsed, iteration):
+        symbols, mem = self.symbols, self.mem
+        self.wcount, nextmem = 0, 0
+        for line in parsed:
+            label, inst, fields, exprs = line.label, line.inst, line.fields, line.exprs
+            words, memptr = [], nextmem
+            if iteration == 0 and label or inst == "EQU":
+                if label in symbols:
+                    self.errors.append("Error: Symbol %16s redefined in ...\n         %s" % (label, line.text.strip()))
                 try:
-                    exec("PC=%d+%d" % (nextmem,len(opfields)-1), globals(), symtab) # calculate PC as it will be in EXEC state
-                    words = [int(eval( f,globals(), symtab)) for f in opfields ] + ([0] if inst=="BYTE" else []) # pad out BYTE lines wih a single zero
-                    words = ([(words[i+1]&0xFF)<<8|(words[i]&0xFF) for i in range(0,len(words)-1,2)]) if inst=="BYTE" else words # pack bytes 2 to a word
-                except (ValueError, NameError, TypeError,SyntaxError):
-                    (words,errors)=([0]*3,errors+["Error: illegal or undefined register name or expression in ...\n         %s" % line.strip() ])
-                if inst in op:
-                    (dst,src,val,abs_src) = (words+[0])[:3] + [words[1] if words[1]>0 else -words[1]]
-                    errors=(errors+["Error: short constant out of range in ...\n         %s"%(line.strip())]) if (inst in('inc','dec') and (abs_src>0xF)) else errors
-                    (inst,src) = ('dec' if inst=='inc' else 'inc',(~src +1)&0xF) if inst in('inc','dec') and (src&0x8000) else (inst,src)
-                    words=[((len(words)==3)<<12)|(pdict[pred] if ((op.index(inst)&0x10)==0) else 0x2000)|((op.index(inst)&0x0F)<<8)|(src<<4)|dst,val&0xFFFF][:len(words)-(len(words)==2)]
-            (wordmem[nextmem:nextmem+len(words)], nextmem,wcount )  = (words, nextmem+len(words),wcount+len(words))
-        elif inst == "ORG":
-            nextmem = eval(operands,globals(),symtab)
-        elif inst and (inst != "EQU") and iteration>0 :
-            errors.append("Error: unrecognized instruction or macro %s in ...\n         %s" % (inst,line.strip()))
-        if iteration > 0 :
-            print("%04x  %-20s  %s"%(memptr,' '.join([("%04x" % i) for i in words]),line.rstrip()))
-print ("\nAssembled %d words of code with %d error%s and %d warning%s." % (wcount,len(errors),'' if len(errors)==1 else 's',len(warnings),'' if len(warnings)==1 else 's'))
-print ("\nSymbol Table:\n\n%s\n\n%s\n%s" % ('\n'.join(["%-32s 0x%04X (%06d)" % (k,v,v) for k,v in sorted(symtab.items()) if not re.match("r\d|r\d\d|pc|psr",k)]),'\n'.join(errors),'\n'.join(warnings)))
-with open("/dev/null" if len(errors)>0 else sys.argv[2],"w" ) as f:   ## write to hex file only if no errors else send result to null file
-    f.write( '\n'.join([''.join("%04x " % d for d in wordmem[j:j+24]) for j in [i for i in range(0,len(wordmem),24)]]))
-sys.exit( len(errors)>0)
+                    if label:
+                        symbols[label] = nextmem
+                    else:
+                        symbols[fields[0]] = int(exprs[1].value(symbols))
+                except (ValueError, IndexError):
+                    self._error("illegal or undefined expression", line)
+            if (inst in ("WORD", "BYTE") or inst in OPCODES) and iteration < 1:
+                # Sizes only in the first pass; two operands make a 1 word instruction
+                nextmem += len(fields) if inst == "WORD" else (len(fields) + 1) // 2 if inst == "BYTE" else len(fields) - 1
+            elif inst in OPCODES or inst in ("BYTE", "WORD") or inst in STRINGS:
+                if inst in STRINGS:
+                    strings = STRING_RE.match(line.text.rstrip())
+                    data = codecs.decode("".join(x for x in strings.groups() if x is not None), "unicode_escape")
+                    length = chr(len(data) & 0xFF) if inst == "PBSTRING" else "" # limit string length to 255 for PBSTRINGS
+                    step, wordstr = (2 if inst in ("BSTRING", "PBSTRING") else 1), length + data + chr(0)
+                    words = [ord(wordstr[i]) | ((ord(wordstr[i + 1]) << 8) if inst in ("BSTRING", "PBSTRING") else 0)
+                             for i in range(0, len(wordstr) - 1, step)]
+                else:
+                    if len(fields) == 2 and not REG_RE.match(fields[1]) and inst not in ("inc", "dec", "WORD", "BYTE"):
+                        self.warnings.append("Warning: suspected register field missing in ...\n         %s" % line.text.strip())
+                    try:
+                        symbols["PC"] = nextmem + len(fields) - 1 # PC as it will be in the EXEC state
+                        words = [int(e.value(symbols)) for e in exprs] + ([0] if inst == "BYTE" else []) # pad BYTE lines with a zero
+                        if inst == "BYTE":
+                            words = [(words[i + 1] & 0xFF) << 8 | (words[i] & 0xFF) for i in range(0, len(words) - 1, 2)]
+                    except (ValueError, TypeError):
+                        words = [0] * 3
+                        self._error("illegal or undefined register name or expression", line)
+                    if inst in OPCODES:
+                        words = self._encode(inst, line.pred, words, line)
+                mem[nextmem:nextmem + len(words)] = [w & 0xFFFF for w in words]
+                nextmem += len(words)
+                self.wcount += len(words)
+                self.top = max(self.top, nextmem)
+            elif inst == "ORG":
+                try:
+                    nextmem = int(self.expression(line.operands).value(symbols))
+                except ValueError:
+                    self._error("illegal or undefined expression", line)
+            elif inst and inst != "EQU" and iteration > 0:
+                self._error("unrecognized instruction or macro %s" % inst, line)
+            if iteration > 0:
+                self.listing.append("%04x  %-20s  %s" % (memptr, " ".join("%04x" % (w & 0xFFFF) for w in words), line.text.rstrip()))
+
+    def _encode(self, inst, pred, words, line):
+        if len(words) < 2:
+            self._error("missing register field", line)
+            words = words + [0] * (2 - len(words))
+        dst, src, val = (words + [0])[:3]
+        if inst in ("inc", "dec") and abs(src) > 0xF:
+            self._error("short constant out of range", line)
+        if inst in ("inc", "dec") and (src & 0x8000):
+            inst, src = ("dec" if inst == "inc" else "inc"), (~src + 1) & 0xF
+        op = OPCODES[inst]
+        word = ((len(words) == 3) << 12) | (PREDICATES[pred] if (op & 0x10) == 0 else 0x2000) | ((op & 0x0F) << 8) | (src << 4) | dst
+        return [word, val & 0xFFFF][:len(words) - (len(words) == 2)]
+
+    def summary(self):
+        s = "\nAssembled %d words of code with %d error%s and %d warning%s." % (
+            self.wcount, len(self.errors), "" if len(self.errors) == 1 else "s",
+            len(self.warnings), "" if len(self.warnings) == 1 else "s")
+        table = "\n".join("%-32s 0x%04X (%06d)" % (k, v, v) for k, v in sorted(self.symbols.items()) if not NOT_SYM_RE.match(k))
+        return s + "\n\nSymbol Table:\n\n%s\n\n%s\n%s" % (table, "\n".join(self.errors), "\n".join(self.warnings))
+
+    # The memory image as hex, 24 words to a line, as readhex() reads
+    def hex(self):
+        return "\n".join("".join("%04x " % d for d in self.mem[j:j + 24]) for j in range(0, len(self.mem), 24))
+
+    # The memory image up to the last word assembled, as little endian words
+    def binary(self):
+        return b"".join(w.to_bytes(2, "little") for w in self.mem[:self.top])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("source", help="assembler source")
+    parser.add_argument("hex", help="hex file to write, as readhex() reads")
+    parser.add_argument("--bin", help="binary file to write, of little endian words")
+    parser.add_argument("--lst", help="file to write the listing to, instead of stdout")
+    args = parser.parse_args()
+
+    asm = Assembler()
+    with open(args.source) as f:
+        ok = asm.assemble(f.readlines())
+
+    listing = "\n".join(asm.listing) + "\n" + asm.summary() + "\n"
+    if args.lst:
+        with open(args.lst, "w") as f:
+            f.write(listing)
+    else:
+        sys.stdout.write(listing)
+    # Write the hex and binary files only if there were no errors
+    if ok:
+        with open(args.hex, "w") as f:
+            f.write(asm.hex())
+        if args.bin:
+            with open(args.bin, "wb") as f:
+                f.write(asm.binary())
+    sys.exit(not ok)
@@ -0,0 +1,298 @@
+import argparse
+import sys
+import time
+from array import array
+
+from readhex import readhex
+
+# Instruction set simulator for the OPC6, for running programs from
+# opc6asm.py much faster than the nMigen core in simulation, and for
+# checking the core against.
+#
+# Instructions are decoded through a table of all 64K instruction words,
+# and their predicates through a table of the predicate bits and the flags,
+# so the inner loop does no string or dict work. The decoded instructions,
+# with their second words and the address of the next, are kept for each
+# address until it is stored to. Memory and IO are flat arrays of 64K
+# 16-bit words.
+#
+# The semantics are those of the OPC6 spec: flags are set by every
+# instruction that writes a register other than the PC, a 2-word
+# instruction with r0 as destination and no memory access takes its
+# operand as the constant alone, and a putpsr that sets a software
+# interrupt number jumps to the interrupt vector. Hardware interrupts are
+# not modelled.
+#
+# With stats, the instructions run are counted by instruction word in
+# counts, and those predicated off in off, from which histogram.py makes
+# the counts by opcode and predicate.
+
+OPS = "mov,and,or,xor,add,adc,sto,ld,ror,jsr,sub,sbc,inc,lsr,dec,asr,halt,bswp,putpsr,getpsr,rti,not,out,in,push,pop,cmp,cmpc".split(",")
+(MOV, AND, OR, XOR, ADD, ADC, STO, LD, ROR, JSR, SUB, SBC, INC, LSR, DEC, ASR,
+ HLT, BSWP, PPSR, GPSR, RTI, NOT, OUT, IN, PUSH, POP, CMP, CMPC) = range(len(OPS))
+
+# Predicate field, bits 15:13, to the prefix the assembler takes; 1 marks
+# the non-predicated instructions
+PREDS = ["", "", "z.", "nz.", "c.", "nc.", "mi.", "pl."]
+
+Z = 0; C = 1; S = 2; EI = 3
+INT_VECTOR = 0x0002
+UART = 0xfe09
+
+# Whether an instruction executes, indexed by its predicate field and the
+# S, C and Z flags as (pred << 3) | (psr & 7)
+def _pred_table():
+    table = []
+    for p in range(8):
+        for f in range(8):
+            z, c, s = f & 1, (f >> 1) & 1, (f >> 2) & 1
+            flag = [1, 1, z, z, c, c, s, s][p]
+            table.append(p == 1 or bool(flag ^ (p & 1)))
+    return table
+
+# Decoded instruction words: (op, source, destination, 2-word, predicate
+# index, constant of a 1-word instruction). The source of a 2-word
+# instruction that does not take the source register is 0, and that of inc
+# and dec is 0 with the 4-bit constant as the constant. push and pop step
+# the stack pointer by the constant.
+def _decode_table():
+    table = []
+    for w in range(0x10000):
+        pred = w >> 13
+        op = ((w >> 8) & 0xf) | (0x10 if pred == 1 else 0)
+        src, dst, two = (w >> 4) & 0xf, w & 0xf, (w >> 12) & 1
+        k = 0
+        if op >= len(OPS):
+            op = MOV
+        if op in (INC, DEC) and not two:
+            src, k = 0, src
+        elif op == PUSH:
+            k = 0xffff
+        elif op == POP:
+            k = 1
+        elif two and dst == 0 and op not in (LD, STO, IN, OUT):
+            src = 0
+        table.append((op, src, dst, two, pred << 3, k))
+    return table
+
+# The Z, C and S flags of a 17-bit result, with the carry in bit 16
+FLAGS = [(v & 0xffff == 0) | ((v >> 15) & 2) | ((v >> 13) & 4) for v in range(0x20000)]
+
+REGS_FORMAT = " ".join(["%04x"] * 16)
+
+PRED   = _pred_table()
+DECODE = _decode_table()
+
+def disassemble(w, imm=None):
+    op = ((w >> 8) & 0xf) | (0x10 if w >> 13 == 1 else 0)
+    name = PREDS[w >> 13] + (OPS[op] if op < len(OPS) else "???")
+    text = "%-10s r%d, r%d" % (name, w & 0xf, (w >> 4) & 0xf)
+    return text + (", 0x%04x" % imm if w & 0x1000 else "")
+
+class OPC6Emu:
+    def __init__(self, code=None, stats=False):
+        self.mem     = array('H', bytes(0x20000))
+        self.io      = array('H', bytes(0x20000))
+        self.regs    = [0] * 16  # regs[15] is the PC
+        self.psr     = 0
+        self.pci     = 0
+        self.psri    = 0
+        self.halted  = False
+        self.halt_pc = 0
+        self.halt_no = 0
+        self.steps   = 0
+        self.outputs = []        # (address, data) of each out
+        self.counts  = [0] * 0x10000 if stats else None
+        self.off     = [0] * 0x10000 if stats else None
+        self.icache  = [None] * 0x10000
+        self._text   = {}
+        if code:
+            self.load(code)
+
+    def load(self, code, addr=0):
+        self.mem[addr:addr + len(code)] = array('H', code)
+        self.flush()
+
+    # Forget the decoded instructions, which must be done after mem is
+    # written other than by the program
+    def flush(self):
+        self.icache[:] = [None] * 0x10000
+
+    @property
+    def pc(self):
+        return self.regs[15]
+
+    # Run up to max_steps instructions, or until a halt, counting those that
+    # are predicated off. A line is written to trace for each instruction
+    # and out, and to out for each out only, if they are given. Returns the
+    # number of instructions run.
+    def run(self, max_steps=None, trace=None, out=None):
+        mem, io, r, icache, decode, pred, flags, outputs = self.mem, self.io, self.regs, self.icache, DECODE, PRED, FLAGS, self.outputs
+        counts, off = self.counts, self.off
+        psr = self.psr
+        out = trace or out
+        n = 0
+        limit = 0 if self.halted else (1 << 62) if max_steps is None else max_steps
+        while n < limit:
+            n += 1
+            pc = r[15]
+            d = icache[pc]
+            if d is None:
+                op, src, dst, two, p, k = decode[mem[pc]]
+                d = icache[pc] = (op, src, dst, mem[(pc + 1) & 0xffff] if two else k, (pc + 1 + two) & 0xffff, p)
+            op, src, dst, imm, r[15], p = d
+            if counts is not None:
+                counts[mem[pc]] += 1
+            if pred[p | (psr & 7)]:
+                a = (r[src] + imm) & 0xffff
+                # The arithmetic results are 17 bits, with the carry
+                if op == DEC or op == SUB:
+                    res = r[dst] + (a ^ 0xffff) + 1
+                    r[dst] = res & 0xffff
+                    if dst != 15:
+                        psr = (psr & 0xf8) | flags[res]
+                elif op == INC or op == ADD:
+                    res = r[dst] + a
+                    r[dst] = res & 0xffff
+                    if dst != 15:
+                        psr = (psr & 0xf8) | flags[res]
+                elif op == LD or op == IN:
+                    res = r[dst] = mem[a] if op == LD else io[a]
+                    if dst != 15:
+                        psr = (psr & 0xfa) | flags[res]
+                elif op == MOV:
+                    r[dst] = a
+                    if dst != 15:
+                        psr = (psr & 0xfa) | flags[a]
+                elif op == STO:
+                    mem[a] = r[dst]
+                    icache[a] = icache[(a - 1) & 0xffff] = None
+                elif op == CMP or op == CMPC:
+                    res = r[dst] + (a ^ 0xffff) + (1 if op == CMP else (psr >> 1) & 1)
+                    if dst != 15:
+                        psr = (psr & 0xf8) | flags[res]
+                    else:
+                        r[15] = res & 0xffff
+                elif op == ADC or op == SBC:
+                    res = r[dst] + (a if op == ADC else a ^ 0xffff) + ((psr >> 1) & 1)
+                    r[dst] = res & 0xffff
+                    if dst != 15:
+                        psr = (psr & 0xf8) | flags[res]
+                elif op == JSR:
+                    r[dst] = r[15]
+                    r[15] = a
+                    if dst != 15:
+                        psr = (psr & 0xfa) | flags[a]
+                elif op <= XOR or op == NOT or op == BSWP:
+                    if op == AND:
+                        res = r[dst] & a
+                    elif op == OR:
+                        res = r[dst] | a
+                    elif op == XOR:
+                        res = r[dst] ^ a
+                    elif op == NOT:
+                        res = a ^ 0xffff
+                    else:
+                        res = ((a & 0xff) << 8) | (a >> 8)
+                    r[dst] = res
+                    if dst != 15:
+                        psr = (psr & 0xfa) | flags[res]
+                elif op == ROR or op == LSR or op == ASR:
+                    # The carry is the bit shifted out
+                    res = ((a & 1) << 16) | (a >> 1) | (((psr >> 1) & 1) << 15 if op == ROR else a & 0x8000 if op == ASR else 0)
+                    r[dst] = res & 0xffff
+                    if dst != 15:
+                        psr = (psr & 0xf8) | flags[res]
+                elif op == PUSH:
+                    mem[a] = r[dst]
+                    icache[a] = icache[(a - 1) & 0xffff] = None
+                    r[src] = a
+                elif op == POP:
+                    res = mem[r[src]]
+                    r[src] = a
+                    r[dst] = res
+                    if dst != 15:
+                        psr = (psr & 0xfa) | flags[res]
+                elif op == OUT:
+                    io[a] = r[dst]
+                    outputs.append((a, r[dst]))
+                    if out:
+                        # After the instruction, in a trace
+                        if trace:
+                            self.psr = psr
+                            self._trace(trace, pc)
+                        out.write("  OUT:  Address : 0x%04x (%5d)  :  Data : 0x%04x (%5d) %s\n" %
+                                  (a, a, r[dst], r[dst], repr(chr(r[dst] & 0xff)) if a == UART else ""))
+                        if trace:
+                            continue
+                elif op == GPSR:
+                    r[dst] = psr
+                    if dst != 15:
+                        psr = (psr & 0xfa) | flags[psr]
+                elif op == PPSR:
+                    r[dst] = a
+                    psr = a & 0xff
+                    if psr >> 4:
+                        # Software interrupt
+                        self.pci, self.psri = r[15], psr & 0xf
+                        psr &= ~(1 << EI)
+                        r[15] = INT_VECTOR
+                elif op == RTI:
+                    r[dst] = a
+                    r[15] = self.pci
+                    psr = self.psri
+                else: # HLT
+                    r[dst] = a
+                    if dst != 15:
+                        psr = (psr & 0xfa) | flags[a]
+                    self.halted = True
+                    self.halt_pc, self.halt_no = pc, a
+                    limit = n
+                r[0] = 0
+            elif off is not None:
+                off[mem[pc]] += 1
+            if trace:
+                self.psr = psr
+                self._trace(trace, pc)
+        self.psr = psr
+        self.steps += n
+        return n
+
+    def _trace(self, f, pc):
+        psr, w, imm = self.psr, self.mem[pc], self.mem[(pc + 1) & 0xffff]
+        key = (pc, w, imm if w & 0x1000 else 0)
+        text = self._text.get(key)
+        if text is None:
+            text = self._text[key] = "%04x : %04x %4s : %-26s" % (
+                pc, w, "%04x" % imm if w & 0x1000 else "", disassemble(w, imm))
+        f.write("%s : %X %d %d %d %d : %s\n" % (
+            text, psr >> 4, (psr >> EI) & 1, (psr >> S) & 1, (psr >> C) & 1, psr & 1, REGS_FORMAT % tuple(self.regs)))
+
+    # The memory dump, 16 words to a line
+    def dump(self, f):
+        f.write("\n".join("".join("%04x " % d for d in self.mem[i:i + 16]) for i in range(0, len(self.mem), 16)))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("hex", help="program, as written by opc6asm.py")
+    parser.add_argument("dump", nargs="?", help="file to dump memory to, at the end")
+    parser.add_argument("--notrace", action="store_true", help="only write the outs")
+    parser.add_argument("--max", type=int, default=None, help="maximum number of instructions")
+    args = parser.parse_args()
+
+    emu = OPC6Emu(readhex(args.hex))
+    if not args.notrace:
+        print("PC   : Mem       : Instruction                : SWI I S C Z : %s" %
+              " ".join("r%-3d" % i for i in range(16)))
+    t = time.perf_counter()
+    n = emu.run(args.max, trace=None if args.notrace else sys.stdout, out=sys.stdout)
+    t = time.perf_counter() - t
+
+    if emu.halted:
+        print("Stopped on halt instruction at %04x with halt number 0x%04x" % (emu.halt_pc, emu.halt_no))
+    else:
+        print("Stopped after %d instructions at %04x" % (n, emu.pc))
+    if args.dump:
+        with open(args.dump, "w") as f:
+            emu.dump(f)
+    print("%d instructions in %.3f s, %.2f MIPS" % (n, t, n / t / 1e6 if t else 0), file=sys.stderr)
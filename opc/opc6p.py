@@ -0,0 +1,187 @@
+from nmigen import *
+
+MOV=0x0;AND=0x1;OR=0x2;XOR=0x3;ADD=0x4;ADC=0x5;STO=0x6;LD=0x7;ROR=0x8;JSR=0x9;SUB=0xA;SBC=0xB;INC=0xC;LSR=0xD;DEC=0xE;ASR=0xF
+HLT=0x10;BSWP=0x11;PPSR=0x12;GPSR=0x13;RTI=0x14;NOT=0x15;OUT=0x16;IN=0x17;PUSH=0x18;POP=0x19;CMP=0x1A;CMPC=0x1B
+EI=3;S=2;C=1;Z=0;P0=15;P1=14;P2=13;IRLEN=12;INT_VECTOR0=0x0002;INT_VECTOR1=0x0004
+
+# A pipelined OPC6, with the same ports and instruction set as opc6.py.
+#
+# Each instruction is fetched into IR_q, and its second word into IMM_q,
+# and it executes in the cycle after, while the next instruction is
+# fetched. A one-word register instruction takes one cycle and a two-word
+# one two. An instruction that reads or writes memory or IO takes one more,
+# as it has the bus instead of the fetch. An instruction that writes the
+# PC, or is interrupted, throws away the word fetched with it.
+#
+# The instruction before has executed by the time an instruction's
+# predicate is tested, on the flags in PSR_q. A two-word instruction that
+# is predicated off is skipped without fetching its second word.
+#
+# The bus is as for opc6.py, with din read in the cycle that address is
+# set. retire is set after each edge at which an instruction completed,
+# run or predicated off, for co-simulation.
+
+class OPC6(Elaboratable):
+    def __init__(self): # define cpu ports
+        self.reset_b = Signal()
+        self.din = Signal(16)
+        self.int_b = Signal(2)
+        self.clken = Signal()
+        self.vpa = Signal()
+        self.vda = Signal()
+        self.vio = Signal()
+        self.dout = Signal(16)
+        self.address = Signal(16)
+        self.rnw = Signal()
+        self.halted = Signal()
+        self.retire = Signal()
+
+        # Architectural state, for co-simulation. The registers are signals,
+        # so that pop can write two
+        self.PC_q = Signal(16, name="PC_q")
+        self.PSR_q = Signal(8, name="PSR_q")
+        self.RF_q = Array(Signal(16, name="r%d" % i) for i in range(16))
+
+    def ports(self): # For simulation
+        return [self.reset_b, self.din, self.int_b, self.clken, self.halted,
+                self.vpa, self.vda, self.vio, self.dout, self.address, self.rnw]
+
+    def elaborate(self, platform):
+        PC_q       = self.PC_q # Address of the next word to fetch
+        PCI_q      = Signal(16)
+        PSR_q      = self.PSR_q
+        PSRI_q     = Signal(4)
+        IR_q       = Signal(16)
+        IMM_q      = Signal(16)
+        valid_q    = Signal()   # IR_q holds an instruction
+        imm_q      = Signal()   # IMM_q holds its second word
+        reset_s0_b = Signal()
+        reset_s1_b = Signal()
+        op         = Signal(5)
+        src        = Signal(4)
+        dst        = Signal(4)
+        two        = Signal()
+        pred       = Signal()
+        run        = Signal()   # Executes this cycle
+        skip       = Signal()   # Predicated off this cycle
+        mem_op     = Signal()   # ld, sto, in, out, push and pop
+        writes     = Signal()   # sto, out and push
+        loads      = Signal()   # ld, in and pop
+        io         = Signal()
+        data       = Signal()   # The bus is for data, not a fetch
+        src_val    = Signal(16)
+        dst_val    = Signal(16)
+        constant   = Signal(16)
+        operand    = Signal(16)
+        result     = Signal(16)
+        alu_carry  = Signal()
+        value      = Signal(16) # Written to the destination
+        psr_new    = Signal(8)
+        pc_write   = Signal()
+        next_pc    = Signal(16) # Address of the instruction after this one
+        interrupt  = Signal()
+
+        RF_q = self.RF_q
+        m = Module()
+
+        m.d.comb += [
+            op.eq(Cat([IR_q[8:12], (IR_q[13:] == 1)])),
+            src.eq(IR_q[4:8]),
+            dst.eq(IR_q[:4]),
+            two.eq(IR_q[IRLEN]),
+            pred.eq((IR_q[13:] == 1) | (IR_q[P2] ^ Mux(IR_q[P1], Mux(IR_q[P0], PSR_q[S], PSR_q[Z]), Mux(IR_q[P0], PSR_q[C], 1)))),
+            run.eq(valid_q & (~two | imm_q) & pred),
+            skip.eq(valid_q & ~pred),
+            mem_op.eq((IR_q[8:12] == LD) | (IR_q[8:12] == STO) | (op == PUSH) | (op == POP)),
+            writes.eq((IR_q[8:12] == STO) | (op == PUSH)),
+            loads.eq((IR_q[8:12] == LD) | (op == POP)),
+            io.eq((op == IN) | (op == OUT)),
+            data.eq(run & mem_op),
+            # A short inc or dec takes the source field as its constant, and
+            # a two-word instruction to r0 that is not a load or store takes
+            # the second word alone
+            src_val.eq(Mux((src == 0) | (((op == INC) | (op == DEC)) & ~two) | (two & (dst == 0) & ~mem_op), 0, Mux(src == 0xf, PC_q, RF_q[src]))),
+            dst_val.eq(Mux(dst == 0, 0, Mux(dst == 0xf, PC_q, RF_q[dst]))),
+            constant.eq(Mux(two, IMM_q, Mux((op == INC) | (op == DEC), src, Mux(op == PUSH, 0xffff, op == POP)))),
+            operand.eq(src_val + constant),
+            value.eq(Mux(loads, self.din, Mux(op == JSR, PC_q, result))),
+            psr_new.eq(Mux(op == PPSR, operand[:8], Mux(op == RTI, Cat([PSRI_q, Const(0,4)]), Mux((dst != 0xf) & ~writes, Cat([(Mux(loads, self.din, result) == 0), alu_carry, Mux(loads, self.din, result)[15], PSR_q[3:8]]), PSR_q)))),
+            pc_write.eq(((dst == 0xf) & ~writes) | (op == JSR) | (op == RTI)),
+            next_pc.eq(Mux(pc_write, Mux(op == RTI, PCI_q, Mux(op == JSR, result, value)), PC_q)),
+            interrupt.eq(run & (((self.int_b != 3) & PSR_q[EI]) | ((op == PPSR) & (operand[4:8] != 0)))),
+            self.rnw.eq(~(data & writes)), # Set CPU outputs
+            self.dout.eq(dst_val),
+            self.address.eq(Mux(data, Mux(op == POP, src_val, operand), Mux(skip & two, PC_q + 1, PC_q))),
+            self.vpa.eq(~data),
+            self.vda.eq(data & ~io),
+            self.vio.eq(data & io)
+        ]
+
+        with m.If(run & (op == HLT) & self.clken): # Makes simulator detecting halted easier
+            m.d.sync += self.halted.eq(1)
+
+        with m.Switch(op): # ALU
+            with m.Case(AND, OR):
+                m.d.comb += Cat([result,alu_carry]).eq(Cat([Mux(IR_q[8], (dst_val & operand), (dst_val | operand)), PSR_q[C]]))
+            with m.Case(ADD, ADC, INC):
+                m.d.comb += Cat([result,alu_carry]).eq(dst_val + operand + (IR_q[8] & PSR_q[C]))
+            with m.Case(SUB, SBC, CMP, CMPC, DEC):
+                m.d.comb += Cat([result,alu_carry]).eq(dst_val + (operand ^ 0xffff) + Mux(IR_q[8], PSR_q[C],1))
+            with m.Case(XOR, GPSR):
+                m.d.comb += Cat([result,alu_carry]).eq(Mux(op[4], Cat([PSR_q,Const(0,8),PSR_q[C]]), Cat([(dst_val ^ operand),PSR_q[C]])))
+            with m.Case(NOT, BSWP):
+                m.d.comb += Cat([alu_carry,result]).eq(Mux(IR_q[10],Cat([PSR_q[C], ~operand]),Cat([PSR_q[C], operand[8:], operand[:8]])))
+            with m.Case(ROR, ASR, LSR):
+                m.d.comb += Cat([alu_carry,result]).eq(Cat([operand, Mux((IR_q[10] == 0), PSR_q[C], Mux(IR_q[9], operand[15], 0))]))
+            with m.Default():
+                m.d.comb += Cat([result,alu_carry]).eq(Cat([operand, PSR_q[C]]))
+
+        m.d.sync += self.retire.eq(self.clken & reset_s1_b & (run | skip))
+
+        with m.If(self.clken):
+            m.d.sync += [
+                reset_s0_b.eq(self.reset_b), # sync reset
+                reset_s1_b.eq(reset_s0_b)
+            ]
+            with m.If(reset_s1_b == 0): # reset
+                m.d.sync += [
+                    PC_q.eq(0),
+                    PCI_q.eq(0),
+                    PSR_q.eq(0),
+                    valid_q.eq(0),
+                    imm_q.eq(0)
+                ]
+            with m.Else():
+                with m.If(run): # Execute
+                    m.d.sync += PSR_q.eq(Mux(interrupt, psr_new & 0xf7, psr_new)) # Interrupts disabled on entry
+                    with m.If((op == PUSH) | (op == POP)): # Step the stack pointer
+                        m.d.sync += RF_q[src].eq(operand)
+                    with m.If(~writes & (op != CMP) & (op != CMPC)): # Write to register, after the stack pointer for pop
+                        m.d.sync += RF_q[dst].eq(value)
+                with m.If(interrupt): # Set PC, PSR etc
+                    m.d.sync += [
+                        PC_q.eq(Mux((self.int_b[1] == 0), INT_VECTOR1, INT_VECTOR0)),
+                        PCI_q.eq(next_pc),
+                        PSRI_q.eq(psr_new[:4]),
+                        valid_q.eq(0)
+                    ]
+                with m.Elif(run & (mem_op | pc_write)): # No instruction fetched, or the wrong one
+                    m.d.sync += [
+                        PC_q.eq(next_pc),
+                        valid_q.eq(0)
+                    ]
+                with m.Elif(valid_q & two & ~imm_q & pred): # Fetch the second word
+                    m.d.sync += [
+                        IMM_q.eq(self.din),
+                        imm_q.eq(1),
+                        PC_q.eq(PC_q + 1)
+                    ]
+                with m.Else(): # Fetch the next instruction, past the second word of one predicated off
+                    m.d.sync += [
+                        IR_q.eq(self.din),
+                        valid_q.eq(1),
+                        imm_q.eq(0),
+                        PC_q.eq(Mux(skip & two, PC_q + 2, PC_q + 1))
+                    ]
+
+        return m
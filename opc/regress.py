@@ -0,0 +1,145 @@
+import argparse
+import glob
+import gzip
+import hashlib
+import os
+import sys
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from opc6_cosim import CORES, assemble, cosim, simulate
+from opc6emu import OPC6Emu, UART
+from readhex import readhex
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Regression of the programs in tests: each is assembled, run on the
+# emulator, and run on the cores in simulation, and what the core wrote to
+# the UART, and its memory once it halted, are compared with the
+# emulator's. The programs, and then the simulations, run in a pool of
+# processes, longest first. The hex files, and the emulator traces, dumps
+# and UART output, are cached in tests/cache, by a hash of the source and
+# of the tools that made them, so that only the simulations are run again
+# when only the cores change.
+#
+# A run cut short by --max-cycles is partial, and is an error unless
+# --allow-partial is given, when it passes if what it did so far matches.
+
+def digest(*files):
+    h = hashlib.sha256()
+    for f in files:
+        with open(f, "rb") as fh:
+            h.update(fh.read())
+    return h.hexdigest()[:16]
+
+def uart(outputs):
+    return "".join(chr(d & 0xff) for a, d in outputs if a == UART)
+
+# Assemble and emulate a program, or take the results from the cache.
+# Returns the hex file, the emulator results and the times taken, which are
+# None where the cache was used.
+def prepare(src, cache):
+    name = os.path.basename(src)[:-2]
+    hexfile = os.path.join(cache, "{}-{}.hex".format(name, digest(src, os.path.join(HERE, "opc6asm.py"))))
+    t_asm = None
+    if not os.path.exists(hexfile):
+        t = time.perf_counter()
+        assemble(src, hexfile)
+        t_asm = time.perf_counter() - t
+
+    base = os.path.join(cache, "{}-{}".format(name, digest(hexfile, os.path.join(HERE, "opc6emu.py"))))
+    t_emu = None
+    if not os.path.exists(base + ".emu.stdout"):
+        t = time.perf_counter()
+        emu = OPC6Emu(readhex(hexfile))
+        with gzip.open(base + ".trace.gz", "wt") as trace:
+            emu.run(trace=trace)
+        with open(base + ".dump", "w") as f:
+            emu.dump(f)
+        with open(base + ".steps", "w") as f:
+            f.write("{} {}\n".format(emu.steps, int(emu.halted)))
+        with open(base + ".emu.stdout", "w", newline="") as f:
+            f.write(uart(emu.outputs))
+        t_emu = time.perf_counter() - t
+
+    with open(base + ".steps") as f:
+        steps, halted = map(int, f.read().split())
+    return hexfile, base, steps, halted, t_asm, t_emu
+
+# Run a program on a core in simulation, or in lockstep with the emulator,
+# and compare the results with the emulator's
+def check(core, hexfile, base, max_cycles, lockstep):
+    code = readhex(hexfile)
+    t = time.perf_counter()
+    if lockstep:
+        cycles, steps, diffs = cosim(core, code, max_cycles, 0)
+        result = "partial, {} instructions".format(steps) if diffs and diffs[0].startswith("not halted") else \
+                 diffs[0] if diffs else "pass"
+    else:
+        cycles, halted, outputs, mem = simulate(core, code, max_cycles)
+        with open(base + ".emu.stdout", newline="") as f:
+            expected = f.read()
+        got = uart(outputs)
+        if not expected.startswith(got):
+            result = "UART output differs at character {}".format(
+                next((i for i, (a, b) in enumerate(zip(got, expected)) if a != b), len(expected)))
+        elif not halted:
+            result = "partial, {} of {} characters".format(len(got), len(expected))
+        elif got != expected:
+            result = "UART output short, {} of {} characters".format(len(got), len(expected))
+        else:
+            dump = array('H', readhex(base + ".dump"))
+            a = next((a for a in range(len(mem)) if mem[a] != dump[a]), None)
+            result = "pass" if a is None else "mem[0x{:04x}] is 0x{:04x}, expected 0x{:04x}".format(a, mem[a], dump[a])
+    return cycles, result, time.perf_counter() - t
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("programs", nargs="*", help="assembler sources, default all in tests")
+    parser.add_argument("--core", choices=list(CORES) + ["all"], default="all", help="core to run")
+    parser.add_argument("--jobs", type=int, default=None, help="processes, default one for each CPU")
+    parser.add_argument("--max-cycles", type=int, default=3000000, help="maximum cycles for each simulation")
+    parser.add_argument("--lockstep", action="store_true", help="check each instruction against the emulator")
+    parser.add_argument("--allow-partial", action="store_true", help="pass runs cut short by --max-cycles that match so far")
+    parser.add_argument("--cache", default=os.path.join(HERE, "tests", "cache"), help="cache directory")
+    args = parser.parse_args()
+
+    programs = args.programs or sorted(glob.glob(os.path.join(HERE, "tests", "*.s")))
+    cores = list(CORES) if args.core == "all" else [args.core]
+    os.makedirs(args.cache, exist_ok=True)
+
+    t = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        prepared = dict(zip(programs, pool.map(prepare, programs, [args.cache] * len(programs))))
+        # The longest first, so that they do not hold up the end
+        jobs = sorted(((src, core) for src in programs for core in cores), key=lambda j: -prepared[j[0]][2])
+        futures = {job: pool.submit(check, job[1], prepared[job[0]][0], prepared[job[0]][1],
+                                    args.max_cycles, args.lockstep) for job in jobs}
+        results = {job: f.result() for job, f in futures.items()}
+    t = time.perf_counter() - t
+
+    def secs(s, first):
+        return "" if not first else "cached" if s is None else "{:.1f}".format(s)
+
+    print("{:<18} {:<6} {:>7} {:>7} {:>8} {:>9} {:>9} {:>6}  {}".format(
+        "program", "core", "asm s", "emu s", "sim s", "instrs", "cycles", "CPI", "result"))
+    errors = 0
+    partial = 0
+    total = 0
+    for src in programs:
+        hexfile, base, steps, halted, t_asm, t_emu = prepared[src]
+        total += (t_asm or 0) + (t_emu or 0)
+        for i, core in enumerate(cores):
+            cycles, result, t_sim = results[(src, core)]
+            total += t_sim
+            if result.startswith("partial"):
+                partial += 1
+            if result != "pass" and not (args.allow_partial and result.startswith("partial")):
+                errors += 1
+            print("{:<18} {:<6} {:>7} {:>7} {:>8.1f} {:>9} {:>9} {:>6}  {}".format(
+                os.path.basename(src) if i == 0 else "", core, secs(t_asm, i == 0), secs(t_emu, i == 0), t_sim,
+                steps, cycles, "{:.3f}".format(cycles / steps) if halted and result == "pass" else "", result))
+    print("{} programs on {} in {:.1f} s, {:.1f} s of work".format(len(programs), ", ".join(cores), t, total))
+    print("{} partial, {} errors".format(partial, errors))
+    sys.exit(1 if errors else 0)
@@ -0,0 +1,101 @@
+from nmigen.sim import Passive, Settle
+
+# Behavioral model of a 16-bit SDRAM chip, for simulation, on the chip
+# side of the Sdram controller in sdram16.py. It decodes the commands on
+# cs, ras, cas and we at each edge of the sdram clock, keeps the open row
+# of each bank, and stores the words written, with their byte masks. The
+# word read is put on the data lines for one cycle, two cycles after the
+# read command, for CAS latency 2, and is zero otherwise, so a read taken
+# at the wrong time is seen. The init sequence must come first, a
+# precharge of all banks and then a load of the mode, with CAS latency 2
+# and no write bursts, a read or write must be to an active bank, and
+# after the init there must be a refresh in each refresh_cycles cycles,
+# 7.8us at 100MHz. Anything else raises AssertionError.
+#
+# mem holds the words, by the controller's word address: bank, row and
+# then column, as the controller splits it.
+class SdramModel:
+    INHIBIT   = 0b1111
+    NOP       = 0b0111
+    ACTIVE    = 0b0011
+    READ      = 0b0101
+    WRITE     = 0b0100
+    PRECHARGE = 0b0010
+    REFRESH   = 0b0001
+    LOAD_MODE = 0b0000
+
+    def __init__(self, ctrl, mem, refresh_cycles=780):
+        self.ctrl       = ctrl
+        self.mem        = mem
+        self.refresh_cycles = refresh_cycles
+        self.mode       = None
+        self.precharged = False
+        self.rows       = [None] * 4
+        self.refreshes  = 0
+        self.reads      = 0
+        self.writes     = 0
+        self.cycles     = 0
+        self.refreshed  = 0    # Cycle of the last refresh
+        self.max_gap    = 0    # Most cycles between two refreshes
+
+    def address(self, ba, row, col):
+        return ((col >> 8) & 1) << 23 | ba << 21 | row << 8 | (col & 0xff)
+
+    def process(self):
+        ctrl = self.ctrl
+        pending = [] # Words being read: edges to go, and the word
+        yield Passive()
+        while True:
+            yield
+            yield Settle()
+            self.cycles += 1
+            if self.mode is not None:
+                assert self.cycles - self.refreshed <= self.refresh_cycles, "no refresh for %d cycles" % (self.cycles - self.refreshed)
+            out = None
+            for p in pending:
+                p[0] -= 1
+                if p[0] == 0:
+                    out = p[1]
+            pending = [p for p in pending if p[0] > 0]
+            yield ctrl.sd_data_in.eq(0 if out is None else out)
+
+            cmd = ((yield ctrl.sd_cs) << 3 | (yield ctrl.sd_ras) << 2 |
+                   (yield ctrl.sd_cas) << 1 | (yield ctrl.sd_we))
+            a = yield ctrl.sd_addr
+            ba = yield ctrl.sd_ba
+            if cmd in (self.INHIBIT, self.NOP):
+                continue
+            if cmd == self.PRECHARGE:
+                assert a & 0x400, "precharge of one bank"
+                self.precharged = True
+                self.rows = [None] * 4
+            elif cmd == self.LOAD_MODE:
+                assert self.precharged, "mode loaded before precharge"
+                assert (a >> 4) & 7 == 2 and a & 0x200, "mode 0x%03x is not CAS latency 2 without write bursts" % a
+                self.mode = a
+            elif cmd == self.REFRESH:
+                self.refreshes += 1
+                if self.mode is not None:
+                    self.max_gap = max(self.max_gap, self.cycles - self.refreshed)
+                self.refreshed = self.cycles
+            else:
+                assert self.mode is not None, "command 0x%x before the mode is loaded" % cmd
+                if cmd == self.ACTIVE:
+                    self.rows[ba] = a
+                else:
+                    assert self.rows[ba] is not None, "command 0x%x to bank %d, which is not active" % (cmd, ba)
+                    addr = self.address(ba, self.rows[ba], a & 0x1ff)
+                    if cmd == self.READ:
+                        self.reads += 1
+                        pending.append([2, self.mem[addr]])
+                    elif cmd == self.WRITE:
+                        assert (yield ctrl.sd_data_dir), "write without driving the data lines"
+                        dqm = yield ctrl.sd_dqm
+                        d = yield ctrl.sd_data_out
+                        mask = (0 if dqm & 1 else 0x00ff) | (0 if dqm & 2 else 0xff00)
+                        self.mem[addr] = (self.mem[addr] & ~mask) | (d & mask)
+                        self.writes += 1
+                    else:
+                        raise AssertionError("unknown command 0x%x" % cmd)
+                    if a & 0x400: # Auto precharge
+                        self.rows[ba] = None
@@ -0,0 +1,30 @@
+import argparse
+import gzip
+import re
+import sys
+
+# Prints what a program wrote to the UART, from the OUT lines of an
+# opc6emu.py trace, or of a co-simulation log, on stdin or from a file,
+# which may be gzipped.
+UART = {6: 0xfe09}
+
+OUT_RE = re.compile(r"OUT\s*:\s*Address\s*:\s*0x([0-9a-fA-F]+).*?Data\s*:\s*0x([0-9a-fA-F]+)")
+
+def show_stdout(f, uart):
+    for line in f:
+        m = OUT_RE.search(line)
+        if m and int(m.group(1), 16) == uart:
+            sys.stdout.write(chr(int(m.group(2), 16) & 0xff))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-6", dest="cpu", action="store_const", const=6, default=6, help="OPC6 UART address")
+    parser.add_argument("-f", "--file", default=None, help="trace or log, instead of stdin")
+    args = parser.parse_args()
+
+    if args.file is None:
+        show_stdout(sys.stdin, UART[args.cpu])
+    else:
+        opener = gzip.open if args.file.endswith(".gz") else open
+        with opener(args.file, "rt") as f:
+            show_stdout(f, UART[args.cpu])
@@ -4,39 +4,67 @@ from ov7670_config import *
 from sccb import *
 from readhex import *
 
+# Configures the camera from config.mem, or from a dict of register
+# settings given as config, when start is set. clk_freq defaults to the
+# platform clock frequency. The OV7670 takes SCCB clocks of up to 400kHz.
+#
+# With verify set, the registers are read back once they are written, and
+# errors counts those that differ. SIOD must then be an open drain pin,
+# driven low only when siod_en is set and siod is low, with siod_i its
+# level.
 class CamConfig(Elaboratable):
-    def __init__(self):
+    def __init__(self, clk_freq=None, config=None, sccb_freq=100000, verify=False):
+        self.clk_freq = clk_freq
+        self.config = config
+        self.sccb_freq = sccb_freq
+        self.verify = verify
+
         self.start = Signal()
+        self.siod_i = Signal(reset=1)
         self.sioc = Signal()
         self.siod = Signal()
+        self.siod_en = Signal()
         self.done = Signal()
         self.rom_addr = Signal(8)
+        self.errors = Signal(8)
+        self.bad_reg = Signal(8)
 
     def elaborate(self, platform):
         m = Module()
 
-        config_data = readhex("config.mem")
-        config_rom = Memory(width=16, depth=len(config_data), init=config_data)
+        if self.config is None:
+            config_data = readhex("config.mem")
+        else:
+            config_data = OV7670Config.compile(self.config)
+        config_rom = Memory(width=17, depth=len(config_data), init=OV7670Config.rom(config_data))
         m.submodules.r = r = config_rom.read_port()
 
-        ov7670_config = OV7670Config()
+        ov7670_config = OV7670Config(clk_freq=self.clk_freq, verify=self.verify)
         m.submodules.ov7670_config = ov7670_config
 
-        sccb = SCCB()
+        sccb = SCCB(sccb_freq=self.sccb_freq, clk_freq=self.clk_freq)
         m.submodules.sccb = sccb
 
         m.d.comb += [
             self.sioc.eq(~sccb.sioc_oe),
             self.siod.eq(~sccb.siod_oe),
+            self.siod_en.eq(~sccb.siod_rd),
+            sccb.siod_i.eq(self.siod_i),
             self.done.eq(ov7670_config.done),
             r.addr.eq(ov7670_config.rom_addr),
             ov7670_config.sccb_ready.eq(sccb.ready),
+            ov7670_config.sccb_busy.eq(sccb.busy),
+            ov7670_config.sccb_rd_data.eq(sccb.rd_data),
+            ov7670_config.sccb_rd_valid.eq(sccb.rd_valid),
             ov7670_config.start.eq(self.start),
             ov7670_config.rom_data.eq(r.data),
             sccb.address.eq(ov7670_config.sccb_addr),
             sccb.data.eq(ov7670_config.sccb_data),
+            sccb.read.eq(ov7670_config.sccb_read),
             sccb.start.eq(ov7670_config.sccb_start),
-            self.rom_addr.eq(ov7670_config.rom_addr)
+            self.rom_addr.eq(ov7670_config.rom_addr),
+            self.errors.eq(ov7670_config.errors),
+            self.bad_reg.eq(ov7670_config.bad_reg)
         ]
 
         return m
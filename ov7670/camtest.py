@@ -65,7 +65,7 @@ class CamTest(Elaboratable):
         m.submodules.w = w = buffer.write_port()
         
         # Camera config
-        camconfig = CamConfig()
+        camconfig = CamConfig(sccb_freq=400000)
         m.submodules.camconfig = camconfig
 
         m.d.comb += [
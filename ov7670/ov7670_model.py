@@ -0,0 +1,137 @@
+import numpy as np
+
+from nmigen.sim import Delay, Passive
+
+from sccb_model import SCCBModel
+
+# Behavioral model of the OV7670 camera, for simulation. It answers the
+# register writes on the SCCB bus, with SCCBModel, and sends a sequence of
+# RGB565 images (numpy arrays of 16-bit pixels), over and over, on PCLK,
+# VSYNC, HREF and the data lines.
+#
+# Each frame is sent in the format selected by the registers at its start:
+# RGB565, high byte first, if COM7 selects RGB and COM15 RGB565, or YUV422
+# in Y U Y V order if COM7 selects YUV, as it does after a reset. Other RGB
+# formats are sent as RGB565, but recorded as "rgb". MVFP mirrors and flips
+# the image.
+#
+# The timing is in pclk cycles: each line is 2 cycles a pixel with HREF
+# high, followed by h_blank cycles with it low. Each frame starts with
+# vsync lines of VSYNC high and v_back blank lines, and ends with v_front
+# blank lines.
+class OV7670Model:
+    COM7  = 0x12
+    COM15 = 0x40
+    MVFP  = 0x1e
+
+    DEFAULTS = {
+        COM7:  0x00,
+        COM15: 0xc0,
+        MVFP:  0x01
+    }
+
+    def __init__(self, frames, pclk_period=1e-6, h_blank=16, vsync=2, v_back=2, v_front=1, addr=0x42):
+        self.frames      = frames
+        self.pclk_period = pclk_period
+        self.h_blank     = h_blank
+        self.vsync       = vsync
+        self.v_back      = v_back
+        self.v_front     = v_front
+        self.sccb        = SCCBModel(addr)
+
+        # pclk cycles so far, and the cycle each frame started, with its
+        # index and format
+        self.cycles      = 0
+        self.sent        = []
+
+    # The register state, from the writes so far. Setting bit 7 of COM7
+    # resets the registers.
+    def registers(self):
+        regs = dict(self.DEFAULTS)
+        for a, d in self.sccb.writes:
+            if a == self.COM7 and d & 0x80:
+                regs = dict(self.DEFAULTS)
+            else:
+                regs[a] = d
+        return regs
+
+    def reg(self, addr):
+        return self.registers().get(addr, 0)
+
+    def format(self):
+        regs = self.registers()
+        if not regs[self.COM7] & 0x04:
+            return "yuv422"
+        elif (regs[self.COM15] >> 4) & 3 == 1:
+            return "rgb565"
+        else:
+            return "rgb"
+
+    # YUV of an RGB565 image, with the chroma of each pair of pixels averaged
+    @staticmethod
+    def rgb2yuv(img):
+        img = np.asarray(img, dtype=np.int64)
+        r = (img >> 11) << 3
+        g = ((img >> 5) & 0x3f) << 2
+        b = (img & 0x1f) << 3
+        y = (77 * r + 150 * g + 29 * b + 128) >> 8
+        u = (-43 * r - 85 * g + 128 * b + 128) >> 8
+        v = (128 * r - 107 * g - 21 * b + 128) >> 8
+        u = (u[:, 0::2] + u[:, 1::2] + 1) // 2 + 128
+        v = (v[:, 0::2] + v[:, 1::2] + 1) // 2 + 128
+        return np.clip(y, 0, 255), np.clip(u, 0, 255), np.clip(v, 0, 255)
+
+    # The bytes of each line of an image, in the current format
+    def lines(self, img):
+        mvfp = self.reg(self.MVFP)
+        img = np.asarray(img)
+        if mvfp & 0x20:
+            img = img[:, ::-1]
+        if mvfp & 0x10:
+            img = img[::-1]
+        h, w = img.shape
+        if self.format() == "yuv422":
+            ys, us, vs = self.rgb2yuv(img)
+            out = np.zeros((h, 2 * w), dtype=np.int64)
+            out[:, 0::2] = ys
+            out[:, 1::4] = us
+            out[:, 3::4] = vs
+        else:
+            out = np.zeros((h, 2 * w), dtype=np.int64)
+            out[:, 0::2] = img >> 8
+            out[:, 1::2] = img & 0xff
+        return [[int(b) for b in line] for line in out]
+
+    # Simulator process that drives the pixel clock and the camera outputs
+    def process(self, p_clock, vsync, href, p_data):
+        def clock(v, h, d):
+            yield vsync.eq(v)
+            yield href.eq(h)
+            yield p_data.eq(d)
+            yield Delay(self.pclk_period / 2)
+            yield p_clock.eq(1)
+            yield Delay(self.pclk_period / 2)
+            yield p_clock.eq(0)
+            self.cycles += 1
+
+        def process():
+            yield Passive()
+            n = 0
+            while True:
+                img = self.frames[n % len(self.frames)]
+                line_cycles = 2 * img.shape[1] + self.h_blank
+                lines = self.lines(img)
+                self.sent.append((self.cycles, n % len(self.frames), self.format()))
+                for i in range(self.vsync * line_cycles):
+                    yield from clock(1, 0, 0)
+                for i in range(self.v_back * line_cycles):
+                    yield from clock(0, 0, 0)
+                for line in lines:
+                    for b in line:
+                        yield from clock(0, 1, b)
+                    for i in range(self.h_blank):
+                        yield from clock(0, 0, 0)
+                for i in range(self.v_front * line_cycles):
+                    yield from clock(0, 0, 0)
+                n += 1
+        return process
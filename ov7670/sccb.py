@@ -1,3 +1,4 @@
+import math
 from enum import IntEnum
 
 from nmigen import *
@@ -17,144 +18,232 @@ class SCCBState(IntEnum):
     DONE         = 11
     TIMER        = 12
 
+# SCCB master for register writes and reads, at up to 400kHz.
+#
+# Commands are queued: ready is set while there is room for one, and one
+# is taken with start, along with address, data and read, so the next
+# command can be given while the last is being sent and follows it after
+# just the bus free time. busy is set while a command is queued or being
+# sent.
+#
+# A read is a 2-phase write of the register address, followed by a 2-phase
+# read, after which rd_data holds the value read and rd_valid is set for a
+# cycle. siod_i is the level of SIOD, sampled at the end of each high SIOC
+# period. siod_rd is set while the camera may drive SIOD: the data bits of
+# a read and the ninth bit of each phase, when SIOD should not be driven.
 class SCCB(Elaboratable):
-    def __init__(self):
-        self.start   = Signal()
-        self.address = Signal(8)
-        self.data    = Signal(8)
-        self.ready   = Signal(reset=1)
-        self.sioc_oe = Signal(reset=0)
-        self.siod_oe = Signal(reset=0)
+    def __init__(self, sccb_freq=100000, clk_freq=None):
+        # Parameters, clk_freq defaults to the platform clock frequency
+        self.sccb_freq = sccb_freq
+        self.clk_freq  = clk_freq
+
+        # Inputs
+        self.start    = Signal()
+        self.address  = Signal(8)
+        self.data     = Signal(8)
+        self.read     = Signal()
+        self.siod_i   = Signal(reset=1)
+
+        # Outputs
+        self.ready    = Signal(reset=1)
+        self.busy     = Signal()
+        self.rd_data  = Signal(8)
+        self.rd_valid = Signal()
+        self.sioc_oe  = Signal(reset=0)
+        self.siod_oe  = Signal(reset=0)
+        self.siod_rd  = Signal(reset=0)
 
     def elaborate(self, platform):
         m = Module()
-        
+
         camera_addr = 0x42
-        sccb_freq   = 100000
+        sccb_freq   = self.sccb_freq
+        clk_freq    = self.clk_freq or platform.default_clk_frequency
+
+        # Cycles in a quarter of a bit, rounded up so the bus is never too
+        # fast, and so that SIOC is low for at least 1.3us, and in the bus
+        # free time between a stop and the next start, which must also be
+        # at least 1.3us. The TIMER state and the state that sets the timer
+        # take 2 of them.
+        quarter = max(math.ceil(clk_freq / (4 * sccb_freq)), math.ceil(clk_freq * 0.65e-6), 2)
+        t_buf   = max(2 * quarter, math.ceil(clk_freq * 1.3e-6))
 
         fsm_state        = Signal(4, reset=0)
         fsm_return_state = Signal(4, reset=0)
-        timer            = Signal(32, reset=0)
+        timer            = Signal(range(t_buf))
         latched_address  = Signal(8)
         latched_data     = Signal(8)
+        latched_read     = Signal()
+        second           = Signal()
+        receiving        = Signal()
         byte_counter     = Signal(2, reset=0)
         tx_byte          = Signal(8, reset=0)
+        rx_byte          = Signal(8, reset=0)
         byte_index       = Signal(4, reset=0)
 
-        delay1 = int(platform.default_clk_frequency / (4 * sccb_freq))
-        delay2 = int((2 * platform.default_clk_frequency) / sccb_freq)
+        # The command queue
+        q_valid          = Signal()
+        q_address        = Signal(8)
+        q_data           = Signal(8)
+        q_read           = Signal()
+
+        m.d.comb += [
+            self.ready.eq(~q_valid),
+            self.busy.eq(q_valid | (fsm_state != SCCBState.IDLE))
+        ]
+
+        with m.If(self.start & ~q_valid):
+            m.d.sync += [
+                q_valid.eq(1),
+                q_address.eq(self.address),
+                q_data.eq(self.data),
+                q_read.eq(self.read)
+            ]
+
+        m.d.sync += self.rd_valid.eq(0)
 
         with m.Switch(fsm_state):
             with m.Case(SCCBState.IDLE):
                 m.d.sync += [
                     byte_index.eq(0),
                     byte_counter.eq(0),
+                    second.eq(0),
                     self.sioc_oe.eq(0),
                     self.siod_oe.eq(0)
                 ]
-                with m.If(self.start):
+                with m.If(q_valid):
                     m.d.sync += [
                         fsm_state.eq(SCCBState.START_SIGNAL),
-                        latched_address.eq(self.address),
-                        latched_data.eq(self.data),
-                        self.ready.eq(0)
+                        latched_address.eq(q_address),
+                        latched_data.eq(q_data),
+                        latched_read.eq(q_read),
+                        q_valid.eq(0)
                     ]
-                with m.Else():
-                    m.d.sync += self.ready.eq(1)
             with m.Case(SCCBState.START_SIGNAL):
                 m.d.sync += [
                     fsm_state.eq(SCCBState.TIMER),
                     fsm_return_state.eq(SCCBState.LOAD_BYTE),
-                    timer.eq(delay1),
+                    timer.eq(quarter - 2),
+                    byte_counter.eq(0),
                     self.sioc_oe.eq(0),
                     self.siod_oe.eq(1)
                 ]
             with m.Case(SCCBState.LOAD_BYTE):
                 m.d.sync += [
                     byte_counter.eq(byte_counter + 1),
-                    byte_index.eq(0)
+                    byte_index.eq(0),
+                    receiving.eq(0)
                 ]
-                with m.If(byte_counter == 3):
+                # A write has 3 phases, and each transaction of a read 2
+                with m.If((byte_counter == 3) | ((byte_counter == 2) & latched_read)):
                     m.d.sync += fsm_state.eq(SCCBState.END_SIGNAL_1)
                 with m.Else():
                     m.d.sync += fsm_state.eq(SCCBState.TX_BYTE_1)
                 with m.Switch(byte_counter):
                     with m.Case(0):
-                        m.d.sync += tx_byte.eq(camera_addr)
+                        m.d.sync += tx_byte.eq(camera_addr | second)
                     with m.Case(1):
-                        m.d.sync += tx_byte.eq(latched_address)
-                    with m.Case(2):
-                        m.d.sync += tx_byte.eq(latched_data)
+                        m.d.sync += [
+                            tx_byte.eq(Mux(second, 0xff, latched_address)),
+                            receiving.eq(second)
+                        ]
                     with m.Default():
                         m.d.sync += tx_byte.eq(latched_data)
             with m.Case(SCCBState.TX_BYTE_1):
                 m.d.sync += [
                     fsm_state.eq(SCCBState.TIMER),
                     fsm_return_state.eq(SCCBState.TX_BYTE_2),
-                    timer.eq(delay1),
+                    timer.eq(quarter - 2),
                     self.sioc_oe.eq(1)
                 ]
             with m.Case(SCCBState.TX_BYTE_2):
                 m.d.sync += [
                     fsm_state.eq(SCCBState.TIMER),
                     fsm_return_state.eq(SCCBState.TX_BYTE_3),
-                    timer.eq(delay1)
+                    timer.eq(quarter - 2)
                 ]
-                with m.If(byte_index == 8):
-                    m.d.sync += self.siod_oe.eq(0)
+                # Let the camera drive SIOD for the ninth bit, and the data
+                # of a read. The ninth bit of a read is then high, for NA.
+                with m.If((byte_index == 8) | receiving):
+                    m.d.sync += [
+                        self.siod_oe.eq(0),
+                        self.siod_rd.eq(1)
+                    ]
                 with m.Else():
-                    m.d.sync += self.siod_oe.eq(~tx_byte[7])
+                    m.d.sync += [
+                        self.siod_oe.eq(~tx_byte[7]),
+                        self.siod_rd.eq(0)
+                    ]
             with m.Case(SCCBState.TX_BYTE_3):
                 m.d.sync += [
                     fsm_state.eq(SCCBState.TIMER),
                     fsm_return_state.eq(SCCBState.TX_BYTE_4),
-                    timer.eq(delay1),
+                    timer.eq(quarter - 2),
                     self.sioc_oe.eq(0)
                 ]
             with m.Case(SCCBState.TX_BYTE_4):
+                # SIOC stays high for a second quarter
                 m.d.sync += [
+                    fsm_state.eq(SCCBState.TIMER),
+                    timer.eq(quarter - 2),
                     tx_byte.eq(tx_byte << 1),
                     byte_index.eq(byte_index + 1)
                 ]
+                with m.If(receiving & (byte_index < 8)):
+                    m.d.sync += rx_byte.eq(Cat(self.siod_i, rx_byte[:7]))
                 with m.If(byte_index == 8):
-                    m.d.sync += fsm_state.eq(SCCBState.LOAD_BYTE)
+                    m.d.sync += fsm_return_state.eq(SCCBState.LOAD_BYTE)
                 with m.Else():
-                    m.d.sync += fsm_state.eq(SCCBState.TX_BYTE_1)
+                    m.d.sync += fsm_return_state.eq(SCCBState.TX_BYTE_1)
             with m.Case(SCCBState.END_SIGNAL_1):
                 m.d.sync += [
                     fsm_state.eq(SCCBState.TIMER),
                     fsm_return_state.eq(SCCBState.END_SIGNAL_2),
-                    timer.eq(delay1),
+                    timer.eq(quarter - 2),
                     self.sioc_oe.eq(1)
                 ]
             with m.Case(SCCBState.END_SIGNAL_2):
                 m.d.sync += [
                     fsm_state.eq(SCCBState.TIMER),
                     fsm_return_state.eq(SCCBState.END_SIGNAL_3),
-                    timer.eq(delay1),
-                    self.siod_oe.eq(1)
+                    timer.eq(quarter - 2),
+                    self.siod_oe.eq(1),
+                    self.siod_rd.eq(0)
                 ]
             with m.Case(SCCBState.END_SIGNAL_3):
                 m.d.sync += [
                     fsm_state.eq(SCCBState.TIMER),
                     fsm_return_state.eq(SCCBState.END_SIGNAL_4),
-                    timer.eq(delay1),
+                    timer.eq(quarter - 2),
                     self.sioc_oe.eq(0)
                 ]
             with m.Case(SCCBState.END_SIGNAL_4):
                 m.d.sync += [
                     fsm_state.eq(SCCBState.TIMER),
                     fsm_return_state.eq(SCCBState.DONE),
-                    timer.eq(delay1),
+                    timer.eq(quarter - 2),
                     self.siod_oe.eq(0)
                 ]
             with m.Case(SCCBState.DONE):
+                # Wait the bus free time, and then start the read phase of a
+                # read, or the next command
                 m.d.sync += [
                     fsm_state.eq(SCCBState.TIMER),
-                    fsm_return_state.eq(SCCBState.IDLE),
-                    timer.eq(delay2),
-                    byte_counter.eq(0)                    
+                    timer.eq(t_buf - 2),
+                    byte_counter.eq(0)
                 ]
+                with m.If(latched_read & ~second):
+                    m.d.sync += [
+                        fsm_return_state.eq(SCCBState.START_SIGNAL),
+                        second.eq(1)
+                    ]
+                with m.Else():
+                    m.d.sync += fsm_return_state.eq(SCCBState.IDLE)
+                with m.If(second):
+                    m.d.sync += [
+                        self.rd_data.eq(rx_byte),
+                        self.rd_valid.eq(1)
+                    ]
             with m.Case(SCCBState.TIMER):
                 with m.If(timer == 0):
                     m.d.sync += [
@@ -165,4 +254,3 @@ class SCCB(Elaboratable):
                     m.d.sync += timer.eq(timer - 1)
 
         return m
-
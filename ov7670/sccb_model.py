@@ -0,0 +1,94 @@
+from nmigen.sim import Passive
+
+# Behavioral model of the camera end of the SCCB bus, for simulation.
+# Decodes 3-phase write transmissions from the SIOC and SIOD lines, and
+# records the register writes addressed to the camera. A 2-phase write
+# sets the register that the next 2-phase read returns, which the model
+# drives onto SIOD, and records. Registers in read_only read back as given,
+# whatever is written to them.
+class SCCBModel:
+    def __init__(self, addr=0x42, read_only=None):
+        self.addr      = addr
+        self.read_only = read_only or {}
+        self.regs      = {}
+        self.writes    = []
+        self.reads     = []
+        self.ignored   = 0
+
+        self._sioc     = 1
+        self._siod     = 1
+        self._active   = False
+        self._bits     = []
+        self._ptr      = 0
+        self._drive    = 1
+
+    # Returns the value of a register, or default if it has not been written
+    def reg(self, addr, default=0):
+        return self.regs.get(addr, default)
+
+    # The value a read of a register returns
+    def read(self, addr):
+        return self.read_only.get(addr, self.reg(addr))
+
+    # Update the model with the state of the bus, every clock cycle, and
+    # return the level the camera drives SIOD to
+    def step(self, sioc, siod):
+        if sioc and self._sioc and self._siod and not siod:
+            # Start condition
+            self._active = True
+            self._bits = []
+        elif sioc and self._sioc and not self._siod and siod:
+            # Stop condition
+            if self._active:
+                self._end()
+            self._active = False
+        elif sioc and not self._sioc and self._active:
+            # Data is sampled on the rising edge of SIOC
+            self._bits.append(siod)
+        elif not sioc and self._sioc and self._active:
+            # The data bits of a read change after the falling edge
+            n = len(self._bits) - 9
+            if self._reading() and 0 <= n < 8:
+                self._drive = (self.read(self._ptr) >> (7 - n)) & 1
+            else:
+                self._drive = 1
+        if not self._active:
+            self._drive = 1
+        self._sioc = sioc
+        self._siod = siod
+        return self._drive
+
+    def _reading(self):
+        return len(self._bits) >= 8 and self._byte(0) == self.addr | 1
+
+    def _byte(self, i):
+        b = 0
+        for bit in self._bits[9 * i:9 * i + 8]:
+            b = (b << 1) | bit
+        return b
+
+    def _end(self):
+        # Each phase is 8 bits followed by a don't care bit
+        data = [self._byte(i) for i in range(len(self._bits) // 9)]
+        if len(data) == 3 and data[0] == self.addr:
+            self.regs[data[1]] = data[2]
+            self.writes.append((data[1], data[2]))
+            self._ptr = data[1]
+        elif len(data) == 2 and data[0] == self.addr:
+            self._ptr = data[1]
+        elif len(data) == 2 and data[0] == self.addr | 1:
+            self.reads.append((self._ptr, self.read(self._ptr)))
+        else:
+            self.ignored += 1
+
+    # Simulator process that follows the bus, and drives siod_o with the
+    # camera's level of SIOD, if given
+    def process(self, sioc, siod, siod_o=None):
+        def process():
+            yield Passive()
+            while True:
+                drive = self.step((yield sioc), (yield siod))
+                if siod_o is not None:
+                    yield siod_o.eq(drive)
+                yield
+        return process
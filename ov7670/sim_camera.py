@@ -0,0 +1,147 @@
+import argparse
+
+import numpy as np
+
+from nmigen import *
+from nmigen.sim import *
+
+from camconfig import CamConfig
+from camread import CamRead
+from ov7670_model import OV7670Model
+from readhex import readhex
+
+# End-to-end simulation of the camera side of camtest.py, without a camera:
+# OV7670Model is configured over the SCCB by CamConfig, and its frames are
+# read by CamRead and written to the frame buffer, with the addresses that
+# camtest.py uses, for a smaller image. The register writes must be those
+# of config.mem, the pixels read must be those sent, and each frame must
+# leave the frame buffer as the addressing says it should. The pixel clock
+# is half the system clock, so that each pixel_valid is seen. The frame
+# buffer writes are recorded rather than kept in a Memory, as the addresses
+# are spread out over 320 * 240 words. The configuration time and the
+# frame rate are reported.
+
+class Top(Elaboratable):
+    def __init__(self, clk_freq):
+        self.camconfig = CamConfig(clk_freq=clk_freq)
+        self.camread   = CamRead()
+
+        self.w_en      = Signal()
+        self.w_addr    = Signal(17)
+        self.w_data    = Signal(16)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        m.submodules.camconfig = camconfig = self.camconfig
+        m.submodules.camread = camread = self.camread
+
+        m.d.comb += [
+            self.w_en.eq(camread.pixel_valid),
+            self.w_addr.eq((camread.row[1:] * 320) + camread.col[1:]),
+            self.w_data.eq(camread.pixel_data)
+        ]
+
+        return m
+
+# The frame buffer writes of a frame: CamRead's row counts the pixels of a
+# line, including the one being written, and col counts the lines
+def expected(img):
+    h, w = img.shape
+    fb = {}
+    for y in range(h):
+        for x in range(w):
+            fb[(((x + 1) >> 1) * 320 + (y >> 1)) & 0x1ffff] = int(img[y, x])
+    return fb
+
+def run(frames, n_frames, clk_freq, pclk_ratio):
+    h, w = frames[0].shape
+    dut = Top(clk_freq)
+    camera = OV7670Model(frames, pclk_period=pclk_ratio / clk_freq)
+
+    captured = []
+    config_cycles = [0]
+
+    def process():
+        cycles = 0
+
+        # Configure the camera
+        yield dut.camconfig.start.eq(1)
+        yield
+        yield dut.camconfig.start.eq(0)
+        while not (yield dut.camconfig.done):
+            cycles += 1
+            yield
+        config_cycles[0] = cycles
+
+        # Collect the pixels and writes of each frame, from one frame_done to
+        # the next
+        pixels, fb = None, {}
+        last_valid = last_done = 0
+        while len(captured) < n_frames:
+            valid, done = (yield dut.w_en), (yield dut.camread.frame_done)
+            if valid and not last_valid and pixels is not None:
+                pixels.append((yield dut.w_data))
+            if valid and pixels is not None:
+                fb[(yield dut.w_addr)] = (yield dut.w_data)
+            if done and not last_done:
+                if pixels is not None:
+                    captured.append((camera.cycles, pixels, fb))
+                pixels, fb = [], {}
+            last_valid, last_done = valid, done
+            yield
+
+    sim = Simulator(dut)
+    sim.add_clock(1 / clk_freq)
+    sim.add_sync_process(process)
+    sim.add_sync_process(camera.sccb.process(dut.camconfig.sioc, dut.camconfig.siod))
+    sim.add_process(camera.process(dut.camread.p_clock, dut.camread.vsync, dut.camread.href, dut.camread.p_data))
+    sim.run()
+
+    errors = 0
+
+    # The register writes
+    writes = [(d >> 8, d & 0xff) for d in readhex("config.mem") if d not in (0xffff, 0xfff0)]
+    if camera.sccb.writes != writes:
+        print("    {} register writes, expected {}".format(len(camera.sccb.writes), len(writes)))
+        errors += 1
+    if camera.format() != "rgb565":
+        print("    camera format", camera.format(), "expected rgb565")
+        errors += 1
+
+    # The frames must follow the video in order, starting from any frame
+    refs = [[int(p) for p in f.ravel()] for f in frames]
+    n = None
+    for i, (pclks, pixels, fb) in enumerate(captured):
+        matches = [k for k, ref in enumerate(refs) if pixels == ref]
+        if n is None and matches:
+            n = matches[0]
+        if n is None or n % len(frames) not in matches:
+            print("    frame {} does not match frame {} of the video, {} pixels".format(i, n, len(pixels)))
+            errors += 1
+            n = None
+        else:
+            if fb != expected(frames[n % len(frames)]):
+                print("    frame {} frame buffer differs".format(i))
+                errors += 1
+            n += 1
+
+    period = (captured[-1][0] - captured[0][0]) / max(len(captured) - 1, 1)
+    print("{}x{}: configured in {:.1f} ms, {} frames, one every {:.0f} pclk cycles {:>2} errors".format(
+        w, h, config_cycles[0] / clk_freq * 1e3, len(captured), period, errors))
+    return errors
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=32)
+    parser.add_argument("--height", type=int, default=16)
+    parser.add_argument("--frames", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    video = [rng.integers(0, 1 << 16, (args.height, args.width)) for i in range(3)]
+
+    errors = run(video, args.frames, 400000, 2.0)
+
+    print("{} errors".format(errors))
@@ -0,0 +1,138 @@
+import argparse
+import math
+
+from nmigen import *
+from nmigen.sim import *
+
+from camconfig import CamConfig
+from ov7670_config import OV7670Config
+from sccb_model import SCCBModel
+from readhex import readhex
+
+# Configure SCCBModel with CamConfig, from config.mem and from a dict of
+# register settings, at 100kHz and 400kHz, with and without the readback.
+# The writes must be those of the config, in order, the reads those of the
+# last write to each register, and the errors those of the registers that
+# the model does not let change. The SIOC high and low times, the bus free
+# time between transactions and the gaps between them are checked against
+# the SCCB timing, and the configuration times are reported.
+
+SETTINGS = {
+    0x12: 0x04, # COM7, RGB
+    0x40: 0xd0, # COM15, RGB565
+    0x3a: 0x0c, # TSLB
+    0x11: 0x80, # CLKRC
+    0x1e: 0x37  # MVFP, mirrored and flipped
+}
+
+class Top(Elaboratable):
+    def __init__(self, clk_freq, config, sccb_freq, verify):
+        self.camconfig = CamConfig(clk_freq=clk_freq, config=config, sccb_freq=sccb_freq, verify=verify)
+        self.siod_o    = Signal(reset=1)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        m.submodules.camconfig = camconfig = self.camconfig
+
+        # SIOD is pulled up, and low if either end drives it low
+        m.d.comb += camconfig.siod_i.eq(Mux(camconfig.siod_en, camconfig.siod, 1) & self.siod_o)
+
+        return m
+
+def run(clk_freq, config, sccb_freq, verify, read_only):
+    dut = Top(clk_freq, config, sccb_freq, verify)
+    model = SCCBModel(read_only=read_only)
+
+    cycles = [0]
+    result = [0, 0]
+    edges = []
+    starts = []
+    stops = []
+
+    def process():
+        cc = dut.camconfig
+        yield cc.start.eq(1)
+        yield
+        yield cc.start.eq(0)
+        last_c, last_d = 1, 1
+        while not (yield cc.done):
+            c, d = (yield cc.sioc), (yield cc.siod)
+            if c != last_c:
+                edges.append((cycles[0], c))
+            if c and last_c and last_d and not d:
+                starts.append(cycles[0])
+            if c and last_c and not last_d and d:
+                stops.append(cycles[0])
+            last_c, last_d = c, d
+            cycles[0] += 1
+            yield
+        result[:] = [(yield cc.errors), (yield cc.bad_reg)]
+
+    sim = Simulator(dut)
+    sim.add_clock(1 / clk_freq)
+    sim.add_sync_process(process)
+    sim.add_sync_process(model.process(dut.camconfig.sioc, dut.camconfig.siod, dut.siod_o))
+    sim.run()
+
+    errors = 0
+
+    words = readhex("config.mem") if config is None else OV7670Config.compile(config)
+    writes = [(w >> 8, w & 0xff) for w in words if w not in (OV7670Config.DELAY, OV7670Config.END)]
+    if model.writes != writes:
+        print("    {} register writes, expected {}".format(len(model.writes), len(writes)))
+        errors += 1
+
+    # The reads, of the last value written to each register
+    checked = [((w >> 8) & 0xff, w & 0xff) for w in OV7670Config.rom(words) if w & OV7670Config.VERIFY]
+    reads = [(a, read_only.get(a, d)) for a, d in checked] if verify else []
+    if model.reads != reads:
+        print("    {} register reads, expected {}".format(len(model.reads), len(reads)))
+        errors += 1
+    bad = [a for a, d in checked if read_only.get(a, d) != d]
+    n_errors, bad_reg = result
+    if verify and (n_errors != len(bad) or (bad and bad_reg != bad[-1])):
+        print("    {} errors, last at register {:#x}, expected {} at {}".format(
+            n_errors, bad_reg, len(bad), [hex(a) for a in bad]))
+        errors += 1
+    if model.ignored:
+        print("    {} transactions ignored".format(model.ignored))
+        errors += 1
+
+    # SIOC timing: each high and low time at least half the period, less
+    # a cycle
+    half = clk_freq / sccb_freq / 2
+    short = [t1 - t0 for (t0, c0), (t1, c1) in zip(edges, edges[1:]) if t1 - t0 < math.floor(half) - 1]
+    if short:
+        print("    SIOC level held for {} cycles, expected at least {:.1f}".format(min(short), half))
+        errors += 1
+
+    # Bus free time, and the gaps between the writes
+    gaps = [t1 - t0 for t0, t1 in zip(stops, starts[1:])]
+    t_buf = math.ceil(clk_freq * 1.3e-6)
+    if min(gaps) < t_buf:
+        print("    bus free for {} cycles, expected at least {}".format(min(gaps), t_buf))
+        errors += 1
+
+    # The gaps, other than the 10ms delay after the reset
+    gap = max(g for g in gaps if g < clk_freq / 200)
+    print("{:>6} {}kHz{}: {} writes, {} reads, configured in {:.2f} ms, gaps of up to {:.1f} us {:>2} errors".format(
+        "dict" if config is not None else "config", sccb_freq // 1000, " verify" if verify else "",
+        len(model.writes), len(model.reads), cycles[0] / clk_freq * 1e3, gap / clk_freq * 1e6, errors))
+    return errors
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clk", type=float, default=2e6, help="system clock frequency")
+    args = parser.parse_args()
+
+    clk_freq = int(args.clk)
+    errors = 0
+    for config, sccb_freq, verify, read_only in [
+            (None,     100000, False, {}),
+            (None,     400000, False, {}),
+            (None,     400000, True,  {}),
+            (SETTINGS, 400000, True,  {0x1e: 0x07, 0x11: 0x00})]:
+        errors += run(clk_freq, config, sccb_freq, verify, read_only)
+
+    print("{} errors".format(errors))
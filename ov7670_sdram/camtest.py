@@ -107,7 +107,7 @@ class CamTest(Elaboratable):
         m.d.sync += cnt.eq(cnt + 1)
 
         # Camera config
-        camconfig = CamConfig()
+        camconfig = CamConfig(sccb_freq=400000)
         m.submodules.camconfig = camconfig
 
         m.d.comb += [
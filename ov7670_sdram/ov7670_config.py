@@ -7,55 +7,145 @@ class OV7670ConfigState(IntEnum):
     SEND_CMD = 1
     DONE     = 2
     TIMER    = 3
+    READ     = 4
 
+# Sends the config words from a ROM to the camera through an SCCB: each
+# word is a register address and data, or DELAY, which waits 10ms once the
+# writes before it have been sent, or END. The writes are queued in the
+# SCCB, so they follow each other without gaps.
+#
+# With verify set, the registers are then read back, for the words with
+# the VERIFY bit, as rom() sets it, and errors counts those that differ,
+# with bad_reg the last of them. done is set once this is finished.
 class OV7670Config(Elaboratable):
-    def __init__(self):
-        self.sccb_ready = Signal()
-        self.rom_data   = Signal(16)
-        self.start      = Signal()
-        self.rom_addr   = Signal(8, reset=0)
-        self.done       = Signal(reset=0)
-        self.sccb_addr  = Signal(8, reset=0)
-        self.sccb_data  = Signal(8, reset=0)
-        self.sccb_start = Signal(reset=0)
-       
+    COM7_RESET = 0x1280
+    DELAY      = 0xfff0
+    END        = 0xffff
+    VERIFY     = 0x10000
+
+    # Config words for a dict of register settings, in order, after a reset
+    # of the registers and the delay it needs, if reset is set
+    @classmethod
+    def compile(cls, settings, reset=True):
+        words = [cls.COM7_RESET, cls.DELAY] if reset else []
+        for addr, data in settings.items():
+            if not 0 <= addr < 0xff:
+                raise ValueError("Register address {:#x} is out of range".format(addr))
+            if not 0 <= data <= 0xff:
+                raise ValueError("Data {:#x} for register {:#x} is out of range".format(data, addr))
+            words.append((addr << 8) | data)
+        return words + [cls.END]
+
+    # ROM contents for config words: VERIFY is set on the last write to each
+    # register, other than a reset, which does not read back
+    @classmethod
+    def rom(cls, words):
+        last = {}
+        for i, w in enumerate(words):
+            if w not in (cls.DELAY, cls.END) and not (w >> 8 == cls.COM7_RESET >> 8 and w & 0x80):
+                last[w >> 8] = i
+        return [w | (cls.VERIFY if last.get(w >> 8) == i else 0) for i, w in enumerate(words)]
+
+    def __init__(self, clk_freq=None, verify=False):
+        # Parameters, clk_freq defaults to the platform clock frequency
+        self.clk_freq      = clk_freq
+        self.verify        = verify
+
+        # Inputs
+        self.start         = Signal()
+        self.rom_data      = Signal(17)
+        self.sccb_ready    = Signal()
+        self.sccb_busy     = Signal()
+        self.sccb_rd_data  = Signal(8)
+        self.sccb_rd_valid = Signal()
+
+        # Outputs
+        self.rom_addr      = Signal(8, reset=0)
+        self.done          = Signal(reset=0)
+        self.sccb_addr     = Signal(8, reset=0)
+        self.sccb_data     = Signal(8, reset=0)
+        self.sccb_read     = Signal(reset=0)
+        self.sccb_start    = Signal(reset=0)
+        self.errors        = Signal(8, reset=0)
+        self.bad_reg       = Signal(8, reset=0)
+
     def elaborate(self, platform):
         fsm_state        = Signal(3, reset=OV7670ConfigState.IDLE)
         fsm_return_state = Signal(3)
         timer            = Signal(32, reset=0)
+        checking         = Signal()
+        expected         = Signal(8)
 
         m = Module()
 
+        clk_freq = self.clk_freq or platform.default_clk_frequency
+
         with m.Switch(fsm_state):
             with m.Case(OV7670ConfigState.IDLE):
                 m.d.sync += self.rom_addr.eq(0)
                 with m.If(self.start):
                     m.d.sync += [
                         fsm_state.eq(OV7670ConfigState.SEND_CMD),
+                        checking.eq(0),
+                        self.errors.eq(0),
                         self.done.eq(0)
                     ]
             with m.Case(OV7670ConfigState.SEND_CMD):
-                with m.Switch(self.rom_data):
-                    with m.Case(0xffff):
-                        m.d.sync += fsm_state.eq(OV7670ConfigState.DONE)
-                    with m.Case(0xfff0):
-                        m.d.sync += [
-                            timer.eq(int(platform.default_clk_frequency / 100)),
-                            fsm_state.eq(OV7670ConfigState.TIMER),
-                            fsm_return_state.eq(OV7670ConfigState.SEND_CMD),
-                            self.rom_addr.eq(self.rom_addr + 1)
-                        ]
+                with m.Switch(self.rom_data[:16]):
+                    with m.Case(self.END):
+                        # Wait for the writes to be sent, and then read
+                        # them back, if verify is set
+                        with m.If(~self.sccb_busy):
+                            if self.verify:
+                                with m.If(~checking):
+                                    m.d.sync += [
+                                        checking.eq(1),
+                                        timer.eq(0),
+                                        fsm_state.eq(OV7670ConfigState.TIMER),
+                                        fsm_return_state.eq(OV7670ConfigState.SEND_CMD),
+                                        self.rom_addr.eq(0)
+                                    ]
+                                with m.Else():
+                                    m.d.sync += fsm_state.eq(OV7670ConfigState.DONE)
+                            else:
+                                m.d.sync += fsm_state.eq(OV7670ConfigState.DONE)
+                    with m.Case(self.DELAY):
+                        with m.If(~self.sccb_busy):
+                            m.d.sync += [
+                                timer.eq(Mux(checking, 0, int(clk_freq / 100))),
+                                fsm_state.eq(OV7670ConfigState.TIMER),
+                                fsm_return_state.eq(OV7670ConfigState.SEND_CMD),
+                                self.rom_addr.eq(self.rom_addr + 1)
+                            ]
                     with m.Default():
-                        with m.If(self.sccb_ready):
+                        with m.If(checking & ~self.rom_data[16]):
                             m.d.sync += [
+                                timer.eq(0),
                                 fsm_state.eq(OV7670ConfigState.TIMER),
                                 fsm_return_state.eq(OV7670ConfigState.SEND_CMD),
+                                self.rom_addr.eq(self.rom_addr + 1)
+                            ]
+                        with m.Elif(self.sccb_ready):
+                            m.d.sync += [
+                                fsm_state.eq(Mux(checking, OV7670ConfigState.READ, OV7670ConfigState.TIMER)),
+                                fsm_return_state.eq(OV7670ConfigState.SEND_CMD),
                                 timer.eq(0), # one cycle delay
                                 self.rom_addr.eq(self.rom_addr + 1),
-                                self.sccb_addr.eq(self.rom_data[8:]),
+                                self.sccb_addr.eq(self.rom_data[8:16]),
                                 self.sccb_data.eq(self.rom_data[0:8]),
-                                self.sccb_start.eq(1)
+                                self.sccb_read.eq(checking),
+                                self.sccb_start.eq(1),
+                                expected.eq(self.rom_data[0:8])
                             ]
+            with m.Case(OV7670ConfigState.READ):
+                m.d.sync += self.sccb_start.eq(0)
+                with m.If(self.sccb_rd_valid):
+                    m.d.sync += fsm_state.eq(OV7670ConfigState.SEND_CMD)
+                    with m.If(self.sccb_rd_data != expected):
+                        m.d.sync += [
+                            self.errors.eq(Mux(self.errors == 0xff, 0xff, self.errors + 1)),
+                            self.bad_reg.eq(self.sccb_addr)
+                        ]
             with m.Case(OV7670ConfigState.DONE):
                 m.d.sync += [
                     fsm_state.eq(OV7670ConfigState.IDLE),
@@ -69,4 +159,3 @@ class OV7670Config(Elaboratable):
                     m.d.sync += timer.eq(timer - 1)
 
         return m
-
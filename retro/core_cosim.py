@@ -0,0 +1,157 @@
+# core_cosim.py: Runs the 6800 Core in simulation in lockstep with Emu6800
+
+# Run the APF system ROM for 200000 cycles:
+# python3 core_cosim.py roms/apf_4000.rom --cycles 200000
+
+import argparse
+import collections
+import sys
+import time
+from typing import Dict, List, Tuple
+
+from nmigen import Module, ClockDomain
+from nmigen.sim import Simulator, Settle
+
+from core import Core
+from emu6800 import Emu6800, IRQ_VECTOR, RESET_VECTOR
+
+PIA_DRB = 0x2002  # Reading it clears the IRQ
+
+
+def apf_memory(filename: str) -> bytearray:
+    """The memory of the APF machine, as retro_test.py decodes it: 8K of
+    RAM, the PIA, whose keyboard rows read as no key pressed, and the 2K
+    system ROM at 0x4000, with the reset and IRQ vectors. Everything else
+    reads as 0xFF. Here it is all writable."""
+    mem = bytearray([0xFF]) * 0x10000
+    mem[0:0x2000] = bytes(0x2000)
+    mem[PIA_DRB] = 0
+    with open(filename, "rb") as f:
+        rom = f.read()
+    for base in range(0x4000, 0x6000, len(rom)):
+        mem[base:base + len(rom)] = rom
+    mem[RESET_VECTOR:RESET_VECTOR + 2] = (0x4000).to_bytes(2, "big")
+    mem[IRQ_VECTOR:IRQ_VECTOR + 2] = (0x42A4).to_bytes(2, "big")
+    return mem
+
+
+def cosim(mem: bytearray, cycles: int, irq_period: int, window: int) -> Tuple[Emu6800, Dict, List[str]]:
+    """Runs Core for the given cycles, and Emu6800 an instruction at each
+    end_instr_flag, with the same memory, comparing the registers and
+    flags after each instruction, and the writes it made. Returns the
+    emulator, the cycles Core took for each instruction against those
+    of the datasheet, and the differences, which stop the run."""
+    m = Module()
+    m.submodules.core = core = Core()
+    m.domains.ph1 = ClockDomain("ph1")
+
+    emu = Emu6800(mem)
+    mem = bytearray(mem)
+    timing: Dict[Tuple[str, int, int], int] = collections.Counter()
+    history = collections.deque(maxlen=window)
+    diffs: List[str] = []
+
+    def compare(writes: List[Tuple[int, int]]):
+        state = []
+        for reg in (core.a, core.b, core.x, core.sp, core.pc, core.ccs):
+            state.append((yield reg))
+        expected = emu.state()
+        for name, v, e in zip(("a", "b", "x", "sp", "pc", "cc"), state, expected):
+            if v != e:
+                diffs.append("%s is 0x%02X, expected 0x%02X" % (name, v, e))
+        if writes != emu.writes:
+            diffs.append("wrote %s, expected %s" % (
+                " ".join("%04X=%02X" % w for w in writes) or "nothing",
+                " ".join("%04X=%02X" % w for w in emu.writes) or "nothing"))
+
+    def process():
+        irq = False
+        reset = True  # The first end_instr_flag ends the reset
+        waiting = False
+        pending = None  # The writes of the instruction to compare after this edge
+        writes: List[Tuple[int, int]] = []
+        n = 0
+        # The process starts after the first edge, in cycle 1
+        for c in range(1, cycles):
+            if irq_period and c % irq_period == 0:
+                irq = True
+            yield core.IRQ.eq(irq)
+            irq_seen = irq  # As Core samples it, before a read of the PIA clears it
+            yield Settle()
+            if pending is not None:
+                yield from compare(pending)
+                pending = None
+                if diffs:
+                    return
+
+            addr = yield core.Addr
+            rw = yield core.RW
+            vma = yield core.VMA
+            if rw:
+                yield core.Din.eq(mem[addr])
+                if vma and addr == PIA_DRB:
+                    irq = False
+            elif vma:
+                data = yield core.Dout
+                mem[addr] = data
+                writes.append((addr, data))
+            yield Settle()
+            n += 1
+
+            if (yield core.end_instr_flag):
+                wai = yield core.wai
+                if reset:
+                    emu.reset()
+                    reset = False
+                    pending = []
+                elif wai and waiting:
+                    pass  # Waiting for an interrupt
+                else:
+                    pc = emu.pc
+                    text = "IRQ" if emu.irq and not emu.mask else emu.disassemble(pc)
+                    expected = emu.step()
+                    name = emu.last[0] if emu.last else "IRQ"
+                    timing[(name, n, expected)] += 1
+                    history.append("%10d  %04X  %-16s %2d cycles" % (c, pc, text, n))
+                    pending = writes
+                waiting = bool(wai)
+                emu.irq = irq_seen
+                writes = []
+                n = 0
+            yield
+
+    sim = Simulator(m)
+    sim.add_clock(1e-6, domain="ph1")
+    sim.add_sync_process(process, domain="ph1")
+    sim.run()
+
+    if diffs:
+        print("\n".join(history))
+    return emu, timing, diffs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("rom", help="the APF system ROM, such as roms/apf_4000.rom")
+    parser.add_argument("--cycles", type=int, default=100000, help="cycles to run")
+    parser.add_argument("--irq-period", type=int, default=14915,
+                        help="cycles between IRQs, as from vsync at 60Hz, 0 for none")
+    parser.add_argument("--window", type=int, default=16, help="instructions shown before a difference")
+    args = parser.parse_args()
+
+    t = time.perf_counter()
+    emu, timing, diffs = cosim(apf_memory(args.rom), args.cycles, args.irq_period, args.window)
+    t = time.perf_counter() - t
+
+    for d in diffs:
+        print("  " + d)
+
+    # Instructions that took other than the datasheet's cycles
+    for (name, n, expected), count in sorted(timing.items()):
+        if n != expected:
+            print("  %-6s %2d cycles, %2d on the 6800, %8d times" % (name, n, expected, count))
+
+    irqs = sum(count for (name, _, _), count in timing.items() if name == "IRQ")
+    print("%d instructions, %d IRQs, in %d cycles, %.1f s" % (emu.steps, irqs, args.cycles, t))
+    print("%d errors" % bool(diffs))
+    sys.exit(1 if diffs else 0)
@@ -0,0 +1,588 @@
+# emu6800.py: Instruction set simulator for the 6800 CPU
+
+# Run a ROM, with the vectors the APF machine decodes:
+# python3 emu6800.py roms/apf_4000.rom --reset 0x4000 --irq 0x42a4 --steps 1000
+
+import argparse
+from typing import Callable, List, Optional, Tuple
+
+from consts.consts import Flags
+
+# Flag masks
+C = 1 << Flags.C
+V = 1 << Flags.V
+Z = 1 << Flags.Z
+N = 1 << Flags.N
+I = 1 << Flags.I
+H = 1 << Flags.H
+
+# The N and Z flags of each 8-bit value
+NZ = [(N if v & 0x80 else 0) | (Z if v == 0 else 0) for v in range(256)]
+
+
+class Mode:
+    """Addressing modes. The effective address of an immediate operand
+    is that of the operand, just after the opcode."""
+
+    INH = 0
+    IMM = 1
+    DIR = 2
+    IND = 3
+    EXT = 4
+    REL = 5
+
+
+# Instruction sizes by mode. IMM16 instructions are one longer.
+SIZES = [1, 2, 2, 2, 3, 2]
+
+IRQ_VECTOR = 0xFFF8
+SWI_VECTOR = 0xFFFA
+NMI_VECTOR = 0xFFFC
+RESET_VECTOR = 0xFFFE
+
+IRQ_CYCLES = 12
+WAI_IRQ_CYCLES = 4
+
+# The semantics, as functions of the emulator, the operand and the
+# accumulator or memory value, returning the result and setting the flags.
+
+
+def _add(e: "Emu6800", r: int, m: int, carry: int = 0) -> int:
+    s = r + m + carry
+    res = s & 0xFF
+    e.cc = (e.cc & (0xFF ^ (H | N | Z | V | C))) | NZ[res] \
+        | (H if (r & 0xF) + (m & 0xF) + carry > 0xF else 0) \
+        | (V if (r ^ res) & (m ^ res) & 0x80 else 0) | (C if s > 0xFF else 0)
+    return res
+
+
+def _sub(e: "Emu6800", r: int, m: int, borrow: int = 0) -> int:
+    s = r - m - borrow
+    res = s & 0xFF
+    e.cc = (e.cc & (0xFF ^ (N | Z | V | C))) | NZ[res] \
+        | (V if (r ^ m) & (r ^ res) & 0x80 else 0) | (C if s < 0 else 0)
+    return res
+
+
+def _logic(e: "Emu6800", res: int) -> int:
+    e.cc = (e.cc & (0xFF ^ (N | Z | V))) | NZ[res]
+    return res
+
+
+def _shift(e: "Emu6800", res: int, carry: int) -> int:
+    """Sets N, Z, C to carry, and V to N ^ C."""
+    n = res >> 7
+    e.cc = (e.cc & (0xFF ^ (N | Z | V | C))) | NZ[res] | carry | (V if n ^ carry else 0)
+    return res
+
+
+ALU = {
+    "SUB": lambda e, r, m: _sub(e, r, m),
+    "CMP": lambda e, r, m: _sub(e, r, m),
+    "SBC": lambda e, r, m: _sub(e, r, m, e.cc & C),
+    "AND": lambda e, r, m: _logic(e, r & m),
+    "BIT": lambda e, r, m: _logic(e, r & m),
+    "LDA": lambda e, r, m: _logic(e, m),
+    "EOR": lambda e, r, m: _logic(e, r ^ m),
+    "ADC": lambda e, r, m: _add(e, r, m, e.cc & C),
+    "ORA": lambda e, r, m: _logic(e, r | m),
+    "ADD": lambda e, r, m: _add(e, r, m),
+}
+
+# Read-modify-write instructions of the 0x40 block, on a value
+UNARY = {
+    "NEG": lambda e, m: _sub(e, 0, m),
+    "COM": lambda e, m: _com(e, m),
+    "LSR": lambda e, m: _shift(e, m >> 1, m & 1),
+    "ROR": lambda e, m: _shift(e, (m >> 1) | ((e.cc & C) << 7), m & 1),
+    "ASR": lambda e, m: _shift(e, (m >> 1) | (m & 0x80), m & 1),
+    "ASL": lambda e, m: _shift(e, (m << 1) & 0xFF, m >> 7),
+    "ROL": lambda e, m: _shift(e, ((m << 1) & 0xFF) | (e.cc & C), m >> 7),
+    "DEC": lambda e, m: _incdec(e, (m - 1) & 0xFF, 0x7F),
+    "INC": lambda e, m: _incdec(e, (m + 1) & 0xFF, 0x80),
+    "TST": lambda e, m: _tst(e, m),
+    "CLR": lambda e, m: _tst(e, 0),
+}
+
+
+def _com(e: "Emu6800", m: int) -> int:
+    res = m ^ 0xFF
+    e.cc = (e.cc & (0xFF ^ (N | Z | V | C))) | NZ[res] | C
+    return res
+
+
+def _incdec(e: "Emu6800", res: int, overflow: int) -> int:
+    e.cc = (e.cc & (0xFF ^ (N | Z | V))) | NZ[res] | (V if res == overflow else 0)
+    return res
+
+
+def _tst(e: "Emu6800", res: int) -> int:
+    e.cc = (e.cc & (0xFF ^ (N | Z | V | C))) | NZ[res]
+    return res
+
+
+def _nz16(e: "Emu6800", res: int) -> int:
+    e.cc = (e.cc & (0xFF ^ (N | Z | V))) | (N if res & 0x8000 else 0) | (Z if res == 0 else 0)
+    return res
+
+
+def _lt(cc: int) -> bool:
+    return bool(cc & N) != bool(cc & V)
+
+
+# Branch conditions, of the flags, by the low nibble of the opcode
+BRANCHES = [
+    ("BRA", lambda cc: True),
+    ("BRN", lambda cc: False),
+    ("BHI", lambda cc: not cc & (C | Z)),
+    ("BLS", lambda cc: bool(cc & (C | Z))),
+    ("BCC", lambda cc: not cc & C),
+    ("BCS", lambda cc: bool(cc & C)),
+    ("BNE", lambda cc: not cc & Z),
+    ("BEQ", lambda cc: bool(cc & Z)),
+    ("BVC", lambda cc: not cc & V),
+    ("BVS", lambda cc: bool(cc & V)),
+    ("BPL", lambda cc: not cc & N),
+    ("BMI", lambda cc: bool(cc & N)),
+    ("BGE", lambda cc: not _lt(cc)),
+    ("BLT", lambda cc: _lt(cc)),
+    ("BGT", lambda cc: not (cc & Z or _lt(cc))),
+    ("BLE", lambda cc: bool(cc & Z or _lt(cc))),
+]
+
+Op = Tuple[str, int, int, int, Callable[["Emu6800", int], None]]
+
+
+class Emu6800:
+    """A 6800 with a flat 64K memory, running an instruction a step.
+
+    Instructions are dispatched through a table of the 256 opcodes, giving
+    the mnemonic, the addressing mode, the size, the cycles from the
+    MC6800 datasheet and the function that executes it on the effective
+    address. Undefined opcodes take two cycles and do nothing, as on the
+    nMigen Core.
+
+    An IRQ is taken at the start of a step if irq is set and the I flag is
+    clear, as a step of its own. After WAI, a step without one idles for a
+    cycle, and is not counted in steps. As on Core, the I flag that is checked
+    after CLI, SEI and TAP is that from before them. DAA leaves V, which
+    the datasheet leaves undefined, unchanged, as Core does.
+    """
+
+    def __init__(self, mem: Optional[bytes] = None):
+        self.mem = bytearray(mem if mem is not None else 0x10000)
+        assert len(self.mem) == 0x10000
+        self.a = 0
+        self.b = 0
+        self.x = 0
+        self.sp = 0
+        self.pc = 0
+        self.cc = 0b11010000
+        self.irq = False  # The IRQ line
+        self.waiting = False  # In WAI
+        self.mask = I  # The I flag as it was at the end of the last step
+        self.cycles = 0
+        self.steps = 0
+        self.writes: List[Tuple[int, int]] = []  # (address, data) written by the last step
+        self.last: Optional[Op] = None  # The last instruction, or None for an interrupt
+
+    def read16(self, addr: int) -> int:
+        return (self.mem[addr & 0xFFFF] << 8) | self.mem[(addr + 1) & 0xFFFF]
+
+    def write(self, addr: int, data: int):
+        self.mem[addr] = data
+        self.writes.append((addr, data))
+
+    def push(self, data: int):
+        self.write(self.sp, data)
+        self.sp = (self.sp - 1) & 0xFFFF
+
+    def pull(self) -> int:
+        self.sp = (self.sp + 1) & 0xFFFF
+        return self.mem[self.sp]
+
+    def push_all(self):
+        """Pushes the state, as for SWI, WAI and interrupts."""
+        self.push(self.pc & 0xFF)
+        self.push(self.pc >> 8)
+        self.push(self.x & 0xFF)
+        self.push(self.x >> 8)
+        self.push(self.a)
+        self.push(self.b)
+        self.push(self.cc)
+
+    def reset(self):
+        self.pc = self.read16(RESET_VECTOR)
+        self.cc |= I
+        self.mask = I
+        self.waiting = False
+
+    def step(self) -> int:
+        """Runs an instruction, or takes an interrupt, returning the cycles
+        it took."""
+        self.writes = []
+        if self.waiting and not (self.irq and not self.mask):
+            self.cycles += 1
+            return 1
+        self.steps += 1
+        if self.irq and not self.mask:
+            if not self.waiting:
+                self.push_all()
+            cycles = WAI_IRQ_CYCLES if self.waiting else IRQ_CYCLES
+            self.waiting = False
+            self.cc |= I
+            self.pc = self.read16(IRQ_VECTOR)
+            self.mask = I
+            self.last = None
+        else:
+            mem = self.mem
+            pc = self.pc
+            self.last = op = TABLE[mem[pc]]
+            name, mode, size, cycles, fn = op
+            if mode == Mode.DIR:
+                ea = mem[(pc + 1) & 0xFFFF]
+            elif mode == Mode.EXT:
+                ea = self.read16(pc + 1)
+            elif mode == Mode.IND:
+                ea = (self.x + mem[(pc + 1) & 0xFFFF]) & 0xFFFF
+            else:
+                ea = (pc + 1) & 0xFFFF
+            self.pc = (pc + size) & 0xFFFF
+            mask = self.cc & I
+            fn(self, ea)
+            self.mask = mask if fn in MASK_LATE else self.cc & I
+        self.cycles += cycles
+        return cycles
+
+    def run(self, max_steps: int):
+        for _ in range(max_steps):
+            self.step()
+
+    def state(self) -> Tuple[int, int, int, int, int, int]:
+        return (self.a, self.b, self.x, self.sp, self.pc, self.cc)
+
+    def disassemble(self, pc: int) -> str:
+        name, mode, size, _, _ = TABLE[self.mem[pc]]
+        if mode == Mode.INH:
+            return name
+        elif mode == Mode.IMM:
+            if size == 3:
+                return "%s #$%04X" % (name, self.read16(pc + 1))
+            return "%s #$%02X" % (name, self.mem[(pc + 1) & 0xFFFF])
+        elif mode == Mode.DIR:
+            return "%s $%02X" % (name, self.mem[(pc + 1) & 0xFFFF])
+        elif mode == Mode.IND:
+            return "%s $%02X,X" % (name, self.mem[(pc + 1) & 0xFFFF])
+        elif mode == Mode.EXT:
+            return "%s $%04X" % (name, self.read16(pc + 1))
+        offset = self.mem[(pc + 1) & 0xFFFF]
+        return "%s $%04X" % (name, (pc + 2 + offset - ((offset & 0x80) << 1)) & 0xFFFF)
+
+
+def _acc_op(f: Callable, acc: str, store: bool) -> Callable[[Emu6800, int], None]:
+    """An ALU instruction on accumulator acc and memory."""
+    if store:
+        def op(e: Emu6800, ea: int):
+            setattr(e, acc, f(e, getattr(e, acc), e.mem[ea]))
+    else:
+        def op(e: Emu6800, ea: int):
+            f(e, getattr(e, acc), e.mem[ea])
+    return op
+
+
+def _unary_acc(f: Callable, acc: str, store: bool) -> Callable[[Emu6800, int], None]:
+    if store:
+        def op(e: Emu6800, ea: int):
+            setattr(e, acc, f(e, getattr(e, acc)))
+    else:
+        def op(e: Emu6800, ea: int):
+            f(e, getattr(e, acc))
+    return op
+
+
+def _unary_mem(f: Callable, store: bool) -> Callable[[Emu6800, int], None]:
+    if store:
+        def op(e: Emu6800, ea: int):
+            e.write(ea, f(e, e.mem[ea]))
+    else:
+        def op(e: Emu6800, ea: int):
+            f(e, e.mem[ea])
+    return op
+
+
+def _sta(acc: str) -> Callable[[Emu6800, int], None]:
+    def op(e: Emu6800, ea: int):
+        e.write(ea, _logic(e, getattr(e, acc)))
+    return op
+
+
+def _ld16(reg: str) -> Callable[[Emu6800, int], None]:
+    def op(e: Emu6800, ea: int):
+        setattr(e, reg, _nz16(e, e.read16(ea)))
+    return op
+
+
+def _st16(reg: str) -> Callable[[Emu6800, int], None]:
+    def op(e: Emu6800, ea: int):
+        value = _nz16(e, getattr(e, reg))
+        e.write(ea, value >> 8)
+        e.write((ea + 1) & 0xFFFF, value & 0xFF)
+    return op
+
+
+def _cpx(e: Emu6800, ea: int):
+    """N and V are those of the subtraction of the high bytes alone, as on
+    the 6800; C is not changed."""
+    m = e.read16(ea)
+    hi = (e.x >> 8) - (m >> 8)
+    res = hi & 0xFF
+    e.cc = (e.cc & (0xFF ^ (N | Z | V))) | (N if res & 0x80 else 0) | (Z if e.x == m else 0) \
+        | (V if ((e.x >> 8) ^ (m >> 8)) & ((e.x >> 8) ^ res) & 0x80 else 0)
+
+
+def _branch(cond: Callable[[int], bool]) -> Callable[[Emu6800, int], None]:
+    def op(e: Emu6800, ea: int):
+        if cond(e.cc):
+            offset = e.mem[ea]
+            e.pc = (e.pc + offset - ((offset & 0x80) << 1)) & 0xFFFF
+    return op
+
+
+def _bsr(e: Emu6800, ea: int):
+    e.push(e.pc & 0xFF)
+    e.push(e.pc >> 8)
+    offset = e.mem[ea]
+    e.pc = (e.pc + offset - ((offset & 0x80) << 1)) & 0xFFFF
+
+
+def _jsr(e: Emu6800, ea: int):
+    e.push(e.pc & 0xFF)
+    e.push(e.pc >> 8)
+    e.pc = ea
+
+
+def _jmp(e: Emu6800, ea: int):
+    e.pc = ea
+
+
+def _rts(e: Emu6800, ea: int):
+    hi = e.pull()
+    e.pc = (hi << 8) | e.pull()
+
+
+def _rti(e: Emu6800, ea: int):
+    e.cc = e.pull() | 0xC0
+    e.b = e.pull()
+    e.a = e.pull()
+    hi = e.pull()
+    e.x = (hi << 8) | e.pull()
+    hi = e.pull()
+    e.pc = (hi << 8) | e.pull()
+
+
+def _swi(e: Emu6800, ea: int):
+    e.push_all()
+    e.cc |= I
+    e.pc = e.read16(SWI_VECTOR)
+
+
+def _wai(e: Emu6800, ea: int):
+    e.push_all()
+    e.waiting = True
+
+
+def _daa(e: Emu6800, ea: int):
+    lo, hi = e.a & 0xF, e.a >> 4
+    adjust = 0
+    if lo > 9 or e.cc & H:
+        adjust |= 0x06
+    if hi > 9 or e.cc & C or (lo > 9 and hi == 9):
+        adjust |= 0x60
+    s = e.a + adjust
+    e.a = s & 0xFF
+    e.cc = (e.cc & (0xFF ^ (N | Z))) | NZ[e.a] | (C if s > 0xFF else 0)
+
+
+def _flag(mask: int, value: bool) -> Callable[[Emu6800, int], None]:
+    def op(e: Emu6800, ea: int):
+        e.cc = (e.cc | mask) if value else (e.cc & (0xFF ^ mask))
+    return op
+
+
+def _tap(e: Emu6800, ea: int):
+    e.cc = e.a | 0xC0
+
+
+def _tpa(e: Emu6800, ea: int):
+    e.a = e.cc | 0xC0
+
+
+def _tab(e: Emu6800, ea: int):
+    e.b = _logic(e, e.a)
+
+
+def _tba(e: Emu6800, ea: int):
+    e.a = _logic(e, e.b)
+
+
+def _aba(e: Emu6800, ea: int):
+    e.a = _add(e, e.a, e.b)
+
+
+def _sba(e: Emu6800, ea: int):
+    e.a = _sub(e, e.a, e.b)
+
+
+def _cba(e: Emu6800, ea: int):
+    _sub(e, e.a, e.b)
+
+
+def _inx(e: Emu6800, ea: int):
+    e.x = (e.x + 1) & 0xFFFF
+    e.cc = (e.cc & (0xFF ^ Z)) | (Z if e.x == 0 else 0)
+
+
+def _dex(e: Emu6800, ea: int):
+    e.x = (e.x - 1) & 0xFFFF
+    e.cc = (e.cc & (0xFF ^ Z)) | (Z if e.x == 0 else 0)
+
+
+def _ins(e: Emu6800, ea: int):
+    e.sp = (e.sp + 1) & 0xFFFF
+
+
+def _des(e: Emu6800, ea: int):
+    e.sp = (e.sp - 1) & 0xFFFF
+
+
+def _tsx(e: Emu6800, ea: int):
+    e.x = (e.sp + 1) & 0xFFFF
+
+
+def _txs(e: Emu6800, ea: int):
+    e.sp = (e.x - 1) & 0xFFFF
+
+
+def _psh(acc: str) -> Callable[[Emu6800, int], None]:
+    def op(e: Emu6800, ea: int):
+        e.push(getattr(e, acc))
+    return op
+
+
+def _pul(acc: str) -> Callable[[Emu6800, int], None]:
+    def op(e: Emu6800, ea: int):
+        setattr(e, acc, e.pull())
+    return op
+
+
+def _nop(e: Emu6800, ea: int):
+    pass
+
+
+# The instructions whose change to the I flag is not seen until after the
+# next instruction
+MASK_LATE = set()
+
+
+def _table() -> List[Op]:
+    """Builds the table of the 256 opcodes."""
+    table: List[Op] = [("???", Mode.INH, 1, 2, _nop)] * 256
+
+    def add(opcode: int, name: str, mode: int, cycles: int, fn: Callable, size: Optional[int] = None):
+        table[opcode] = (name, mode, size or SIZES[mode], cycles, fn)
+
+    inherent = {
+        0x01: ("NOP", 2, _nop), 0x06: ("TAP", 2, _tap), 0x07: ("TPA", 2, _tpa),
+        0x08: ("INX", 4, _inx), 0x09: ("DEX", 4, _dex),
+        0x0A: ("CLV", 2, _flag(V, False)), 0x0B: ("SEV", 2, _flag(V, True)),
+        0x0C: ("CLC", 2, _flag(C, False)), 0x0D: ("SEC", 2, _flag(C, True)),
+        0x0E: ("CLI", 2, _flag(I, False)), 0x0F: ("SEI", 2, _flag(I, True)),
+        0x10: ("SBA", 2, _sba), 0x11: ("CBA", 2, _cba), 0x16: ("TAB", 2, _tab), 0x17: ("TBA", 2, _tba),
+        0x19: ("DAA", 2, _daa), 0x1B: ("ABA", 2, _aba),
+        0x30: ("TSX", 4, _tsx), 0x31: ("INS", 4, _ins), 0x32: ("PULA", 4, _pul("a")), 0x33: ("PULB", 4, _pul("b")),
+        0x34: ("DES", 4, _des), 0x35: ("TXS", 4, _txs), 0x36: ("PSHA", 4, _psh("a")), 0x37: ("PSHB", 4, _psh("b")),
+        0x39: ("RTS", 5, _rts), 0x3B: ("RTI", 10, _rti), 0x3E: ("WAI", 9, _wai), 0x3F: ("SWI", 12, _swi),
+    }
+    for opcode, (name, cycles, fn) in inherent.items():
+        add(opcode, name, Mode.INH, cycles, fn)
+    MASK_LATE.update(table[op][4] for op in (0x06, 0x0E, 0x0F))
+
+    for i, (name, cond) in enumerate(BRANCHES):
+        add(0x20 + i, name, Mode.REL, 4, _branch(cond))
+
+    # The 0x40 block: A, B, indexed and extended
+    for low, name in [(0x0, "NEG"), (0x3, "COM"), (0x4, "LSR"), (0x6, "ROR"), (0x7, "ASR"), (0x8, "ASL"),
+                      (0x9, "ROL"), (0xA, "DEC"), (0xC, "INC"), (0xD, "TST"), (0xF, "CLR")]:
+        f = UNARY[name]
+        store = name != "TST"
+        add(0x40 | low, name + "A", Mode.INH, 2, _unary_acc(f, "a", store))
+        add(0x50 | low, name + "B", Mode.INH, 2, _unary_acc(f, "b", store))
+        add(0x60 | low, name, Mode.IND, 7, _unary_mem(f, store))
+        add(0x70 | low, name, Mode.EXT, 6, _unary_mem(f, store))
+    add(0x6E, "JMP", Mode.IND, 4, _jmp)
+    add(0x7E, "JMP", Mode.EXT, 3, _jmp)
+
+    # The 0x80 block: A and B, in immediate, direct, indexed and extended
+    modes = [(Mode.IMM, 2), (Mode.DIR, 3), (Mode.IND, 5), (Mode.EXT, 4)]
+    for low, name in [(0x0, "SUB"), (0x1, "CMP"), (0x2, "SBC"), (0x4, "AND"), (0x5, "BIT"), (0x6, "LDA"),
+                      (0x8, "EOR"), (0x9, "ADC"), (0xA, "ORA"), (0xB, "ADD")]:
+        store = name not in ("CMP", "BIT")
+        for m, (mode, cycles) in enumerate(modes):
+            add(0x80 | (m << 4) | low, name + "A", mode, cycles, _acc_op(ALU[name], "a", store))
+            add(0xC0 | (m << 4) | low, name + "B", mode, cycles, _acc_op(ALU[name], "b", store))
+    for m, (mode, cycles) in enumerate(modes[1:], 1):
+        add(0x87 | (m << 4), "STAA", mode, cycles + 1, _sta("a"))
+        add(0xC7 | (m << 4), "STAB", mode, cycles + 1, _sta("b"))
+    for m, (mode, cycles) in enumerate(modes):
+        add(0x8C | (m << 4), "CPX", mode, cycles + 1, _cpx, 3 if mode == Mode.IMM else None)
+        add(0x8E | (m << 4), "LDS", mode, cycles + 1, _ld16("sp"), 3 if mode == Mode.IMM else None)
+        add(0xCE | (m << 4), "LDX", mode, cycles + 1, _ld16("x"), 3 if mode == Mode.IMM else None)
+        if mode != Mode.IMM:
+            add(0x8F | (m << 4), "STS", mode, cycles + 2, _st16("sp"))
+            add(0xCF | (m << 4), "STX", mode, cycles + 2, _st16("x"))
+    add(0x8D, "BSR", Mode.REL, 8, _bsr)
+    add(0xAD, "JSR", Mode.IND, 8, _jsr)
+    add(0xBD, "JSR", Mode.EXT, 9, _jsr)
+
+    return table
+
+
+TABLE = _table()
+
+
+def load_rom(filename: str, base: int) -> bytearray:
+    """A 64K memory with the binary ROM at base."""
+    mem = bytearray(0x10000)
+    with open(filename, "rb") as f:
+        rom = f.read()
+    mem[base:base + len(rom)] = rom
+    return mem
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("rom", help="binary ROM image")
+    parser.add_argument("--base", type=lambda s: int(s, 0), default=0x4000, help="address of the ROM")
+    parser.add_argument("--reset", type=lambda s: int(s, 0), help="reset vector, if not in the ROM")
+    parser.add_argument("--irq", type=lambda s: int(s, 0), help="IRQ vector, if not in the ROM")
+    parser.add_argument("--steps", type=int, default=100, help="instructions to run")
+    parser.add_argument("--notrace", action="store_true", help="print only the totals")
+    args = parser.parse_args()
+
+    mem = load_rom(args.rom, args.base)
+    for vector, addr in ((RESET_VECTOR, args.reset), (IRQ_VECTOR, args.irq)):
+        if addr is not None:
+            mem[vector:vector + 2] = addr.to_bytes(2, "big")
+    emu = Emu6800(mem)
+    emu.reset()
+    for _ in range(args.steps):
+        pc = emu.pc
+        text = emu.disassemble(pc)
+        waiting = emu.waiting
+        cycles = emu.step()
+        if not args.notrace and not (waiting and emu.waiting):
+            if emu.last is None:
+                text = "IRQ"
+            print("%10d  %04X  %-16s A=%02X B=%02X X=%04X SP=%04X CC=%02X  %2d" % (
+                emu.cycles, pc, text, emu.a, emu.b, emu.x, emu.sp, emu.cc, cycles))
+    print("%d instructions, %d cycles" % (emu.steps, emu.cycles))
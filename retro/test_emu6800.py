@@ -0,0 +1,64 @@
+# test_emu6800.py: Checks of Emu6800 on short programs
+
+import sys
+
+from emu6800 import Emu6800, IRQ_VECTOR, RESET_VECTOR, IRQ_CYCLES, WAI_IRQ_CYCLES
+
+
+def emulator(program: bytes, irq_handler: int = 0x0100) -> Emu6800:
+    """An emulator with the program at 0, and the IRQ vector pointing at
+    irq_handler, reset and with the I flag clear."""
+    mem = bytearray(0x10000)
+    mem[0:len(program)] = program
+    mem[RESET_VECTOR:RESET_VECTOR + 2] = (0).to_bytes(2, "big")
+    mem[IRQ_VECTOR:IRQ_VECTOR + 2] = irq_handler.to_bytes(2, "big")
+    emu = Emu6800(mem)
+    emu.reset()
+    emu.sp = 0x01FF
+    emu.cc &= ~0x10
+    emu.mask = 0
+    return emu
+
+
+def test_wai_idles():
+    # WAI; LDAA #$55, with the IRQ line low
+    emu = emulator(bytes([0x3E, 0x86, 0x55]))
+    emu.step()
+    assert emu.waiting and emu.pc == 0x0001 and emu.sp == 0x01F8
+    for _ in range(10):
+        assert emu.step() == 1
+    assert emu.waiting and emu.pc == 0x0001 and emu.a == 0 and emu.steps == 1 and not emu.writes
+
+
+def test_wai_irq():
+    # WAI; LDAA #$55, with the handler at $0100 and an IRQ after a while
+    emu = emulator(bytes([0x3E, 0x86, 0x55]), 0x0100)
+    emu.step()
+    emu.step()
+    emu.irq = True
+    assert emu.step() == WAI_IRQ_CYCLES
+    assert not emu.waiting and emu.pc == 0x0100 and emu.last is None
+    assert not emu.writes  # The state was pushed by WAI
+    assert emu.read16(0x01FE) == 0x0001
+
+
+def test_irq():
+    # NOP, with an IRQ after it
+    emu = emulator(bytes([0x01]))
+    emu.irq = True
+    assert emu.step() == IRQ_CYCLES
+    assert emu.pc == 0x0100 and emu.sp == 0x01F8 and emu.read16(0x01FE) == 0x0000
+
+
+if __name__ == "__main__":
+    errors = 0
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            try:
+                test()
+                print("%s ok" % name)
+            except AssertionError:
+                print("%s failed" % name)
+                errors += 1
+    print("%d errors" % errors)
+    sys.exit(1 if errors else 0)